@@ -0,0 +1,115 @@
+"""Incremental catalogue sync for clients that keep a local copy (the bot).
+
+Clients send back the opaque ``version`` token they received last time and
+get every item whose ``updated_at`` moved past it, ordered by
+``(updated_at, id)`` so that large deltas page cleanly. Rows younger than
+``CATALOG_DELTA_SETTLE_SECONDS`` are held back: a transaction that commits
+late with an older ``updated_at`` would otherwise slip behind a token that
+was already handed out.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MenuItem
+
+DEFAULT_DELTA_LIMIT = 1000
+MAX_DELTA_LIMIT = 5000
+
+_NUTRIENT_FIELDS = ("calories", "protein", "fat", "carbs", "fiber", "sodium")
+_VALUES = (
+    "id",
+    "title",
+    "price",
+    "is_available",
+    "tags",
+    "allergens",
+    "exclusions",
+    "updated_at",
+    *(f"nutrients__{field}" for field in _NUTRIENT_FIELDS),
+)
+
+
+class InvalidVersion(ValueError):
+    """Raised for a version token the server did not issue."""
+
+
+def encode_version(updated_at: datetime, item_id: int) -> str:
+    micros = int(updated_at.timestamp() * 1_000_000)
+    return f"{micros}.{item_id}"
+
+
+def decode_version(token: str) -> Tuple[datetime, int]:
+    try:
+        micros, item_id = token.split(".", 1)
+        stamp = datetime.fromtimestamp(int(micros) / 1_000_000, tz=dt_timezone.utc)
+        return stamp, int(item_id)
+    except (ValueError, OverflowError, OSError):
+        raise InvalidVersion("Некорректный токен версии каталога") from None
+
+
+def _settle_seconds() -> float:
+    return float(getattr(settings, "CATALOG_DELTA_SETTLE_SECONDS", 2))
+
+
+def _serialize(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "price": row["price"],
+        "is_available": row["is_available"],
+        "tags": row["tags"],
+        "allergens": row["allergens"],
+        "exclusions": row["exclusions"],
+        "nutrients": {field: row[f"nutrients__{field}"] for field in _NUTRIENT_FIELDS},
+    }
+
+
+def catalog_delta(since: str | None = None, *, limit: int = DEFAULT_DELTA_LIMIT) -> Dict[str, Any]:
+    """
+    Items changed after ``since`` (all available items when it is empty).
+
+    Returns ``{"version", "full", "has_more", "items", "removed"}``: ``items``
+    are available items to upsert, ``removed`` ids of items that became
+    unavailable. Keep calling with the returned version while ``has_more``.
+    """
+    limit = max(1, min(int(limit), MAX_DELTA_LIMIT))
+    horizon = timezone.now() - timedelta(seconds=_settle_seconds())
+    queryset = MenuItem.objects.filter(updated_at__lte=horizon)
+    full = not since
+    if full:
+        queryset = queryset.filter(is_available=True)
+    else:
+        stamp, item_id = decode_version(since)
+        queryset = queryset.filter(Q(updated_at__gt=stamp) | Q(updated_at=stamp, id__gt=item_id))
+
+    rows = list(queryset.order_by("updated_at", "id").values(*_VALUES)[: limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items: List[Dict[str, Any]] = []
+    removed: List[int] = []
+    for row in rows:
+        if row["is_available"]:
+            items.append(_serialize(row))
+        else:
+            removed.append(row["id"])
+
+    if rows:
+        version = encode_version(rows[-1]["updated_at"], rows[-1]["id"])
+    else:
+        version = since or ""
+    return {"version": version, "full": full, "has_more": has_more, "items": items, "removed": removed}
+
+
+__all__ = [
+    "InvalidVersion",
+    "catalog_delta",
+    "decode_version",
+    "encode_version",
+]
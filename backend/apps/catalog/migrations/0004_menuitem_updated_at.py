@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0003_rename_catalog_men_source_de0e54_idx_cat_menuitem_source_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="menuitem",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name="menuitem",
+            index=models.Index(fields=["updated_at", "id"], name="cat_menuitem_updated_idx"),
+        ),
+    ]
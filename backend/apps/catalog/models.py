@@ -49,6 +49,7 @@ class MenuItem(models.Model):
     allergens = models.JSONField(default=list)
     exclusions = models.JSONField(default=list)
     nutrients = models.OneToOneField(Nutrients, on_delete=models.CASCADE, related_name="item")
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         indexes = [
@@ -57,6 +58,7 @@ class MenuItem(models.Model):
             models.Index(fields=["tags"], name="cat_menuitem_tags_idx"),
             models.Index(fields=["allergens"], name="cat_menuitem_allergens_idx"),
             models.Index(fields=["exclusions"], name="cat_menuitem_exclusions_idx"),
+            models.Index(fields=["updated_at", "id"], name="cat_menuitem_updated_idx"),
         ]
 
 
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import MenuItem, Nutrients
+
+
+@receiver(post_save, sender=Nutrients)
+def touch_item_on_nutrients_change(sender, instance, created, **kwargs):
+    # Дельта каталога идёт по MenuItem.updated_at — правка одних КБЖУ тоже должна её сдвинуть.
+    if created:
+        return
+    MenuItem.objects.filter(nutrients_id=instance.pk).update(updated_at=timezone.now())
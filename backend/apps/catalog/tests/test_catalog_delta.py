@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+
+
+@pytest.fixture
+def api_client(db):
+    client = APIClient()
+    user = get_user_model().objects.create_user(username="delta@example.com", password="StrongPass123")
+    client.force_authenticate(user=user)
+    return client
+
+
+@pytest.fixture(autouse=True)
+def no_settle(settings):
+    settings.CATALOG_DELTA_SETTLE_SECONDS = 0
+
+
+@pytest.fixture
+def menu_items(db):
+    restaurant = Restaurant.objects.create(name="Delta", city="City")
+    items = []
+    for idx in range(5):
+        items.append(
+            MenuItem.objects.create(
+                source="restaurant",
+                source_id=restaurant.id,
+                title=f"Блюдо {idx}",
+                price=100 + idx,
+                nutrients=Nutrients.objects.create(calories=300 + idx, protein=20, fat=10, carbs=30),
+            )
+        )
+    return items
+
+
+def _drain(client, since=""):
+    items, removed = {}, []
+    while True:
+        payload = client.get("/api/catalog/items/delta/", {"since": since, "limit": 2}).json()
+        items.update({item["id"]: item for item in payload["items"]})
+        removed.extend(payload["removed"])
+        since = payload["version"]
+        if not payload["has_more"]:
+            return items, removed, since
+
+
+@pytest.mark.django_db
+def test_full_snapshot_then_delta(api_client, menu_items):
+    items, removed, version = _drain(api_client)
+    assert sorted(items) == sorted(item.id for item in menu_items)
+    assert items[menu_items[0].id]["nutrients"]["calories"] == 300
+    assert removed == []
+
+    resp = api_client.get("/api/catalog/items/delta/", {"since": version}).json()
+    assert resp["items"] == [] and resp["removed"] == [] and resp["version"] == version
+
+    changed, gone = menu_items[1], menu_items[3]
+    changed.price = 999
+    changed.save()
+    gone.is_available = False
+    gone.save()
+
+    items, removed, new_version = _drain(api_client, version)
+    assert list(items) == [changed.id] and items[changed.id]["price"] == 999
+    assert removed == [gone.id]
+    assert new_version != version
+
+
+@pytest.mark.django_db
+def test_nutrients_edit_moves_the_item_into_the_delta(api_client, menu_items):
+    MenuItem.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+    _, _, version = _drain(api_client)
+
+    nutrients = menu_items[2].nutrients
+    nutrients.calories = 777
+    nutrients.save()
+
+    items, removed, _ = _drain(api_client, version)
+    assert list(items) == [menu_items[2].id]
+    assert items[menu_items[2].id]["nutrients"]["calories"] == 777
+    assert removed == []
+
+
+@pytest.mark.django_db
+def test_delta_holds_back_unsettled_rows(api_client, menu_items, settings):
+    settings.CATALOG_DELTA_SETTLE_SECONDS = 60
+    assert api_client.get("/api/catalog/items/delta/").json()["items"] == []
+
+    MenuItem.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+    assert len(api_client.get("/api/catalog/items/delta/").json()["items"]) == 5
+
+
+@pytest.mark.django_db
+def test_delta_accepts_bot_key_and_rejects_bad_token(menu_items, settings):
+    settings.BOT_INTERNAL_KEY = "bot-key"
+    client = APIClient()
+    assert client.get("/api/catalog/items/delta/").status_code in (401, 403)
+    resp = client.get("/api/catalog/items/delta/", {"since": "oops"}, HTTP_X_BOT_KEY="bot-key")
+    assert resp.status_code == 400
@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import MenuItemViewSet, catalog_health
+from .views import MenuItemViewSet, catalog_health, items_delta
 
 router = DefaultRouter()
 router.register(r"items", MenuItemViewSet, basename="items")
 
 urlpatterns = [
+    path("items/delta/", items_delta, name="items-delta"),
     path("", include(router.urls)),
     path("health/", catalog_health, name="catalog-health"),
 ]
@@ -2,13 +2,16 @@ from __future__ import annotations
 
 from django.conf import settings
 
-from rest_framework import permissions, viewsets
+from rest_framework import permissions, status as drf_status, viewsets
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
+from apps.common.permissions import HasBotKey
+from apps.common.query_budget import query_budget
 from apps.nutrition.menu_filters import MenuFilterService
 
+from .delta import DEFAULT_DELTA_LIMIT, InvalidVersion, catalog_delta
 from .models import MenuItem
 from .serializers import MenuItemSerializer
 
@@ -21,7 +24,7 @@ def _get_minimum_available_items() -> int:
 
 
 class MenuItemViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = MenuItem.objects.filter(is_available=True)
+    queryset = MenuItem.objects.filter(is_available=True).select_related("nutrients")
     serializer_class = MenuItemSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -40,6 +43,25 @@ class MenuItemViewSet(viewsets.ReadOnlyModelViewSet):
 
         return qs.order_by("title")[:limit]
 
+    @query_budget(2)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated | HasBotKey])
+def items_delta(request):
+    """Items changed since ``?since=<version>``; without it — a full snapshot, page by page."""
+    try:
+        limit = int(request.query_params.get("limit", DEFAULT_DELTA_LIMIT))
+    except (TypeError, ValueError):
+        limit = DEFAULT_DELTA_LIMIT
+    try:
+        payload = catalog_delta(request.query_params.get("since") or None, limit=limit)
+    except InvalidVersion as exc:
+        return Response({"detail": str(exc)}, status=drf_status.HTTP_400_BAD_REQUEST)
+    return Response(payload)
+
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
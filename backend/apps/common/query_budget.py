@@ -0,0 +1,192 @@
+"""Per-request database instrumentation and query budgets.
+
+:class:`QueryBudgetMiddleware` wraps every request in a
+``connection.execute_wrapper`` (works without ``DEBUG``), counts queries and
+database time, and groups statements by shape — the SQL text with
+parameters stripped and ``IN (...)`` lists collapsed. It reports the numbers
+in ``X-DB-*`` response headers and one structured log record per request.
+Streaming responses run most of their queries while the body is sent, after
+the headers are out: they are counted until the last chunk and reported in
+the log record (and checked against the budget) only.
+
+Shapes repeated at least ``QUERY_BUDGET_REPEAT_THRESHOLD`` times are flagged
+as a likely N+1. Views can declare a budget with :func:`query_budget`. When
+``QUERY_BUDGET_STRICT`` is on (the test suite turns it on in ``conftest.py``),
+exceeding it raises :class:`QueryBudgetExceeded` instead of only being logged.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("apps.db")
+
+_IN_LIST_RE = re.compile(r"IN \((?:%s, )*%s\)")
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    max_queries: int
+    max_repeats: Optional[int] = None
+
+
+def query_budget(max_queries: int, *, max_repeats: int | None = None) -> Callable:
+    """
+    Declare how many queries a view may run per request.
+
+    Works on function views, view classes and viewset actions::
+
+        @query_budget(3)
+        def list(self, request): ...
+
+    ``max_repeats`` overrides the global repeat threshold for this view.
+    """
+    budget = QueryBudget(max_queries, max_repeats)
+
+    def decorator(target):
+        target.query_budget = budget
+        return target
+
+    return decorator
+
+
+def sql_shape(sql: str) -> str:
+    shape = _IN_LIST_RE.sub("IN (...)", sql)
+    shape = _NUMBER_RE.sub("N", shape)  # LIMIT 21 / OFFSET 40 и литералы в сыром SQL
+    return _SPACE_RE.sub(" ", shape).strip()
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    duration: float = 0.0
+    shapes: Counter = field(default_factory=Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            if not sql.startswith(("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")):
+                self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        return {shape: n for shape, n in self.shapes.most_common() if n >= threshold}
+
+    def as_dict(self, threshold: int) -> Dict[str, Any]:
+        return {
+            "queries": self.count,
+            "db_ms": round(self.duration * 1000, 2),
+            "repeated": self.repeated(threshold),
+        }
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = getattr(view_func, "query_budget", None)
+        cls = getattr(view_func, "cls", None) or getattr(view_func, "view_class", None)
+        if budget is None and cls is not None:
+            actions = getattr(view_func, "actions", None) or {}
+            action = actions.get(request.method.lower())
+            budget = getattr(getattr(cls, action, None), "query_budget", None) if action else None
+            budget = budget or getattr(cls, "query_budget", None)
+        request._query_budget = budget
+        request._query_view = getattr(view_func, "__qualname__", None) or getattr(view_func, "__name__", "")
+        if cls is not None:
+            request._query_view = f"{cls.__module__}.{cls.__qualname__}"
+        return None
+
+    @staticmethod
+    def _instrument(stats: QueryStats) -> ExitStack:
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+        return stack
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with self._instrument(stats):
+            response = self.get_response(request)
+        if response.streaming and not getattr(response, "is_async", False):
+            response.streaming_content = self._stream(request, response, stats, response.streaming_content)
+        else:
+            self._report(request, response, stats)
+        return response
+
+    def _stream(self, request, response, stats: QueryStats, content):
+        # Тело отдаётся после возврата из __call__ (под ASGI — в другом потоке),
+        # поэтому обёртки ставим заново на время отдачи.
+        with self._instrument(stats):
+            yield from content
+        self._report(request, response, stats, headers=False)
+
+    def _report(self, request, response, stats: QueryStats, *, headers: bool = True) -> None:
+        threshold = int(getattr(settings, "QUERY_BUDGET_REPEAT_THRESHOLD", 5))
+        budget: Optional[QueryBudget] = getattr(request, "_query_budget", None)
+        view = getattr(request, "_query_view", "")
+        if budget is not None and budget.max_repeats is not None:
+            threshold = budget.max_repeats
+        repeated = stats.repeated(threshold)
+
+        problems: List[str] = []
+        if budget is not None and stats.count > budget.max_queries:
+            problems.append(f"{stats.count} queries > budget {budget.max_queries}")
+        if repeated:
+            problems.append(f"repeated SQL shapes (>= {threshold}x)")
+
+        if headers and getattr(settings, "QUERY_BUDGET_HEADERS", settings.DEBUG):
+            response["X-DB-Queries"] = str(stats.count)
+            response["X-DB-Time-Ms"] = f"{stats.duration * 1000:.1f}"
+            if repeated:
+                response["X-DB-Repeated"] = str(max(repeated.values()))
+            if budget is not None:
+                response["X-DB-Budget"] = str(budget.max_queries)
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            **stats.as_dict(threshold),
+        }
+        if budget is not None:
+            record["budget"] = budget.max_queries
+        level = logging.WARNING if problems else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, "db.request %s", json.dumps(record, ensure_ascii=False), extra={"db": record})
+
+        if problems and getattr(settings, "QUERY_BUDGET_STRICT", False):
+            details = "\n".join(f"  {n}x {shape}" for shape, n in stats.shapes.most_common(5))
+            raise QueryBudgetExceeded(
+                f"{request.method} {request.path} ({view}): {'; '.join(problems)}\n{details}"
+            )
+
+
+__all__ = [
+    "QueryBudget",
+    "QueryBudgetExceeded",
+    "QueryBudgetMiddleware",
+    "QueryStats",
+    "query_budget",
+    "sql_shape",
+]
@@ -1,5 +1,36 @@
+import logging
+import signal
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def install_reload_signal(signame: str) -> bool:
+    """Перестраивать LLM-провайдеры по сигналу (например, SIGUSR2 после ротации ключа)."""
+    from .llm_provider import default_registry
+
+    signum = getattr(signal, signame, None)
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signum)
+
+    def handler(sig, frame):
+        default_registry.request_reload()
+        if callable(previous):
+            previous(sig, frame)
+
+    signal.signal(signum, handler)
+    return True
+
 
 class NutritionConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.nutrition"
+
+    def ready(self):
+        signame = getattr(settings, "LLM_PROVIDER_RELOAD_SIGNAL", "")
+        if signame and not install_reload_signal(signame):
+            logger.warning("LLM provider reload signal %s was not installed", signame)
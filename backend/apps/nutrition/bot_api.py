@@ -4,9 +4,13 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 from apps.common.permissions import HasBotKey
-from apps.users.models import Profile
+from apps.common.query_budget import query_budget
+from apps.users.profile_sync import MAX_BATCH_SIZE, upsert_telegram_profiles
 from .planner import build_menu_for_user
+from .tracing import planner_trace
 from .models import MenuPlan
+from .singleflight import get_single_flight, plan_generation_key
+from .views import serialize_menu_plan
 
 
 User = get_user_model()
@@ -20,32 +24,35 @@ def upsert_profile(request):
       "profile": {... как на фронте/боте ...},
       "city": "Москва" (опц.)
     }
-    """
-    tg_id = request.data.get("telegram_id")
-    prof = request.data.get("profile") or {}
-    city = request.data.get("city") or ""
-
-    if not tg_id or not isinstance(prof, dict):
-        return Response({"detail":"telegram_id or profile missing"}, status=status.HTTP_400_BAD_REQUEST)
+    или пачкой: {"profiles": [{"telegram_id": ..., "profile": {...}, "city": ...}, ...]}
 
-    user, created = User.objects.get_or_create(telegram_id=tg_id, defaults={"username": f"tg_{tg_id}"})
-    if city:
-        user.city = city
-        user.save(update_fields=["city"])
+    Пишет только изменившиеся поля и возвращает их списком ("changed").
+    """
+    batch = request.data.get("profiles")
+    single = batch is None
+    entries = [request.data] if single else batch
+    if not isinstance(entries, list) or not entries:
+        return Response({"detail": "profiles must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(entries) > MAX_BATCH_SIZE:
+        return Response({"detail": f"at most {MAX_BATCH_SIZE} profiles per request"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("profile") or {}, dict):
+            return Response({"detail": "telegram_id or profile missing"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if int(entry.get("telegram_id") or 0) <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({"detail": "telegram_id or profile missing"}, status=status.HTTP_400_BAD_REQUEST)
 
-    p, _ = Profile.objects.get_or_create(user=user, defaults=dict(
-        sex=prof.get("sex","m"),
-        height_cm=prof.get("height_cm",175),
-        weight_kg=prof.get("weight_kg",70),
-        activity_level=prof.get("activity_level","moderate"),
-        goal=prof.get("goal","recomp"),
-    ))
-    # Обновим поля
-    for f in ["sex","birth_date","height_cm","weight_kg","body_fat_pct","activity_level","goal","allergies","exclusions","daily_budget"]:
-        if f in prof:
-            setattr(p, f, prof[f])
-    p.save()
-    return Response({"ok": True, "user_id": user.id})
+    results = [result.as_dict() for result in upsert_telegram_profiles(entries)]
+    if not single:
+        return Response({"results": results})
+    result = results[0]
+    if result.get("errors"):
+        return Response({"detail": "invalid profile", "errors": result["errors"]},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response({"ok": True, **result})
 
 @api_view(["POST"])
 @permission_classes([HasBotKey])
@@ -58,27 +65,63 @@ def generate_and_save(request):
     if not tg_id:
         return Response({"detail":"telegram_id missing"}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        user = User.objects.get(telegram_id=tg_id)
+        user = User.objects.select_related("profile").get(profile__telegram_id=tg_id)
     except User.DoesNotExist:
         return Response({"detail":"user not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    data = build_menu_for_user(user)
+    plan_date = date.today()
+
+    def generate():
+        with planner_trace("bot_generate"):
+            data = build_menu_for_user(user)
+            plan = MenuPlan.create_from_payload(
+                user=user,
+                payload=data,
+                plan_date=plan_date,
+            )
+        payload = dict(data)
+        payload.update(
+            {
+                "plan_id": plan.id,
+                "status": plan.status,
+                "status_display": plan.get_status_display(),
+                "date": plan.date.isoformat(),
+                "created_at": plan.created_at.isoformat(),
+            }
+        )
+        return payload
+
+    # Повторный запрос бота, пока первый ещё генерируется, получает тот же план.
+    payload, shared = get_single_flight().do(plan_generation_key(user, plan_date), generate)
+    response = Response(dict(payload))
+    if shared:
+        response["X-Plan-Coalesced"] = "1"
+    return response
 
-    plan = MenuPlan.create_from_payload(
-        user=user,
-        payload=data,
-        plan_date=date.today(),
-        provider="hybrid",
-    )
-    payload = dict(data)
-    payload.update(
-        {
-            "plan_id": plan.id,
-            "status": plan.status,
-            "status_display": plan.get_status_display(),
-            "date": plan.date.isoformat(),
-            "created_at": plan.created_at.isoformat(),
-        }
-    )
 
-    return Response(payload)
+@query_budget(4)
+@api_view(["GET"])
+@permission_classes([HasBotKey])
+def list_plans(request):
+    """
+    Query: ?telegram_id=123&limit=7&date=YYYY-MM-DD
+    Последние планы пользователя Telegram, новые первыми.
+    """
+    try:
+        tg_id = int(request.query_params.get("telegram_id") or 0)
+        limit = int(request.query_params.get("limit", "7"))
+    except (TypeError, ValueError):
+        return Response({"detail": "telegram_id and limit must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+    if not tg_id:
+        return Response({"detail": "telegram_id missing"}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, 90))
+
+    plans = MenuPlan.objects.filter(user__profile__telegram_id=tg_id)
+    date_param = request.query_params.get("date")
+    if date_param:
+        try:
+            plans = plans.filter(date=date.fromisoformat(date_param))
+        except ValueError:
+            return Response({"detail": "invalid date"}, status=status.HTTP_400_BAD_REQUEST)
+    plans = plans.order_by("-date", "-created_at").prefetch_related("meals__item__nutrients")[:limit]
+    return Response([serialize_menu_plan(plan) for plan in plans])
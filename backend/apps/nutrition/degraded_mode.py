@@ -0,0 +1,214 @@
+"""Adaptive degraded mode for plan generation.
+
+:class:`DegradedModeController` watches the LLM calls made by
+:class:`~apps.nutrition.menu_selection.MenuSelectionService` over a rolling
+window. Once the window has ``min_samples`` calls and either the error rate
+(an empty plan, an exception or a shed call counts as an error) or the
+latency quantile breaks its SLO, the controller trips: new requests skip
+the LLM and get the deterministic solver's plan, saved with the
+``degraded`` provider value.
+
+After ``cooldown`` seconds one request every ``probe_interval`` seconds is
+let through to the LLM as a probe. A probe that returns a plan within the
+latency SLO ends degraded mode; a failed one keeps it and the next probe
+waits another interval.
+
+State is per process: every worker decides from the calls it has seen.
+``/api/nutrition/health/`` shows it.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+NORMAL = "normal"
+DEGRADED = "degraded"
+DEGRADED_PROVIDER = "degraded"
+
+
+@dataclass(frozen=True)
+class Decision:
+    use_llm: bool
+    probe: bool = False
+
+
+class DegradedModeController:
+    def __init__(
+            self,
+            *,
+            window: float = 60.0,
+            min_samples: int = 10,
+            latency_slo: float = 8.0,
+            latency_quantile: float = 0.9,
+            error_rate_slo: float = 0.5,
+            cooldown: float = 120.0,
+            probe_interval: float = 15.0,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.window = window
+        self.min_samples = max(1, int(min_samples))
+        self.latency_slo = latency_slo
+        self.latency_quantile = latency_quantile
+        self.error_rate_slo = error_rate_slo
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        # Зависший зонд (запрос упал до record) не должен блокировать восстановление навсегда.
+        self.probe_timeout = max(probe_interval, latency_slo * 2)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._samples: Deque[Tuple[float, float, bool]] = deque()
+        self.state = NORMAL
+        self.reason = ""
+        self.changed_at: float | None = None
+        self._cooldown_until = 0.0
+        self._last_probe: float | None = None
+        self._probe_started: float | None = None
+        self.trips = 0
+        self.degraded_requests = 0
+        self.probes = 0
+
+    def _purge(self, now: float) -> None:
+        while self._samples and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+
+    def _window_stats(self) -> Tuple[int, float, float | None]:
+        count = len(self._samples)
+        if not count:
+            return 0, 0.0, None
+        errors = sum(1 for _, _, ok in self._samples if not ok)
+        latencies = sorted(latency for _, latency, _ in self._samples)
+        quantile = latencies[min(count - 1, int(self.latency_quantile * count))]
+        return count, errors / count, quantile
+
+    def decide(self) -> Decision:
+        with self._lock:
+            if self.state == NORMAL:
+                return Decision(use_llm=True)
+            now = self._clock()
+            probe_busy = self._probe_started is not None and now - self._probe_started < self.probe_timeout
+            probe_due = self._last_probe is None or now - self._last_probe >= self.probe_interval
+            if now >= self._cooldown_until and not probe_busy and probe_due:
+                self._probe_started = self._last_probe = now
+                self.probes += 1
+                return Decision(use_llm=True, probe=True)
+            self.degraded_requests += 1
+            return Decision(use_llm=False)
+
+    def record(self, latency: float, *, ok: bool, probe: bool = False) -> None:
+        with self._lock:
+            now = self._clock()
+            if probe:
+                self._probe_started = None
+                if ok and latency <= self.latency_slo:
+                    self._switch(NORMAL, now, "probe succeeded")
+                return
+            if self.state != NORMAL:
+                return  # запрос начался до перехода в деградацию
+            self._samples.append((now, latency, ok))
+            self._purge(now)
+            count, error_rate, latency_q = self._window_stats()
+            if count < self.min_samples:
+                return
+            if error_rate > self.error_rate_slo:
+                self._switch(DEGRADED, now, f"error rate {error_rate:.0%} > {self.error_rate_slo:.0%}")
+            elif latency_q is not None and latency_q > self.latency_slo:
+                self._switch(
+                    DEGRADED,
+                    now,
+                    f"p{int(self.latency_quantile * 100)} latency {latency_q:.1f}s > {self.latency_slo:.1f}s",
+                )
+
+    def _switch(self, state: str, now: float, reason: str) -> None:
+        self.state = state
+        self.reason = reason
+        self.changed_at = now
+        self._samples.clear()
+        if state == DEGRADED:
+            self.trips += 1
+            self._cooldown_until = now + self.cooldown
+            self._last_probe = None
+            logger.warning("Planner switched to degraded mode: %s", reason)
+        else:
+            logger.info("Planner left degraded mode: %s", reason)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            now = self._clock()
+            self._purge(now)
+            count, error_rate, latency_q = self._window_stats()
+            payload: Dict[str, Any] = {
+                "enabled": True,
+                "state": self.state,
+                "reason": self.reason,
+                "seconds_in_state": round(now - self.changed_at, 1) if self.changed_at is not None else None,
+                "window": {
+                    "seconds": self.window,
+                    "samples": count,
+                    "error_rate": round(error_rate, 4),
+                    "latency_quantile_ms": round(latency_q * 1000, 1) if latency_q is not None else None,
+                },
+                "slo": {
+                    "error_rate": self.error_rate_slo,
+                    "latency_ms": round(self.latency_slo * 1000, 1),
+                    "latency_quantile": self.latency_quantile,
+                },
+                "trips": self.trips,
+                "degraded_requests": self.degraded_requests,
+                "probes": self.probes,
+            }
+            if self.state == DEGRADED:
+                payload["cooldown_left_s"] = round(max(0.0, self._cooldown_until - now), 1)
+            return payload
+
+
+_default: Tuple[Tuple, DegradedModeController | None] | None = None
+_default_lock = threading.Lock()
+
+
+def get_degraded_controller() -> DegradedModeController | None:
+    """Process-wide controller configured by ``PLANNER_SLO_*``; ``None`` when disabled."""
+    global _default
+    config = (
+        bool(getattr(settings, "PLANNER_DEGRADED_ENABLED", False)),
+        float(getattr(settings, "PLANNER_SLO_WINDOW_SECONDS", 60)),
+        int(getattr(settings, "PLANNER_SLO_MIN_SAMPLES", 10)),
+        float(getattr(settings, "PLANNER_SLO_LATENCY_MS", 8000)) / 1000,
+        float(getattr(settings, "PLANNER_SLO_LATENCY_QUANTILE", 0.9)),
+        float(getattr(settings, "PLANNER_SLO_ERROR_RATE", 0.5)),
+        float(getattr(settings, "PLANNER_DEGRADED_COOLDOWN_SECONDS", 120)),
+        float(getattr(settings, "PLANNER_DEGRADED_PROBE_SECONDS", 15)),
+    )
+    with _default_lock:
+        if _default is None or _default[0] != config:
+            enabled, window, min_samples, latency_slo, quantile, error_rate, cooldown, probe_interval = config
+            controller = None
+            if enabled:
+                controller = DegradedModeController(
+                    window=window,
+                    min_samples=min_samples,
+                    latency_slo=latency_slo,
+                    latency_quantile=quantile,
+                    error_rate_slo=error_rate,
+                    cooldown=cooldown,
+                    probe_interval=probe_interval,
+                )
+            _default = (config, controller)
+        return _default[1]
+
+
+__all__ = [
+    "DEGRADED",
+    "DEGRADED_PROVIDER",
+    "Decision",
+    "DegradedModeController",
+    "NORMAL",
+    "get_degraded_controller",
+]
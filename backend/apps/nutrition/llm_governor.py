@@ -0,0 +1,488 @@
+"""Cluster-wide admission control for LLM calls.
+
+Every web and Celery worker asks the governor before each chat completion.
+A call is admitted when
+
+* fewer than ``max_concurrency`` calls are in flight across the cluster
+  (batch calls leave ``interactive_reserve`` slots to interactive ones);
+* no queued request of the same or a higher priority is ahead of it;
+* the tokens-per-minute bucket holds the call's estimated cost (prompt
+  estimate plus ``max_tokens``). The bucket refills continuously at
+  ``tpm / 60`` tokens per second up to ``tpm``.
+
+What happens when it is not admitted depends on the mode of its priority:
+``wait`` polls until the deadline, ``queue`` also takes a place in a priority
+queue (interactive before batch, then first come first served) and ``shed``
+gives up at once. A request that is not admitted by its deadline is shed:
+the provider returns no plan and the selection service runs the
+deterministic fallback.
+
+Priority comes from :func:`llm_priority`; requests are interactive unless
+the caller (nightly push, plan library build) marks them as batch.
+
+:class:`RedisGovernorStore` keeps the state in Redis and makes each decision
+in one Lua script: holders and the queue are sorted sets, the bucket is a
+hash. Holders have a lease, so a worker that dies mid-call frees its slot
+after ``lease`` seconds; queued requests that stop polling drop out after
+``queue_lease``. :class:`LocalGovernorStore` applies the same rules inside
+one process.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Protocol, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+MODES = ("wait", "queue", "shed")
+BACKENDS = ("local", "redis", "off")
+
+# Приоритет очереди вычисляется как priority * _PRIORITY_SPAN + время постановки в мс.
+_PRIORITY_SPAN = 10 ** 13
+
+_priority: ContextVar[int] = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+@contextmanager
+def llm_priority(priority: int) -> Iterator[None]:
+    """LLM calls inside the block are admitted with ``priority``."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class GovernorStore(Protocol):
+    def enqueue(self, token: str, *, priority: int, now: float) -> None: ...
+
+    def dequeue(self, token: str) -> None: ...
+
+    def try_acquire(self, token: str, *, priority: int, cost: int, queued: bool, now: float) -> bool: ...
+
+    def release(self, token: str) -> None: ...
+
+    def snapshot(self, now: float) -> Dict[str, Any]: ...
+
+
+class _Limits:
+    def __init__(self, *, max_concurrency: int, tpm: int, interactive_reserve: int, lease: float, queue_lease: float):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.tpm = max(0, int(tpm))
+        self.interactive_reserve = max(0, min(int(interactive_reserve), self.max_concurrency - 1))
+        self.lease = lease
+        self.queue_lease = queue_lease
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "tpm": self.tpm,
+            "interactive_reserve": self.interactive_reserve,
+        }
+
+
+class LocalGovernorStore(_Limits):
+    def __init__(self, **limits: Any) -> None:
+        super().__init__(**limits)
+        self._lock = threading.Lock()
+        self._holders: Dict[str, float] = {}
+        # token -> (priority, время постановки, последний опрос)
+        self._queue: Dict[str, Tuple[int, float, float]] = {}
+        self._tokens = float(self.tpm)
+        self._refilled: float | None = None
+
+    def _purge(self, now: float) -> None:
+        for token, expires in list(self._holders.items()):
+            if expires <= now:
+                del self._holders[token]
+        for token, (_, _, seen) in list(self._queue.items()):
+            if now - seen >= self.queue_lease:
+                del self._queue[token]
+
+    def _refill(self, now: float) -> float:
+        if self._refilled is not None:
+            self._tokens = min(self.tpm, self._tokens + (now - self._refilled) * self.tpm / 60)
+        self._refilled = now
+        return self._tokens
+
+    def enqueue(self, token: str, *, priority: int, now: float) -> None:
+        with self._lock:
+            self._queue[token] = (priority, now, now)
+
+    def dequeue(self, token: str) -> None:
+        with self._lock:
+            self._queue.pop(token, None)
+
+    def try_acquire(self, token: str, *, priority: int, cost: int, queued: bool, now: float) -> bool:
+        with self._lock:
+            self._purge(now)
+            free = self.max_concurrency - len(self._holders)
+            if priority != INTERACTIVE:
+                free -= self.interactive_reserve
+            if queued and token in self._queue:
+                own_priority, enqueued, _ = self._queue[token]
+                self._queue[token] = (own_priority, enqueued, now)
+                ahead = sum(1 for p, t, _ in self._queue.values() if (p, t) < (own_priority, enqueued))
+            else:
+                ahead = sum(1 for p, _, _ in self._queue.values() if p <= priority)
+            if free - ahead <= 0:
+                return False
+            if self.tpm:
+                cost = min(cost, self.tpm)
+                if self._refill(now) < cost:
+                    return False
+                self._tokens -= cost
+            self._holders[token] = now + self.lease
+            self._queue.pop(token, None)
+            return True
+
+    def release(self, token: str) -> None:
+        with self._lock:
+            self._holders.pop(token, None)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        with self._lock:
+            self._purge(now)
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _ in self._queue.values():
+                queued[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            return {
+                "in_flight": len(self._holders),
+                "queued": queued,
+                "tokens_available": int(self._refill(now)) if self.tpm else None,
+            }
+
+
+_ACQUIRE_SCRIPT = """
+local holders, queue, seen, bucket = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local token = ARGV[1]
+local now = tonumber(ARGV[2])
+local lease, queue_lease = tonumber(ARGV[3]), tonumber(ARGV[4])
+local limit, reserve = tonumber(ARGV[5]), tonumber(ARGV[6])
+local priority, queued = tonumber(ARGV[7]), ARGV[8] == "1"
+local cost, tpm, span = tonumber(ARGV[9]), tonumber(ARGV[10]), tonumber(ARGV[11])
+
+redis.call("ZREMRANGEBYSCORE", holders, "-inf", now)
+for _, member in ipairs(redis.call("ZRANGEBYSCORE", seen, "-inf", now - queue_lease)) do
+    redis.call("ZREM", queue, member)
+    redis.call("ZREM", seen, member)
+end
+
+local free = limit - redis.call("ZCARD", holders)
+if priority > 0 then
+    free = free - reserve
+end
+local ahead = nil
+if queued then
+    ahead = redis.call("ZRANK", queue, token)
+    if ahead then
+        redis.call("ZADD", seen, now, token)
+    end
+end
+if not ahead then
+    ahead = redis.call("ZCOUNT", queue, "-inf", string.format("(%.0f", (priority + 1) * span))
+end
+if free - ahead <= 0 then
+    return 0
+end
+
+if tpm > 0 then
+    local state = redis.call("HMGET", bucket, "tokens", "ts")
+    local tokens = tonumber(state[1]) or tpm
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(tpm, tokens + math.max(0, now - ts) * tpm / 60000)
+    cost = math.min(cost, tpm)
+    if tokens < cost then
+        redis.call("HSET", bucket, "tokens", tokens, "ts", now)
+        return 0
+    end
+    redis.call("HSET", bucket, "tokens", tokens - cost, "ts", now)
+end
+
+redis.call("ZADD", holders, now + lease, token)
+redis.call("ZREM", queue, token)
+redis.call("ZREM", seen, token)
+return 1
+"""
+
+
+class RedisGovernorStore(_Limits):
+    def __init__(self, client, *, prefix: str = "llm:governor:", **limits: Any) -> None:
+        super().__init__(**limits)
+        self.client = client
+        self.keys = [prefix + name for name in ("holders", "queue", "seen", "bucket")]
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs: Any) -> "RedisGovernorStore":
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def enqueue(self, token: str, *, priority: int, now: float) -> None:
+        now_ms = int(now * 1000)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zadd(self.keys[1], {token: priority * _PRIORITY_SPAN + now_ms})
+        pipe.zadd(self.keys[2], {token: now_ms})
+        pipe.execute()
+
+    def dequeue(self, token: str) -> None:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zrem(self.keys[1], token)
+        pipe.zrem(self.keys[2], token)
+        pipe.execute()
+
+    def try_acquire(self, token: str, *, priority: int, cost: int, queued: bool, now: float) -> bool:
+        args = [
+            token,
+            int(now * 1000),
+            int(self.lease * 1000),
+            int(self.queue_lease * 1000),
+            self.max_concurrency,
+            self.interactive_reserve,
+            priority,
+            "1" if queued else "0",
+            int(cost),
+            self.tpm,
+            _PRIORITY_SPAN,
+        ]
+        return bool(self._acquire(keys=self.keys, args=args))
+
+    def release(self, token: str) -> None:
+        self.client.zrem(self.keys[0], token)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        now_ms = int(now * 1000)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zcount(self.keys[0], f"({now_ms}", "+inf")
+        for priority in PRIORITY_NAMES:
+            pipe.zcount(self.keys[1], priority * _PRIORITY_SPAN, f"({(priority + 1) * _PRIORITY_SPAN}")
+        pipe.hmget(self.keys[3], "tokens", "ts")
+        in_flight, *queued, (tokens, ts) = pipe.execute()
+        available = None
+        if self.tpm:
+            tokens = float(tokens) if tokens is not None else float(self.tpm)
+            elapsed = max(0, now_ms - int(float(ts))) if ts is not None else 0
+            available = int(min(self.tpm, tokens + elapsed * self.tpm / 60000))
+        return {
+            "in_flight": in_flight,
+            "queued": dict(zip(PRIORITY_NAMES.values(), queued)),
+            "tokens_available": available,
+        }
+
+
+class Ticket:
+    """An admitted call; release it when the completion is done (or use ``with``)."""
+
+    def __init__(self, store: GovernorStore | None, token: str) -> None:
+        self._store = store
+        self.token = token
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            if self._store is not None:
+                self._store.release(self.token)
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class _PriorityStats:
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.waited = 0
+        self.shed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        decided = self.admitted + self.shed
+        return {
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "shed": self.shed,
+            "shed_rate": round(self.shed / decided, 4) if decided else None,
+            "mean_wait_ms": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else None,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+class LLMGovernor:
+    def __init__(
+            self,
+            store: GovernorStore | None,
+            *,
+            mode: str = "queue",
+            batch_mode: str = "queue",
+            deadline: float = 3.0,
+            batch_deadline: float = 300.0,
+            poll_interval: float = 0.02,
+            max_poll_interval: float = 0.25,
+            clock: Callable[[], float] = time.time,
+    ) -> None:
+        for value in (mode, batch_mode):
+            if value not in MODES:
+                raise ValueError(f"unknown admission mode {value!r}")
+        self.store = store
+        self.policies = {INTERACTIVE: (mode, deadline), BATCH: (batch_mode, batch_deadline)}
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._clock = clock
+        self._stats = {priority: _PriorityStats() for priority in PRIORITY_NAMES}
+        self._stats_lock = threading.Lock()
+
+    def acquire(
+            self,
+            *,
+            cost: int,
+            priority: int | None = None,
+            sleep: Callable[[float], Any] = time.sleep,
+    ) -> Ticket | None:
+        """
+        A :class:`Ticket` once the call is admitted, ``None`` if it is shed.
+
+        ``sleep`` may return ``True`` to abandon waiting (a cancelled hedge).
+        """
+        if self.store is None:
+            return Ticket(None, "")
+        priority = current_priority() if priority is None else priority
+        mode, deadline = self.policies.get(priority, self.policies[BATCH])
+        token = uuid.uuid4().hex
+        started = self._clock()
+        queued = mode == "queue"
+        if queued:
+            self.store.enqueue(token, priority=priority, now=started)
+        interval = self.poll_interval
+        admitted = False
+        try:
+            while True:
+                now = self._clock()
+                if self.store.try_acquire(token, priority=priority, cost=cost, queued=queued, now=now):
+                    admitted = True
+                    self._record(priority, admitted=True, waited=now - started)
+                    return Ticket(self.store, token)
+                remaining = started + deadline - now
+                if mode == "shed" or remaining <= 0 or sleep(min(interval, remaining)) is True:
+                    self._record(priority, admitted=False, waited=now - started)
+                    logger.warning(
+                        "LLM call shed (%s, mode=%s) after %.2fs", PRIORITY_NAMES.get(priority), mode, now - started
+                    )
+                    return None
+                interval = min(self.max_poll_interval, interval * 1.5)
+        finally:
+            if queued and not admitted:
+                self.store.dequeue(token)
+
+    def _record(self, priority: int, *, admitted: bool, waited: float) -> None:
+        with self._stats_lock:
+            stats = self._stats.setdefault(priority, _PriorityStats())
+            if not admitted:
+                stats.shed += 1
+                return
+            stats.admitted += 1
+            if waited > 0.001:
+                stats.waited += 1
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        if self.store is None:
+            return {"enabled": False}
+        with self._stats_lock:
+            priorities = {PRIORITY_NAMES.get(p, str(p)): s.as_dict() for p, s in self._stats.items()}
+        try:
+            cluster = self.store.snapshot(self._clock())
+        except Exception:  # pragma: no cover - статистика не должна ронять админку
+            logger.exception("LLM governor: snapshot failed")
+            cluster = None
+        return {
+            "enabled": True,
+            "modes": {PRIORITY_NAMES[p]: {"mode": m, "deadline_s": d} for p, (m, d) in self.policies.items()},
+            "limits": self.store.as_dict() if isinstance(self.store, _Limits) else None,
+            "cluster": cluster,
+            "process": priorities,
+        }
+
+
+_default: Tuple[Tuple, LLMGovernor] | None = None
+_default_lock = threading.Lock()
+
+
+def get_governor() -> LLMGovernor:
+    """Process-wide governor configured by ``LLM_GOVERNOR_*``; rebuilt when the settings change."""
+    global _default
+    config = (
+        getattr(settings, "LLM_GOVERNOR_BACKEND", "local"),
+        getattr(settings, "LLM_GOVERNOR_REDIS_URL", ""),
+        int(getattr(settings, "LLM_GOVERNOR_MAX_CONCURRENCY", 8)),
+        int(getattr(settings, "LLM_GOVERNOR_TPM", 150_000)),
+        int(getattr(settings, "LLM_GOVERNOR_INTERACTIVE_RESERVE", 2)),
+        float(getattr(settings, "LLM_GOVERNOR_LEASE_SECONDS", 120)),
+        getattr(settings, "LLM_GOVERNOR_MODE", "queue"),
+        getattr(settings, "LLM_GOVERNOR_BATCH_MODE", "queue"),
+        float(getattr(settings, "LLM_GOVERNOR_DEADLINE_SECONDS", 3)),
+        float(getattr(settings, "LLM_GOVERNOR_BATCH_DEADLINE_SECONDS", 300)),
+    )
+    with _default_lock:
+        if _default is None or _default[0] != config:
+            backend, url, concurrency, tpm, reserve, lease, mode, batch_mode, deadline, batch_deadline = config
+            if backend not in BACKENDS:
+                raise ValueError(f"unknown LLM governor backend {backend!r}")
+            limits = {
+                "max_concurrency": concurrency,
+                "tpm": tpm,
+                "interactive_reserve": reserve,
+                "lease": lease,
+                "queue_lease": 10.0,
+            }
+            store: GovernorStore | None = None
+            if backend == "redis":
+                store = RedisGovernorStore.from_url(url, **limits)
+            elif backend == "local":
+                store = LocalGovernorStore(**limits)
+            _default = (
+                config,
+                LLMGovernor(
+                    store,
+                    mode=mode,
+                    batch_mode=batch_mode,
+                    deadline=deadline,
+                    batch_deadline=batch_deadline,
+                ),
+            )
+        return _default[1]
+
+
+__all__ = [
+    "BACKENDS",
+    "BATCH",
+    "INTERACTIVE",
+    "LLMGovernor",
+    "LocalGovernorStore",
+    "MODES",
+    "PRIORITY_NAMES",
+    "RedisGovernorStore",
+    "Ticket",
+    "current_priority",
+    "get_governor",
+    "llm_priority",
+]
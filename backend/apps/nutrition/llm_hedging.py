@@ -0,0 +1,232 @@
+"""Hedged and raced menu composition across several LLM providers.
+
+:class:`HedgedProvider` wraps an ordered list of providers. In ``hedge`` mode
+it calls the first one and, if no valid plan has arrived after the hedge
+delay (or the call already failed), the next one; in ``race`` mode all start
+at once. The first non-empty plan wins. Sub-providers validate their answers
+with ``_parse_plan`` and return ``[]`` otherwise, so an empty result is
+treated as a loss.
+
+The hedge delay adapts: each provider keeps a :class:`LatencyHistogram` of
+its successful calls, and once it has ``min_samples`` observations the
+delay is the configured quantile (p90 by default) of the primary's latency,
+clamped to ``[min_delay, max_delay]``.
+
+Calls run in a small thread pool. A synchronous HTTP request cannot be
+interrupted, so "cancelling" the loser means setting its cancel event:
+:class:`~apps.nutrition.llm_provider.OpenAIProvider` stops retrying, its
+answer is discarded, and the caller returns without waiting for it.
+"""
+from __future__ import annotations
+
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+from .llm_governor import current_priority, llm_priority
+from .llm_provider import PROVIDERS, LLMProvider, _cancel_event
+from .tracing import annotate
+
+logger = logging.getLogger(__name__)
+
+MODES = ("hedge", "race")
+
+
+def _default_bounds() -> List[float]:
+    bounds, value = [], 0.01
+    while value < 120:
+        bounds.append(round(value, 4))
+        value *= 1.25
+    return bounds
+
+
+class LatencyHistogram:
+    """Thread-safe histogram with geometric buckets from 10 ms to 2 minutes (±12.5%)."""
+
+    def __init__(self, bounds: Sequence[float] | None = None) -> None:
+        self.bounds = list(bounds) if bounds is not None else _default_bounds()
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def quantile(self, q: float) -> float | None:
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank and n:
+                    return self.bounds[min(index, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def as_dict(self) -> Dict[str, Any]:
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.5)),
+            "p90_ms": ms(self.quantile(0.9)),
+            "p99_ms": ms(self.quantile(0.99)),
+        }
+
+
+class HedgedProvider(LLMProvider):
+    def __init__(
+        self,
+        providers: Sequence[Tuple[str, LLMProvider]],
+        *,
+        mode: str = "hedge",
+        hedge_delay: float = 1.5,
+        hedge_quantile: float = 0.9,
+        min_delay: float = 0.1,
+        max_delay: float = 10.0,
+        min_samples: int = 20,
+        max_workers: int = 8,
+    ) -> None:
+        if not providers:
+            raise ValueError("HedgedProvider needs at least one provider")
+        if mode not in MODES:
+            raise ValueError(f"unknown hedge mode {mode!r}")
+        self.providers = list(providers)
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.histograms = {name: LatencyHistogram() for name, _ in self.providers}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, str], *, http_client=None) -> "HedgedProvider":
+        names = [n.strip() for n in config.get("LLM_HEDGE_PROVIDERS", "openai,openai_secondary").split(",")]
+        providers = [
+            (name, PROVIDERS[name](config=config, http_client=http_client))
+            for name in names
+            if name and name != "hedged"
+        ]
+        return cls(
+            providers,
+            mode=config.get("LLM_HEDGE_MODE", "hedge"),
+            hedge_delay=float(config.get("LLM_HEDGE_DELAY_MS", "1500")) / 1000,
+            hedge_quantile=float(config.get("LLM_HEDGE_QUANTILE", "0.9")),
+            min_delay=float(config.get("LLM_HEDGE_MIN_DELAY_MS", "100")) / 1000,
+            max_delay=float(config.get("LLM_HEDGE_MAX_DELAY_MS", "10000")) / 1000,
+            max_workers=int(config.get("LLM_HEDGE_WORKERS", "8")),
+        )
+
+    def close(self) -> None:
+        # Не ждём: запущенные вызовы доработают сами, новых уже не будет.
+        self._executor.shutdown(wait=False)
+        for _, provider in self.providers:
+            close = getattr(provider, "close", None)
+            if close is not None:
+                close()
+
+    def current_hedge_delay(self) -> float:
+        primary = self.histograms[self.providers[0][0]]
+        if primary.count < self.min_samples:
+            return self.hedge_delay
+        delay = primary.quantile(self.hedge_quantile) or self.hedge_delay
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    @property
+    def enabled(self) -> bool:
+        return any(provider.enabled for _, provider in self.providers)
+
+    def latency_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "hedge_delay_ms": round(self.current_hedge_delay() * 1000, 1),
+            "providers": {name: hist.as_dict() for name, hist in self.histograms.items()},
+        }
+
+    def _call(
+            self,
+            name: str,
+            provider: LLMProvider,
+            context: Dict,
+            cancel: threading.Event,
+            priority: int,
+    ) -> List[Dict]:
+        _cancel_event.set(cancel)
+        started = time.perf_counter()
+        try:
+            with llm_priority(priority):
+                plan = provider.compose_menu(context)
+        except Exception:
+            logger.exception("LLM provider %s failed", name)
+            plan = []
+        if plan:
+            self.histograms[name].observe(time.perf_counter() - started)
+        elif not cancel.is_set():
+            self.histograms[name].failure()
+        return plan
+
+    def compose_menu(self, context: Dict) -> List[Dict]:
+        cancel = threading.Event()
+        priority = current_priority()
+        queue = list(self.providers)
+        launched: Dict[Future, str] = {}
+        delay = 0.0 if self.mode == "race" else self.current_hedge_delay()
+        next_launch = time.perf_counter()
+
+        def launch() -> Future:
+            name, provider = queue.pop(0)
+            # Пустой контекст: без трассировки вызывающего, зато со своим cancel-событием
+            # и приоритетом вызывающего для LLM-governor.
+            future = self._executor.submit(
+                contextvars.Context().run, self._call, name, provider, context, cancel, priority
+            )
+            launched[future] = name
+            return future
+
+        winner: str | None = None
+        plan: List[Dict] = []
+        pending: set[Future] = set()
+        try:
+            while winner is None and (pending or queue):
+                # Следующий провайдер — по истечении задержки или сразу, если текущие уже проиграли.
+                while queue and (time.perf_counter() >= next_launch or not pending):
+                    pending.add(launch())
+                    next_launch = time.perf_counter() + delay
+                timeout = max(0.0, next_launch - time.perf_counter()) if queue else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result and winner is None:
+                        winner, plan = launched[future], result
+        finally:
+            cancel.set()
+
+        annotate(
+            mode=self.mode,
+            hedge_delay_ms=round(delay * 1000, 1),
+            launched=list(launched.values()),
+            winner=winner,
+        )
+        return plan
+
+
+__all__ = ["HedgedProvider", "LatencyHistogram", "MODES"]
@@ -1,10 +1,14 @@
 import json
 import logging
 import os
+import threading
 import time
+from contextvars import ContextVar
 from textwrap import dedent
-from typing import Dict, List
+from typing import Callable, Dict, Hashable, Iterator, List, Mapping, Optional, Tuple
 
+import httpx
+import openai
 from openai import (
     APIConnectionError,
     APITimeoutError,
@@ -14,6 +18,11 @@ from openai import (
     RateLimitError,
 )
 
+from .llm_governor import LLMGovernor, Ticket, get_governor
+from .plan_stream import IncrementalPlanParser
+from .prompt_encoding import encode_items, estimate_tokens
+from .tracing import annotate
+
 logger = logging.getLogger(__name__)
 
 SYSTEM_PROMPT = dedent(
@@ -26,24 +35,68 @@ SYSTEM_PROMPT = dedent(
 ).strip()
 
 
+_cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("llm_cancel", default=None)
+
+
+def request_cancelled() -> bool:
+    """True when a composite provider no longer needs this call's answer."""
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def wait_or_cancelled(seconds: float) -> bool:
+    """Sleep between retries; returns True as soon as the call is cancelled."""
+    event = _cancel_event.get()
+    if event is None:
+        time.sleep(seconds)
+        return False
+    return event.wait(seconds)
+
+
 class LLMProvider:
+    enabled = True
+
     def compose_menu(self, context: Dict) -> List[Dict]:
         raise NotImplementedError
 
+    def compose_menu_stream(self, context: Dict) -> Iterator[Dict]:
+        """Plan entries as they become available; by default all at once."""
+        yield from self.compose_menu(context)
+
+    def close(self) -> None:
+        """Release threads or other resources the provider owns; the shared HTTP pool is not its own."""
+
 
 class OpenAIProvider(LLMProvider):
-    def __init__(self, client: OpenAI | None = None) -> None:
-        self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        self.temperature = float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
-        self.timeout = float(os.getenv("OPENAI_TIMEOUT", "20"))
-        self.max_attempts = max(1, int(os.getenv("OPENAI_MAX_RETRIES", "3")))
-        self.retry_delay = float(os.getenv("OPENAI_RETRY_DELAY", "2.0"))
-        self.max_plan_items = max(1, int(os.getenv("NUTRIBOT_MAX_PLAN_ITEMS", "6")))
-        self.prompt_items_limit = max(1, int(os.getenv("NUTRIBOT_PROMPT_ITEMS_LIMIT", "40")))
+    def __init__(
+        self,
+        client: OpenAI | None = None,
+        *,
+        config: Mapping[str, str] | None = None,
+        http_client: httpx.Client | None = None,
+        governor: LLMGovernor | None = None,
+    ) -> None:
+        env = (config if config is not None else os.environ).get
+        self.governor = governor
+        self.model = env("OPENAI_MODEL", "gpt-4o-mini")
+        self.temperature = float(env("OPENAI_TEMPERATURE", "0.2"))
+        self.timeout = float(env("OPENAI_TIMEOUT", "20"))
+        self.max_attempts = max(1, int(env("OPENAI_MAX_RETRIES", "3")))
+        self.retry_delay = float(env("OPENAI_RETRY_DELAY", "2.0"))
+        self.max_plan_items = max(1, int(env("NUTRIBOT_MAX_PLAN_ITEMS", "6")))
+        self.prompt_items_limit = max(1, int(env("NUTRIBOT_PROMPT_ITEMS_LIMIT", "40")))  # только verbose
+        self.prompt_token_budget = max(200, int(env("NUTRIBOT_PROMPT_TOKEN_BUDGET", "1500")))
+        self.prompt_format = env("NUTRIBOT_PROMPT_FORMAT", "compact")
+        # Пакетный режим (ночная генерация): пользователей на запрос и бюджет общей таблицы блюд.
+        self.batch_max_users = max(1, int(env("NUTRIBOT_BATCH_MAX_USERS", "8")))
+        self.batch_token_budget = max(200, int(env("NUTRIBOT_BATCH_TOKEN_BUDGET", "3000")))
+        self.stream = env("OPENAI_STREAM", "0") == "1"
+        # ~30 токенов на запись плана, остальное — обёртка JSON.
+        self.max_completion_tokens = max(64, int(env("OPENAI_MAX_TOKENS", str(60 + 45 * self.max_plan_items))))
 
         self._client = client
         if self._client is None:
-            api_key = os.getenv("OPENAI_API_KEY")
+            api_key = env("OPENAI_API_KEY")
             if not api_key:
                 logger.warning("OpenAI API key is not configured; provider disabled.")
                 self._enabled = False
@@ -55,47 +108,84 @@ class OpenAIProvider(LLMProvider):
                 "max_retries": 0,
             }
 
-            base_url = os.getenv("OPENAI_BASE_URL")
+            base_url = env("OPENAI_BASE_URL")
             if base_url:
                 client_kwargs["base_url"] = base_url
 
-            organization = os.getenv("OPENAI_ORGANIZATION")
+            organization = env("OPENAI_ORGANIZATION")
             if organization:
                 client_kwargs["organization"] = organization
 
+            if http_client is not None:
+                client_kwargs["http_client"] = http_client
+
             self._client = OpenAI(**client_kwargs)
 
         self._enabled = True
 
+    @property
+    def enabled(self) -> bool:
+        return getattr(self, "_enabled", False)
+
     def compose_menu(self, context: Dict) -> List[Dict]:
+        if self.stream:
+            return list(self.compose_menu_stream(context))
         if not getattr(self, "_enabled", False):
+            annotate(outcome="disabled")
             return []
 
         if not context.get("items"):
             logger.info("LLM provider received empty items list; returning fallback plan.")
+            annotate(outcome="no_items")
             return []
 
         prompt = self._build_user_prompt(context)
+        raw_content, outcome = self._complete(prompt, max_tokens=self.max_completion_tokens)
+        if raw_content is None:
+            annotate(outcome=outcome)
+            return []
+        plan = self._parse_plan(raw_content, context)
+        annotate(outcome="ok" if plan else "unparsable")
+        return plan
+
+    def _complete(self, prompt: str, *, max_tokens: int) -> Tuple[Optional[str], str]:
+        """One JSON chat completion with retries: ``(content, outcome)``, content ``None`` on failure."""
+        cost = self._call_cost(prompt, max_tokens=max_tokens)
         attempts_left = self.max_attempts
+        outcome = "unavailable"
 
         while attempts_left > 0:
+            if request_cancelled():
+                outcome = "cancelled"
+                break
+            annotate(attempts=self.max_attempts - attempts_left + 1)
+            ticket = self._admit(cost)
+            if ticket is None:
+                outcome = "shed"
+                break
             try:
-                response = self._client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=self.temperature,
-                    max_tokens=800,
-                    response_format={"type": "json_object"},
-                )
+                with ticket:
+                    response = self._client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": SYSTEM_PROMPT},
+                            {"role": "user", "content": prompt},
+                        ],
+                        temperature=self.temperature,
+                        max_tokens=max_tokens,
+                        response_format={"type": "json_object"},
+                    )
+                usage = getattr(response, "usage", None)
+                if usage is not None:
+                    annotate(
+                        prompt_tokens=getattr(usage, "prompt_tokens", None),
+                        completion_tokens=getattr(usage, "completion_tokens", None),
+                    )
                 raw_content = self._extract_message_content(response)
                 if not raw_content:
                     logger.warning("LLM response is empty; falling back to greedy knapsack.")
-                    return []
-                plan = self._parse_plan(raw_content, context)
-                return plan
+                    return None, "empty"
+                return raw_content, "ok"
             except (APITimeoutError, APIConnectionError, RateLimitError) as exc:
                 attempts_left -= 1
                 logger.warning(
@@ -103,20 +193,281 @@ class OpenAIProvider(LLMProvider):
                     exc,
                     attempts_left,
                 )
-                if attempts_left <= 0:
+                if attempts_left <= 0 or wait_or_cancelled(self.retry_delay):
                     break
-                time.sleep(self.retry_delay)
             except BadRequestError as exc:
                 logger.error("OpenAI rejected request: %s", exc)
+                outcome = "rejected"
                 break
             except OpenAIError:
                 logger.exception("Unexpected OpenAI error while composing menu")
+                outcome = "error"
                 break
             except Exception:  # pragma: no cover - safety net
                 logger.exception("Unexpected error while talking to OpenAI")
+                outcome = "error"
                 break
-        return []
+        return None, outcome
+
+    def compose_menu_batch(self, contexts: Mapping[Hashable, Dict]) -> Dict[Hashable, List[Dict]]:
+        """
+        Plans for several users, ``batch_max_users`` per chat completion.
+
+        Meant for contexts that share candidates (same city and restrictions):
+        the prompt holds one table built from the union of their items and a
+        targets line per user under a short alias, and the answer is
+        ``{"plans": {"u1": [...], ...}}``. Each user's entries are checked
+        against that user's own candidates, as in :meth:`_parse_plan`.
+
+        A user left without a valid plan in a parsed answer gets a
+        single-user call. If the batch call itself fails, its users get
+        ``[]`` and the caller's fallback takes over, instead of one more
+        request per user to an LLM that is already failing.
+        """
+        plans: Dict[Hashable, List[Dict]] = {key: [] for key in contexts}
+        if not getattr(self, "_enabled", False):
+            annotate(outcome="disabled")
+            return plans
+        keys = [key for key, context in contexts.items() if context.get("items")]
+        for start in range(0, len(keys), self.batch_max_users):
+            group = {key: contexts[key] for key in keys[start:start + self.batch_max_users]}
+            if len(group) == 1:
+                key, context = next(iter(group.items()))
+                plans[key] = self.compose_menu(context)
+            else:
+                plans.update(self._compose_group(group))
+        return plans
+
+    def _compose_group(self, group: Dict[Hashable, Dict]) -> Dict[Hashable, List[Dict]]:
+        aliases = {f"u{idx}": key for idx, key in enumerate(group, 1)}
+        prompt = self._build_batch_prompt(aliases, group)
+        raw_content, outcome = self._complete(prompt, max_tokens=self.max_completion_tokens * len(group))
+        if raw_content is None:
+            annotate(outcome=outcome, batch_users=len(group))
+            return {key: [] for key in group}
+
+        try:
+            data = json.loads(raw_content)
+        except json.JSONDecodeError:
+            logger.warning("Failed to decode batched LLM JSON response")
+            data = {}
+        raw_plans = data.get("plans") if isinstance(data, dict) else None
+        if not isinstance(raw_plans, dict):
+            raw_plans = {}
+
+        plans: Dict[Hashable, List[Dict]] = {}
+        missing: List[Hashable] = []
+        for alias, key in aliases.items():
+            plans[key] = self._validate_plan(raw_plans.get(alias), group[key])
+            if not plans[key]:
+                missing.append(key)
+        for key in missing:
+            plans[key] = self.compose_menu(group[key])
+        annotate(
+            outcome="ok" if not missing else "partial",
+            batch_users=len(group),
+            batch_retried=len(missing),
+        )
+        return plans
+
+    def compose_menu_stream(self, context: Dict) -> Iterator[Dict]:
+        """
+        Stream the completion and yield validated plan entries as soon as
+        each one is complete; the stream is closed after ``max_plan_items``.
+
+        A failed attempt is retried only while nothing has been yielded yet.
+        """
+        if not getattr(self, "_enabled", False):
+            annotate(outcome="disabled")
+            return
+        if not context.get("items"):
+            annotate(outcome="no_items")
+            return
+
+        prompt = self._build_user_prompt(context)
+        cost = self._call_cost(prompt)
+        lookup = self._items_lookup(context)
+        used_ids: set[int] = set()
+        outcome = "unavailable"
+
+        for attempt in range(1, self.max_attempts + 1):
+            if request_cancelled():
+                outcome = "cancelled"
+                break
+            annotate(attempts=attempt, stream=True)
+            ticket = self._admit(cost)
+            if ticket is None:
+                outcome = "shed"
+                break
+            stream = None
+            try:
+                # Слот занят, пока читаем поток.
+                with ticket:
+                    stream = self._client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": SYSTEM_PROMPT},
+                            {"role": "user", "content": prompt},
+                        ],
+                        temperature=self.temperature,
+                        max_tokens=self.max_completion_tokens,
+                        response_format={"type": "json_object"},
+                        stream=True,
+                    )
+                    parser = IncrementalPlanParser()
+                    for chunk in stream:
+                        choices = getattr(chunk, "choices", None) or []
+                        delta = getattr(choices[0], "delta", None) if choices else None
+                        for raw in parser.feed(getattr(delta, "content", None) or ""):
+                            entry = self._validate_entry(raw, lookup, used_ids)
+                            if entry is None:
+                                continue
+                            yield entry
+                            if len(used_ids) >= self.max_plan_items:
+                                break
+                        if parser.done or len(used_ids) >= self.max_plan_items:
+                            break
+                outcome = "ok" if used_ids else "unparsable"
+                break
+            except (APITimeoutError, APIConnectionError, RateLimitError) as exc:
+                logger.warning("OpenAI stream failed (%s), attempt %s/%s", exc, attempt, self.max_attempts)
+                if used_ids or attempt >= self.max_attempts or wait_or_cancelled(self.retry_delay):
+                    break
+            except BadRequestError as exc:
+                logger.error("OpenAI rejected request: %s", exc)
+                outcome = "rejected"
+                break
+            except OpenAIError:
+                logger.exception("Unexpected OpenAI error while streaming menu")
+                outcome = "error"
+                break
+            finally:
+                if stream is not None and hasattr(stream, "close"):
+                    # Остаток ответа не нужен — закрываем соединение, а не дочитываем.
+                    stream.close()
+        annotate(outcome=outcome, plan_items=len(used_ids))
+
+    def _call_cost(self, prompt: str, *, max_tokens: int | None = None) -> int:
+        if max_tokens is None:
+            max_tokens = self.max_completion_tokens
+        return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt) + max_tokens
+
+    def _admit(self, cost: int) -> Optional[Ticket]:
+        """Ask the cluster-wide governor for a slot and tokens; ``None`` means shed."""
+        governor = self.governor or get_governor()
+        started = time.perf_counter()
+        ticket = governor.acquire(cost=cost, sleep=wait_or_cancelled)
+        annotate(
+            admission="admitted" if ticket is not None else "shed",
+            admission_wait_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        return ticket
+
     def _build_user_prompt(self, context: Dict) -> str:
+        if self.prompt_format == "verbose":
+            return self._build_verbose_prompt(context)
+        return self._build_compact_prompt(context)
+
+    @staticmethod
+    def _targets_text(targets: Mapping) -> str:
+        return (
+            f"{targets.get('calories')} ккал, Б {targets.get('protein')}г, "
+            f"Ж {targets.get('fat')}г, У {targets.get('carbs')}г."
+        )
+
+    @staticmethod
+    def _restriction_lines(restrictions: Mapping) -> List[str]:
+        lines = []
+        allergies = restrictions.get("allergies") or []
+        exclusions = restrictions.get("exclusions") or []
+        if allergies:
+            lines.append("Аллергии: " + ", ".join(map(str, allergies)) + ".")
+        if exclusions:
+            lines.append("Исключения: " + ", ".join(map(str, exclusions)) + ".")
+        return lines
+
+    def _build_compact_prompt(self, context: Dict) -> str:
+        targets = context.get("targets") or {}
+        restrictions = context.get("restrictions") or {}
+
+        lines = ["Цели на день: " + self._targets_text(targets), *self._restriction_lines(restrictions)]
+        instructions = (
+            "Составь план из 3-5 приемов пищи только из блюд таблицы, разнообразно, "
+            "попадая в калории и БЖУ. qty — число порций (можно дробное), "
+            'time_hint — breakfast|lunch|dinner|snack|any. Ответ строго JSON: '
+            '{"plan": [{"item_id": 1, "qty": 1.0, "time_hint": "breakfast"}]}; '
+            'если план невозможен — {"plan": []}.'
+        )
+
+        fixed = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens("\n".join(lines)) + estimate_tokens(instructions)
+        items = context.get("items") or []
+        encoded = encode_items(items, targets, token_budget=self.prompt_token_budget - fixed, max_items=len(items))
+        annotate(
+            prompt_items=len(encoded.item_ids),
+            prompt_dropped=encoded.dropped,
+            prompt_tokens_est=fixed + encoded.tokens,
+        )
+        return "\n".join([*lines, *encoded.lines, instructions])
+
+    def _build_batch_prompt(self, aliases: Mapping[str, Hashable], group: Mapping[Hashable, Dict]) -> str:
+        contexts = [group[key] for key in aliases.values()]
+        restrictions = [context.get("restrictions") or {} for context in contexts]
+        shared_restrictions = all(r == restrictions[0] for r in restrictions)
+
+        # Общая таблица: объединение кандидатов, ранжированное по средним целям группы.
+        items: Dict[int, Dict] = {}
+        for context in contexts:
+            for item in context.get("items") or []:
+                items.setdefault(int(item["id"]), item)
+        # Блюда таблицы, которых нет у конкретного пользователя (например, дороже его бюджета).
+        unavailable = [sorted(items.keys() - self._items_lookup(context).keys()) for context in contexts]
+
+        def user_lines(shown) -> List[str]:
+            lines = ["Цели на день по пользователям:"]
+            for (alias, key), own, missing in zip(aliases.items(), restrictions, unavailable):
+                parts = [f"{alias}: " + self._targets_text(group[key].get("targets") or {})]
+                if not shared_restrictions:
+                    parts.extend(self._restriction_lines(own))
+                missing = [item_id for item_id in missing if item_id in shown]
+                if missing:
+                    parts.append("Недоступны: " + ", ".join(map(str, missing)) + ".")
+                lines.append(" ".join(parts))
+            if shared_restrictions:
+                lines.extend(self._restriction_lines(restrictions[0]))
+            return lines
+
+        instructions = (
+            "Составь каждому пользователю план из 3-5 приемов пищи только из доступных ему блюд таблицы, "
+            "разнообразно, попадая в его калории и БЖУ. qty — число порций (можно дробное), "
+            'time_hint — breakfast|lunch|dinner|snack|any. Ответ строго JSON: '
+            '{"plans": {"u1": [{"item_id": 1, "qty": 1.0, "time_hint": "breakfast"}], "u2": []}}; '
+            "если план для пользователя невозможен — пустой список."
+        )
+        mean_targets = {
+            key: sum(float((context.get("targets") or {}).get(key) or 0) for context in contexts) / len(contexts)
+            for key in ("calories", "protein", "fat", "carbs")
+        }
+        # Бюджет считаем с полными списками недоступных: в таблицу войдёт не больше.
+        fixed = (
+            estimate_tokens(SYSTEM_PROMPT)
+            + estimate_tokens("\n".join(user_lines(items.keys())))
+            + estimate_tokens(instructions)
+        )
+        encoded = encode_items(
+            list(items.values()),
+            mean_targets,
+            token_budget=self.batch_token_budget - fixed,
+            max_items=len(items),
+        )
+        lines = user_lines(set(encoded.item_ids))
+        annotate(
+            prompt_items=len(encoded.item_ids),
+            prompt_dropped=encoded.dropped,
+            prompt_tokens_est=fixed + encoded.tokens,
+        )
+        return "\n".join([*lines, *encoded.lines, instructions])
+
+    def _build_verbose_prompt(self, context: Dict) -> str:
         targets = context.get("targets") or {}
         restrictions = context.get("restrictions") or {}
         items = context.get("items") or []
@@ -210,10 +561,27 @@ class OpenAIProvider(LLMProvider):
         if not isinstance(data, dict):
             return []
 
-        raw_plan = data.get("plan")
+        return self._validate_plan(data.get("plan"), context)
+
+    def _validate_plan(self, raw_plan, context: Dict) -> List[Dict]:
         if not isinstance(raw_plan, list):
             return []
 
+        items_lookup = self._items_lookup(context)
+        parsed_plan: List[Dict] = []
+        used_ids: set[int] = set()
+
+        for entry in raw_plan:
+            parsed = self._validate_entry(entry, items_lookup, used_ids)
+            if parsed is None:
+                continue
+            parsed_plan.append(parsed)
+            if len(parsed_plan) >= self.max_plan_items:
+                break
+
+        return parsed_plan
+
+    def _items_lookup(self, context: Dict) -> Dict[int, Dict]:
         items_lookup: Dict[int, Dict] = {}
         for item in context.get("items", []):
             item_id = item.get("id")
@@ -222,62 +590,229 @@ class OpenAIProvider(LLMProvider):
             except (TypeError, ValueError):
                 continue
             items_lookup[int_id] = item
+        return items_lookup
 
-        parsed_plan: List[Dict] = []
-        used_ids: set[int] = set()
+    def _validate_entry(self, entry, items_lookup: Dict[int, Dict], used_ids: set[int]) -> Optional[Dict]:
+        if not isinstance(entry, dict):
+            return None
 
-        for entry in raw_plan:
-            if not isinstance(entry, dict):
-                continue
+        try:
+            item_id = int(entry.get("item_id"))
+        except (TypeError, ValueError):
+            return None
 
-            try:
-                item_id = int(entry.get("item_id"))
-            except (TypeError, ValueError):
-                continue
+        if item_id in used_ids or item_id not in items_lookup:
+            return None
 
-            if item_id in used_ids or item_id not in items_lookup:
-                continue
+        qty_raw = entry.get("qty", 1)
+        try:
+            qty = float(qty_raw)
+        except (TypeError, ValueError):
+            qty = 1.0
 
-            qty_raw = entry.get("qty", 1)
-            try:
-                qty = float(qty_raw)
-            except (TypeError, ValueError):
-                qty = 1.0
+        if qty <= 0:
+            return None
 
-            if qty <= 0:
-                continue
+        qty = min(max(qty, 0.5), 5.0)
 
-            qty = min(max(qty, 0.5), 5.0)
+        time_hint = entry.get("time_hint") or "any"
+        if not isinstance(time_hint, str):
+            time_hint = "any"
+        time_hint = time_hint.strip().lower() or "any"
 
-            time_hint = entry.get("time_hint") or "any"
-            if not isinstance(time_hint, str):
-                time_hint = "any"
-            time_hint = time_hint.strip().lower() or "any"
+        title = entry.get("title") or items_lookup[item_id].get("title")
+        if not isinstance(title, str):
+            title = str(items_lookup[item_id].get("title", ""))
 
-            title = entry.get("title") or items_lookup[item_id].get("title")
-            if not isinstance(title, str):
-                title = str(items_lookup[item_id].get("title", ""))
+        used_ids.add(item_id)
+        return {
+            "item_id": item_id,
+            "qty": round(qty, 2),
+            "time_hint": time_hint,
+            "title": title,
+        }
 
-            parsed_plan.append(
-                {
-                    "item_id": item_id,
-                    "qty": round(qty, 2),
-                    "time_hint": time_hint,
-                    "title": title,
-                }
-            )
 
-            used_ids.add(item_id)
+def _prefixed_config(config: Mapping[str, str], prefix: str) -> Dict[str, str]:
+    """``OPENAI_SECONDARY_MODEL`` overrides ``OPENAI_MODEL`` and so on."""
+    merged = dict(config)
+    for key, value in config.items():
+        if key.startswith(prefix):
+            merged["OPENAI_" + key[len(prefix):]] = value
+    return merged
 
-            if len(parsed_plan) >= self.max_plan_items:
-                break
 
-        return parsed_plan
+def _build_openai_secondary(*, config: Mapping[str, str] | None = None, http_client=None) -> LLMProvider:
+    config = config if config is not None else os.environ
+    return OpenAIProvider(config=_prefixed_config(config, "OPENAI_SECONDARY_"), http_client=http_client)
+
+
+def _build_hedged(*, config: Mapping[str, str] | None = None, http_client=None) -> LLMProvider:
+    from .llm_hedging import HedgedProvider
 
+    return HedgedProvider.from_config(config if config is not None else os.environ, http_client=http_client)
 
-PROVIDERS = {"openai": OpenAIProvider}
 
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "openai_secondary": _build_openai_secondary,
+    "hedged": _build_hedged,
+}
+ProviderBuilder = Callable[..., LLMProvider]
 
-def get_provider():
-    key = os.getenv("LLM_PROVIDER", "openai")
-    return PROVIDERS[key]()
+
+def _read_config_file(path: str) -> Dict[str, str]:
+    values: Dict[str, str] = {}
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip().strip("'\"")
+    return values
+
+
+def _close_provider(provider) -> None:
+    close = getattr(provider, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:  # pragma: no cover - defensive
+        logger.exception("Failed to close LLM provider %r", provider)
+
+
+class ProviderRegistry:
+    """
+    Process-wide cache of LLM providers.
+
+    Providers are built once per key and share one pooled ``httpx.Client``,
+    so connections (and TLS sessions) to the API host are reused across
+    plans. Configuration is ``os.environ`` overlaid with the optional
+    ``LLM_PROVIDER_CONFIG_FILE`` (``KEY=VALUE`` lines, e.g. a mounted
+    secret). The file is re-checked every ``LLM_PROVIDER_RELOAD_SECONDS``
+    and immediately after :meth:`request_reload` (wired to a signal in
+    ``apps.py``); when it changed, providers are rebuilt on next use.
+    """
+
+    def __init__(
+        self,
+        *,
+        providers: Mapping[str, ProviderBuilder] | None = None,
+        config_file: str | None = None,
+        reload_interval: float | None = None,
+        pool_size: int | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.providers = providers if providers is not None else PROVIDERS
+        self.config_file = config_file if config_file is not None else os.getenv("LLM_PROVIDER_CONFIG_FILE", "")
+        if reload_interval is None:
+            reload_interval = float(os.getenv("LLM_PROVIDER_RELOAD_SECONDS", "0"))
+        self.reload_interval = reload_interval
+        self.pool_size = max(1, pool_size or int(os.getenv("LLM_HTTP_POOL_SIZE", "16")))
+        self.clock = clock
+        self.builds = 0
+
+        self._lock = threading.Lock()
+        self._instances: Dict[str, LLMProvider] = {}
+        self._config: Optional[Dict[str, str]] = None
+        self._config_stamp: Optional[float] = None
+        self._checked_at = clock()
+        self._reload_requested = False
+        self._http_client: httpx.Client | None = None
+        self._retired: List[httpx.Client] = []
+        self._retired_providers: List[LLMProvider] = []
+
+    def _file_stamp(self) -> Optional[float]:
+        if not self.config_file:
+            return None
+        try:
+            return os.stat(self.config_file).st_mtime
+        except OSError:
+            return None
+
+    def config(self) -> Dict[str, str]:
+        if self._config is None:
+            config = dict(os.environ)
+            self._config_stamp = self._file_stamp()
+            if self._config_stamp is not None:
+                try:
+                    config.update(_read_config_file(self.config_file))
+                except OSError:
+                    logger.exception("Cannot read LLM provider config %s", self.config_file)
+            self._config = config
+        return self._config
+
+    def http_client(self) -> httpx.Client:
+        if self._http_client is None:
+            timeout = float(self.config().get("OPENAI_TIMEOUT", "20"))
+            client_class = getattr(openai, "DefaultHttpxClient", httpx.Client)
+            self._http_client = client_class(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._http_client
+
+    def request_reload(self) -> None:
+        """Only sets a flag, so it is safe to call from a signal handler."""
+        self._reload_requested = True
+
+    def reload(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        for provider in self._retired_providers:
+            _close_provider(provider)
+        # Как и HTTP-клиент: старые провайдеры могут ещё отвечать в других потоках.
+        self._retired_providers = list(self._instances.values())
+        self._instances = {}
+        self._config = None
+        for client in self._retired:
+            client.close()
+        # Текущий клиент ещё может обслуживать запросы в других потоках — закрываем на следующей перезагрузке.
+        self._retired = [self._http_client] if self._http_client is not None else []
+        self._http_client = None
+
+    def _maybe_reload(self) -> None:
+        now = self.clock()
+        due = self.reload_interval > 0 and now - self._checked_at >= self.reload_interval
+        if not (self._reload_requested or due):
+            return
+        with self._lock:
+            forced, self._reload_requested = self._reload_requested, False
+            self._checked_at = now
+            if forced or self._file_stamp() != self._config_stamp:
+                logger.info("Reloading LLM providers (%s)", "signal" if forced else "config changed")
+                self._reset()
+
+    def get(self, key: str | None = None) -> LLMProvider:
+        self._maybe_reload()
+        key = key or self.config().get("LLM_PROVIDER", "openai")
+        provider = self._instances.get(key)
+        if provider is None:
+            with self._lock:
+                provider = self._instances.get(key)
+                if provider is None:
+                    provider = self.providers[key](config=self.config(), http_client=self.http_client())
+                    self._instances[key] = provider
+                    self.builds += 1
+        return provider
+
+    def close(self) -> None:
+        with self._lock:
+            self._reset()
+            for provider in self._retired_providers:
+                _close_provider(provider)
+            self._retired_providers = []
+            for client in self._retired:
+                client.close()
+            self._retired = []
+
+
+default_registry = ProviderRegistry()
+
+
+def get_provider(key: str | None = None) -> LLMProvider:
+    return default_registry.get(key)
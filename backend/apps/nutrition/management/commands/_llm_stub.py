@@ -0,0 +1,127 @@
+"""Local OpenAI-compatible chat completions stub for LLM benchmarks."""
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+_ITEM_ID_RE = re.compile(r"#(\d+)")
+
+Responder = Callable[[List[Dict]], Dict]
+
+
+def pick_first_items(messages: List[Dict], count: int = 3) -> Dict:
+    """Default answer: a plan from the first item ids mentioned in the prompt."""
+    prompt = messages[-1].get("content", "") if messages else ""
+    ids = list(dict.fromkeys(int(m) for m in _ITEM_ID_RE.findall(prompt)))[:count]
+    return {"plan": [{"item_id": item_id, "qty": 1, "time_hint": "any"} for item_id in ids]}
+
+
+class StubLLMServer:
+    """
+    Threaded HTTP server answering ``POST /v1/chat/completions``.
+
+    Counts requests, TCP connections, prompt and completion characters; ``latency`` plus
+    ``latency_per_kchar`` for every 1000 prompt characters is added to each
+    response to imitate model time (prefill grows with the prompt).
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        latency_per_kchar: float = 0.0,
+        responder: Optional[Responder] = None,
+    ) -> None:
+        self.latency = latency
+        self.latency_per_kchar = latency_per_kchar
+        self.responder = responder or pick_first_items
+        self.requests = 0
+        self.connections = 0
+        self.prompt_chars = 0
+        self.completion_chars = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                messages = body.get("messages") or []
+                prompt_chars = sum(len(m.get("content") or "") for m in messages)
+                with stub._lock:
+                    stub.requests += 1
+                    stub.prompt_chars += prompt_chars
+                delay = stub.latency + stub.latency_per_kchar * prompt_chars / 1000
+                if delay:
+                    time.sleep(delay)
+                content = json.dumps(stub.responder(messages), ensure_ascii=False)
+                with stub._lock:
+                    stub.completion_chars += len(content)
+                payload = json.dumps(
+                    {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "stub"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "finish_reason": "stop",
+                                "message": {"role": "assistant", "content": content},
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": prompt_chars // 4,
+                            "completion_tokens": len(content) // 4,
+                            "total_tokens": (prompt_chars + len(content)) // 4,
+                        },
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self) -> "StubLLMServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "StubLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
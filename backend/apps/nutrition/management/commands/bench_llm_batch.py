@@ -0,0 +1,138 @@
+"""Requests/sec, tokens per plan and plan quality: one prompt per user vs. batched prompts."""
+from __future__ import annotations
+
+import random
+import re
+import statistics
+import time
+from typing import Dict, List
+
+import httpx
+from django.core.management.base import BaseCommand
+
+from apps.nutrition.llm_governor import LLMGovernor
+from apps.nutrition.llm_provider import OpenAIProvider
+
+from ._llm_stub import StubLLMServer
+from .bench_llm_prompt import _catalog, _plan_error, _targets, stub_model
+
+_USER_LINE = re.compile(r"^(u\d+): (\d+) ккал, Б (\d+)г, Ж (\d+)г, У (\d+)г\.(?: Недоступны: ([\d, ]+)\.)?", re.M)
+_TABLE_ROW = re.compile(r"^\d+\|", re.M)
+
+
+def batch_model(messages: List[Dict]) -> Dict:
+    """:func:`stub_model` for each user of a batched prompt; single prompts as is."""
+    prompt = messages[-1]["content"]
+    users = _USER_LINE.findall(prompt)
+    if not users:
+        return stub_model(messages)
+    rows = [line for line in prompt.splitlines() if _TABLE_ROW.match(line)]
+    plans = {}
+    for alias, calories, protein, fat, carbs, unavailable in users:
+        hidden = {f"{item_id.strip()}|" for item_id in unavailable.split(",") if item_id.strip()}
+        own_rows = [row for row in rows if row[: row.index("|") + 1] not in hidden]
+        single = f"Цели на день: {calories} ккал, Б {protein}г, Ж {fat}г, У {carbs}г.\n" + "\n".join(own_rows)
+        plans[alias] = stub_model([{"role": "user", "content": single}])["plan"]
+    return {"plans": plans}
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate plans for groups of users sharing a catalog (same city and restrictions), "
+        "one chat completion per user vs. batched completions, against a local stub model whose "
+        "latency grows with the prompt; report requests/sec, plans/sec, tokens per plan and "
+        "plan macro error"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--groups", type=int, default=8, help="(city, restrictions) groups.")
+        parser.add_argument("--users", type=int, default=8, help="Users per group.")
+        parser.add_argument("--batch", type=int, default=8, help="NUTRIBOT_BATCH_MAX_USERS.")
+        parser.add_argument("--items", type=int, default=120, help="Dishes in a group's catalog.")
+        parser.add_argument("--share", type=float, default=0.9, help="Part of the catalog each user can order.")
+        parser.add_argument("--budget", type=int, default=1500, help="NUTRIBOT_PROMPT_TOKEN_BUDGET.")
+        parser.add_argument("--batch-budget", type=int, default=3000, help="NUTRIBOT_BATCH_TOKEN_BUDGET.")
+        parser.add_argument("--latency-ms", type=float, default=300.0)
+        parser.add_argument("--ms-per-kchar", type=float, default=15.0, help="Stub prefill cost.")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        groups = []
+        for group_idx in range(max(1, options["groups"])):
+            rng = random.Random(options["seed"] + group_idx)
+            catalog = _catalog(max(1, options["items"]), rng)
+            lookup = {item["id"]: item for item in catalog}
+            contexts = {}
+            for user_idx in range(max(1, options["users"])):
+                items = [item for item in catalog if rng.random() < options["share"]]
+                contexts[f"{group_idx}:{user_idx}"] = {
+                    "targets": _targets(rng),
+                    "items": items,
+                    "restrictions": {"allergies": [], "exclusions": []},
+                }
+            groups.append((contexts, lookup))
+        users = sum(len(contexts) for contexts, _ in groups)
+
+        with StubLLMServer(
+            latency=options["latency_ms"] / 1000,
+            latency_per_kchar=options["ms_per_kchar"] / 1000,
+            responder=batch_model,
+        ) as stub:
+            http_client = httpx.Client(timeout=60)
+            provider = OpenAIProvider(
+                config={
+                    "OPENAI_API_KEY": "bench",
+                    "OPENAI_BASE_URL": stub.base_url,
+                    "OPENAI_MAX_RETRIES": "1",
+                    "NUTRIBOT_PROMPT_TOKEN_BUDGET": str(options["budget"]),
+                    "NUTRIBOT_BATCH_TOKEN_BUDGET": str(options["batch_budget"]),
+                    "NUTRIBOT_BATCH_MAX_USERS": str(options["batch"]),
+                },
+                http_client=http_client,
+                governor=LLMGovernor(None),  # меряем запросы, а не лимиты
+            )
+            results = {}
+            for mode in ("single", "batch"):
+                stub.requests = stub.prompt_chars = stub.completion_chars = 0
+                errors, empty = [], 0
+                started = time.perf_counter()
+                for contexts, lookup in groups:
+                    if mode == "batch":
+                        plans = provider.compose_menu_batch(contexts)
+                    else:
+                        plans = {key: provider.compose_menu(context) for key, context in contexts.items()}
+                    for key, plan in plans.items():
+                        if not plan:
+                            empty += 1
+                            continue
+                        error = _plan_error(plan, lookup, contexts[key]["targets"])
+                        errors.append(statistics.fmean(error.values()))
+                elapsed = time.perf_counter() - started
+                plans_made = max(1, users - empty)
+                results[mode] = {
+                    "requests": stub.requests,
+                    "elapsed": elapsed,
+                    # Заглушка считает токены как символы / 4.
+                    "prompt": stub.prompt_chars / 4 / plans_made,
+                    "completion": stub.completion_chars / 4 / plans_made,
+                    "error": statistics.fmean(errors or [1]),
+                    "empty": empty,
+                }
+            http_client.close()
+
+        for mode, stats in results.items():
+            self.stdout.write(
+                f"{mode:<6} requests={stats['requests']} "
+                f"requests/s={stats['requests'] / stats['elapsed']:.2f} "
+                f"plans/s={users / stats['elapsed']:.2f} "
+                f"tokens/plan prompt≈{stats['prompt']:.0f} completion≈{stats['completion']:.0f} "
+                f"macro error={stats['error'] * 100:.1f}% empty={stats['empty']}/{users}"
+            )
+        single, batch = results["single"], results["batch"]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"batched: {single['elapsed'] / batch['elapsed']:.1f}x plans/s, "
+                f"{(batch['prompt'] + batch['completion']) / (single['prompt'] + single['completion']) * 100:.0f}% "
+                f"of the tokens per plan"
+            )
+        )
@@ -0,0 +1,169 @@
+"""Prompt size, latency and plan quality: verbose vs. compact token-budgeted prompts."""
+from __future__ import annotations
+
+import random
+import re
+import statistics
+import time
+from typing import Dict, List
+
+import httpx
+from django.core.management.base import BaseCommand
+
+from apps.nutrition.llm_provider import SYSTEM_PROMPT, OpenAIProvider
+from apps.nutrition.prompt_encoding import estimate_tokens
+
+from ._llm_stub import StubLLMServer
+
+_VERBOSE_ROW = re.compile(r"#(\d+): .*? — ([\d.]+) ккал, Б/Ж/У: ([\d.]+)/([\d.]+)/([\d.]+)г")
+_COMPACT_ROW = re.compile(r"^(\d+)\|[^|\n]*\|([\d.]+)\|([\d.]+)\|([\d.]+)\|([\d.]+)\|", re.M)
+_TARGETS = (
+    re.compile(r"Калории: (\d+)\n- Белки: (\d+)\n- Жиры: (\d+)\n- Углеводы: (\d+)"),
+    re.compile(r"Цели на день: (\d+) ккал, Б (\d+)г, Ж (\d+)г, У (\d+)г"),
+)
+MACROS = ("kcal", "protein", "fat", "carbs")
+
+
+def stub_model(messages: List[Dict]) -> Dict:
+    """
+    A deterministic "model": sees only the dishes present in the prompt and
+    greedily adds the dish that brings the running totals closest to the
+    targets, so a better candidate list gives a better plan.
+    """
+    prompt = messages[-1]["content"]
+    rows = _COMPACT_ROW.findall(prompt) or _VERBOSE_ROW.findall(prompt)
+    match = next((m for m in (r.search(prompt) for r in _TARGETS) if m), None)
+    targets = [float(v) for v in match.groups()] if match else [2000.0, 120.0, 70.0, 220.0]
+    dishes = {int(r[0]): [float(v) for v in r[1:]] for r in rows}
+
+    def error(totals):
+        return sum(((t - g) / g) ** 2 for t, g in zip(totals, targets))
+
+    totals, plan = [0.0] * 4, []
+    while dishes and len(plan) < 5:
+        dish_id, values = min(dishes.items(), key=lambda d: error([t + v for t, v in zip(totals, d[1])]))
+        if error([t + v for t, v in zip(totals, values)]) >= error(totals):
+            break
+        totals = [t + v for t, v in zip(totals, values)]
+        del dishes[dish_id]
+        plan.append({"item_id": dish_id, "qty": 1, "time_hint": "any"})
+    return {"plan": plan}
+
+
+def _catalog(size: int, rng: random.Random) -> List[Dict]:
+    items = []
+    for idx in range(1, size + 1):
+        protein, fat, carbs = rng.uniform(3, 60), rng.uniform(2, 45), rng.uniform(5, 120)
+        items.append(
+            {
+                "id": idx,
+                "title": f"{rng.choice(['Салат', 'Суп', 'Боул', 'Паста', 'Омлет', 'Стейк', 'Каша'])} "
+                         f"{rng.choice(['с курицей', 'с лососем', 'овощной', 'с киноа', 'с сыром'])} №{idx}",
+                "kcal": round(protein * 4 + fat * 9 + carbs * 4, 1),
+                "protein": round(protein, 1),
+                "fat": round(fat, 1),
+                "carbs": round(carbs, 1),
+                "tags": rng.sample(["веган", "без глютена", "острое", "хит", "фитнес"], k=rng.randint(0, 2)),
+                "price": rng.randint(150, 900),
+            }
+        )
+    rng.shuffle(items)
+    return items
+
+
+def _targets(rng: random.Random) -> Dict[str, int]:
+    calories = rng.choice([1600, 1900, 2200, 2600, 3000])
+    return {
+        "calories": calories,
+        "protein": int(calories * 0.3 / 4),
+        "fat": int(calories * 0.3 / 9),
+        "carbs": int(calories * 0.4 / 4),
+    }
+
+
+def _plan_error(plan: List[Dict], items: Dict[int, Dict], targets: Dict[str, int]) -> Dict[str, float]:
+    totals = dict.fromkeys(MACROS, 0.0)
+    for entry in plan:
+        for macro in MACROS:
+            totals[macro] += items[entry["item_id"]][macro] * entry["qty"]
+    keys = {"kcal": "calories", "protein": "protein", "fat": "fat", "carbs": "carbs"}
+    return {macro: abs(totals[macro] - targets[keys[macro]]) / targets[keys[macro]] for macro in MACROS}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the verbose prompt (one sentence per dish, first N dishes) with the compact "
+        "table filled in score order up to a token budget, against a local stub model whose "
+        "latency grows with the prompt; report prompt tokens, latency and plan macro error"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=50)
+        parser.add_argument("--items", type=int, default=120, help="Candidates in the context.")
+        parser.add_argument("--budget", type=int, default=1500, help="NUTRIBOT_PROMPT_TOKEN_BUDGET.")
+        parser.add_argument("--verbose-limit", type=int, default=40, help="NUTRIBOT_PROMPT_ITEMS_LIMIT.")
+        parser.add_argument("--latency-ms", type=float, default=20.0)
+        parser.add_argument("--ms-per-kchar", type=float, default=15.0, help="Stub prefill cost.")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        runs = max(1, options["runs"])
+        with StubLLMServer(
+            latency=options["latency_ms"] / 1000,
+            latency_per_kchar=options["ms_per_kchar"] / 1000,
+            responder=stub_model,
+        ) as stub:
+            base = {"OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": stub.base_url, "OPENAI_MAX_RETRIES": "1"}
+            http_client = httpx.Client(timeout=30)
+            formats = {
+                "verbose": OpenAIProvider(
+                    config={**base, "NUTRIBOT_PROMPT_FORMAT": "verbose",
+                            "NUTRIBOT_PROMPT_ITEMS_LIMIT": str(options["verbose_limit"])},
+                    http_client=http_client,
+                ),
+                "compact": OpenAIProvider(
+                    config={**base, "NUTRIBOT_PROMPT_TOKEN_BUDGET": str(options["budget"])},
+                    http_client=http_client,
+                ),
+            }
+            results = {name: {"tokens": [], "latency": [], "kcal": [], "macros": [], "empty": 0} for name in formats}
+            for run in range(runs):
+                rng = random.Random(options["seed"] + run)
+                items = _catalog(max(1, options["items"]), rng)
+                targets = _targets(rng)
+                context = {
+                    "targets": targets,
+                    "items": items,
+                    "restrictions": {"allergies": [], "exclusions": []},
+                }
+                lookup = {item["id"]: item for item in items}
+                for name, provider in formats.items():
+                    stats = results[name]
+                    prompt = provider._build_user_prompt(context)
+                    stats["tokens"].append(estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt))
+                    started = time.perf_counter()
+                    plan = provider.compose_menu(context)
+                    stats["latency"].append(time.perf_counter() - started)
+                    if not plan:
+                        stats["empty"] += 1
+                        continue
+                    error = _plan_error(plan, lookup, targets)
+                    stats["kcal"].append(error["kcal"])
+                    stats["macros"].append(statistics.fmean(error.values()))
+            http_client.close()
+
+        for name, stats in results.items():
+            self.stdout.write(
+                f"{name:<8} prompt≈{statistics.fmean(stats['tokens']):.0f} tokens "
+                f"latency mean={statistics.fmean(stats['latency']) * 1000:.1f}ms "
+                f"kcal error={statistics.fmean(stats['kcal'] or [1]) * 100:.1f}% "
+                f"macro error={statistics.fmean(stats['macros'] or [1]) * 100:.1f}% "
+                f"empty={stats['empty']}/{runs}"
+            )
+        verbose, compact = results["verbose"], results["compact"]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"compact uses {statistics.fmean(compact['tokens']) / statistics.fmean(verbose['tokens']) * 100:.0f}% "
+                f"of the verbose prompt tokens"
+            )
+        )
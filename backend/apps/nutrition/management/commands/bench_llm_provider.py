@@ -0,0 +1,128 @@
+"""Per-call overhead of building LLM providers vs. the process-wide registry."""
+from __future__ import annotations
+
+import os
+import statistics
+import threading
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+from apps.nutrition.llm_provider import OpenAIProvider, ProviderRegistry
+
+from ._llm_stub import StubLLMServer
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _context(items: int) -> dict:
+    return {
+        "targets": {"calories": 2100, "protein": 130, "fat": 70, "carbs": 220},
+        "restrictions": {"allergies": [], "exclusions": []},
+        "items": [
+            {
+                "id": idx,
+                "title": f"Блюдо {idx}",
+                "kcal": 400.0 + idx,
+                "protein": 25.0,
+                "fat": 12.0,
+                "carbs": 40.0,
+                "tags": [],
+                "price": 300,
+            }
+            for idx in range(1, items + 1)
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compose menus against a local OpenAI-compatible stub, building a provider per call "
+        "(the old get_provider behaviour) and through ProviderRegistry, and report latency "
+        "and TCP connections opened"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=200, help="compose_menu calls per mode.")
+        parser.add_argument("--threads", type=int, default=4, help="Concurrent callers.")
+        parser.add_argument("--items", type=int, default=40, help="Items in the prompt context.")
+        parser.add_argument("--latency-ms", type=float, default=0.0, help="Stub model latency.")
+
+    def _run(self, mode: str, *, calls: int, threads: int, context: dict, stub: StubLLMServer, config: dict):
+        registry = ProviderRegistry(config_file="", pool_size=threads)
+        connections_before = stub.connections
+        latencies: list[float] = []
+        failures = 0
+        lock = threading.Lock()
+
+        def worker(count: int) -> None:
+            nonlocal failures
+            local: list[float] = []
+            local_failures = 0
+            for _ in range(count):
+                started = time.perf_counter()
+                if mode == "fresh":
+                    # Как раньше: новый клиент и свой пул соединений на каждый план.
+                    provider = OpenAIProvider(config=config, http_client=httpx.Client(timeout=20))
+                else:
+                    provider = registry.get()
+                if not provider.compose_menu(context):
+                    local_failures += 1
+                local.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(local)
+                failures += local_failures
+
+        per_thread = [calls // threads + (1 if idx < calls % threads else 0) for idx in range(threads)]
+        workers = [threading.Thread(target=worker, args=(count,)) for count in per_thread if count]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        registry.close()
+
+        self.stdout.write(
+            f"{mode:<8} calls={len(latencies)} elapsed={elapsed:.3f}s "
+            f"mean={statistics.fmean(latencies) * 1000:.2f}ms "
+            f"p50={_percentile(latencies, 50) * 1000:.2f}ms "
+            f"p95={_percentile(latencies, 95) * 1000:.2f}ms "
+            f"connections={stub.connections - connections_before} builds={registry.builds or len(latencies)} "
+            f"failures={failures}"
+        )
+        return statistics.fmean(latencies)
+
+    def handle(self, *args, **options):
+        calls = max(1, options["calls"])
+        threads = max(1, options["threads"])
+        context = _context(max(1, options["items"]))
+
+        with StubLLMServer(latency=options["latency_ms"] / 1000) as stub:
+            config = {
+                "OPENAI_API_KEY": "bench",
+                "OPENAI_BASE_URL": stub.base_url,
+                "OPENAI_MAX_RETRIES": "1",
+            }
+            saved = {key: os.environ.get(key) for key in config}
+            os.environ.update(config)
+            try:
+                fresh = self._run("fresh", calls=calls, threads=threads, context=context, stub=stub, config=config)
+                shared = self._run("registry", calls=calls, threads=threads, context=context, stub=stub, config=config)
+            finally:
+                for key, value in saved.items():
+                    if value is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = value
+
+        self.stdout.write(
+            self.style.SUCCESS(f"registry saves {(fresh - shared) * 1000:.2f}ms per call ({fresh / shared:.1f}x)")
+        )
@@ -0,0 +1,111 @@
+"""Hit rate, latency and macro error of the plan library against live generation."""
+from __future__ import annotations
+
+import random
+import statistics
+import time
+from typing import Dict, List
+
+from django.core.management.base import BaseCommand
+
+from apps.catalog.models import MenuItem
+from apps.nutrition.plan_library import (
+    SOLVERS,
+    build_plan_library,
+    lookup_plan,
+    macro_error,
+    plan_totals,
+    profile_targets,
+    selection_service_for,
+)
+from apps.nutrition.planner import build_menu_for_user
+from apps.users.models import Profile
+
+
+def _p90(values: List[float]) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+
+def _describe(values: List[float], scale: float = 100.0, unit: str = "%") -> str:
+    if not values:
+        return "n/a"
+    return f"mean={statistics.fmean(values) * scale:.1f}{unit} p90={_p90(values) * scale:.1f}{unit}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Sample real profiles and compare the precomputed plan library with live generation "
+        "(same solver): hit rate, lookup vs. live latency and the macro error of both plans "
+        "against each profile's own targets"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sample", type=int, default=200, help="Profiles to sample.")
+        parser.add_argument("--solver", choices=SOLVERS, default="greedy")
+        parser.add_argument("--build", action="store_true", help="Rebuild the library first.")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        solver = options["solver"]
+        selection_service = selection_service_for(solver)
+        if options["build"]:
+            started = time.perf_counter()
+            built = build_plan_library(solver=solver, selection_service=selection_service)
+            self.stdout.write(f"built {built.as_dict()} in {time.perf_counter() - started:.1f}s")
+
+        ids = list(Profile.objects.values_list("id", flat=True))
+        ids = random.Random(options["seed"]).sample(ids, min(len(ids), max(1, options["sample"])))
+        profiles = Profile.objects.filter(id__in=ids).select_related("user")
+
+        hits = 0
+        latency: Dict[str, List[float]] = {"library": [], "live": []}
+        errors: Dict[str, List[float]] = {"library": [], "live": [], "live_on_hits": []}
+        for profile in profiles:
+            targets = profile_targets(profile)
+
+            started = time.perf_counter()
+            hit = lookup_plan(
+                targets=targets,
+                city=profile.city,
+                allergies=profile.allergies,
+                exclusions=profile.exclusions,
+                budget=profile.daily_budget,
+            )
+            latency["library"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            data = build_menu_for_user(profile.user, selection_service=selection_service, use_library=False)
+            latency["live"].append(time.perf_counter() - started)
+
+            ids_in_plan = [entry["item_id"] for entry in data["plan"]]
+            nutrients = {
+                item_id: values
+                for item_id, *values in MenuItem.objects.filter(id__in=ids_in_plan).values_list(
+                    "id", "nutrients__calories", "nutrients__protein", "nutrients__fat", "nutrients__carbs"
+                )
+            }
+            live_error = macro_error(plan_totals(data["plan"], nutrients), targets)
+            errors["live"].append(live_error)
+            if hit is not None:
+                hits += 1
+                errors["library"].append(hit.macro_error)
+                errors["live_on_hits"].append(live_error)
+
+        sampled = len(latency["live"])
+        if not sampled:
+            self.stdout.write(self.style.WARNING("no profiles to sample"))
+            return
+        self.stdout.write(f"profiles={sampled} solver={solver} hit rate={hits / sampled * 100:.1f}%")
+        self.stdout.write(
+            f"latency library lookup {_describe(latency['library'], 1000, 'ms')}, "
+            f"live {_describe(latency['live'], 1000, 'ms')}"
+        )
+        self.stdout.write(
+            f"macro error library {_describe(errors['library'])}, "
+            f"live on the same profiles {_describe(errors['live_on_hits'])}, "
+            f"live overall {_describe(errors['live'])}"
+        )
+        if errors["library"]:
+            delta = statistics.fmean(errors["library"]) - statistics.fmean(errors["live_on_hits"])
+            self.stdout.write(self.style.SUCCESS(f"library vs live macro error: {delta * 100:+.1f} pp"))
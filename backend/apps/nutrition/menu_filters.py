@@ -3,11 +3,14 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, Mapping, Sequence
 
+from django.conf import settings
 from django.db import connection
 from django.db.models import Q, QuerySet
 
 from apps.catalog.models import MenuItem, Restaurant, Store
 
+from .tracing import annotate, current_trace
+
 
 class MenuConstraintFilter:
     """Base class for filters applied to the menu queryset."""
@@ -134,7 +137,15 @@ class MenuFilterService:
     def filter(self, **criteria: Any) -> list[MenuItem]:
         normalized = self._normalize_criteria(criteria)
         queryset = self.queryset_factory()
+        # COUNT после каждого фильтра — отдельный запрос, поэтому только по флагу.
+        counts = {} if current_trace() and getattr(settings, "PLANNER_TRACE_FILTER_COUNTS", False) else None
+        if counts is not None:
+            counts["all"] = queryset.count()
         for filter_ in self.filters:
             queryset = filter_.apply(queryset, normalized)
+            if counts is not None:
+                counts[getattr(filter_, "criteria_key", None) or type(filter_).__name__] = queryset.count()
+        if counts is not None:
+            annotate(filter_counts=counts)
         queryset = queryset.select_related("nutrients")
         return list(queryset[: self.limit])
\ No newline at end of file
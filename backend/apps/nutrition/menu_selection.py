@@ -1,17 +1,24 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Callable, Dict, List, Mapping, Sequence
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Mapping, Sequence
 
 from apps.catalog.models import MenuItem
+from .degraded_mode import DEGRADED_PROVIDER, Decision, DegradedModeController
 from .llm_provider import LLMProvider, get_provider
 from .services import Targets
+from .tracing import annotate, span
 
 logger = logging.getLogger(__name__)
 
 Plan = List[Dict[str, Any]]
 FallbackStrategy = Callable[[Sequence[MenuItem], Targets], Plan]
 ProviderFactory = Callable[[], LLMProvider]
+ControllerFactory = Callable[[], DegradedModeController | None]
+
+HYBRID_PROVIDER = "hybrid"
 
 
 def greedy_knapsack(items: Sequence[MenuItem], targets: Targets) -> Plan:
@@ -51,6 +58,30 @@ def greedy_knapsack(items: Sequence[MenuItem], targets: Targets) -> Plan:
     return picked
 
 
+@dataclass
+class SelectedPlan:
+    plan: Plan
+    provider: str
+
+
+@dataclass
+class StreamedPlan:
+    """Plan entries yielded as they arrive plus the ``provider`` the plan is saved with."""
+
+    entries: Iterator[Dict[str, Any]]
+    provider: str
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.entries
+
+
+@dataclass
+class PlanRequest:
+    items: Sequence[MenuItem]
+    targets: Targets
+    restrictions: Mapping[str, Any] | None = None
+
+
 class MenuSelectionService:
     """Compose a day plan using an LLM with a deterministic fallback."""
 
@@ -60,10 +91,12 @@ class MenuSelectionService:
         provider_factory: ProviderFactory | None = None,
         fallback_strategy: FallbackStrategy | None = None,
         context_items_limit: int = 120,
+        controller_factory: ControllerFactory | None = None,
     ) -> None:
         self.provider_factory: ProviderFactory = provider_factory or get_provider
         self.fallback_strategy: FallbackStrategy = fallback_strategy or greedy_knapsack
         self.context_items_limit = max(1, int(context_items_limit))
+        self.controller_factory: ControllerFactory = controller_factory or (lambda: None)
 
     def serialize_targets(self, targets: Targets) -> Dict[str, int]:
         protein = int(targets.protein_g)
@@ -128,6 +161,108 @@ class MenuSelectionService:
             )
         return payload
 
+    def _context(self, items, targets, restrictions):
+        normalized_items = self._normalize_items(items)
+        context = {
+            "targets": self.serialize_targets(targets),
+            "items": self._serialize_items(normalized_items),
+            "restrictions": self._normalize_restrictions(restrictions),
+        }
+        return normalized_items, context
+
+    def _decide(self) -> tuple[DegradedModeController | None, Decision]:
+        controller = self.controller_factory()
+        return controller, controller.decide() if controller is not None else Decision(use_llm=True)
+
+    @staticmethod
+    def _record(
+            controller,
+            decision: Decision,
+            provider: LLMProvider,
+            has_items: bool,
+            started: float,
+            ok: bool,
+    ) -> None:
+        # Пустой контекст и выключенный провайдер ничего не говорят о здоровье LLM.
+        if controller is None or not has_items or not getattr(provider, "enabled", True):
+            return
+        controller.record(perf_counter() - started, ok=ok, probe=decision.probe)
+
+    def stream_plan(
+        self,
+        *,
+        items: Sequence[MenuItem],
+        targets: Targets,
+        restrictions: Mapping[str, Any] | None = None,
+    ) -> StreamedPlan:
+        """
+        Like :meth:`compose`, but the entries are yielded as the provider produces them.
+
+        The degraded-mode decision is taken right away, so ``provider`` is
+        known before the first entry is read.
+        """
+        normalized_items, context = self._context(items, targets, restrictions)
+        controller, decision = self._decide()
+
+        def entries() -> Iterator[Dict[str, Any]]:
+            produced = 0
+            if decision.use_llm:
+                provider = self.provider_factory()
+                started = perf_counter()
+                try:
+                    for entry in provider.compose_menu_stream(context):
+                        produced += 1
+                        yield entry
+                except Exception:  # pragma: no cover - defensive
+                    logger.exception("LLM provider failed to stream menu")
+                self._record(controller, decision, provider, bool(context["items"]), started, ok=bool(produced))
+            if not produced:
+                yield from self.fallback_strategy(normalized_items, targets)
+
+        return StreamedPlan(
+            entries=entries(),
+            provider=HYBRID_PROVIDER if decision.use_llm else DEGRADED_PROVIDER,
+        )
+
+    def compose(
+        self,
+        *,
+        items: Sequence[MenuItem],
+        targets: Targets,
+        restrictions: Mapping[str, Any] | None = None,
+    ) -> SelectedPlan:
+        """Plan plus the ``provider`` value it is saved with: ``hybrid``, or ``degraded`` when the LLM was skipped."""
+        with span("serialize"):
+            normalized_items, context = self._context(items, targets, restrictions)
+            annotate(items=len(normalized_items), context_items=len(context["items"]))
+
+        controller, decision = self._decide()
+        plan: Plan = []
+        if decision.use_llm:
+            with span("llm"):
+                provider = self.provider_factory()
+                started = perf_counter()
+                try:
+                    plan = provider.compose_menu(context)
+                except Exception:  # pragma: no cover - defensive
+                    logger.exception("LLM provider failed to compose menu")
+                    annotate(outcome="error")
+                    plan = []
+                if decision.probe:
+                    annotate(probe=True)
+                self._record(controller, decision, provider, bool(context["items"]), started, ok=bool(plan))
+        else:
+            annotate(degraded=True)
+
+        fallback = None
+        if not plan:
+            fallback = getattr(self.fallback_strategy, "__name__", type(self.fallback_strategy).__name__)
+            with span("fallback"):
+                plan = self.fallback_strategy(normalized_items, targets)
+        annotate(fallback=fallback)
+
+        return SelectedPlan(plan=plan, provider=HYBRID_PROVIDER if decision.use_llm else DEGRADED_PROVIDER)
+
     def select_plan(
         self,
         *,
@@ -135,22 +270,55 @@ class MenuSelectionService:
         targets: Targets,
         restrictions: Mapping[str, Any] | None = None,
     ) -> Plan:
-        normalized_items = self._normalize_items(items)
-        restrictions_payload = self._normalize_restrictions(restrictions)
-        context = {
-            "targets": self.serialize_targets(targets),
-            "items": self._serialize_items(normalized_items),
-            "restrictions": restrictions_payload,
-        }
+        return self.compose(items=items, targets=targets, restrictions=restrictions).plan
 
-        plan: Plan
-        try:
-            plan = self.provider_factory().compose_menu(context)
-        except Exception:  # pragma: no cover - defensive
-            logger.exception("LLM provider failed to compose menu")
-            plan = []
+    def compose_batch(self, requests: Mapping[Hashable, PlanRequest]) -> Dict[Hashable, SelectedPlan]:
+        """
+        :meth:`compose` for a group of users that share candidates.
 
-        if not plan:
-            plan = self.fallback_strategy(normalized_items, targets)
+        A provider with ``compose_menu_batch`` gets all of them at once and
+        packs several users into one prompt; others are called once per user.
+        Users left without a plan get the fallback one by one. Batch calls
+        follow the degraded-mode decision but are not recorded against the
+        interactive SLO.
+        """
+        with span("serialize"):
+            prepared = {
+                key: self._context(request.items, request.targets, request.restrictions)
+                for key, request in requests.items()
+            }
+            annotate(users=len(prepared))
+
+        controller, decision = self._decide()
+        plans: Dict[Hashable, Plan] = {key: [] for key in prepared}
+        if decision.use_llm:
+            with span("llm"):
+                provider = self.provider_factory()
+                contexts = {key: context for key, (_, context) in prepared.items()}
+                try:
+                    compose_menu_batch = getattr(provider, "compose_menu_batch", None)
+                    if compose_menu_batch is not None:
+                        plans.update(compose_menu_batch(contexts))
+                    else:
+                        plans.update({key: provider.compose_menu(context) for key, context in contexts.items()})
+                except Exception:  # pragma: no cover - defensive
+                    logger.exception("LLM provider failed to compose menus")
+                    annotate(outcome="error")
+                if decision.probe:
+                    annotate(probe=True)
+                    # Задержка батча — это много ответов сразу, а сбой одного пользователя прячется
+                    # среди удачных: в интерактивный SLO батч не пишем, пробу отпускаем без вердикта.
+                    if controller is not None:
+                        controller.record(0.0, ok=False, probe=True)
+        else:
+            annotate(degraded=True)
+
+        missing = [key for key, plan in plans.items() if not plan]
+        if missing:
+            with span("fallback"):
+                for key in missing:
+                    plans[key] = self.fallback_strategy(prepared[key][0], requests[key].targets)
+        annotate(fallbacks=len(missing))
 
-        return plan
\ No newline at end of file
+        provider_name = HYBRID_PROVIDER if decision.use_llm else DEGRADED_PROVIDER
+        return {key: SelectedPlan(plan=plan, provider=provider_name) for key, plan in plans.items()}
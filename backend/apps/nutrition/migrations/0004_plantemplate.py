@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nutrition", "0003_menuplan_processing_and_meal_note"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlanTemplate",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("key", models.CharField(max_length=160, unique=True)),
+                ("city", models.CharField(blank=True, max_length=100)),
+                ("calories", models.PositiveIntegerField()),
+                ("protein_pct", models.PositiveSmallIntegerField()),
+                ("fat_pct", models.PositiveSmallIntegerField()),
+                ("restrictions_key", models.CharField(blank=True, max_length=16)),
+                ("restrictions", models.JSONField(default=dict)),
+                ("plan", models.JSONField(default=list)),
+                ("item_ids", models.JSONField(default=list)),
+                ("source", models.CharField(max_length=16)),
+                ("profiles", models.PositiveIntegerField(default=0)),
+                ("macro_error", models.FloatField(default=0)),
+                ("built_at", models.DateTimeField()),
+            ],
+            options={
+                "indexes": [models.Index(fields=["city", "protein_pct", "fat_pct", "restrictions_key", "calories"], name="nutr_plantemplate_bucket_idx")],
+            },
+        ),
+    ]
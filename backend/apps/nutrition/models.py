@@ -4,6 +4,8 @@ from django.db import models, transaction
 from django.conf import settings
 from apps.catalog.models import MenuItem
 
+from .tracing import span
+
 
 class MenuPlan(models.Model):
     class Status(models.TextChoices):
@@ -34,7 +36,7 @@ class MenuPlan(models.Model):
         user,
         payload: dict,
         plan_date: dt_date | None = None,
-        provider: str = "hybrid",
+        provider: str | None = None,
     ):
         plan_date = plan_date or dt_date.today()
 
@@ -45,7 +47,7 @@ class MenuPlan(models.Model):
 
         plan_items = payload.get("plan") or []
 
-        with transaction.atomic():
+        with span("create_from_payload"), transaction.atomic():
             plan = cls.objects.create(
                 user=user,
                 date=plan_date,
@@ -53,7 +55,7 @@ class MenuPlan(models.Model):
                 target_protein=int(targets.get("protein_g") or 0),
                 target_fat=int(targets.get("fat_g") or 0),
                 target_carbs=int(targets.get("carbs_g") or 0),
-                provider=provider,
+                provider=provider or payload.get("provider") or "hybrid",
             )
 
             (
@@ -107,3 +109,31 @@ class PlanMeal(models.Model):
     qty = models.FloatField(default=1.0)
     time_hint = models.CharField(max_length=16, default="any")
     user_note = models.TextField(blank=True, default="")
+
+
+class PlanTemplate(models.Model):
+    """Готовый план для корзины профилей, собирается ночью (apps/nutrition/plan_library.py)."""
+
+    key = models.CharField(max_length=160, unique=True)
+    city = models.CharField(max_length=100, blank=True)
+    calories = models.PositiveIntegerField()
+    protein_pct = models.PositiveSmallIntegerField()
+    fat_pct = models.PositiveSmallIntegerField()
+    restrictions_key = models.CharField(max_length=16, blank=True)
+    restrictions = models.JSONField(default=dict)
+    plan = models.JSONField(default=list)
+    item_ids = models.JSONField(default=list)
+    source = models.CharField(max_length=16)
+    profiles = models.PositiveIntegerField(default=0)
+    macro_error = models.FloatField(default=0)
+    built_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["city", "protein_pct", "fat_pct", "restrictions_key", "calories"],
+                name="nutr_plantemplate_bucket_idx",
+            ),
+        ]
+
+    def __str__(self): return self.key
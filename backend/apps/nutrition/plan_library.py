@@ -0,0 +1,441 @@
+"""Precomputed day plans for the most common profile buckets.
+
+Most profiles fall into a few hundred combinations of city, calorie need,
+macro split and restriction set. The nightly :func:`build_plan_library`
+groups profiles by :func:`bucket_for`, composes one plan per popular bucket
+with the regular selection service (the LLM, or the deterministic solver
+with ``PLAN_LIBRARY_SOLVER=greedy``) and stores it as a
+:class:`~apps.nutrition.models.PlanTemplate`.
+
+:func:`lookup_plan` takes the template of the nearest bucket (same city,
+split and restrictions, calories within one step), re-checks that its dishes
+are still available, within the budget and free of the user's allergens and
+exclusions, and scales portions to the user's own calories. On a miss it
+returns ``None`` and the planner composes the plan live.
+
+Hits, misses and the macro error of served plans are counted in the Django
+cache (per process with LocMem, shared with Redis) and reported by
+:func:`library_stats`; ``manage.py bench_plan_library`` compares the library
+with live generation on a sample of real profiles.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.catalog.models import MenuItem
+from .llm_governor import BATCH, llm_priority
+from .llm_provider import LLMProvider
+from .menu_filters import MenuFilterService
+from .menu_selection import MenuSelectionService, Plan
+from .models import PlanTemplate
+from .services import Targets, tdee
+
+logger = logging.getLogger(__name__)
+
+MACROS = ("calories", "protein", "fat", "carbs")
+SOLVERS = ("llm", "greedy")
+MIN_QTY = 0.5
+MAX_QTY = 5.0
+
+_STATS_PREFIX = "nutrition:plan_library:"
+
+
+def _normalize_values(values: Iterable[Any] | None) -> Tuple[str, ...]:
+    if not values:
+        return ()
+    if isinstance(values, str):
+        values = [values]
+    return tuple(sorted({str(value).strip().lower() for value in values if str(value).strip()}))
+
+
+def _restrictions_hash(allergies: Tuple[str, ...], exclusions: Tuple[str, ...]) -> str:
+    if not allergies and not exclusions:
+        return ""
+    raw = "a=" + ",".join(allergies) + ";e=" + ",".join(exclusions)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def restrictions_key(allergies: Iterable[Any] | None, exclusions: Iterable[Any] | None) -> str:
+    """Key of a set of restrictions, insensitive to case and order; ``""`` when there are none."""
+    return _restrictions_hash(_normalize_values(allergies), _normalize_values(exclusions))
+
+
+@dataclass(frozen=True)
+class PlanBucket:
+    city: str
+    calories: int
+    protein_pct: int
+    fat_pct: int
+    allergies: Tuple[str, ...] = ()
+    exclusions: Tuple[str, ...] = ()
+
+    @property
+    def restrictions_key(self) -> str:
+        return _restrictions_hash(self.allergies, self.exclusions)
+
+    @property
+    def key(self) -> str:
+        return f"{self.city}|{self.calories}|{self.protein_pct}/{self.fat_pct}|{self.restrictions_key}"
+
+    def targets(self) -> Targets:
+        """Targets of the bucket centre, used to compose its template."""
+        carbs_pct = max(0, 100 - self.protein_pct - self.fat_pct)
+        return Targets(
+            calories=self.calories,
+            protein_g=int(round(self.calories * self.protein_pct / 100 / 4)),
+            fat_g=int(round(self.calories * self.fat_pct / 100 / 9)),
+            carbs_g=int(round(self.calories * carbs_pct / 100 / 4)),
+        )
+
+    def restrictions(self) -> Dict[str, List[str]]:
+        return {"allergies": list(self.allergies), "exclusions": list(self.exclusions)}
+
+
+def _calorie_step() -> int:
+    return max(1, int(getattr(settings, "PLAN_LIBRARY_CALORIE_STEP", 100)))
+
+
+def _macro_step() -> int:
+    return max(1, int(getattr(settings, "PLAN_LIBRARY_MACRO_STEP", 5)))
+
+
+def _quantize(value: float, step: int) -> int:
+    return int(math.floor(value / step + 0.5)) * step
+
+
+def bucket_for(
+        targets: Targets,
+        *,
+        city: str | None,
+        allergies: Iterable[Any] | None = None,
+        exclusions: Iterable[Any] | None = None,
+) -> PlanBucket:
+    calories = max(1, int(targets.calories))
+    return PlanBucket(
+        city=(city or "").strip(),
+        calories=max(_calorie_step(), _quantize(calories, _calorie_step())),
+        protein_pct=_quantize(targets.protein_g * 4 * 100 / calories, _macro_step()),
+        fat_pct=_quantize(targets.fat_g * 9 * 100 / calories, _macro_step()),
+        allergies=_normalize_values(allergies),
+        exclusions=_normalize_values(exclusions),
+    )
+
+
+def plan_totals(plan: Sequence[Mapping[str, Any]], nutrients: Mapping[int, Sequence[float]]) -> Dict[str, float]:
+    """Sum of calories and macros of a plan; ``nutrients`` maps item id to (kcal, protein, fat, carbs)."""
+    totals = dict.fromkeys(MACROS, 0.0)
+    for entry in plan:
+        values = nutrients.get(entry.get("item_id"))
+        if not values:
+            continue
+        qty = float(entry.get("qty") or 0)
+        for key, value in zip(MACROS, values):
+            totals[key] += float(value or 0) * qty
+    return totals
+
+
+def macro_error(totals: Mapping[str, float], targets: Targets) -> float:
+    """Mean relative deviation of calories, protein, fat and carbs from the targets."""
+    wanted = (targets.calories, targets.protein_g, targets.fat_g, targets.carbs_g)
+    errors = [abs(totals[key] - goal) / goal for key, goal in zip(MACROS, wanted) if goal]
+    return sum(errors) / len(errors) if errors else 0.0
+
+
+def _item_nutrients(items: Iterable[MenuItem]) -> Dict[int, Tuple[float, float, float, float]]:
+    return {
+        item.id: (item.nutrients.calories, item.nutrients.protein, item.nutrients.fat, item.nutrients.carbs)
+        for item in items
+        if getattr(item, "nutrients", None) is not None
+    }
+
+
+def scale_plan(plan: Sequence[Mapping[str, Any]], factor: float) -> Plan:
+    """Portions scaled by ``factor``, rounded to quarters and kept within sane bounds."""
+    scaled: Plan = []
+    for entry in plan:
+        qty = float(entry.get("qty") or 1) * factor
+        scaled.append({**entry, "qty": min(MAX_QTY, max(MIN_QTY, round(qty * 4) / 4))})
+    return scaled
+
+
+# ---------------------------------------------------------------------------
+# Поиск
+
+
+@dataclass
+class LibraryHit:
+    template_id: int
+    bucket_key: str
+    plan: Plan
+    macro_error: float
+
+
+def _budget_value(budget: Any) -> int | None:
+    try:
+        value = int(budget)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def lookup_plan(
+        *,
+        targets: Targets,
+        city: str | None,
+        allergies: Iterable[Any] | None = None,
+        exclusions: Iterable[Any] | None = None,
+        budget: Any = None,
+) -> LibraryHit | None:
+    """
+    Plan of the nearest usable bucket scaled to ``targets``, or ``None``.
+
+    Two queries: the neighbouring templates and the current state of all
+    their dishes.
+    """
+    bucket = bucket_for(targets, city=city, allergies=allergies, exclusions=exclusions)
+    step = _calorie_step()
+    templates = sorted(
+        PlanTemplate.objects.filter(
+            city=bucket.city,
+            protein_pct=bucket.protein_pct,
+            fat_pct=bucket.fat_pct,
+            restrictions_key=bucket.restrictions_key,
+            calories__in=[bucket.calories - step, bucket.calories, bucket.calories + step],
+        ),
+        key=lambda template: abs(template.calories - targets.calories),
+    )
+    if not templates:
+        _record(hit=False)
+        return None
+
+    item_ids = {item_id for template in templates for item_id in template.item_ids}
+    items = {
+        item.id: item
+        for item in MenuItem.objects.filter(id__in=item_ids, is_available=True).select_related("nutrients")
+    }
+    banned_allergens, banned_exclusions = set(bucket.allergies), set(bucket.exclusions)
+    budget_value = _budget_value(budget)
+
+    def usable(item: MenuItem | None) -> bool:
+        if item is None or getattr(item, "nutrients", None) is None:
+            return False
+        if budget_value is not None and item.price > budget_value:
+            return False
+        # Каталог мог обновиться после сборки библиотеки.
+        if banned_allergens & set(_normalize_values(item.allergens)):
+            return False
+        return not banned_exclusions & set(_normalize_values(item.exclusions))
+
+    nutrients = _item_nutrients(items.values())
+    for template in templates:
+        if not template.item_ids or not all(usable(items.get(item_id)) for item_id in template.item_ids):
+            continue
+        plan = scale_plan(template.plan, targets.calories / max(1, template.calories))
+        error = macro_error(plan_totals(plan, nutrients), targets)
+        _record(hit=True, error=error)
+        return LibraryHit(template_id=template.id, bucket_key=template.key, plan=plan, macro_error=error)
+
+    _record(hit=False)
+    return None
+
+
+def _record(*, hit: bool, error: float = 0.0) -> None:
+    counters = {"hits": 1, "error_micro": int(round(error * 1_000_000))} if hit else {"misses": 1}
+    for name, delta in counters.items():
+        key = _STATS_PREFIX + name
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, delta)
+        except ValueError:  # ключ вытеснен между add и incr
+            cache.set(key, delta, timeout=None)
+
+
+def library_stats() -> Dict[str, Any]:
+    values = cache.get_many([_STATS_PREFIX + name for name in ("hits", "misses", "error_micro")])
+    hits = int(values.get(_STATS_PREFIX + "hits", 0))
+    misses = int(values.get(_STATS_PREFIX + "misses", 0))
+    error_sum = int(values.get(_STATS_PREFIX + "error_micro", 0)) / 1_000_000
+    return {
+        "enabled": bool(getattr(settings, "PLAN_LIBRARY_ENABLED", False)),
+        "templates": PlanTemplate.objects.count(),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        "mean_macro_error": round(error_sum / hits, 4) if hits else None,
+    }
+
+
+def reset_library_stats() -> None:
+    cache.delete_many([_STATS_PREFIX + name for name in ("hits", "misses", "error_micro")])
+
+
+# ---------------------------------------------------------------------------
+# Ночная сборка
+
+
+class _NoLLM(LLMProvider):
+    enabled = False
+
+    def compose_menu(self, context: Dict) -> List[Dict]:
+        return []
+
+
+def selection_service_for(solver: str) -> MenuSelectionService:
+    if solver not in SOLVERS:
+        raise ValueError(f"unknown plan library solver {solver!r}")
+    if solver == "greedy":
+        return MenuSelectionService(provider_factory=_NoLLM)
+    return MenuSelectionService()
+
+
+def profile_targets(profile) -> Targets:
+    return tdee(
+        profile.sex,
+        profile.weight_kg,
+        profile.height_cm,
+        profile.birth_date,
+        profile.activity_level,
+        profile.goal,
+    )
+
+
+def popular_buckets(profiles: Iterable[Any], *, limit: int, min_profiles: int = 1) -> List[Tuple[PlanBucket, int]]:
+    counter: Counter[PlanBucket] = Counter()
+    for profile in profiles:
+        targets = profile_targets(profile)
+        counter[bucket_for(targets, city=profile.city, allergies=profile.allergies, exclusions=profile.exclusions)] += 1
+    return [(bucket, count) for bucket, count in counter.most_common(limit) if count >= min_profiles]
+
+
+@dataclass
+class LibraryBuildResult:
+    buckets: int = 0
+    built: int = 0
+    empty: int = 0
+    failed: int = 0
+    removed: int = 0
+    profiles_covered: int = 0
+    macro_errors: List[float] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "buckets": self.buckets,
+            "built": self.built,
+            "empty": self.empty,
+            "failed": self.failed,
+            "removed": self.removed,
+            "profiles_covered": self.profiles_covered,
+            "mean_macro_error": (
+                round(sum(self.macro_errors) / len(self.macro_errors), 4) if self.macro_errors else None
+            ),
+        }
+
+
+def build_plan_library(
+        *,
+        limit: int | None = None,
+        min_profiles: int | None = None,
+        solver: str | None = None,
+        filter_service: MenuFilterService | None = None,
+        selection_service: MenuSelectionService | None = None,
+) -> LibraryBuildResult:
+    """
+    Compose templates for the ``limit`` most common buckets and drop the rest.
+
+    Buckets shared by fewer than ``min_profiles`` profiles are not worth a
+    template. A bucket whose plan comes out empty loses its template; one
+    whose composition raised keeps the previous night's.
+    """
+    from apps.users.models import Profile
+
+    limit = limit if limit is not None else int(getattr(settings, "PLAN_LIBRARY_SIZE", 500))
+    min_profiles = min_profiles if min_profiles is not None else int(getattr(settings, "PLAN_LIBRARY_MIN_PROFILES", 3))
+    solver = solver or getattr(settings, "PLAN_LIBRARY_SOLVER", "llm")
+    filter_service = filter_service or MenuFilterService()
+    selection_service = selection_service or selection_service_for(solver)
+
+    started = timezone.now()
+    result = LibraryBuildResult()
+    profiles = Profile.objects.only(
+        "city", "sex", "weight_kg", "height_cm", "birth_date", "activity_level", "goal", "allergies", "exclusions"
+    ).iterator(chunk_size=2000)
+    buckets = popular_buckets(profiles, limit=limit, min_profiles=min_profiles)
+    result.buckets = len(buckets)
+    failed_keys: List[str] = []
+
+    for bucket, count in buckets:
+        targets = bucket.targets()
+        try:
+            items = filter_service.filter(
+                city=bucket.city or None,
+                allergies=list(bucket.allergies),
+                exclusions=list(bucket.exclusions),
+            )
+            with llm_priority(BATCH):
+                plan = selection_service.select_plan(items=items, targets=targets, restrictions=bucket.restrictions())
+        except Exception:
+            logger.exception("Plan library: failed to compose bucket %s", bucket.key)
+            result.failed += 1
+            failed_keys.append(bucket.key)
+            continue
+        if not plan:
+            result.empty += 1
+            continue
+
+        error = macro_error(plan_totals(plan, _item_nutrients(items)), targets)
+        PlanTemplate.objects.update_or_create(
+            key=bucket.key,
+            defaults={
+                "city": bucket.city,
+                "calories": bucket.calories,
+                "protein_pct": bucket.protein_pct,
+                "fat_pct": bucket.fat_pct,
+                "restrictions_key": bucket.restrictions_key,
+                "restrictions": bucket.restrictions(),
+                "plan": plan,
+                "item_ids": [entry["item_id"] for entry in plan],
+                "source": solver,
+                "profiles": count,
+                "macro_error": error,
+                "built_at": started,
+            },
+        )
+        result.built += 1
+        result.profiles_covered += count
+        result.macro_errors.append(error)
+
+    # Корзины, выпавшие из топа или оставшиеся без плана, больше не обслуживаем;
+    # при сбое сборки остаётся вчерашний шаблон — блюда всё равно проверяются при поиске.
+    stale = PlanTemplate.objects.filter(built_at__lt=started).exclude(key__in=failed_keys)
+    result.removed, _ = stale.delete()
+    return result
+
+
+__all__ = [
+    "LibraryBuildResult",
+    "LibraryHit",
+    "MACROS",
+    "PlanBucket",
+    "SOLVERS",
+    "bucket_for",
+    "build_plan_library",
+    "library_stats",
+    "lookup_plan",
+    "macro_error",
+    "plan_totals",
+    "popular_buckets",
+    "profile_targets",
+    "reset_library_stats",
+    "restrictions_key",
+    "scale_plan",
+    "selection_service_for",
+]
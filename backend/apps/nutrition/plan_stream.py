@@ -0,0 +1,118 @@
+"""Incremental, tolerant parsing of a streamed ``{"plan": [...]}`` answer.
+
+:class:`IncrementalPlanParser` is fed completion chunks as they arrive and
+returns each entry object of the ``plan`` array as soon as its closing brace
+is seen, so the first meals can be shown long before the completion ends.
+
+It tolerates what models tend to produce around JSON: prose or a code fence
+before the object, a bare top-level array instead of ``{"plan": ...}``,
+trailing commas and Python literals inside an entry. Entries that still do
+not parse are skipped; nothing after the closing ``]`` is read.
+"""
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, List
+
+_PLAN_KEY_RE = re.compile(r'"plan"\s*:\s*\[')
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL_RE = re.compile(r"\b(True|False|None)\b")
+
+
+def _loads_tolerant(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    repaired = _TRAILING_COMMA_RE.sub(r"\1", text)
+    repaired = _PY_LITERAL_RE.sub(lambda m: _PY_LITERALS[m.group(1)], repaired)
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        return None
+
+
+class IncrementalPlanParser:
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._entry_start = -1
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _find_array(self) -> bool:
+        stripped = self._buffer.lstrip()
+        if stripped.startswith("```"):
+            newline = stripped.find("\n")
+            stripped = stripped[newline + 1:].lstrip() if newline >= 0 else ""
+        if stripped.startswith("["):
+            self._pos = self._buffer.index("[") + 1
+            return True
+        match = _PLAN_KEY_RE.search(self._buffer)
+        if match:
+            self._pos = match.end()
+            return True
+        return False
+
+    def feed(self, chunk: str) -> List[dict]:
+        """Add a chunk; returns the plan entries completed by it."""
+        if self._done or not chunk:
+            return []
+        self._buffer += chunk
+        if not self._in_array:
+            if not self._find_array():
+                return []
+            self._in_array = True
+
+        entries: List[dict] = []
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._entry_start = pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    if char == "]":
+                        self._done = True
+                        pos += 1
+                        break
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._entry_start >= 0:
+                        entry = _loads_tolerant(buffer[self._entry_start: pos + 1])
+                        if isinstance(entry, dict):
+                            entries.append(entry)
+                        self._entry_start = -1
+            pos += 1
+
+        # Разобранное больше не нужно — держим только незакрытую запись.
+        keep_from = self._entry_start if self._entry_start >= 0 else pos
+        self._buffer = buffer[keep_from:]
+        self._pos = pos - keep_from
+        if self._entry_start >= 0:
+            self._entry_start = 0
+        return entries
+
+
+__all__ = ["IncrementalPlanParser"]
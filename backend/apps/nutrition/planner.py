@@ -1,13 +1,67 @@
 from __future__ import annotations
 
-from typing import Dict
+from typing import Dict, Iterable, Tuple
 
+from django.conf import settings
+
+from .degraded_mode import get_degraded_controller
 from .menu_filters import MenuFilterService
-from .menu_selection import MenuSelectionService
-from .services import tdee
+from .menu_selection import MenuSelectionService, PlanRequest, StreamedPlan
+from .plan_library import LibraryHit, lookup_plan, restrictions_key
+from .services import Targets, tdee
+from .tracing import annotate, planner_trace, span
 
 default_filter_service = MenuFilterService()
-default_selection_service = MenuSelectionService()
+default_selection_service = MenuSelectionService(controller_factory=get_degraded_controller)
+
+
+def _targets(profile) -> Targets:
+    with span("tdee"):
+        return tdee(
+            profile.sex,
+            profile.weight_kg,
+            profile.height_cm,
+            profile.birth_date,
+            profile.activity_level,
+            profile.goal,
+        )
+
+
+def _library_plan(profile, targets: Targets, use_library: bool | None) -> LibraryHit | None:
+    if use_library is None:
+        use_library = getattr(settings, "PLAN_LIBRARY_ENABLED", False)
+    if not use_library:
+        return None
+    with span("library"):
+        hit = lookup_plan(
+            targets=targets,
+            city=profile.city,
+            allergies=profile.allergies,
+            exclusions=profile.exclusions,
+            budget=profile.daily_budget,
+        )
+        if hit is None:
+            annotate(hit=False)
+        else:
+            annotate(hit=True, bucket=hit.bucket_key, macro_error=round(hit.macro_error, 4))
+    return hit
+
+
+def _candidates(profile, filter_service: MenuFilterService):
+    with span("filter"):
+        items = filter_service.filter(
+            city=profile.city,
+            allergies=profile.allergies,
+            exclusions=profile.exclusions,
+            budget=profile.daily_budget,
+        )
+        annotate(candidates=len(items))
+
+    restrictions = {
+        "allergies": profile.allergies,
+        "exclusions": profile.exclusions,
+    }
+    return items, restrictions
 
 
 def build_menu_for_user(
@@ -15,40 +69,124 @@ def build_menu_for_user(
         *,
         filter_service: MenuFilterService | None = None,
         selection_service: MenuSelectionService | None = None,
+        use_library: bool | None = None,
 ) -> Dict:
-    """Build a daily menu for the given user profile."""
+    """
+    Build a daily menu for the given user profile.
+
+    A precomputed plan of the profile's bucket is used when one fits (see
+    :mod:`apps.nutrition.plan_library`); ``use_library`` overrides
+    ``PLAN_LIBRARY_ENABLED``. ``provider`` in the result tells how the plan
+    was made: ``library``, ``hybrid`` or ``degraded`` (LLM skipped, see
+    :mod:`apps.nutrition.degraded_mode`).
+    """
     filter_service = filter_service or default_filter_service
     selection_service = selection_service or default_selection_service
 
-    profile = user.profile
-    targets = tdee(
-        profile.sex,
-        profile.weight_kg,
-        profile.height_cm,
-        profile.birth_date,
-        profile.activity_level,
-        profile.goal,
-    )
-
-    items = filter_service.filter(
-        city=getattr(user, "city", None),
-        allergies=profile.allergies,
-        exclusions=profile.exclusions,
-        budget=profile.daily_budget,
-    )
+    with planner_trace("build_menu", user_id=user.pk):
+        profile = user.profile
+        targets = _targets(profile)
+        hit = _library_plan(profile, targets, use_library)
+        if hit is not None:
+            return {
+                "targets": selection_service.serialize_targets(targets),
+                "plan": hit.plan,
+                "provider": "library",
+            }
 
-    restrictions = {
-        "allergies": profile.allergies,
-        "exclusions": profile.exclusions,
-    }
-
-    plan = selection_service.select_plan(
-        items=items,
-        targets=targets,
-        restrictions=restrictions,
-    )
+        items, restrictions = _candidates(profile, filter_service)
+        with span("select_plan"):
+            selected = selection_service.compose(
+                items=items,
+                targets=targets,
+                restrictions=restrictions,
+            )
+            annotate(plan_items=len(selected.plan))
 
     return {
         "targets": selection_service.serialize_targets(targets),
-        "plan": plan,
+        "plan": selected.plan,
+        "provider": selected.provider,
     }
+
+
+def batch_group_key(profile) -> Tuple[str, str]:
+    """Profiles with equal keys see the same candidates and can share one batched prompt."""
+    return (profile.city or "").strip(), restrictions_key(profile.allergies, profile.exclusions)
+
+
+def build_menus_for_users(
+        users: Iterable,
+        *,
+        filter_service: MenuFilterService | None = None,
+        selection_service: MenuSelectionService | None = None,
+        use_library: bool | None = None,
+) -> Dict[int, Dict]:
+    """
+    :func:`build_menu_for_user` for several users at once, keyed by user pk.
+
+    Library misses are composed together with
+    :meth:`MenuSelectionService.compose_batch`, so users should come from
+    one :func:`batch_group_key` group. Used by nightly generation.
+    """
+    filter_service = filter_service or default_filter_service
+    selection_service = selection_service or default_selection_service
+    users = list(users)
+    results: Dict[int, Dict] = {}
+    pending: Dict[int, PlanRequest] = {}
+
+    with planner_trace("build_menu_batch", users=len(users)):
+        for user in users:
+            profile = user.profile
+            targets = _targets(profile)
+            hit = _library_plan(profile, targets, use_library)
+            if hit is not None:
+                results[user.pk] = {
+                    "targets": selection_service.serialize_targets(targets),
+                    "plan": hit.plan,
+                    "provider": "library",
+                }
+                continue
+            items, restrictions = _candidates(profile, filter_service)
+            pending[user.pk] = PlanRequest(items=items, targets=targets, restrictions=restrictions)
+
+        if pending:
+            with span("select_plan"):
+                selected = selection_service.compose_batch(pending)
+                annotate(batched=len(pending))
+            for pk, request in pending.items():
+                results[pk] = {
+                    "targets": selection_service.serialize_targets(request.targets),
+                    "plan": selected[pk].plan,
+                    "provider": selected[pk].provider,
+                }
+    return results
+
+
+def stream_menu_for_user(
+        user,
+        *,
+        filter_service: MenuFilterService | None = None,
+        selection_service: MenuSelectionService | None = None,
+        use_library: bool | None = None,
+) -> Tuple[Dict, StreamedPlan]:
+    """
+    Targets right away and the plan entries as the LLM streams them.
+
+    Candidates are selected before returning, so iterating only talks to
+    the provider (and runs the fallback if it produced nothing). A library
+    hit is returned as an already finished iterator. ``provider`` of the
+    result is what the plan is saved with, as in :func:`build_menu_for_user`.
+    """
+    filter_service = filter_service or default_filter_service
+    selection_service = selection_service or default_selection_service
+
+    profile = user.profile
+    targets = _targets(profile)
+    hit = _library_plan(profile, targets, use_library)
+    if hit is not None:
+        return selection_service.serialize_targets(targets), StreamedPlan(entries=iter(hit.plan), provider="library")
+
+    items, restrictions = _candidates(profile, filter_service)
+    streamed = selection_service.stream_plan(items=items, targets=targets, restrictions=restrictions)
+    return selection_service.serialize_targets(targets), streamed
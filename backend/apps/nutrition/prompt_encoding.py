@@ -0,0 +1,129 @@
+"""Compact, token-budgeted encoding of candidate dishes for the LLM prompt.
+
+Candidates are rendered as a table: the column header once, then one
+``|``-separated row per dish, instead of a sentence per dish that repeats
+"ккал", "Б/Ж/У", "цена" and "теги". Rows are added in score order (closeness
+of a dish to a per-meal share of the targets) until the estimated prompt
+size reaches the token budget, so a tight budget drops the least useful
+dishes rather than whatever happened to come last.
+
+:func:`estimate_tokens` is a tokenizer-free approximation tuned for mixed
+Russian/ASCII text (BPE vocabularies split Cyrillic into shorter pieces
+than Latin). It is meant for budgeting, not for billing.
+"""
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, List, Mapping, Sequence
+
+TABLE_COLUMNS = "id|название|ккал|Б|Ж|У|цена|теги"
+MEALS_PER_DAY = 4
+
+_TOKEN_RE = re.compile(r"[A-Za-z]+|[^\W\d_A-Za-z]+|\d+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        if piece.isascii():
+            # Латиница ~4 символа на токен, числа — по 3 цифры.
+            tokens += math.ceil(len(piece) / (3 if piece.isdigit() else 4))
+        else:
+            tokens += math.ceil(len(piece) / 2.5) if piece[0].isalpha() else 1
+    # Перевод строки и пробел перед словом почти всегда сливаются с соседним токеном.
+    return tokens + text.count("\n")
+
+
+def _number(value: Any) -> str:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return ""
+    return str(int(round(number))) if abs(number) >= 10 or number == int(number) else f"{number:.1f}"
+
+
+def _cell(value: Any) -> str:
+    return str(value).replace("|", "/").replace("\n", " ").strip()
+
+
+def encode_row(item: Mapping[str, Any]) -> str:
+    tags = item.get("tags") or []
+    return "|".join(
+        [
+            str(item["id"]),
+            _cell(item.get("title", "")),
+            _number(item.get("kcal")),
+            _number(item.get("protein")),
+            _number(item.get("fat")),
+            _number(item.get("carbs")),
+            _number(item.get("price")) if item.get("price") is not None else "",
+            ",".join(_cell(tag) for tag in tags),
+        ]
+    )
+
+
+def score_item(item: Mapping[str, Any], targets: Mapping[str, Any]) -> float:
+    """Lower is better: relative distance of a dish from one meal's share of the targets."""
+    distance = 0.0
+    for key, target_key, weight in (
+        ("kcal", "calories", 2.0),
+        ("protein", "protein", 1.0),
+        ("fat", "fat", 0.5),
+        ("carbs", "carbs", 0.5),
+    ):
+        share = float(targets.get(target_key) or 0) / MEALS_PER_DAY
+        if share <= 0:
+            continue
+        distance += weight * abs(float(item.get(key) or 0) - share) / share
+    return distance
+
+
+@dataclass
+class EncodedItems:
+    lines: List[str]
+    item_ids: List[int]
+    tokens: int
+    dropped: int
+
+
+def encode_items(
+        items: Sequence[Mapping[str, Any]],
+        targets: Mapping[str, Any],
+        *,
+        token_budget: int,
+        max_items: int,
+) -> EncodedItems:
+    """
+    Header and rows of the best-scoring items that fit into ``token_budget``.
+
+    A row that does not fit is skipped and smaller ones are still tried, so
+    one long title does not end the list early.
+    """
+    header = f"Блюда ({TABLE_COLUMNS}):"
+    lines = [header]
+    tokens = estimate_tokens(header) + 1
+    item_ids: List[int] = []
+    ranked = sorted(items, key=lambda item: score_item(item, targets))
+    for item in ranked:
+        if len(item_ids) >= max_items:
+            break
+        row = encode_row(item)
+        cost = estimate_tokens(row) + 1
+        if tokens + cost > token_budget:
+            continue
+        lines.append(row)
+        item_ids.append(int(item["id"]))
+        tokens += cost
+    return EncodedItems(lines=lines, item_ids=item_ids, tokens=tokens, dropped=len(ranked) - len(item_ids))
+
+
+__all__ = [
+    "EncodedItems",
+    "TABLE_COLUMNS",
+    "encode_items",
+    "encode_row",
+    "estimate_tokens",
+    "score_item",
+]
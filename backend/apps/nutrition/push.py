@@ -0,0 +1,301 @@
+"""Morning menu push to Telegram subscribers.
+
+Celery beat runs :func:`dispatch_menu_push` every few minutes. It walks the
+time zones of opted-in profiles, claims the ones whose local push hour has
+come (``SKIP LOCKED``, leasing them with ``menu_push_claimed_at``) and fans
+the claimed ids out to generation tasks in chunks. Each chunk builds and
+saves the plans and publishes them to a Redis stream every few users,
+marking ``menu_push_last_date`` only for profiles whose plan went out, so a
+profile is pushed at most once per local day and failed ones are retried on
+a later run. The bot starts formatting and sending under Telegram limits
+while the rest of the batch is still being generated.
+Within a chunk, users with the same city and restrictions can share one LLM
+prompt (``llm_batch_size``).
+"""
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Protocol, Sequence, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.users.models import Profile
+
+from .llm_governor import BATCH, llm_priority
+from .models import MenuPlan
+from .planner import batch_group_key, build_menu_for_user, build_menus_for_users
+from .tracing import planner_trace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_FLUSH_EVERY = 20
+DEFAULT_CLAIM_TTL = timedelta(minutes=30)
+
+
+class PushSink(Protocol):
+    def publish(self, messages: Sequence[Dict[str, Any]]) -> None: ...
+
+
+class RedisStreamSink:
+    """Publishes push messages to a Redis stream read by the bot's consumer group."""
+
+    def __init__(self, url: str, stream: str, *, maxlen: int | None = None):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.stream = stream
+        self.maxlen = maxlen
+
+    def publish(self, messages: Sequence[Dict[str, Any]]) -> None:
+        if not messages:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for message in messages:
+            pipe.xadd(
+                self.stream,
+                {"data": json.dumps(message, ensure_ascii=False, separators=(",", ":"))},
+                maxlen=self.maxlen,
+                approximate=True,
+            )
+        pipe.execute()
+
+
+def get_default_sink() -> PushSink:
+    return RedisStreamSink(
+        getattr(settings, "MENU_PUSH_REDIS_URL", settings.CELERY_BROKER_URL),
+        getattr(settings, "MENU_PUSH_STREAM", "menu:push"),
+        maxlen=getattr(settings, "MENU_PUSH_STREAM_MAXLEN", 200_000),
+    )
+
+
+@dataclass
+class PushDispatchResult:
+    timezones: int = 0
+    claimed: int = 0
+    chunks: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+@dataclass
+class PushChunkResult:
+    generated: int = 0
+    failed: int = 0
+    published: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+def _subscribers():
+    return Profile.objects.filter(menu_push_enabled=True, telegram_id__isnull=False)
+
+
+def _zone(name: str) -> ZoneInfo | None:
+    try:
+        return ZoneInfo(name or settings.TIME_ZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def claim_due_profiles(
+        *,
+        tz_name: str,
+        now: datetime,
+        limit: int,
+        window_hours: int,
+        claim_ttl: timedelta = DEFAULT_CLAIM_TTL,
+) -> Tuple[date | None, List[int]]:
+    """
+    Claim up to ``limit`` subscribers in ``tz_name`` whose push hour has come.
+
+    Returns the local date of the zone and the claimed profile ids. Profiles
+    whose hour passed more than ``window_hours`` ago are left for tomorrow
+    rather than woken up in the evening. A claim is a lease: profiles still
+    without ``menu_push_last_date`` after ``claim_ttl`` (the chunk task died)
+    are claimed again.
+    """
+    zone = _zone(tz_name)
+    if zone is None:
+        logger.warning("Menu push: unknown time zone %r", tz_name)
+        return None, []
+    local = now.astimezone(zone)
+    plan_date = local.date()
+    with transaction.atomic():
+        ids = list(
+            _subscribers()
+            .select_for_update(skip_locked=True, of=("self",))
+            .filter(
+                Q(menu_push_last_date__isnull=True) | Q(menu_push_last_date__lt=plan_date),
+                Q(menu_push_claimed_at__isnull=True) | Q(menu_push_claimed_at__lt=now - claim_ttl),
+                timezone=tz_name,
+                menu_push_hour__lte=local.hour,
+                menu_push_hour__gt=local.hour - window_hours,
+            )
+            .order_by("id")
+            .values_list("id", flat=True)[:limit]
+        )
+        if ids:
+            Profile.objects.filter(id__in=ids).update(menu_push_claimed_at=now)
+    return plan_date, ids
+
+
+def _enqueue_chunk(profile_ids: List[int], plan_date: date) -> None:
+    from .tasks import generate_menu_push_chunk_task
+
+    generate_menu_push_chunk_task.delay(profile_ids, plan_date.isoformat())
+
+
+def dispatch_menu_push(
+        *,
+        now: datetime | None = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_chunks: int = 1000,
+        window_hours: int = 3,
+        claim_ttl: timedelta = DEFAULT_CLAIM_TTL,
+        enqueue: Callable[[List[int], date], Any] | None = None,
+) -> PushDispatchResult:
+    """Claim due subscribers zone by zone and hand them to generation in chunks."""
+    result = PushDispatchResult()
+    now = now or timezone.now()
+    enqueue = enqueue or _enqueue_chunk
+    zones = _subscribers().values_list("timezone", flat=True).distinct()
+    for tz_name in zones:
+        result.timezones += 1
+        while result.chunks < max_chunks:
+            plan_date, ids = claim_due_profiles(
+                tz_name=tz_name, now=now, limit=chunk_size, window_hours=window_hours, claim_ttl=claim_ttl
+            )
+            if not ids:
+                break
+            enqueue(ids, plan_date)
+            result.claimed += len(ids)
+            result.chunks += 1
+            if len(ids) < chunk_size:
+                break
+    if result.claimed:
+        logger.info("Menu push dispatched: %s", result.as_dict())
+    return result
+
+
+def build_push_message(profile: Profile, plan: MenuPlan, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact payload the bot needs to render the morning message."""
+    return {
+        "telegram_id": profile.telegram_id,
+        "plan_id": plan.id,
+        "date": plan.date.isoformat(),
+        "targets": {key: data["targets"].get(key) for key in ("calories", "protein_g", "fat_g", "carbs_g")},
+        "plan": [
+            {
+                "title": entry.get("title"),
+                "qty": entry.get("qty", 1),
+                "time_hint": entry.get("time_hint") or "any",
+            }
+            for entry in data.get("plan") or []
+        ],
+    }
+
+
+def _batches(profiles: Sequence[Profile], size: int) -> List[List[Profile]]:
+    if size <= 1:
+        return [[profile] for profile in profiles]
+    groups: Dict[Tuple[str, str], List[Profile]] = {}
+    for profile in profiles:
+        groups.setdefault(batch_group_key(profile), []).append(profile)
+    return [group[start:start + size] for group in groups.values() for start in range(0, len(group), size)]
+
+
+def _build_batch(profiles: Sequence[Profile]) -> Dict[int, Dict[str, Any]]:
+    if len(profiles) < 2:
+        return {}
+    try:
+        with llm_priority(BATCH):
+            return build_menus_for_users([profile.user for profile in profiles])
+    except Exception:
+        logger.exception("Menu push: batched generation failed for profiles %s", [p.pk for p in profiles])
+        return {}
+
+
+def generate_push_chunk(
+        profile_ids: Iterable[int],
+        *,
+        plan_date: date,
+        sink: PushSink | None = None,
+        flush_every: int = DEFAULT_FLUSH_EVERY,
+        llm_batch_size: int = 1,
+) -> PushChunkResult:
+    """
+    Build and save today's plan for each profile and publish it for the bot.
+
+    Messages go out every ``flush_every`` plans instead of at the end of the
+    chunk, so sending overlaps with generation. Profiles are marked as pushed
+    for ``plan_date`` once their message is published. A failure for one user
+    is logged, releases the claim so a later dispatch retries it, and does
+    not stop the chunk.
+
+    With ``llm_batch_size`` > 1 profiles are grouped by
+    :func:`~apps.nutrition.planner.batch_group_key` and up to that many are
+    composed together; if a batch fails, its users are built one by one.
+    """
+    result = PushChunkResult()
+    sink = sink or get_default_sink()
+    pending: List[Dict[str, Any]] = []
+    pushed: List[int] = []
+    failed: List[int] = []
+
+    def flush() -> None:
+        sink.publish(pending)
+        result.published += len(pending)
+        pending.clear()
+        # Отмечаем день только за опубликованные планы.
+        if pushed:
+            Profile.objects.filter(id__in=pushed).update(menu_push_last_date=plan_date, menu_push_claimed_at=None)
+            pushed.clear()
+
+    profiles = list(Profile.objects.filter(id__in=list(profile_ids)).select_related("user").order_by("id"))
+    for batch in _batches(profiles, llm_batch_size):
+        built = _build_batch(batch)
+        for profile in batch:
+            try:
+                # Ночная рассылка уступает LLM интерактивным запросам.
+                with planner_trace("menu_push"), llm_priority(BATCH):
+                    data = built.get(profile.user_id) or build_menu_for_user(profile.user)
+                    plan = MenuPlan.create_from_payload(
+                        user=profile.user,
+                        payload=data,
+                        plan_date=plan_date,
+                    )
+            except Exception:
+                logger.exception("Menu push: generation failed for profile %s", profile.pk)
+                result.failed += 1
+                failed.append(profile.pk)
+                continue
+            result.generated += 1
+            pending.append(build_push_message(profile, plan, data))
+            pushed.append(profile.pk)
+            if len(pending) >= flush_every:
+                flush()
+    flush()
+    if failed:
+        Profile.objects.filter(id__in=failed).update(menu_push_claimed_at=None)
+    return result
+
+
+__all__ = [
+    "PushChunkResult",
+    "PushDispatchResult",
+    "RedisStreamSink",
+    "build_push_message",
+    "claim_due_profiles",
+    "dispatch_menu_push",
+    "generate_push_chunk",
+]
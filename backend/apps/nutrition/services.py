@@ -40,6 +40,7 @@ def tdee(
         goal: str,
 ) -> Targets:
     a = age(birth_date)
+    weight_kg = float(weight_kg)  # из БД приходит Decimal
     if sex == "m":
         bmr = 10 * weight_kg + 6.25 * height_cm - 5 * a + 5
     else:
@@ -0,0 +1,273 @@
+"""Single-flight plan generation: one LLM round-trip per (user, date, profile version).
+
+A double tap on "generate" in the bot or the web app sends two identical
+requests. With single-flight semantics the first one (the leader) builds and
+saves the plan; the others wait for it and answer with the same plan instead
+of starting a second LLM call that would only mark the first plan
+``RECALCULATED``.
+
+Two backends share the ``do(key, fn) -> (result, shared)`` interface and its
+generator form ``stream(key, gen_fn)`` for the SSE endpoint: the leader's
+items pass through as they are produced, followers get only the generator's
+return value. A leader whose client went away leaves no result, so its
+followers generate themselves.
+
+* :class:`LocalSingleFlight` keeps an in-process future per key. Enough for a
+  single node, where duplicates reach the same process.
+* :class:`RedisSingleFlight` takes a ``SET NX`` lock with a TTL; followers
+  poll a short-lived result key the leader writes before releasing the
+  lock. If the leader dies or fails, its lock expires or is released
+  without a result and a follower takes over.
+
+Only requests that arrive while the leader is still running share its
+result: a deliberate "regenerate" after the answer came back builds a new
+plan as before. Changing the profile changes the key, so an edited profile
+never gets a plan built for the old one.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import date
+from typing import Any, Callable, Dict, Generator, Protocol, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("local", "redis", "off")
+
+_PROFILE_FIELDS = (
+    "sex",
+    "birth_date",
+    "height_cm",
+    "weight_kg",
+    "activity_level",
+    "goal",
+    "allergies",
+    "exclusions",
+    "daily_budget",
+    "city",
+)
+
+
+def profile_version(profile) -> str:
+    """Fingerprint of the profile fields that affect the generated plan."""
+    values = [getattr(profile, name, None) for name in _PROFILE_FIELDS]
+    raw = json.dumps(values, default=str, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def plan_generation_key(user, plan_date: date) -> str:
+    return f"plan:{user.pk}:{plan_date.isoformat()}:{profile_version(user.profile)}"
+
+
+Flight = Generator[Any, None, Tuple[Any, bool]]
+GeneratorFactory = Callable[[], Generator[Any, None, Any]]
+
+
+def _returning(fn: Callable[[], Any]) -> Generator[Any, None, Any]:
+    return fn()
+    yield  # pragma: no cover - делает функцию генератором
+
+
+def _drain(flight: Flight) -> Tuple[Any, bool]:
+    while True:
+        try:
+            next(flight)
+        except StopIteration as stop:
+            return stop.value
+
+
+class SingleFlight(Protocol):
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]: ...
+
+    def stream(self, key: str, fn: GeneratorFactory) -> Flight: ...
+
+
+class NoSingleFlight:
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        return fn(), False
+
+    def stream(self, key: str, fn: GeneratorFactory) -> Flight:
+        return (yield from fn()), False
+
+
+class LocalSingleFlight:
+    def __init__(self, *, wait_timeout: float = 60.0) -> None:
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        return _drain(self.stream(key, lambda: _returning(fn)))
+
+    def stream(self, key: str, fn: GeneratorFactory) -> Flight:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            try:
+                result = future.result(timeout=self.wait_timeout)
+            except FutureTimeout:
+                logger.warning("Single-flight %s: leader still running after %.0fs", key, self.wait_timeout)
+                return (yield from fn()), False
+            if result is not None:
+                return result, True
+            return (yield from fn()), False  # клиент лидера ушёл, не дождавшись
+
+        try:
+            result = yield from fn()
+        except GeneratorExit:
+            future.set_result(None)
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return result, False
+
+
+# Снимает блокировку, только если она всё ещё наша.
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSingleFlight:
+    def __init__(
+            self,
+            client,
+            *,
+            prefix: str = "singleflight:",
+            lock_ttl: float = 120.0,
+            result_ttl: float = 10.0,
+            wait_timeout: float = 60.0,
+            poll_interval: float = 0.05,
+            max_poll_interval: float = 0.25,
+    ) -> None:
+        self.client = client
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisSingleFlight":
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _acquire(self, lock_key: str, token: str) -> bool:
+        return bool(self.client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000)))
+
+    def _result_key(self, key: str, token: str) -> str:
+        return f"{self.prefix}result:{key}:{token}"
+
+    def _lead(self, key: str, lock_key: str, token: str, fn: GeneratorFactory) -> Generator[Any, None, Any]:
+        try:
+            result = yield from fn()
+            self.client.set(
+                self._result_key(key, token),
+                json.dumps(result, ensure_ascii=False, default=str),
+                px=int(self.result_ttl * 1000),
+            )
+            return result
+        finally:
+            self.client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+
+    def _leader_result(self, key: str, leader: str | None) -> Any:
+        if leader is None:
+            return None
+        cached = self.client.get(self._result_key(key, leader))
+        return None if cached is None else json.loads(cached)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        return _drain(self.stream(key, lambda: _returning(fn)))
+
+    def stream(self, key: str, fn: GeneratorFactory) -> Flight:
+        lock_key = self.prefix + "lock:" + key
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        interval = self.poll_interval
+        # Результат ищем под токеном того лидера, которого застали: ответ
+        # предыдущей генерации новому запросу не достаётся.
+        leader: str | None = None
+        while True:
+            if self._acquire(lock_key, token):
+                result = self._leader_result(key, leader)
+                if result is not None:  # лидер закончил между GET и SET NX
+                    self.client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                    return result, True
+                return (yield from self._lead(key, lock_key, token, fn)), False
+            current = self.client.get(lock_key)
+            if current is not None:
+                leader = current.decode() if isinstance(current, bytes) else str(current)
+            result = self._leader_result(key, leader)
+            if result is not None:
+                return result, True
+            if time.monotonic() >= deadline:
+                logger.warning("Single-flight %s: no result after %.0fs, generating anyway", key, self.wait_timeout)
+                return (yield from fn()), False
+            time.sleep(interval)
+            interval = min(self.max_poll_interval, interval * 1.5)
+
+
+_default: Tuple[Tuple, SingleFlight] | None = None
+_default_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Process-wide backend chosen by ``PLAN_SINGLE_FLIGHT``; rebuilt when the settings change."""
+    global _default
+    config = (
+        getattr(settings, "PLAN_SINGLE_FLIGHT", "local"),
+        getattr(settings, "PLAN_SINGLE_FLIGHT_REDIS_URL", ""),
+        float(getattr(settings, "PLAN_SINGLE_FLIGHT_RESULT_SECONDS", 10)),
+        float(getattr(settings, "PLAN_SINGLE_FLIGHT_WAIT_SECONDS", 60)),
+        float(getattr(settings, "PLAN_SINGLE_FLIGHT_LOCK_SECONDS", 120)),
+    )
+    with _default_lock:
+        if _default is None or _default[0] != config:
+            backend, url, result_ttl, wait_timeout, lock_ttl = config
+            if backend not in BACKENDS:
+                raise ValueError(f"unknown single-flight backend {backend!r}")
+            if backend == "redis":
+                instance: SingleFlight = RedisSingleFlight.from_url(
+                    url, result_ttl=result_ttl, wait_timeout=wait_timeout, lock_ttl=lock_ttl
+                )
+            elif backend == "local":
+                instance = LocalSingleFlight(wait_timeout=wait_timeout)
+            else:
+                instance = NoSingleFlight()
+            _default = (config, instance)
+        return _default[1]
+
+
+__all__ = [
+    "BACKENDS",
+    "LocalSingleFlight",
+    "NoSingleFlight",
+    "RedisSingleFlight",
+    "SingleFlight",
+    "get_single_flight",
+    "plan_generation_key",
+    "profile_version",
+]
@@ -1,5 +1,47 @@
+from datetime import date, timedelta
+from typing import Any
+
+from celery import shared_task
+from django.conf import settings
+
 from nutribot.celery import app
 
+from .plan_library import build_plan_library
+from .push import dispatch_menu_push, generate_push_chunk
+
+
 @app.task
 def dummy_task(x: int) -> int:
     return x * 2
+
+
+@shared_task(name="nutrition.dispatch_menu_push")
+def dispatch_menu_push_task(chunk_size: int | None = None) -> dict[str, Any]:
+    """Claim subscribers whose local push hour has come and fan them out to generation chunks."""
+
+    result = dispatch_menu_push(
+        chunk_size=chunk_size or getattr(settings, "MENU_PUSH_CHUNK_SIZE", 100),
+        window_hours=getattr(settings, "MENU_PUSH_WINDOW_HOURS", 3),
+        claim_ttl=timedelta(minutes=getattr(settings, "MENU_PUSH_CLAIM_TTL_MINUTES", 30)),
+    )
+    return result.as_dict()
+
+
+@shared_task(name="nutrition.generate_menu_push_chunk")
+def generate_menu_push_chunk_task(profile_ids: list[int], plan_date: str) -> dict[str, Any]:
+    """Generate plans for one claimed chunk and stream them to the bot as they are ready."""
+
+    result = generate_push_chunk(
+        profile_ids,
+        plan_date=date.fromisoformat(plan_date),
+        llm_batch_size=getattr(settings, "MENU_PUSH_LLM_BATCH_SIZE", 8),
+    )
+    return result.as_dict()
+
+
+@shared_task(name="nutrition.build_plan_library")
+def build_plan_library_task(limit: int | None = None, solver: str | None = None) -> dict[str, Any]:
+    """Nightly: recompose precomputed plans for the most common profile buckets."""
+
+    result = build_plan_library(limit=limit, solver=solver)
+    return result.as_dict()
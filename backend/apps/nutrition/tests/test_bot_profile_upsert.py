@@ -0,0 +1,126 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from apps.users.models import Profile
+from apps.users.profile_sync import upsert_telegram_profiles
+
+User = get_user_model()
+
+WIZARD = {
+    "sex": "f",
+    "birth_date": "1992-04-10",
+    "height_cm": 168,
+    "weight_kg": 61.5,
+    "activity_level": "light",
+    "goal": "lose",
+    "allergies": ["орехи"],
+    "exclusions": [],
+    "daily_budget": None,
+}
+
+
+@pytest.fixture
+def bot_client(settings):
+    settings.BOT_INTERNAL_KEY = "bot-key"
+    client = APIClient()
+    client.credentials(HTTP_X_BOT_KEY="bot-key")
+    return client
+
+
+@pytest.mark.django_db
+def test_upsert_creates_user_and_profile(bot_client):
+    resp = bot_client.post(
+        "/api/nutrition/bot/upsert_profile/",
+        {"telegram_id": 501, "profile": WIZARD, "city": "Казань"},
+        format="json",
+    )
+
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["ok"] is True
+    assert data["created"] is True
+    assert "weight_kg" in data["changed"] and "city" in data["changed"]
+    profile = Profile.objects.select_related("user").get(telegram_id=501)
+    assert profile.user_id == data["user_id"]
+    assert profile.user.username == "tg_501"
+    assert not profile.user.has_usable_password()
+    assert profile.city == "Казань"
+    assert profile.weight_kg == Decimal("61.5")
+    assert profile.birth_date == date(1992, 4, 10)
+    assert profile.allergies == ["орехи"]
+
+
+@pytest.mark.django_db
+def test_upsert_writes_only_changed_fields_in_constant_queries():
+    upsert_telegram_profiles([{"telegram_id": 601, "profile": WIZARD}, {"telegram_id": 602, "profile": WIZARD}])
+
+    with CaptureQueriesContext(connection) as queries:
+        results = upsert_telegram_profiles(
+            [
+                {"telegram_id": 601, "profile": {**WIZARD, "weight_kg": 60}},
+                {"telegram_id": 602, "profile": WIZARD},
+                {"telegram_id": 601, "profile": {"goal": "maintain"}},
+            ]
+        )
+
+    by_tg = {r.telegram_id: r for r in results}
+    assert by_tg[601].changed == ["goal", "weight_kg"]
+    assert by_tg[602].changed == []
+    upserts = [q["sql"] for q in queries if q["sql"].startswith("INSERT")]
+    assert len(upserts) == 1
+    assert "ON CONFLICT" in upserts[0]
+    assert '"height_cm" = EXCLUDED' not in upserts[0]
+    # SELECT текущих значений + один upsert (+ savepoint-обвязка транзакции).
+    assert len([q for q in queries if not q["sql"].upper().startswith(("SAVEPOINT", "RELEASE"))]) == 2
+
+    profile = Profile.objects.get(telegram_id=601)
+    assert profile.goal == "maintain"
+    assert profile.weight_kg == Decimal("60.0")
+    assert Profile.objects.get(telegram_id=602).weight_kg == Decimal("61.5")
+
+
+@pytest.mark.django_db
+def test_upsert_binds_existing_tg_username_profile():
+    user = User.objects.create_user(username="tg_701", password="StrongPass!1")
+
+    [result] = upsert_telegram_profiles([{"telegram_id": 701, "profile": {"goal": "gain"}}])
+
+    assert result.created is False
+    assert result.user_id == user.id
+    assert result.changed == ["goal", "telegram_id"]
+    user.profile.refresh_from_db()
+    assert user.profile.telegram_id == 701
+    assert user.profile.goal == "gain"
+
+
+@pytest.mark.django_db
+def test_batch_endpoint_reports_invalid_profiles_separately(bot_client):
+    resp = bot_client.post(
+        "/api/nutrition/bot/upsert_profile/",
+        {
+            "profiles": [
+                {"telegram_id": 801, "profile": WIZARD},
+                {"telegram_id": 802, "profile": {"goal": "fly", "height_cm": None}},
+            ]
+        },
+        format="json",
+    )
+
+    assert resp.status_code == 200
+    ok, bad = resp.json()["results"]
+    assert ok["created"] is True and "errors" not in ok
+    assert set(bad["errors"]) == {"goal", "height_cm"}
+    assert bad["user_id"] is None
+    assert Profile.objects.filter(telegram_id__in=[801, 802]).count() == 1
+
+    single = bot_client.post(
+        "/api/nutrition/bot/upsert_profile/", {"telegram_id": 803, "profile": {"goal": "fly"}}, format="json"
+    )
+    assert single.status_code == 400
+    assert "goal" in single.json()["errors"]
@@ -0,0 +1,199 @@
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+from apps.nutrition import planner, views
+from apps.nutrition.degraded_mode import DEGRADED, NORMAL, DegradedModeController
+from apps.nutrition.menu_selection import MenuSelectionService
+from apps.nutrition.models import MenuPlan
+from apps.nutrition.plan_library import LibraryHit
+from apps.nutrition.planner import build_menu_for_user
+from apps.nutrition.tracing import planner_trace
+
+User = get_user_model()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingProvider:
+    def __init__(self, plan):
+        self.plan = plan
+        self.calls = 0
+
+    def __call__(self):
+        return self
+
+    def compose_menu(self, context):
+        self.calls += 1
+        return list(self.plan)
+
+
+def make_controller(clock, **overrides):
+    options = {
+        "window": 60,
+        "min_samples": 4,
+        "latency_slo": 2.0,
+        "error_rate_slo": 0.5,
+        "cooldown": 30,
+        "probe_interval": 10,
+        "clock": clock,
+    }
+    options.update(overrides)
+    return DegradedModeController(**options)
+
+
+def test_error_rate_breach_degrades_until_a_probe_succeeds():
+    clock = Clock()
+    controller = make_controller(clock)
+    for ok in (True, False, False):
+        controller.record(0.5, ok=ok)
+    assert controller.state == NORMAL  # мало замеров
+
+    controller.record(0.5, ok=False)
+    assert controller.state == DEGRADED
+    assert not controller.decide().use_llm
+
+    clock.now += 30
+    probe = controller.decide()
+    assert probe.use_llm and probe.probe
+    assert not controller.decide().use_llm  # один зонд за раз
+    controller.record(0.5, ok=False, probe=True)
+    assert not controller.decide().use_llm
+
+    clock.now += 10
+    assert controller.decide().probe
+    controller.record(0.5, ok=True, probe=True)
+    assert controller.state == NORMAL
+    assert controller.decide().use_llm
+    stats = controller.as_dict()
+    assert (stats["trips"], stats["probes"], stats["degraded_requests"]) == (1, 2, 3)
+
+
+def test_latency_breach_and_old_samples_leave_the_window():
+    clock = Clock()
+    controller = make_controller(clock, latency_quantile=0.75)
+    for _ in range(3):
+        controller.record(5.0, ok=True)
+    clock.now += 61
+    controller.record(5.0, ok=True)
+    assert controller.state == NORMAL
+
+    for _ in range(3):
+        controller.record(5.0, ok=True)
+    assert controller.state == DEGRADED
+    assert "latency" in controller.reason
+
+    clock.now += 30
+    controller.decide()
+    controller.record(5.0, ok=True, probe=True)  # план есть, но медленно
+    assert controller.state == DEGRADED
+
+
+def test_stuck_probe_does_not_block_recovery():
+    clock = Clock()
+    controller = make_controller(clock, min_samples=1, probe_interval=1)
+    controller.record(0.1, ok=False)
+    clock.now += 30
+    assert controller.decide().probe
+    clock.now += 2
+    assert not controller.decide().use_llm
+    clock.now += controller.probe_timeout
+    assert controller.decide().probe
+
+
+@pytest.fixture
+def catalog(db):
+    restaurant = Restaurant.objects.create(name="Test", city="Москва", is_active=True)
+    return [
+        MenuItem.objects.create(
+            source="restaurant",
+            source_id=restaurant.id,
+            title=f"Блюдо {idx}",
+            price=300,
+            nutrients=Nutrients.objects.create(calories=kcal, protein=30, fat=15, carbs=50),
+        )
+        for idx, kcal in enumerate([450, 600, 350])
+    ]
+
+
+@pytest.mark.django_db
+def test_degraded_plans_skip_the_llm_and_are_marked(catalog, settings):
+    settings.PLAN_LIBRARY_ENABLED = False
+    user = User.objects.create_user(username="deg", password="StrongPass123")
+    controller = make_controller(Clock(), min_samples=1)
+    provider = CountingProvider([])
+    service = MenuSelectionService(provider_factory=provider, controller_factory=lambda: controller)
+
+    data = build_menu_for_user(user, selection_service=service)
+    assert data["provider"] == "hybrid"
+    assert provider.calls == 1
+    assert controller.state == DEGRADED  # пустой ответ LLM — ошибка
+
+    with planner_trace("generate_menu") as trace:
+        data = build_menu_for_user(user, selection_service=service)
+    assert provider.calls == 1
+    assert data["provider"] == "degraded"
+    assert data["plan"]
+    spans = {s.name: s for s in trace.spans}
+    assert "select_plan.llm" not in spans
+    assert spans["select_plan"].attrs["degraded"] is True
+
+    plan = MenuPlan.create_from_payload(user=user, payload=data)
+    assert plan.provider == "degraded"
+
+
+@pytest.mark.django_db
+def test_streamed_plans_are_saved_with_their_provider(catalog, settings, monkeypatch):
+    settings.PLAN_LIBRARY_ENABLED = False
+    user = User.objects.create_user(username="deg-stream", password="StrongPass123")
+    controller = make_controller(Clock(), min_samples=1)
+    controller.record(0.1, ok=False)
+    monkeypatch.setattr(
+        planner,
+        "default_selection_service",
+        MenuSelectionService(provider_factory=CountingProvider([]), controller_factory=lambda: controller),
+    )
+    client = APIClient()
+    client.force_authenticate(user)
+
+    def stream():
+        response = client.post("/api/nutrition/generate/stream/")
+        assert response.status_code == 200
+        b"".join(response.streaming_content)
+        return MenuPlan.objects.filter(user=user).latest("created_at")
+
+    plan = stream()
+    assert plan.provider == "degraded"
+    assert plan.meals.exists()
+
+    hit = LibraryHit(template_id=1, bucket_key="b", plan=[{"item_id": catalog[0].id, "qty": 1.0}], macro_error=0.0)
+    monkeypatch.setattr(planner, "_library_plan", lambda *args: hit)
+    assert stream().provider == "library"
+
+
+@pytest.mark.django_db
+def test_health_reports_controller_state(monkeypatch):
+    client = APIClient()
+    controller = make_controller(Clock(), min_samples=1)
+    monkeypatch.setattr(views, "get_degraded_controller", lambda: controller)
+
+    assert client.get("/api/nutrition/health/").json()["status"] == "ok"
+
+    controller.record(0.1, ok=False)
+    payload = client.get("/api/nutrition/health/").json()
+    assert payload["status"] == "degraded"
+    assert payload["planner"]["state"] == "degraded"
+    assert payload["planner"]["cooldown_left_s"] == 30
+
+    monkeypatch.setattr(views, "get_degraded_controller", lambda: None)
+    assert client.get("/api/nutrition/health/").json() == {
+        "status": "ok",
+        "planner": {"enabled": False, "state": "normal"},
+    }
@@ -0,0 +1,139 @@
+import json
+
+import httpx
+
+from apps.nutrition.degraded_mode import DEGRADED, NORMAL, DegradedModeController
+from apps.nutrition.llm_provider import OpenAIProvider
+from apps.nutrition.menu_selection import MenuSelectionService, PlanRequest
+from apps.nutrition.services import Targets
+
+
+def _item(item_id, kcal):
+    return {"id": item_id, "title": f"Блюдо {item_id}", "kcal": kcal, "protein": 30, "fat": 15, "carbs": 60,
+            "tags": [], "price": 300}
+
+
+def _context(calories, item_ids):
+    return {
+        "targets": {"calories": calories, "protein": 120, "fat": 60, "carbs": 220},
+        "items": [_item(item_id, 300 + item_id * 10) for item_id in item_ids],
+        "restrictions": {"allergies": ["орехи"], "exclusions": []},
+    }
+
+
+def _completion(content):
+    return httpx.Response(
+        200,
+        json={
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "test",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        },
+    )
+
+
+def _provider(handler, **config):
+    http_client = httpx.Client(transport=httpx.MockTransport(handler))
+    provider = OpenAIProvider(
+        config={"OPENAI_API_KEY": "test", "OPENAI_MAX_RETRIES": "1", **config},
+        http_client=http_client,
+    )
+    return provider, http_client
+
+
+def test_batch_shares_one_prompt_and_validates_per_user():
+    prompts = []
+
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][-1]["content"]
+        prompts.append(prompt)
+        if '"plans"' in prompt:
+            # u1 — корректно, у u2 блюдо 3 не из его кандидатов, u3 нет в ответе.
+            return _completion(json.dumps({"plans": {
+                "u1": [{"item_id": 1, "qty": 1, "time_hint": "lunch"}, {"item_id": 3, "qty": 2}],
+                "u2": [{"item_id": 3, "qty": 1}],
+            }}))
+        return _completion(json.dumps({"plan": [{"item_id": 5, "qty": 1, "time_hint": "dinner"}]}))
+
+    provider, http_client = _provider(handler)
+    contexts = {"a": _context(1800, [1, 2, 3]), "b": _context(2400, [1, 2, 5]), "c": _context(2000, [2, 5])}
+
+    plans = provider.compose_menu_batch(contexts)
+
+    batch_prompt = prompts[0]
+    assert "u1: 1800 ккал" in batch_prompt and "u3: 2000 ккал" in batch_prompt
+    assert batch_prompt.count("Аллергии: орехи.") == 1
+    assert "u1: 1800 ккал, Б 120г, Ж 60г, У 220г. Недоступны: 5." in batch_prompt
+    assert "Недоступны: 1, 3." in batch_prompt
+    assert sorted(int(row.split("|")[0]) for row in batch_prompt.splitlines() if row[:1].isdigit()) == [1, 2, 3, 5]
+    assert [e["item_id"] for e in plans["a"]] == [1, 3]
+    # Пользователи без валидного плана — отдельными запросами.
+    assert len(prompts) == 3
+    assert [e["item_id"] for e in plans["b"]] == [5]
+    assert [e["item_id"] for e in plans["c"]] == [5]
+    http_client.close()
+
+
+def test_failed_batch_call_leaves_users_to_the_fallback():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    provider, http_client = _provider(handler, NUTRIBOT_BATCH_MAX_USERS="2")
+    contexts = {key: _context(2000, [1, 2]) for key in "abc"}
+
+    plans = provider.compose_menu_batch(contexts)
+
+    assert plans == {"a": [], "b": [], "c": []}
+    assert len(calls) == 2  # группа из двух и одиночный запрос
+    http_client.close()
+
+
+class SingleProvider:
+    def compose_menu(self, context):
+        if context["targets"]["calories"] < 2000:
+            return []
+        return [{"item_id": context["items"][0]["id"], "qty": 1, "time_hint": "any", "title": "x"}]
+
+
+def test_compose_batch_falls_back_per_user(monkeypatch):
+    service = MenuSelectionService(provider_factory=SingleProvider, fallback_strategy=lambda items, targets: ["greedy"])
+    monkeypatch.setattr(service, "_serialize_items", lambda items: [{"id": 1}])
+    requests = {
+        "low": PlanRequest(items=[], targets=Targets(calories=1500, protein_g=90, fat_g=50, carbs_g=170)),
+        "high": PlanRequest(items=[], targets=Targets(calories=2500, protein_g=150, fat_g=80, carbs_g=290)),
+    }
+
+    selected = service.compose_batch(requests)
+
+    assert selected["low"].plan == ["greedy"]
+    assert selected["high"].plan[0]["item_id"] == 1
+    assert {s.provider for s in selected.values()} == {"hybrid"}
+
+
+def test_batch_calls_stay_out_of_the_interactive_slo(monkeypatch):
+    now = [0.0]
+    controller = DegradedModeController(
+        window=60, min_samples=1, latency_slo=2.0, error_rate_slo=0.5, cooldown=30, probe_interval=10,
+        clock=lambda: now[0],
+    )
+    controller.probe_timeout = 300  # зависшая проба не освободилась бы сама
+    service = MenuSelectionService(provider_factory=SingleProvider, controller_factory=lambda: controller)
+    monkeypatch.setattr(service, "_serialize_items", lambda items: [{"id": 1}])
+    requests = {"low": PlanRequest(items=[], targets=Targets(calories=1500, protein_g=90, fat_g=50, carbs_g=170))}
+
+    service.compose_batch(requests)  # пустой ответ, но это батч
+    assert controller.state == NORMAL
+
+    controller.record(0.1, ok=False)
+    assert controller.state == DEGRADED
+    now[0] = 31
+    selected = service.compose_batch(requests)
+    assert selected["low"].provider == "hybrid"  # батч взял пробу
+    assert controller.state == DEGRADED
+    now[0] = 41
+    assert controller.decide().probe  # и отпустил её без вердикта
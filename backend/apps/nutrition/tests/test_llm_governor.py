@@ -0,0 +1,280 @@
+import os
+import threading
+import uuid
+
+import httpx
+import pytest
+
+from apps.nutrition.llm_governor import (
+    BATCH,
+    INTERACTIVE,
+    LLMGovernor,
+    LocalGovernorStore,
+    RedisGovernorStore,
+    llm_priority,
+)
+from apps.nutrition.llm_provider import OpenAIProvider
+
+# Настоящий Redis для проверки Lua-скрипта: LLM_GOVERNOR_TEST_REDIS_URL=redis://localhost:6379/15
+REDIS_URL = os.getenv("LLM_GOVERNOR_TEST_REDIS_URL")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _bound(value):
+    if value in ("-inf", "+inf"):
+        return float(value), False
+    value = str(value)
+    if value.startswith("("):
+        return float(value[1:]), True
+    return float(value), False
+
+
+def _in_range(score, low, high):
+    (low, low_open), (high, high_open) = _bound(low), _bound(high)
+    return (score > low if low_open else score >= low) and (score < high if high_open else score <= high)
+
+
+class FakeRedis:
+    """Sorted sets and hashes RedisGovernorStore uses; the acquire script runs as its Python twin."""
+
+    def __init__(self):
+        self.zsets = {}
+        self.hashes = {}
+        self.lock = threading.RLock()
+
+    def zadd(self, key, mapping):
+        with self.lock:
+            self.zsets.setdefault(key, {}).update({member: float(score) for member, score in mapping.items()})
+
+    def zrem(self, key, member):
+        with self.lock:
+            return int(self.zsets.get(key, {}).pop(member, None) is not None)
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zcount(self, key, low, high):
+        with self.lock:
+            return sum(1 for score in self.zsets.get(key, {}).values() if _in_range(score, low, high))
+
+    def zrangebyscore(self, key, low, high):
+        with self.lock:
+            items = sorted(self.zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+            return [member for member, score in items if _in_range(score, low, high)]
+
+    def zremrangebyscore(self, key, low, high):
+        with self.lock:
+            for member in self.zrangebyscore(key, low, high):
+                self.zrem(key, member)
+
+    def zrank(self, key, member):
+        with self.lock:
+            if member not in self.zsets.get(key, {}):
+                return None
+            return self.zrangebyscore(key, "-inf", "+inf").index(member)
+
+    def hset(self, key, mapping):
+        with self.lock:
+            self.hashes.setdefault(key, {}).update({field: str(value) for field, value in mapping.items()})
+
+    def hmget(self, key, *fields):
+        with self.lock:
+            return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        return lambda keys, args: self._acquire(keys, [str(arg) for arg in args])
+
+    def _acquire(self, keys, args):
+        # Построчный двойник _ACQUIRE_SCRIPT.
+        holders, queue, seen, bucket = keys
+        token, now = args[0], float(args[1])
+        lease, queue_lease = float(args[2]), float(args[3])
+        limit, reserve = int(args[4]), int(args[5])
+        priority, queued = int(args[6]), args[7] == "1"
+        cost, tpm, span = float(args[8]), float(args[9]), float(args[10])
+        with self.lock:
+            self.zremrangebyscore(holders, "-inf", now)
+            for member in self.zrangebyscore(seen, "-inf", now - queue_lease):
+                self.zrem(queue, member)
+                self.zrem(seen, member)
+
+            free = limit - self.zcard(holders)
+            if priority > 0:
+                free -= reserve
+            ahead = None
+            if queued:
+                ahead = self.zrank(queue, token)
+                if ahead is not None:
+                    self.zadd(seen, {token: now})
+            if ahead is None:
+                ahead = self.zcount(queue, "-inf", "(%.0f" % ((priority + 1) * span))
+            if free - ahead <= 0:
+                return 0
+
+            if tpm > 0:
+                tokens, ts = self.hmget(bucket, "tokens", "ts")
+                tokens = float(tokens) if tokens is not None else tpm
+                ts = float(ts) if ts is not None else now
+                tokens = min(tpm, tokens + max(0, now - ts) * tpm / 60000)
+                cost = min(cost, tpm)
+                if tokens < cost:
+                    self.hset(bucket, {"tokens": tokens, "ts": now})
+                    return 0
+                self.hset(bucket, {"tokens": tokens - cost, "ts": now})
+
+            self.zadd(holders, {token: now + lease})
+            self.zrem(queue, token)
+            self.zrem(seen, token)
+            return 1
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.client, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client.lock:
+            return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+def _limits(overrides):
+    limits = {"max_concurrency": 2, "tpm": 0, "interactive_reserve": 0, "lease": 60, "queue_lease": 10}
+    limits.update(overrides)
+    return limits
+
+
+def make_store(**overrides):
+    return LocalGovernorStore(**_limits(overrides))
+
+
+@pytest.fixture(params=["local", "redis-fake", "redis"])
+def store_factory(request):
+    """The same admission rules for the in-process store and the Redis one."""
+    if request.param == "local":
+        yield make_store
+        return
+    if request.param == "redis-fake":
+        client = FakeRedis()
+    else:
+        if not REDIS_URL:
+            pytest.skip("LLM_GOVERNOR_TEST_REDIS_URL is not set")
+        import redis
+
+        client = redis.Redis.from_url(REDIS_URL)
+    prefix = f"test:llm:governor:{uuid.uuid4().hex}:"
+    yield lambda **overrides: RedisGovernorStore(client, prefix=prefix, **_limits(overrides))
+    if request.param == "redis":
+        client.delete(*(prefix + name for name in ("holders", "queue", "seen", "bucket")))
+        client.close()
+
+
+def test_concurrency_limit_and_interactive_reserve(store_factory):
+    store = store_factory(max_concurrency=3, interactive_reserve=1)
+    governor = LLMGovernor(store, mode="shed", batch_mode="shed")
+
+    batch = [governor.acquire(cost=1, priority=BATCH) for _ in range(3)]
+    assert [t is not None for t in batch] == [True, True, False]
+    interactive = governor.acquire(cost=1, priority=INTERACTIVE)
+    assert interactive is not None
+    assert governor.acquire(cost=1, priority=INTERACTIVE) is None
+
+    interactive.release()
+    interactive.release()  # повторный release безопасен
+    assert store.snapshot(0)["in_flight"] == 2
+    stats = governor.stats()["process"]
+    assert stats["batch"]["shed"] == 1
+    assert stats["interactive"]["shed_rate"] == 0.5
+
+
+def test_tokens_per_minute_bucket_refills(store_factory):
+    clock = Clock()
+    store = store_factory(max_concurrency=10, tpm=1000)
+    governor = LLMGovernor(store, mode="shed", clock=clock)
+
+    assert governor.acquire(cost=600) is not None
+    assert governor.acquire(cost=600) is None
+    clock.now += 12  # +200 токенов
+    assert governor.acquire(cost=600) is not None
+    assert governor.acquire(cost=5000) is None  # дороже бюджета — ждёт полного ведра
+    clock.now += 60
+    assert governor.acquire(cost=5000) is not None
+
+
+def test_queue_orders_interactive_before_batch(store_factory):
+    store = store_factory(max_concurrency=1)
+    holder = "holder"
+    assert store.try_acquire(holder, priority=INTERACTIVE, cost=1, queued=False, now=0)
+    store.enqueue("batch", priority=BATCH, now=1)
+    store.enqueue("late-interactive", priority=INTERACTIVE, now=2)
+    store.release(holder)
+
+    assert not store.try_acquire("batch", priority=BATCH, cost=1, queued=True, now=3)
+    assert not store.try_acquire("walk-in", priority=INTERACTIVE, cost=1, queued=False, now=3)
+    assert store.try_acquire("late-interactive", priority=INTERACTIVE, cost=1, queued=True, now=3)
+    assert store.snapshot(3)["queued"] == {"interactive": 0, "batch": 1}
+
+
+def test_abandoned_queue_entries_and_holders_expire(store_factory):
+    store = store_factory(max_concurrency=1, lease=30, queue_lease=5)
+    assert store.try_acquire("crashed", priority=INTERACTIVE, cost=1, queued=False, now=0)
+    store.enqueue("gone", priority=INTERACTIVE, now=0)
+
+    assert not store.try_acquire("next", priority=INTERACTIVE, cost=1, queued=False, now=10)
+    assert store.try_acquire("next", priority=INTERACTIVE, cost=1, queued=False, now=31)
+
+
+def test_wait_mode_sheds_after_deadline_and_batch_uses_its_policy():
+    store = make_store(max_concurrency=1)
+    governor = LLMGovernor(store, mode="wait", deadline=0.05, batch_mode="shed", poll_interval=0.01)
+    held = governor.acquire(cost=1)
+
+    assert governor.acquire(cost=1) is None
+    with llm_priority(BATCH):
+        calls = []
+        assert governor.acquire(cost=1, sleep=calls.append) is None
+        assert calls == []  # shed — без ожидания
+
+    held.release()
+    assert governor.acquire(cost=1) is not None
+
+
+def test_cancelled_wait_gives_up():
+    governor = LLMGovernor(make_store(max_concurrency=1), mode="queue", deadline=30)
+    governor.acquire(cost=1)
+
+    assert governor.acquire(cost=1, sleep=lambda seconds: True) is None
+    assert governor.store.snapshot(0)["queued"]["interactive"] == 0
+
+
+def test_provider_falls_back_when_shed():
+    governor = LLMGovernor(make_store(max_concurrency=1), mode="shed")
+    governor.acquire(cost=1)
+    http_client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+    provider = OpenAIProvider(
+        config={"OPENAI_API_KEY": "test", "OPENAI_MAX_RETRIES": "1"},
+        http_client=http_client,
+        governor=governor,
+    )
+
+    plan = provider.compose_menu({"targets": {"calories": 2000}, "items": [{"id": 1, "title": "Суп", "kcal": 300}]})
+
+    assert plan == []
+    assert governor.stats()["process"]["interactive"]["shed"] == 1
+    http_client.close()
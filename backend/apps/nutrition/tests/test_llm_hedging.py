@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from apps.nutrition.llm_hedging import HedgedProvider, LatencyHistogram
+from apps.nutrition.llm_provider import wait_or_cancelled
+from apps.nutrition.tracing import planner_trace, span
+
+CONTEXT = {"items": [{"id": 1, "title": "Боул"}]}
+
+
+class StubProvider:
+    """Отвечает через ``latency`` секунд; отмену видно по ``cancelled``."""
+
+    def __init__(self, latency: float, plan=None):
+        self.latency = latency
+        self.plan = [{"item_id": 1, "qty": 1.0, "time_hint": "any", "title": "Боул"}] if plan is None else plan
+        self.calls = 0
+        self.cancelled = threading.Event()
+
+    def compose_menu(self, context):
+        self.calls += 1
+        if wait_or_cancelled(self.latency):
+            self.cancelled.set()
+            return []
+        return list(self.plan)
+
+
+def _hedged(primary, secondary, **kwargs):
+    kwargs.setdefault("min_samples", 1000)
+    return HedgedProvider([("primary", primary), ("secondary", secondary)], **kwargs)
+
+
+def test_fast_primary_does_not_hedge():
+    primary, secondary = StubProvider(0.01), StubProvider(0.01)
+    provider = _hedged(primary, secondary, hedge_delay=0.5)
+
+    assert provider.compose_menu(CONTEXT)
+    assert (primary.calls, secondary.calls) == (1, 0)
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    primary, secondary = StubProvider(2.0), StubProvider(0.02)
+    provider = _hedged(primary, secondary, hedge_delay=0.05)
+
+    with planner_trace("test") as trace, span("llm"):
+        started = time.perf_counter()
+        plan = provider.compose_menu(CONTEXT)
+        elapsed = time.perf_counter() - started
+
+    assert plan and elapsed < 0.5
+    assert primary.cancelled.wait(1)
+    assert trace.spans[0].attrs["winner"] == "secondary"
+    assert trace.spans[0].attrs["launched"] == ["primary", "secondary"]
+    assert provider.histograms["secondary"].count == 1
+    assert provider.histograms["primary"].failures == 0  # отменённый вызов — не отказ
+
+
+def test_failed_primary_hedges_without_waiting():
+    primary, secondary = StubProvider(0.0, plan=[]), StubProvider(0.01)
+    provider = _hedged(primary, secondary, hedge_delay=5)
+
+    started = time.perf_counter()
+    assert provider.compose_menu(CONTEXT)
+    assert time.perf_counter() - started < 1
+    assert provider.histograms["primary"].failures == 1
+
+
+def test_race_starts_both_and_takes_the_faster():
+    primary, secondary = StubProvider(0.3), StubProvider(0.01)
+    provider = _hedged(primary, secondary, mode="race", hedge_delay=5)
+
+    assert provider.compose_menu(CONTEXT)
+    assert (primary.calls, secondary.calls) == (1, 1)
+    assert primary.cancelled.wait(1)
+
+
+def test_all_providers_failing_returns_empty_plan():
+    provider = _hedged(StubProvider(0.0, plan=[]), StubProvider(0.0, plan=[]), hedge_delay=0.01)
+    assert provider.compose_menu(CONTEXT) == []
+
+
+def test_hedge_delay_adapts_to_primary_p90():
+    provider = _hedged(StubProvider(0), StubProvider(0), hedge_delay=2, min_samples=10, min_delay=0.01)
+    assert provider.current_hedge_delay() == 2
+
+    hist = provider.histograms["primary"]
+    for _ in range(9):
+        hist.observe(0.2)
+    hist.observe(3.0)
+
+    assert 0.2 <= provider.current_hedge_delay() <= 0.25
+    assert provider.latency_stats()["providers"]["primary"]["count"] == 10
+
+
+def test_histogram_quantiles():
+    hist = LatencyHistogram()
+    assert hist.quantile(0.5) is None
+    for value in (0.05, 0.1, 0.1, 1.0):
+        hist.observe(value)
+    assert hist.quantile(0.5) == pytest.approx(0.1, rel=0.25)
+    assert hist.quantile(0.99) == pytest.approx(1.0, rel=0.25)
+
+
+def test_close_shuts_the_hedge_pool_down():
+    provider = _hedged(StubProvider(0.01), StubProvider(0.01), mode="race")
+    assert provider.compose_menu(CONTEXT)
+
+    provider.close()
+
+    with pytest.raises(RuntimeError, match="shutdown"):
+        provider._executor.submit(lambda: None)
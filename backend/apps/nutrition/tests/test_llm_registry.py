@@ -0,0 +1,104 @@
+import os
+
+from apps.nutrition.llm_provider import OpenAIProvider, ProviderRegistry
+
+
+class StubProvider:
+    def __init__(self, *, config, http_client):
+        self.model = config.get("OPENAI_MODEL", "gpt-4o-mini")
+        self.http_client = http_client
+
+    def compose_menu(self, context):
+        return []
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_registry_builds_provider_once_and_shares_http_pool():
+    registry = ProviderRegistry(providers={"openai": StubProvider, "other": StubProvider}, config_file="", pool_size=4)
+
+    first = registry.get()
+    assert registry.get() is first
+    other = registry.get("other")
+
+    assert registry.builds == 2
+    assert other.http_client is first.http_client is registry.http_client()
+    registry.close()
+
+
+def test_registry_reloads_changed_config_file_after_interval(tmp_path):
+    config = tmp_path / "llm.env"
+    config.write_text("OPENAI_MODEL=model-a\n")
+    clock = Clock()
+    registry = ProviderRegistry(
+        providers={"openai": StubProvider}, config_file=str(config), reload_interval=30, clock=clock
+    )
+    first = registry.get()
+    assert first.model == "model-a"
+
+    config.write_text("# ротация\nOPENAI_MODEL='model-b'\n")
+    stamp = os.stat(config).st_mtime + 5
+    os.utime(config, (stamp, stamp))
+    clock.now = 10
+    assert registry.get() is first  # интервал ещё не прошёл
+
+    clock.now = 31
+    second = registry.get()
+    assert second is not first
+    assert second.model == "model-b"
+    clock.now = 62
+    assert registry.get() is second  # файл не менялся
+    registry.close()
+
+
+def test_request_reload_rebuilds_on_next_use():
+    registry = ProviderRegistry(providers={"openai": StubProvider}, config_file="")
+    first = registry.get()
+    pool = first.http_client
+
+    registry.request_reload()
+    second = registry.get()
+
+    assert second is not first
+    assert second.http_client is not pool
+    assert registry.builds == 2
+    registry.close()
+
+
+def test_reload_closes_providers_retired_by_the_previous_reload():
+    registry = ProviderRegistry(providers={"openai": StubProvider}, config_file="")
+    first = registry.get()
+
+    registry.reload()
+    second = registry.get()
+    assert not hasattr(first, "closed")  # может ещё отвечать в другом потоке
+
+    registry.reload()
+    assert first.closed
+    assert not hasattr(second, "closed")
+
+    registry.close()
+    assert second.closed
+
+
+def test_openai_provider_uses_given_config_and_pool():
+    registry = ProviderRegistry(config_file="")
+    provider = OpenAIProvider(
+        config={"OPENAI_API_KEY": "test", "OPENAI_MODEL": "m", "NUTRIBOT_MAX_PLAN_ITEMS": "3"},
+        http_client=registry.http_client(),
+    )
+
+    assert provider.model == "m"
+    assert provider.max_plan_items == 3
+    assert provider._client._client is registry.http_client()
+    assert OpenAIProvider(config={}).compose_menu({"items": [{"id": 1}]}) == []
+    registry.close()
@@ -302,4 +302,25 @@ def test_update_plan_meal_is_scoped_to_owner(api_client, other_user, menu_item):
         format="json",
     )
 
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+@pytest.mark.django_db
+def test_bot_lists_plans_by_telegram_id(user, other_user, menu_item, settings):
+    settings.BOT_INTERNAL_KEY = "bot-key"
+    user.profile.telegram_id = 555
+    user.profile.save(update_fields=["telegram_id"])
+    MenuPlan.create_from_payload(user=user, payload=_make_payload(menu_item), plan_date=date(2024, 5, 1))
+    latest = MenuPlan.create_from_payload(user=user, payload=_make_payload(menu_item), plan_date=date(2024, 5, 2))
+    MenuPlan.create_from_payload(user=other_user, payload=_make_payload(menu_item), plan_date=date(2024, 5, 2))
+
+    client = APIClient()
+    assert client.get("/api/nutrition/bot/plans/", {"telegram_id": 555}).status_code in (401, 403)
+
+    resp = client.get("/api/nutrition/bot/plans/", {"telegram_id": 555, "limit": 1}, HTTP_X_BOT_KEY="bot-key")
+    assert resp.status_code == 200
+    payload = resp.json()
+    assert [plan["plan_id"] for plan in payload] == [latest.id]
+    assert payload[0]["plan"][0]["item_id"] == menu_item.id
+
+    resp = client.get("/api/nutrition/bot/plans/", {"telegram_id": 555, "date": "2024-05-01"}, HTTP_X_BOT_KEY="bot-key")
+    assert [plan["date"] for plan in resp.json()] == ["2024-05-01"]
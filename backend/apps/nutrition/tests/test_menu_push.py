@@ -0,0 +1,157 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+import pytest
+from django.contrib.auth import get_user_model
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+from apps.nutrition.models import MenuPlan
+from apps.nutrition.push import dispatch_menu_push, generate_push_chunk
+from apps.users.models import Profile
+
+User = get_user_model()
+
+# 06:00 UTC: в Москве 09:00, в Нью-Йорке 01:00.
+NOW = datetime(2030, 3, 2, 6, 0, tzinfo=dt_timezone.utc)
+
+
+class ListSink:
+    def __init__(self):
+        self.batches: list[list[dict]] = []
+
+    def publish(self, messages):
+        if messages:
+            self.batches.append(list(messages))
+
+    @property
+    def messages(self) -> list[dict]:
+        return [message for batch in self.batches for message in batch]
+
+
+def _subscriber(username: str, telegram_id: int, *, tz: str, hour: int = 8, **extra) -> Profile:
+    user = User.objects.create_user(username=username, password="StrongPass123")
+    profile = user.profile
+    profile.telegram_id = telegram_id
+    profile.timezone = tz
+    profile.menu_push_enabled = extra.pop("enabled", True)
+    profile.menu_push_hour = hour
+    for field, value in extra.items():
+        setattr(profile, field, value)
+    profile.save()
+    return profile
+
+
+@pytest.fixture
+def menu_item(db):
+    restaurant = Restaurant.objects.create(name="Kitchen", city="Москва")
+    nutrients = Nutrients.objects.create(calories=520, protein=32, fat=18, carbs=55)
+    return MenuItem.objects.create(
+        source="restaurant", source_id=restaurant.id, title="Боул", price=350, nutrients=nutrients
+    )
+
+
+@pytest.fixture
+def fake_builder(monkeypatch, menu_item):
+    def build(user):
+        if user.username == "broken":
+            raise RuntimeError("provider down")
+        return {
+            "targets": {"calories": 2000, "protein_g": 120, "fat_g": 70, "carbs_g": 210},
+            "plan": [{"item_id": menu_item.id, "title": menu_item.title, "qty": 2, "time_hint": "lunch"}],
+        }
+
+    monkeypatch.setattr("apps.nutrition.push.build_menu_for_user", build)
+
+
+@pytest.mark.django_db
+def test_dispatch_claims_only_subscribers_whose_morning_has_come():
+    due = _subscriber("msk", 1001, tz="Europe/Moscow", hour=8)
+    _subscriber("nyc", 1002, tz="America/New_York", hour=8)
+    _subscriber("late", 1003, tz="Europe/Moscow", hour=5)  # окно в 3 часа уже прошло
+    _subscriber("off", 1004, tz="Europe/Moscow", enabled=False)
+    _subscriber("done", 1005, tz="Europe/Moscow", menu_push_last_date=date(2030, 3, 2))
+
+    chunks = []
+    result = dispatch_menu_push(now=NOW, enqueue=lambda ids, plan_date: chunks.append((ids, plan_date)))
+
+    assert result.claimed == 1
+    assert chunks == [([due.id], date(2030, 3, 2))]
+    due.refresh_from_db()
+    # День отмечает генерация, диспетчер только берёт профиль в аренду.
+    assert (due.menu_push_claimed_at, due.menu_push_last_date) == (NOW, None)
+
+    # Повторный проход, пока аренда жива, никого не берёт.
+    assert dispatch_menu_push(now=NOW + timedelta(minutes=5), enqueue=lambda *args: chunks.append(args)).claimed == 0
+    assert len(chunks) == 1
+    # Задача генерации упала и ничего не отметила — после аренды профиль берётся снова.
+    later = NOW + timedelta(minutes=31)
+    assert dispatch_menu_push(now=later, enqueue=lambda *args: chunks.append(args)).claimed == 1
+
+
+@pytest.mark.django_db
+def test_dispatch_splits_claims_into_chunks():
+    for n in range(5):
+        _subscriber(f"u{n}", 2000 + n, tz="Europe/Moscow")
+
+    chunks = []
+    result = dispatch_menu_push(now=NOW, chunk_size=2, enqueue=lambda ids, plan_date: chunks.append(ids))
+
+    assert result.chunks == 3
+    assert sorted(len(ids) for ids in chunks) == [1, 2, 2]
+    assert Profile.objects.filter(menu_push_claimed_at=NOW).count() == 5
+
+
+@pytest.mark.django_db
+def test_generate_chunk_streams_plans_and_isolates_failures(fake_builder):
+    profiles = [_subscriber(f"g{n}", 3000 + n, tz="Europe/Moscow", menu_push_claimed_at=NOW) for n in range(3)]
+    broken = _subscriber("broken", 3999, tz="Europe/Moscow", menu_push_claimed_at=NOW)
+    sink = ListSink()
+
+    result = generate_push_chunk(
+        [p.id for p in profiles] + [broken.id], plan_date=date(2030, 3, 2), sink=sink, flush_every=2
+    )
+
+    assert result.as_dict() == {"generated": 3, "failed": 1, "published": 3}
+    assert [len(batch) for batch in sink.batches] == [2, 1]
+    message = sink.messages[0]
+    assert message["telegram_id"] == 3000
+    assert message["date"] == "2030-03-02"
+    assert message["targets"]["calories"] == 2000
+    assert message["plan"] == [{"title": "Боул", "qty": 2, "time_hint": "lunch"}]
+    assert MenuPlan.objects.filter(date=date(2030, 3, 2)).count() == 3
+    assert MenuPlan.objects.get(id=message["plan_id"]).user_id == profiles[0].user_id
+    # Отмечены только опубликованные; упавший отпущен и будет взят следующим проходом.
+    stamps = dict(Profile.objects.values_list("id", "menu_push_last_date"))
+    assert {stamps[p.id] for p in profiles} == {date(2030, 3, 2)}
+    assert stamps[broken.id] is None
+    assert not Profile.objects.filter(menu_push_claimed_at__isnull=False).exists()
+
+
+@pytest.mark.django_db
+def test_push_chunk_batches_users_by_city_and_restrictions(monkeypatch):
+    moscow = [_subscriber(f"m{n}", 4000 + n, tz="Europe/Moscow", city="Москва") for n in range(3)]
+    nuts = [_subscriber(f"n{n}", 4100 + n, tz="Europe/Moscow", city="Москва", allergies=["nuts"]) for n in range(2)]
+    spb = _subscriber("spb", 4200, tz="Europe/Moscow", city="Санкт-Петербург")
+    batches, singles = [], []
+    data = {"targets": {"calories": 2000, "protein_g": 120, "fat_g": 70, "carbs_g": 210}, "plan": []}
+
+    def build_batch(users):
+        batches.append(sorted(user.username for user in users))
+        if "n0" in batches[-1]:
+            raise RuntimeError("LLM down")
+        return {user.pk: data for user in users}
+
+    def build_single(user):
+        singles.append(user.username)
+        return data
+
+    monkeypatch.setattr("apps.nutrition.push.build_menus_for_users", build_batch)
+    monkeypatch.setattr("apps.nutrition.push.build_menu_for_user", build_single)
+
+    result = generate_push_chunk(
+        [p.id for p in [*moscow, *nuts, spb]], plan_date=date(2030, 3, 2), sink=ListSink(), llm_batch_size=2
+    )
+
+    assert result.generated == 6
+    assert batches == [["m0", "m1"], ["n0", "n1"]]
+    # m2 и spb — без пары, n0 и n1 — после упавшего пакета.
+    assert sorted(singles) == ["m2", "n0", "n1", "spb"]
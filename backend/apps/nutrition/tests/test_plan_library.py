@@ -0,0 +1,225 @@
+import pytest
+from django.contrib.auth import get_user_model
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+from apps.nutrition.menu_selection import MenuSelectionService
+from apps.nutrition.models import PlanTemplate
+from apps.nutrition.plan_library import (
+    bucket_for,
+    build_plan_library,
+    library_stats,
+    lookup_plan,
+    profile_targets,
+    reset_library_stats,
+    scale_plan,
+)
+from apps.nutrition.planner import build_menu_for_user
+from apps.nutrition.services import Targets
+from apps.nutrition.tracing import planner_trace
+
+User = get_user_model()
+
+
+class ExplodingProvider:
+    def compose_menu(self, context):
+        raise AssertionError("LLM must not be called on a library hit")
+
+
+class EmptyProvider:
+    def compose_menu(self, context):
+        return []
+
+
+@pytest.fixture(autouse=True)
+def _stats():
+    reset_library_stats()
+    yield
+    reset_library_stats()
+
+
+@pytest.fixture
+def catalog(db):
+    restaurant = Restaurant.objects.create(name="Test", city="Москва", is_active=True)
+    items = []
+    for idx, (kcal, allergens) in enumerate([(450, []), (600, []), (700, ["nuts"]), (350, [])]):
+        items.append(
+            MenuItem.objects.create(
+                source="restaurant",
+                source_id=restaurant.id,
+                title=f"Блюдо {idx}",
+                price=300 + idx * 100,
+                allergens=allergens,
+                nutrients=Nutrients.objects.create(calories=kcal, protein=30, fat=15, carbs=50),
+            )
+        )
+    return items
+
+
+def make_user(username, *, weight=70, allergies=("nuts",), city="Москва"):
+    user = User.objects.create_user(username=username, password="StrongPass123")
+    profile = user.profile
+    profile.weight_kg = weight
+    profile.height_cm = 175
+    profile.city = city
+    profile.allergies = list(allergies)
+    profile.save()
+    return user
+
+
+def test_bucket_quantizes_targets_and_normalizes_restrictions():
+    targets = Targets(calories=2234, protein_g=126, fat_g=62, carbs_g=280)
+
+    bucket = bucket_for(targets, city=" Москва ", allergies=["Nuts", "milk", ""], exclusions=None)
+
+    assert bucket.city == "Москва"
+    assert bucket.calories == 2200
+    assert (bucket.protein_pct, bucket.fat_pct) == (25, 25)
+    assert bucket.allergies == ("milk", "nuts")
+    assert bucket == bucket_for(targets, city="Москва", allergies=["nuts", "MILK"])
+    assert bucket.restrictions_key != bucket_for(targets, city="Москва").restrictions_key
+    assert bucket_for(targets, city="Москва").restrictions_key == ""
+    assert bucket.targets().calories == 2200
+
+
+def test_scale_plan_rounds_portions_to_quarters():
+    plan = [{"item_id": 1, "qty": 1.0}, {"item_id": 2, "qty": 3.0}]
+
+    assert [e["qty"] for e in scale_plan(plan, 1.1)] == [1.0, 3.25]
+    assert [e["qty"] for e in scale_plan(plan, 0.1)] == [0.5, 0.5]
+
+
+@pytest.mark.django_db
+def test_build_and_lookup_serves_scaled_plan(catalog):
+    users = [make_user(f"u{idx}") for idx in range(3)]
+    make_user("loner", weight=120, allergies=())
+
+    result = build_plan_library(limit=10, min_profiles=2, solver="greedy")
+
+    assert result.as_dict()["built"] == 1
+    assert result.profiles_covered == 3
+    template = PlanTemplate.objects.get()
+    assert template.city == "Москва"
+    assert catalog[2].id not in template.item_ids  # аллерген отфильтрован при сборке
+
+    profile = users[0].profile
+    targets = profile_targets(profile)
+    hit = lookup_plan(targets=targets, city=profile.city, allergies=["NUTS"], budget=profile.daily_budget)
+
+    assert hit is not None
+    assert hit.template_id == template.id
+    assert [e["item_id"] for e in hit.plan] == template.item_ids
+    assert 0 <= hit.macro_error < 1
+    assert lookup_plan(targets=targets, city=profile.city, allergies=[]) is None
+    stats = library_stats()
+    assert (stats["hits"], stats["misses"], stats["templates"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+@pytest.mark.django_db
+def test_lookup_rechecks_dishes(catalog):
+    user = make_user("u1")
+    build_plan_library(min_profiles=1, solver="greedy")
+    profile = user.profile
+    targets = profile_targets(profile)
+    template = PlanTemplate.objects.get()
+
+    def lookup(**kwargs):
+        return lookup_plan(targets=targets, city="Москва", allergies=["nuts"], **kwargs)
+
+    assert lookup() is not None
+    assert lookup(budget=min(MenuItem.objects.get(id=i).price for i in template.item_ids) - 1) is None
+
+    item = MenuItem.objects.get(id=template.item_ids[0])
+    item.allergens = ["Nuts"]
+    item.save()
+    assert lookup() is None
+
+    item.allergens = []
+    item.is_available = False
+    item.save()
+    assert lookup() is None
+
+
+@pytest.mark.django_db
+def test_nearest_calorie_bucket_is_used(catalog):
+    make_user("u1")
+    build_plan_library(min_profiles=1, solver="greedy")
+    template = PlanTemplate.objects.get()
+
+    def targets_at(calories):
+        return Targets(
+            calories=calories,
+            protein_g=int(round(calories * template.protein_pct / 400)),
+            fat_g=int(round(calories * template.fat_pct / 900)),
+            carbs_g=200,
+        )
+
+    hit = lookup_plan(targets=targets_at(template.calories + 100), city="Москва", allergies=["nuts"])
+    assert hit is not None and hit.template_id == template.id
+    assert lookup_plan(targets=targets_at(template.calories + 300), city="Москва", allergies=["nuts"]) is None
+
+
+@pytest.mark.django_db
+def test_rebuild_drops_buckets_that_left_the_top(catalog):
+    user = make_user("u1")
+    build_plan_library(min_profiles=1, solver="greedy")
+    old_key = PlanTemplate.objects.get().key
+
+    profile = user.profile
+    profile.weight_kg = 110
+    profile.save()
+    result = build_plan_library(min_profiles=1, solver="greedy")
+
+    assert result.removed == 1
+    assert PlanTemplate.objects.get().key != old_key
+
+
+@pytest.mark.django_db
+def test_planner_uses_library_and_falls_through_on_miss(catalog, settings):
+    settings.PLAN_LIBRARY_ENABLED = True
+    user = make_user("u1")
+    build_plan_library(min_profiles=1, solver="greedy")
+    service = MenuSelectionService(provider_factory=ExplodingProvider)
+
+    with planner_trace("generate_menu") as trace:
+        data = build_menu_for_user(user, selection_service=service)
+
+    assert [s.name for s in trace.spans] == ["tdee", "library"]
+    assert trace.spans[1].attrs["hit"] is True
+    assert [e["item_id"] for e in data["plan"]] == PlanTemplate.objects.get().item_ids
+
+    PlanTemplate.objects.all().delete()
+    with planner_trace("generate_menu") as trace:
+        data = build_menu_for_user(user, selection_service=MenuSelectionService(provider_factory=EmptyProvider))
+    assert [s.name for s in trace.spans][:3] == ["tdee", "library", "filter"]
+    assert data["plan"]
+
+    settings.PLAN_LIBRARY_ENABLED = False
+    with planner_trace("generate_menu") as trace:
+        build_menu_for_user(user, selection_service=MenuSelectionService(provider_factory=EmptyProvider))
+    assert "library" not in [s.name for s in trace.spans]
+
+
+
+def test_live_plans_use_the_profile_city(catalog, settings):
+    settings.PLAN_LIBRARY_ENABLED = False
+    elsewhere = Restaurant.objects.create(name="Far", city="Казань", is_active=True)
+    far = MenuItem.objects.create(
+        source="restaurant",
+        source_id=elsewhere.id,
+        title="Эчпочмак",
+        price=200,
+        nutrients=Nutrients.objects.create(calories=500, protein=30, fat=15, carbs=50),
+    )
+    seen = []
+
+    class RecordingProvider:
+        def compose_menu(self, context):
+            seen.extend(item["id"] for item in context["items"])
+            return []
+
+    service = MenuSelectionService(provider_factory=RecordingProvider)
+    build_menu_for_user(make_user("u-city", allergies=()), selection_service=service)
+
+    assert seen
+    assert far.id not in seen
@@ -0,0 +1,226 @@
+import threading
+import time
+
+import pytest
+from rest_framework.test import APIClient
+
+from apps.nutrition.singleflight import LocalSingleFlight, RedisSingleFlight, profile_version
+
+
+class FakeRedis:
+    """The few commands RedisSingleFlight uses, with TTLs in milliseconds."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def _alive(self, key):
+        value = self.data.get(key)
+        if value is None:
+            return None
+        if value[1] is not None and value[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return value[0]
+
+    def get(self, key):
+        with self.lock:
+            value = self._alive(key)
+        return None if value is None else value.encode()
+
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and self._alive(key) is not None:
+                return None
+            self.data[key] = (value, time.monotonic() + px / 1000 if px else None)
+            return True
+
+    def eval(self, script, numkeys, key, token):
+        with self.lock:
+            if self._alive(key) == token:
+                del self.data[key]
+                return 1
+        return 0
+
+
+def run_concurrently(flight, fn, *, callers=3):
+    results = [None] * callers
+    threads = []
+    for idx in range(callers):
+        def call(idx=idx):
+            try:
+                results[idx] = flight.do("plan:1", fn)
+            except RuntimeError as exc:
+                results[idx] = exc
+        threads.append(threading.Thread(target=call))
+        threads[-1].start()
+        time.sleep(0.02)  # лидер — первый
+    return threads, results
+
+
+@pytest.mark.parametrize("make_flight", [
+    lambda: LocalSingleFlight(wait_timeout=5),
+    lambda: RedisSingleFlight(FakeRedis(), wait_timeout=5, poll_interval=0.005),
+])
+def test_concurrent_duplicates_share_one_call(make_flight):
+    flight = make_flight()
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        release.wait(2)
+        return {"plan_id": len(calls)}
+
+    threads, results = run_concurrently(flight, generate)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(calls) == 1
+    assert [r[0] for r in results] == [{"plan_id": 1}] * 3
+    assert sorted(r[1] for r in results) == [False, True, True]
+
+    # Запрос после ответа — новая генерация, а не кэш.
+    assert flight.do("plan:1", generate) == ({"plan_id": 2}, False)
+
+
+@pytest.mark.parametrize("make_flight", [
+    lambda: LocalSingleFlight(wait_timeout=5),
+    lambda: RedisSingleFlight(FakeRedis(), wait_timeout=5, poll_interval=0.005),
+])
+def test_failed_leader_does_not_poison_the_key(make_flight):
+    flight = make_flight()
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(2)
+            raise RuntimeError("LLM down")
+        return {"plan_id": len(calls)}
+
+    threads, results = run_concurrently(flight, generate, callers=2)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert isinstance(results[0], RuntimeError)
+    if isinstance(flight, RedisSingleFlight):
+        # Блокировка снята без результата — ожидающий генерирует сам.
+        assert results[1] == ({"plan_id": 2}, False)
+    else:
+        assert results[1] is results[0]
+    assert flight.do("plan:1", generate)[1] is False
+
+
+@pytest.mark.parametrize("make_flight", [
+    lambda: LocalSingleFlight(wait_timeout=5),
+    lambda: RedisSingleFlight(FakeRedis(), wait_timeout=5, poll_interval=0.005),
+])
+def test_streaming_leader_passes_items_and_shares_its_result(make_flight):
+    flight = make_flight()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        yield "meal-1"
+        yield "meal-2"
+        return {"plan_id": len(calls)}
+
+    leader = flight.stream("plan:1", generate)
+    assert next(leader) == "meal-1"
+    follower = {}
+    thread = threading.Thread(target=lambda: follower.update(result=flight.do("plan:1", lambda: {"plan_id": 99})))
+    thread.start()
+    time.sleep(0.05)
+    assert next(leader) == "meal-2"
+    with pytest.raises(StopIteration) as stop:
+        next(leader)
+    thread.join(2)
+
+    assert stop.value.value == ({"plan_id": 1}, False)
+    assert follower["result"] == ({"plan_id": 1}, True)
+    assert len(calls) == 1
+
+    # Клиент лидера ушёл посреди потока — ждущий генерирует сам.
+    leader = flight.stream("plan:1", generate)
+    next(leader)
+    thread = threading.Thread(target=lambda: follower.update(result=flight.do("plan:1", lambda: {"plan_id": 99})))
+    thread.start()
+    time.sleep(0.05)
+    leader.close()
+    thread.join(2)
+    assert follower["result"] == ({"plan_id": 99}, False)
+
+
+def test_redis_follower_falls_back_after_wait_timeout():
+    client = FakeRedis()
+    client.set("singleflight:lock:plan:1", "someone-else", px=60_000)
+    flight = RedisSingleFlight(client, wait_timeout=0.05, poll_interval=0.01)
+
+    assert flight.do("plan:1", lambda: {"plan_id": 7}) == ({"plan_id": 7}, False)
+
+
+@pytest.mark.django_db
+def test_profile_version_tracks_plan_inputs(django_user_model):
+    profile = django_user_model.objects.create_user(username="v", password="StrongPass123").profile
+    before = profile_version(profile)
+    profile.telegram_stars_balance = 10
+    assert profile_version(profile) == before
+
+    profile.allergies = ["nuts"]
+    assert profile_version(profile) != before
+
+
+@pytest.mark.django_db
+def test_generate_menu_reports_coalesced_response(django_user_model, monkeypatch):
+    class SharedFlight:
+        def do(self, key, fn):
+            return {"targets": {}, "plan": [], "plan_id": 42}, True
+
+    def build(user):
+        raise AssertionError("a follower must not generate")
+
+    monkeypatch.setattr("apps.nutrition.views.get_single_flight", SharedFlight)
+    monkeypatch.setattr("apps.nutrition.views.build_menu_for_user", build)
+    client = APIClient()
+    client.force_authenticate(django_user_model.objects.create_user(username="d", password="StrongPass123"))
+
+    response = client.post("/api/nutrition/generate/")
+
+    assert response.status_code == 200
+    assert response["X-Plan-Coalesced"] == "1"
+    assert response.json()["id"] == 42
+
+
+@pytest.mark.django_db
+def test_streamed_generation_is_coalesced(django_user_model, monkeypatch):
+    class SharedFlight:
+        def stream(self, key, fn):
+            payload = {
+                "targets": {"calories": 2000},
+                "plan": [{"item_id": 1, "qty": 1}],
+                "plan_id": 42,
+                "status": "new",
+                "status_display": "Новый",
+                "date": "2024-05-01",
+                "created_at": "2024-05-01T08:00:00",
+            }
+            return payload, True
+            yield
+
+    def stream_menu(user):
+        raise AssertionError("a follower must not generate")
+
+    monkeypatch.setattr("apps.nutrition.views.get_single_flight", SharedFlight)
+    monkeypatch.setattr("apps.nutrition.views.stream_menu_for_user", stream_menu)
+    client = APIClient()
+    client.force_authenticate(django_user_model.objects.create_user(username="s", password="StrongPass123"))
+
+    body = b"".join(client.post("/api/nutrition/generate/stream/").streaming_content).decode()
+
+    events = [block.split("\n")[0] for block in body.strip().split("\n\n")]
+    assert events == ["event: targets", "event: meal", "event: done"]
+    assert '"plan_id": 42' in body
@@ -0,0 +1,135 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+from apps.nutrition import planner
+from apps.nutrition.llm_provider import OpenAIProvider
+from apps.nutrition.menu_selection import MenuSelectionService
+from apps.nutrition.models import MenuPlan
+from apps.nutrition.plan_stream import IncrementalPlanParser
+from apps.nutrition.tracing import clear_traces, recent_traces
+
+User = get_user_model()
+
+ANSWER = (
+    '{"plan": [{"item_id": 1, "qty": 1.5, "time_hint": "breakfast", "title": "Каша {овсяная}"},'
+    ' {"item_id": 2, "qty": 1, "time_hint": "lunch"}, {"item_id": 3, "qty": 1, "time_hint": "dinner"}]}'
+)
+
+
+def _feed_all(parser, text, size):
+    entries = []
+    for idx in range(0, len(text), size):
+        entries.extend(parser.feed(text[idx: idx + size]))
+    return entries
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 1000])
+def test_parser_yields_entries_regardless_of_chunking(size):
+    parser = IncrementalPlanParser()
+    entries = _feed_all(parser, ANSWER, size)
+
+    assert [e["item_id"] for e in entries] == [1, 2, 3]
+    assert entries[0]["title"] == "Каша {овсяная}"
+    assert parser.done
+
+
+def test_parser_returns_entry_as_soon_as_it_closes():
+    parser = IncrementalPlanParser()
+    assert parser.feed('{"plan": [{"item_id": 1, "qty"') == []
+    assert parser.feed(': 1}, {"item_id"') == [{"item_id": 1, "qty": 1}]
+
+
+def test_parser_tolerates_model_noise():
+    text = 'Вот план:\n```json\n{"plan": [{"item_id": 4, "qty": 2,}, {"item_id": 5, "ok": True}, {broken}]}\n```'
+    assert IncrementalPlanParser().feed(text) == [{"item_id": 4, "qty": 2}, {"item_id": 5, "ok": True}]
+    assert IncrementalPlanParser().feed('[{"item_id": 6}] {"plan": [{"item_id": 7}]}') == [{"item_id": 6}]
+
+
+class FakeStream:
+    def __init__(self, text, size=5):
+        self.pieces = [text[i: i + size] for i in range(0, len(text), size)]
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.pieces:
+            self.consumed += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    def close(self):
+        self.closed = True
+
+
+def _provider(stream, **config):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return stream
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return OpenAIProvider(client, config={"OPENAI_STREAM": "1", **config}), calls
+
+
+def test_stream_stops_after_max_plan_items():
+    stream = FakeStream(ANSWER)
+    provider, calls = _provider(stream, NUTRIBOT_MAX_PLAN_ITEMS="2")
+    context = {"items": [{"id": i, "title": f"Блюдо {i}"} for i in (1, 2, 3)]}
+
+    plan = provider.compose_menu(context)
+
+    assert [e["item_id"] for e in plan] == [1, 2]
+    assert plan[1]["title"] == "Блюдо 2"
+    assert calls[0]["stream"] is True
+    assert calls[0]["max_tokens"] == 60 + 45 * 2
+    assert stream.closed and stream.consumed < len(stream.pieces)
+
+
+@pytest.mark.django_db
+def test_generate_menu_stream_sends_meals_then_saves(monkeypatch):
+    restaurant = Restaurant.objects.create(name="Test", city="Москва", is_active=True)
+    items = [
+        MenuItem.objects.create(
+            source="restaurant",
+            source_id=restaurant.id,
+            title=f"Блюдо {idx}",
+            price=300,
+            nutrients=Nutrients.objects.create(calories=500, protein=30, fat=15, carbs=50),
+        )
+        for idx in range(2)
+    ]
+
+    class StreamingProvider:
+        def compose_menu_stream(self, context):
+            for item in items:
+                yield {"item_id": item.id, "qty": 1.0, "time_hint": "any", "title": item.title}
+
+    monkeypatch.setattr(
+        planner, "default_selection_service", MenuSelectionService(provider_factory=StreamingProvider)
+    )
+    user = User.objects.create_user(username="streamer", password="StrongPass123")
+    client = APIClient()
+    client.force_authenticate(user)
+    clear_traces()
+
+    response = client.post("/api/nutrition/generate/stream/")
+
+    assert response.status_code == 200
+    assert response["Content-Type"] == "text/event-stream"
+    body = b"".join(response.streaming_content).decode()
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in body.strip().split("\n\n")
+    ]
+    assert [name for name, _ in events] == ["targets", "meal", "meal", "done"]
+    assert events[0][1]["calories"] > 0
+    plan = MenuPlan.objects.get(pk=events[-1][1]["plan_id"])
+    assert [meal.item_id for meal in plan.meals.order_by("id")] == [item.id for item in items]
+    [trace] = recent_traces()
+    assert trace["stream"] is True
+    assert {"tdee", "filter"} <= {s["name"] for s in trace["spans"]}
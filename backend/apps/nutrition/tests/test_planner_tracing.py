@@ -0,0 +1,105 @@
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+from apps.nutrition.menu_selection import MenuSelectionService, greedy_knapsack
+from apps.nutrition.models import MenuPlan
+from apps.nutrition.planner import build_menu_for_user
+from apps.nutrition.tracing import clear_traces, planner_trace, recent_traces, stage_summary
+
+User = get_user_model()
+
+
+class EmptyProvider:
+    def compose_menu(self, context):
+        return []
+
+
+@pytest.fixture(autouse=True)
+def _clean_buffer():
+    clear_traces()
+    yield
+    clear_traces()
+
+
+@pytest.fixture
+def user(db):
+    restaurant = Restaurant.objects.create(name="Test", city="Москва", is_active=True)
+    for idx, allergens in enumerate([[], [], ["nuts"]]):
+        MenuItem.objects.create(
+            source="restaurant",
+            source_id=restaurant.id,
+            title=f"Блюдо {idx}",
+            price=300,
+            allergens=allergens,
+            nutrients=Nutrients.objects.create(calories=500 + idx, protein=30, fat=15, carbs=50),
+        )
+    user = User.objects.create_user(username="traced", password="StrongPass123")
+    profile = user.profile
+    profile.weight_kg = 70
+    profile.height_cm = 175
+    profile.allergies = ["nuts"]
+    profile.save()
+    return user
+
+
+@pytest.mark.django_db
+def test_build_menu_records_stages(user, settings):
+    settings.PLANNER_TRACE_FILTER_COUNTS = True
+    service = MenuSelectionService(provider_factory=EmptyProvider, fallback_strategy=greedy_knapsack)
+
+    with planner_trace("generate_menu") as trace:
+        data = build_menu_for_user(user, selection_service=service)
+        MenuPlan.create_from_payload(user=user, payload=data)
+
+    spans = {s.name: s for s in trace.spans}
+    assert list(spans) == [
+        "tdee",
+        "library",
+        "filter",
+        "select_plan",
+        "select_plan.serialize",
+        "select_plan.llm",
+        "select_plan.fallback",
+        "create_from_payload",
+    ]
+    assert trace.attrs["user_id"] == user.pk
+    assert spans["library"].attrs["hit"] is False
+    assert spans["filter"].attrs["candidates"] == 2
+    assert spans["filter"].attrs["filter_counts"]["all"] == 3
+    assert spans["filter"].attrs["filter_counts"]["allergies"] == 2
+    assert spans["select_plan"].attrs["fallback"] == "greedy_knapsack"
+    assert spans["select_plan"].attrs["plan_items"] == len(data["plan"])
+
+    [recorded] = recent_traces()
+    assert recorded["name"] == "generate_menu"
+    assert stage_summary()["select_plan.fallback"]["count"] == 1
+
+
+@pytest.mark.django_db
+def test_build_menu_opens_its_own_trace(user):
+    service = MenuSelectionService(provider_factory=EmptyProvider)
+
+    build_menu_for_user(user, selection_service=service)
+
+    [recorded] = recent_traces()
+    assert recorded["name"] == "build_menu"
+    assert "filter_counts" not in recorded["spans"][2]
+
+
+@pytest.mark.django_db
+def test_traces_endpoint_is_admin_only(user):
+    build_menu_for_user(user, selection_service=MenuSelectionService(provider_factory=EmptyProvider))
+    client = APIClient()
+    client.force_authenticate(user)
+    assert client.get("/api/nutrition/admin/traces/").status_code == 403
+
+    admin = User.objects.create_user(username="admin", password="StrongPass123", is_staff=True)
+    client.force_authenticate(admin)
+    response = client.get("/api/nutrition/admin/traces/?limit=5")
+
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["traces"][0]["user_id"] == user.pk
+    assert {"total", "tdee", "filter", "select_plan.llm"} <= set(payload["stages"])
@@ -0,0 +1,62 @@
+from apps.nutrition.llm_provider import OpenAIProvider
+from apps.nutrition.prompt_encoding import TABLE_COLUMNS, encode_items, encode_row, estimate_tokens
+
+TARGETS = {"calories": 2000, "protein": 120, "fat": 60, "carbs": 240}
+
+
+def _item(item_id, kcal, protein=30.0, **extra):
+    return {
+        "id": item_id,
+        "title": f"Блюдо {item_id}",
+        "kcal": kcal,
+        "protein": protein,
+        "fat": 15.0,
+        "carbs": 60.0,
+        "tags": [],
+        "price": 300,
+        **extra,
+    }
+
+
+def test_estimate_tokens_counts_cyrillic_denser_than_latin():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("калорийность") > estimate_tokens("calorieslist")
+    assert estimate_tokens("a\nb") == estimate_tokens("a b") + 1
+
+
+def test_encode_row_is_compact_and_escapes_separator():
+    row = encode_row(_item(7, 512.4, protein=31.25, title="Боул | с тофу", tags=["веган", "хит"], price=None))
+    assert row == "7|Боул / с тофу|512|31|15|60||веган,хит"
+
+
+def test_items_are_added_in_score_order_until_budget():
+    items = [_item(1, 1500), _item(2, 480), _item(3, 900), _item(4, 520)]
+
+    everything = encode_items(items, TARGETS, token_budget=10_000, max_items=10)
+    assert everything.lines[0] == f"Блюда ({TABLE_COLUMNS}):"
+    assert everything.item_ids == [2, 4, 3, 1]
+
+    tight = encode_items(items, TARGETS, token_budget=everything.tokens - 1, max_items=10)
+    assert tight.item_ids == [2, 4, 3]
+    assert tight.dropped == 1
+    assert tight.tokens <= everything.tokens - 1
+
+
+def test_compact_prompt_is_smaller_than_verbose():
+    context = {
+        "targets": TARGETS,
+        "items": [_item(idx, 300 + idx * 7, tags=["фитнес"]) for idx in range(1, 41)],
+        "restrictions": {"allergies": ["орехи"], "exclusions": []},
+    }
+    compact = OpenAIProvider(config={})
+    verbose = OpenAIProvider(config={"NUTRIBOT_PROMPT_FORMAT": "verbose"})
+
+    compact_prompt = compact._build_user_prompt(context)
+    verbose_prompt = verbose._build_user_prompt(context)
+
+    assert "Аллергии: орехи." in compact_prompt
+    assert compact_prompt.count("|фитнес") == 40
+    assert estimate_tokens(compact_prompt) < estimate_tokens(verbose_prompt) * 0.75
+
+    budgeted = OpenAIProvider(config={"NUTRIBOT_PROMPT_TOKEN_BUDGET": "400"})._build_user_prompt(context)
+    assert 0 < budgeted.count("|фитнес") < 40
@@ -0,0 +1,232 @@
+"""Lightweight tracing for the menu planner pipeline.
+
+A trace is opened with :func:`planner_trace` around one plan generation and
+collects flat, dotted-name spans (``select_plan.llm``) with wall-clock
+durations and small attributes: candidate counts, LLM attempts, the fallback
+strategy. Code deeper in the pipeline calls :func:`span` and
+:func:`annotate`, which are no-ops when no trace is active, so the
+instrumentation costs a ``ContextVar`` lookup outside a trace and a few
+``perf_counter`` calls inside one.
+
+Finished traces go to a per-process ring buffer (``PLANNER_TRACE_BUFFER``),
+exposed with per-stage percentiles by the admin endpoint in ``views.py``,
+and to the ``apps.nutrition.trace`` logger as one JSON record: INFO for
+traces slower than ``PLANNER_TRACE_SLOW_MS``, DEBUG otherwise. With several
+workers each process keeps its own buffer; the log is the complete stream.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger("apps.nutrition.trace")
+
+DEFAULT_BUFFER_SIZE = 500
+DEFAULT_SLOW_MS = 2000
+
+
+@dataclass
+class Span:
+    name: str
+    started: float
+    duration_ms: float = 0.0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "ms": round(self.duration_ms, 2), **self.attrs}
+
+
+@dataclass
+class PlannerTrace:
+    name: str
+    started_at: float = field(default_factory=time.time)
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    spans: List[Span] = field(default_factory=list)
+    duration_ms: float = 0.0
+    error: Optional[str] = None
+    _stack: List[Span] = field(default_factory=list, repr=False)
+
+    def as_dict(self) -> Dict[str, Any]:
+        payload = {
+            "name": self.name,
+            "started_at": round(self.started_at, 3),
+            "ms": round(self.duration_ms, 2),
+            **self.attrs,
+            "spans": [s.as_dict() for s in self.spans],
+        }
+        if self.error:
+            payload["error"] = self.error
+        return payload
+
+
+_current: ContextVar[Optional[PlannerTrace]] = ContextVar("planner_trace", default=None)
+_buffer: Deque[PlannerTrace] = deque(maxlen=DEFAULT_BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+
+
+def _buffer_size() -> int:
+    try:
+        return max(1, int(getattr(settings, "PLANNER_TRACE_BUFFER", DEFAULT_BUFFER_SIZE)))
+    except (TypeError, ValueError):
+        return DEFAULT_BUFFER_SIZE
+
+
+def _record(trace: PlannerTrace) -> None:
+    global _buffer
+    size = _buffer_size()
+    with _buffer_lock:
+        if _buffer.maxlen != size:
+            _buffer = deque(_buffer, maxlen=size)
+        _buffer.append(trace)
+
+    slow_ms = float(getattr(settings, "PLANNER_TRACE_SLOW_MS", DEFAULT_SLOW_MS))
+    level = logging.INFO if trace.duration_ms >= slow_ms or trace.error else logging.DEBUG
+    if logger.isEnabledFor(level):
+        record = trace.as_dict()
+        logger.log(level, "planner.trace %s", json.dumps(record, ensure_ascii=False, default=str),
+                   extra={"trace": record})
+
+
+def current_trace() -> Optional[PlannerTrace]:
+    return _current.get()
+
+
+@contextmanager
+def planner_trace(name: str, **attrs: Any) -> Iterator[PlannerTrace]:
+    """
+    Open a trace for one plan generation.
+
+    Re-entrant: inside an active trace it only adds ``attrs`` to it, so
+    ``build_menu_for_user`` can open its own trace while callers that also
+    save the plan wrap both steps in one.
+    """
+    active = _current.get()
+    if active is not None:
+        active.attrs.update(attrs)
+        yield active
+        return
+
+    trace = PlannerTrace(name=name, attrs=dict(attrs))
+    token = _current.set(trace)
+    started = time.perf_counter()
+    try:
+        yield trace
+    except BaseException as exc:
+        trace.error = type(exc).__name__
+        raise
+    finally:
+        trace.duration_ms = (time.perf_counter() - started) * 1000
+        _current.reset(token)
+        _record(trace)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _SpanContext:
+    __slots__ = ("trace", "span")
+
+    def __init__(self, trace: PlannerTrace, name: str, attrs: Dict[str, Any]):
+        if trace._stack:
+            name = f"{trace._stack[-1].name}.{name}"
+        self.trace = trace
+        self.span = Span(name=name, started=0.0, attrs=attrs)
+
+    def __enter__(self) -> Span:
+        self.trace.spans.append(self.span)
+        self.trace._stack.append(self.span)
+        self.span.started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration_ms = (time.perf_counter() - self.span.started) * 1000
+        if exc_type is not None:
+            self.span.attrs["error"] = exc_type.__name__
+        self.trace._stack.pop()
+        return False
+
+
+def span(name: str, **attrs: Any):
+    """Time a stage of the active trace; nested spans get dotted names."""
+    trace = _current.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _SpanContext(trace, name, attrs)
+
+
+def annotate(**attrs: Any) -> None:
+    """Attach attributes to the innermost open span (or the trace itself)."""
+    trace = _current.get()
+    if trace is None:
+        return
+    target = trace._stack[-1].attrs if trace._stack else trace.attrs
+    target.update(attrs)
+
+
+def recent_traces(limit: int = 50) -> List[Dict[str, Any]]:
+    with _buffer_lock:
+        traces = list(_buffer)[-limit:] if limit > 0 else []
+    return [t.as_dict() for t in reversed(traces)]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 2)
+
+
+def stage_summary() -> Dict[str, Dict[str, Any]]:
+    """Count and p50/p95/p99 milliseconds per stage over the buffered traces."""
+    with _buffer_lock:
+        traces = list(_buffer)
+    durations: Dict[str, List[float]] = {}
+    for trace in traces:
+        durations.setdefault("total", []).append(trace.duration_ms)
+        for s in trace.spans:
+            durations.setdefault(s.name, []).append(s.duration_ms)
+
+    summary: Dict[str, Dict[str, Any]] = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = {
+            "count": len(values),
+            "p50_ms": _percentile(values, 0.50),
+            "p95_ms": _percentile(values, 0.95),
+            "p99_ms": _percentile(values, 0.99),
+            "max_ms": round(values[-1], 2),
+        }
+    return summary
+
+
+def clear_traces() -> None:
+    with _buffer_lock:
+        _buffer.clear()
+
+
+__all__ = [
+    "PlannerTrace",
+    "Span",
+    "annotate",
+    "clear_traces",
+    "current_trace",
+    "planner_trace",
+    "recent_traces",
+    "span",
+    "stage_summary",
+]
@@ -1,15 +1,24 @@
-from datetime import datetime
+import json
+from datetime import date, datetime
 
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import status as drf_status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
 from apps.catalog.models import MenuItem
+from apps.common.query_budget import query_budget
 
+from .degraded_mode import get_degraded_controller
+from .llm_governor import get_governor
+from .llm_provider import get_provider
 from .models import MenuPlan
-from .planner import build_menu_for_user
+from .plan_library import library_stats
+from .planner import build_menu_for_user, stream_menu_for_user
+from .singleflight import get_single_flight, plan_generation_key
+from .tracing import planner_trace, recent_traces, stage_summary
 
 
 def _serialize_meal(meal):
@@ -69,24 +78,95 @@ def serialize_menu_plan(plan):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def generate_menu(request):
-    data = build_menu_for_user(request.user)
-    plan = MenuPlan.create_from_payload(user=request.user, payload=data)
-
-    payload = dict(data)
-    payload.update(
-        {
-            "id": plan.id,
-            "plan_id": plan.id,
-            "status": plan.status,
-            "status_display": plan.get_status_display(),
-            "date": plan.date.isoformat(),
-            "created_at": plan.created_at.isoformat(),
+    user = request.user
+
+    def generate():
+        with planner_trace("generate_menu"):
+            data = build_menu_for_user(user)
+            plan = MenuPlan.create_from_payload(user=user, payload=data)
+
+        payload = dict(data)
+        payload.update(
+            {
+                "plan_id": plan.id,
+                "status": plan.status,
+                "status_display": plan.get_status_display(),
+                "date": plan.date.isoformat(),
+                "created_at": plan.created_at.isoformat(),
+            }
+        )
+        return payload
+
+    # Двойное нажатие «Сгенерировать» ждёт первый запрос и получает тот же план.
+    payload, shared = get_single_flight().do(plan_generation_key(user, date.today()), generate)
+    # Ключ общий с ботом, поэтому id добавляем уже после.
+    response = Response({**payload, "id": payload["plan_id"]})
+    if shared:
+        response["X-Plan-Coalesced"] = "1"
+    return response
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def generate_menu_stream(request):
+    """
+    То же, что generate_menu, но server-sent events: сразу ``targets``, затем
+    ``meal`` на каждое блюдо по мере ответа LLM и ``done`` с сохранённым планом.
+
+    Ключ single-flight общий с generate_menu: дубль, пришедший во время
+    генерации, не зовёт LLM, а получает готовый план лидера одним куском.
+    """
+    user = request.user
+
+    def generate():
+        with planner_trace("generate_menu", stream=True):
+            targets, streamed = stream_menu_for_user(user)
+            yield _sse("targets", targets)
+            plan = []
+            for entry in streamed:
+                plan.append(entry)
+                yield _sse("meal", entry)
+            payload = {"targets": targets, "plan": plan, "provider": streamed.provider}
+            menu_plan = MenuPlan.create_from_payload(user=user, payload=payload)
+        return {
+            **payload,
+            "plan_id": menu_plan.id,
+            "status": menu_plan.status,
+            "status_display": menu_plan.get_status_display(),
+            "date": menu_plan.date.isoformat(),
+            "created_at": menu_plan.created_at.isoformat(),
         }
-    )
 
-    return Response(payload)
+    def events():
+        flight = get_single_flight().stream(plan_generation_key(user, date.today()), generate)
+        payload, shared = yield from flight
+        if shared:
+            yield _sse("targets", payload["targets"])
+            for entry in payload["plan"]:
+                yield _sse("meal", entry)
+        yield _sse(
+            "done",
+            {
+                "id": payload["plan_id"],
+                "plan_id": payload["plan_id"],
+                "status": payload["status"],
+                "status_display": payload["status_display"],
+                "date": payload["date"],
+                "created_at": payload["created_at"],
+            },
+        )
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx не должен копить события
+    return response
 
 
+@query_budget(5)
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def list_menu_plans(request):
@@ -207,6 +287,36 @@ def update_plan_meal(request, plan_id: int, meal_id: int):
     return Response(serialize_menu_plan(refreshed_plan))
 
 
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def planner_traces(request):
+    """Последние трассировки планировщика этого процесса и перцентили по стадиям."""
+    try:
+        limit = int(request.query_params.get("limit", "50"))
+    except (TypeError, ValueError):
+        limit = 50
+    limit = max(0, min(limit, 500))
+    payload = {
+        "stages": stage_summary(),
+        "traces": recent_traces(limit),
+        "plan_library": library_stats(),
+        "llm_governor": get_governor().stats(),
+    }
+    latency_stats = getattr(get_provider(), "latency_stats", None)
+    if latency_stats is not None:
+        payload["providers"] = latency_stats()
+    return Response(payload)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def health(request):
+    """Режим планировщика этого процесса: ``degraded`` — планы без LLM до восстановления."""
+    controller = get_degraded_controller()
+    planner = controller.as_dict() if controller is not None else {"enabled": False, "state": "normal"}
+    return Response({"status": "degraded" if planner["state"] == "degraded" else "ok", "planner": planner})
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def ping(request):
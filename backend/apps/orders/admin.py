@@ -16,7 +16,7 @@ class DeliveryServiceAdmin(admin.ModelAdmin):
 
 @admin.register(DeliveryWindow)
 class DeliveryWindowAdmin(admin.ModelAdmin):
-    list_display = ("service", "city", "start_time", "end_time", "is_default")
+    list_display = ("service", "city", "start_time", "end_time", "capacity", "is_default")
     list_filter = ("city", "service", "is_default")
 
 class OrderItemInline(admin.TabularInline):
@@ -63,7 +63,7 @@ class WalletTransactionAdmin(admin.ModelAdmin):
 
 @admin.register(IntegrationWebhookEvent)
 class IntegrationWebhookEventAdmin(admin.ModelAdmin):
-    list_display = ("id", "source", "event_type", "status",
+    list_display = ("id", "source", "delivery_service", "event_type", "status",
                     "external_event_id", "received_at", "processed_at")
     list_filter = ("source", "status", "received_at")
     search_fields = ("external_event_id", "event_type")
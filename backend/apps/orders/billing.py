@@ -0,0 +1,312 @@
+"""Recurring billing of meal subscriptions.
+
+Celery beat calls :func:`drain_billing_queue` periodically. Each batch claims
+due subscriptions (``next_billing_at <= now``) with ``SELECT ... FOR UPDATE
+SKIP LOCKED``, so several workers split the queue between them. Everything
+a batch does — orders, payment attempts, wallet debits and advancing the
+billing period — is committed together: a worker that dies mid-batch leaves
+the subscriptions due, and the next run bills them exactly once.
+"""
+from __future__ import annotations
+
+import calendar
+import logging
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MealSubscription, Order, PaymentAttempt, SubscriptionPlan, WalletTransaction
+from .services import (
+    InsufficientFundsError,
+    _apply_balance_deltas,
+    _normalize_amount,
+    _quant_for_currency,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+
+_WALLET_PROVIDERS = {
+    Order.Currency.CALOCOIN: PaymentAttempt.Provider.CALOCOIN,
+    Order.Currency.TELEGRAM_STARS: PaymentAttempt.Provider.TELEGRAM_STARS,
+}
+
+
+@dataclass
+class BillingResult:
+    claimed: int = 0
+    billed: int = 0
+    paid: int = 0
+    payment_failed: int = 0
+    awaiting_payment: int = 0
+    skipped: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+def _add_months(value, months: int):
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def add_billing_period(value, billing_period: str):
+    """Shift a date or datetime by one billing period of the plan."""
+    if billing_period == SubscriptionPlan.BillingPeriod.MONTHLY:
+        return _add_months(value, 1)
+    if billing_period == SubscriptionPlan.BillingPeriod.QUARTERLY:
+        return _add_months(value, 3)
+    return value + timedelta(days=7)
+
+
+def _plan_charge(plan: SubscriptionPlan, *, autopay: bool) -> Tuple[str, Decimal] | None:
+    """Pick the currency to bill in: wallet currencies first for autopay, roubles otherwise."""
+    prices = {
+        Order.Currency.CALOCOIN: plan.price_calocoin,
+        Order.Currency.TELEGRAM_STARS: plan.price_telegram_stars,
+        Order.Currency.RUB: plan.price_rub,
+    }
+    if autopay:
+        order = (Order.Currency.CALOCOIN, Order.Currency.TELEGRAM_STARS, Order.Currency.RUB)
+    else:
+        order = (Order.Currency.RUB, Order.Currency.CALOCOIN, Order.Currency.TELEGRAM_STARS)
+    for currency in order:
+        price = prices[currency]
+        if price:
+            return currency, _normalize_amount(currency, price)
+    return None
+
+
+def _next_period(subscription: MealSubscription) -> Tuple[date, date]:
+    period = subscription.plan.billing_period
+    if subscription.current_period_end:
+        start = subscription.current_period_end + timedelta(days=1)
+    else:
+        start = timezone.localdate(subscription.next_billing_at)
+    return start, add_billing_period(start, period) - timedelta(days=1)
+
+
+def _debit_wallets(
+        charges: List[Tuple[MealSubscription, str, Decimal]],
+) -> Dict[int, Tuple[Decimal, Decimal]]:
+    """
+    Debit autopay charges, one conditional UPDATE per profile where possible.
+
+    All charges of a profile are tried together first; if the wallet cannot
+    cover the sum, each charge is retried alone so that affordable ones still
+    go through. Returns ``{subscription_id: (balance_before, balance_after)}``
+    for successful debits.
+    """
+    by_profile: Dict[int, List[Tuple[MealSubscription, str, Decimal]]] = {}
+    for charge in charges:
+        by_profile.setdefault(charge[0].profile_id, []).append(charge)
+
+    debited: Dict[int, Tuple[Decimal, Decimal]] = {}
+    for profile_charges in by_profile.values():
+        profile = profile_charges[0][0].profile
+        deltas: Dict[str, Decimal] = {}
+        for _, currency, amount in profile_charges:
+            deltas[currency] = deltas.get(currency, Decimal("0")) - amount
+        try:
+            balances = _apply_balance_deltas(profile, deltas)
+        except InsufficientFundsError:
+            for subscription, currency, amount in profile_charges:
+                try:
+                    debited[subscription.pk] = _apply_balance_deltas(profile, {currency: -amount})[currency]
+                except InsufficientFundsError:
+                    continue
+            continue
+
+        running = {currency: before for currency, (before, _) in balances.items()}
+        for subscription, currency, amount in profile_charges:
+            before = running[currency]
+            running[currency] = before - amount
+            debited[subscription.pk] = (before, before - amount)
+    return debited
+
+
+def bill_due_subscriptions(*, batch_size: int = DEFAULT_BATCH_SIZE, now=None) -> BillingResult:
+    """
+    Claim up to ``batch_size`` due subscriptions and bill one period for each.
+
+    A subscription that is several periods behind is billed one period per
+    claim and stays due until it catches up.
+    """
+    result = BillingResult()
+    now = now or timezone.now()
+    with transaction.atomic():
+        subscriptions = list(
+            MealSubscription.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(status=MealSubscription.Status.ACTIVE, next_billing_at__lte=now)
+            .select_related("plan", "profile")
+            .order_by("next_billing_at", "id")[:batch_size]
+        )
+        result.claimed = len(subscriptions)
+        if not subscriptions:
+            return result
+
+        billable: List[Tuple[MealSubscription, str, Decimal, date, date]] = []
+        for subscription in subscriptions:
+            charge = _plan_charge(subscription.plan, autopay=subscription.autopay_enabled)
+            if charge is None:
+                # Без цены списывать нечего: снимаем подписку с расписания, чтобы не крутить её вечно.
+                subscription.next_billing_at = None
+                subscription.metadata = {**subscription.metadata, "billing_error": "plan has no price"}
+                subscription.updated_at = now
+                result.skipped += 1
+                continue
+            billable.append((subscription, *charge, *_next_period(subscription)))
+
+        debited = _debit_wallets(
+            [
+                (subscription, currency, amount)
+                for subscription, currency, amount, _, _ in billable
+                if subscription.autopay_enabled and currency in _WALLET_PROVIDERS
+            ]
+        )
+
+        orders: List[Order] = []
+        for subscription, currency, amount, period_start, period_end in billable:
+            if subscription.pk in debited:
+                status = Order.Status.PAID
+            elif subscription.autopay_enabled and currency in _WALLET_PROVIDERS:
+                status = Order.Status.PAYMENT_FAILED
+            else:
+                status = Order.Status.PENDING_PAYMENT
+            plan = subscription.plan
+            orders.append(
+                Order(
+                    user_id=subscription.user_id,
+                    profile_id=subscription.profile_id,
+                    title=f"{plan.name}: {period_start:%d.%m}–{period_end:%d.%m}",
+                    kind=Order.Kind.MEAL_SUBSCRIPTION,
+                    subscription=subscription,
+                    status=status,
+                    delivery_service_id=plan.delivery_service_id,
+                    delivery_window_id=(
+                        subscription.preferred_delivery_window_id or plan.default_delivery_window_id
+                    ),
+                    city=subscription.city,
+                    total_price=amount,
+                    currency=currency,
+                    wallet_currency=currency if status == Order.Status.PAID else None,
+                    paid_at=now if status == Order.Status.PAID else None,
+                    reference=f"sub-{subscription.pk}-{period_start:%Y%m%d}",
+                    metadata={
+                        "period_start": period_start.isoformat(),
+                        "period_end": period_end.isoformat(),
+                    },
+                )
+            )
+        Order.objects.bulk_create(orders)
+
+        ledger: List[WalletTransaction] = []
+        for (subscription, currency, amount, _, _), order in zip(billable, orders):
+            if subscription.pk not in debited:
+                continue
+            quant = _quant_for_currency(currency)
+            before, after = debited[subscription.pk]
+            ledger.append(
+                WalletTransaction(
+                    profile_id=subscription.profile_id,
+                    currency=currency,
+                    direction=WalletTransaction.Direction.DEBIT,
+                    amount=amount,
+                    balance_before=before.quantize(quant),
+                    balance_after=after.quantize(quant),
+                    description=f"Автосписание по подписке #{subscription.pk}",
+                    reference=order.reference,
+                    metadata={"order_id": order.pk, "subscription_id": subscription.pk},
+                    related_order=order,
+                )
+            )
+        WalletTransaction.objects.bulk_create(ledger)
+        ledger_by_order = {tx.related_order_id: tx for tx in ledger}
+
+        attempts: List[PaymentAttempt] = []
+        for (subscription, currency, amount, _, _), order in zip(billable, orders):
+            attempt = PaymentAttempt(
+                order=order,
+                subscription=subscription,
+                provider=_WALLET_PROVIDERS.get(currency, PaymentAttempt.Provider.CARD),
+                amount=amount,
+                currency=currency,
+            )
+            tx = ledger_by_order.get(order.pk)
+            if tx is not None:
+                attempt.status = PaymentAttempt.Status.SUCCEEDED
+                attempt.wallet_transaction = tx
+                attempt.processed_at = now
+                order.payment_transaction = tx
+                result.paid += 1
+            elif order.status == Order.Status.PAYMENT_FAILED:
+                attempt.status = PaymentAttempt.Status.FAILED
+                attempt.failure_code = "insufficient_funds"
+                attempt.failure_reason = "Недостаточно средств для автосписания"
+                attempt.processed_at = now
+                result.payment_failed += 1
+            else:
+                result.awaiting_payment += 1
+            attempts.append(attempt)
+        PaymentAttempt.objects.bulk_create(attempts)
+        if ledger:
+            Order.objects.bulk_update(
+                [order for order in orders if order.payment_transaction_id], ["payment_transaction"]
+            )
+
+        for subscription, _, _, period_start, period_end in billable:
+            subscription.current_period_start = period_start
+            subscription.current_period_end = period_end
+            subscription.next_billing_at = add_billing_period(
+                subscription.next_billing_at, subscription.plan.billing_period
+            )
+            subscription.updated_at = now
+        MealSubscription.objects.bulk_update(
+            subscriptions,
+            ["current_period_start", "current_period_end", "next_billing_at", "metadata", "updated_at"],
+        )
+
+    result.billed = len(billable)
+    return result
+
+
+def drain_billing_queue(
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_batches: int = 50,
+        now=None,
+) -> Dict[str, float]:
+    """Bill batches until nothing is due or ``max_batches`` is reached; reports throughput."""
+    totals = BillingResult()
+    started = time.perf_counter()
+    for _ in range(max(1, max_batches)):
+        batch = bill_due_subscriptions(batch_size=batch_size, now=now)
+        for key, value in batch.as_dict().items():
+            setattr(totals, key, getattr(totals, key) + value)
+        if batch.claimed < batch_size:
+            break
+    elapsed = time.perf_counter() - started
+
+    report: Dict[str, float] = dict(totals.as_dict())
+    report["elapsed"] = round(elapsed, 3)
+    report["billed_per_second"] = round(totals.billed / elapsed, 1) if elapsed and totals.billed else 0.0
+    if totals.claimed:
+        logger.info("Subscription billing finished: %s", report)
+    return report
+
+
+__all__ = [
+    "BillingResult",
+    "add_billing_period",
+    "bill_due_subscriptions",
+    "drain_billing_queue",
+]
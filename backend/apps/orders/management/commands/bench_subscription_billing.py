@@ -0,0 +1,139 @@
+"""Throughput benchmark for the subscription billing runner."""
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from apps.orders.billing import drain_billing_queue
+from apps.orders.models import (
+    DeliveryService,
+    MealSubscription,
+    Order,
+    PaymentAttempt,
+    SubscriptionPlan,
+    WalletTransaction,
+)
+from apps.orders.services import wallet_topup
+
+
+class Command(BaseCommand):
+    help = (
+        "Create many due subscriptions, bill them from several workers at once and "
+        "report subscriptions billed per second and double-billing checks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscriptions", type=int, default=500)
+        parser.add_argument("--users", type=int, default=100, help="Profiles the subscriptions belong to.")
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent billing workers.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-retries", type=int, default=20)
+        parser.add_argument("--keep", action="store_true", help="Do not delete benchmark data.")
+
+    def handle(self, *args, **options):
+        total = max(1, options["subscriptions"])
+        users_count = max(1, min(options["users"], total))
+        workers = max(1, options["workers"])
+        batch_size = max(1, options["batch_size"])
+        max_retries = max(0, options["max_retries"])
+
+        tag = uuid.uuid4().hex[:8]
+        city = f"bench-{tag}"
+        service = DeliveryService.objects.create(slug=f"bench-{tag}", name="Bench", city=city)
+        plan = SubscriptionPlan.objects.create(
+            slug=f"bench-{tag}",
+            name="Bench plan",
+            city=city,
+            delivery_service=service,
+            price_calocoin=Decimal("10.00"),
+        )
+        User = get_user_model()
+        users = [User.objects.create_user(username=f"bench_billing_{tag}_{idx}") for idx in range(users_count)]
+        for idx, user in enumerate(users):
+            # Каждому пятому не хватит денег — проверяем и ветку неуспешного списания.
+            if idx % 5:
+                wallet_topup(user.profile, currency=WalletTransaction.Currency.CALOCOIN, amount=10 * total)
+
+        due_at = timezone.now() - timedelta(minutes=1)
+        MealSubscription.objects.bulk_create(
+            [
+                MealSubscription(
+                    user=users[idx % users_count],
+                    profile=users[idx % users_count].profile,
+                    plan=plan,
+                    status=MealSubscription.Status.ACTIVE,
+                    city=city,
+                    next_billing_at=due_at,
+                )
+                for idx in range(total)
+            ]
+        )
+
+        stats = {"retries": 0, "failures": 0}
+        lock = threading.Lock()
+
+        def run() -> None:
+            retries = failures = 0
+            try:
+                while True:
+                    for attempt in range(max_retries + 1):
+                        try:
+                            report = drain_billing_queue(batch_size=batch_size, max_batches=1)
+                        except OperationalError:
+                            retries += 1
+                            time.sleep(0.001 * (attempt + 1))
+                            continue
+                        break
+                    else:
+                        failures += 1
+                        return
+                    if report["claimed"] < batch_size:
+                        return
+            finally:
+                connection.close()
+                with lock:
+                    stats["retries"] += retries
+                    stats["failures"] += failures
+
+        threads = [threading.Thread(target=run) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        subscriptions = MealSubscription.objects.filter(plan=plan)
+        orders = Order.objects.filter(subscription__plan=plan)
+        billed = orders.count()
+        paid = orders.filter(status=Order.Status.PAID).count()
+        attempts = PaymentAttempt.objects.filter(subscription__plan=plan).count()
+        still_due = subscriptions.filter(next_billing_at__lte=due_at).count()
+
+        self.stdout.write(
+            f"backend={connection.vendor} workers={workers} subscriptions={total} batch={batch_size}"
+        )
+        self.stdout.write(
+            f"billed={billed} paid={paid} elapsed={elapsed:.3f}s "
+            f"throughput={billed / elapsed if elapsed else 0:.1f} subscriptions/s"
+        )
+        self.stdout.write(f"retries={stats['retries']} failures={stats['failures']}")
+
+        if not options["keep"]:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            plan.delete()
+            service.delete()
+
+        if billed != total or attempts != total or still_due:
+            raise CommandError(
+                f"Billing mismatch: orders={billed} attempts={attempts} expected={total} still_due={still_due}"
+            )
+        self.stdout.write(self.style.SUCCESS("Every subscription was billed exactly once"))
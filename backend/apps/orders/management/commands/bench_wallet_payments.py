@@ -0,0 +1,170 @@
+"""Contention benchmark for wallet payments of a single profile."""
+from __future__ import annotations
+
+import statistics
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from apps.orders.models import Order, WalletTransaction
+from apps.orders.services import (
+    OrderPaymentConflict,
+    pay_order_from_wallet,
+    pay_orders_from_wallet,
+    wallet_topup,
+)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Pay many orders of one profile from several threads at once and report "
+        "throughput, latency percentiles, lock retries and ledger consistency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="Concurrent payer threads.")
+        parser.add_argument("--orders", type=int, default=400, help="Orders to create and pay.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1,
+            help="Orders per pay_orders_from_wallet call (1 uses pay_order_from_wallet).",
+        )
+        parser.add_argument(
+            "--topup-every",
+            type=int,
+            default=5,
+            help="Interleave a top-up every N payment calls (0 disables).",
+        )
+        parser.add_argument("--max-retries", type=int, default=20)
+        parser.add_argument("--keep", action="store_true", help="Do not delete benchmark data.")
+
+    def handle(self, *args, **options):
+        threads = max(1, options["threads"])
+        total_orders = max(1, options["orders"])
+        batch_size = max(1, options["batch_size"])
+        topup_every = max(0, options["topup_every"])
+        max_retries = max(0, options["max_retries"])
+
+        User = get_user_model()
+        user = User.objects.create_user(username=f"bench_wallet_{uuid.uuid4().hex[:10]}")
+        profile = user.profile
+        initial = Decimal(total_orders)
+        wallet_topup(profile, currency=WalletTransaction.Currency.CALOCOIN, amount=initial)
+        orders = Order.objects.bulk_create(
+            [
+                Order(
+                    user=user,
+                    profile=profile,
+                    title=f"bench #{idx}",
+                    currency=Order.Currency.CALOCOIN,
+                    total_price=Decimal("1.00"),
+                    status=Order.Status.PENDING_PAYMENT,
+                )
+                for idx in range(total_orders)
+            ]
+        )
+        order_ids = [order.pk for order in orders]
+        chunks = [order_ids[idx: idx + batch_size] for idx in range(0, len(order_ids), batch_size)]
+        # Чередуем владельцев чанков, чтобы потоки конкурировали за один и тот же профиль.
+        per_thread = [chunks[idx::threads] for idx in range(threads)]
+
+        latencies: list[float] = []
+        stats = {"retries": 0, "failures": 0, "conflicts": 0, "topups": 0}
+        lock = threading.Lock()
+
+        def run(thread_chunks: list[list[int]]) -> None:
+            local_latencies: list[float] = []
+            local = {"retries": 0, "failures": 0, "conflicts": 0, "topups": 0}
+            try:
+                for call_no, chunk in enumerate(thread_chunks, start=1):
+                    for attempt in range(max_retries + 1):
+                        started = time.perf_counter()
+                        try:
+                            if batch_size == 1:
+                                pay_order_from_wallet(Order.objects.get(pk=chunk[0]))
+                            else:
+                                pay_orders_from_wallet(chunk)
+                        except OperationalError:
+                            local["retries"] += 1
+                            time.sleep(0.001 * (attempt + 1))
+                            continue
+                        except OrderPaymentConflict:
+                            local["conflicts"] += 1
+                            continue
+                        local_latencies.append(time.perf_counter() - started)
+                        break
+                    else:
+                        local["failures"] += 1
+
+                    if topup_every and call_no % topup_every == 0:
+                        try:
+                            wallet_topup(profile, currency=WalletTransaction.Currency.CALOCOIN, amount=1)
+                            local["topups"] += 1
+                        except OperationalError:
+                            local["retries"] += 1
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local_latencies)
+                    for key, value in local.items():
+                        stats[key] += value
+
+        workers = [threading.Thread(target=run, args=(chunk_set,)) for chunk_set in per_thread]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        paid = Order.objects.filter(pk__in=order_ids, status=Order.Status.PAID).count()
+        debits = WalletTransaction.objects.filter(
+            profile=profile, direction=WalletTransaction.Direction.DEBIT
+        ).count()
+        profile.refresh_from_db()
+        expected_balance = initial + stats["topups"] - paid
+        consistent = paid == debits and profile.calocoin_balance == expected_balance
+
+        self.stdout.write(
+            f"backend={connection.vendor} threads={threads} orders={total_orders} batch={batch_size}"
+        )
+        self.stdout.write(
+            f"paid={paid} calls={len(latencies)} elapsed={elapsed:.3f}s "
+            f"throughput={paid / elapsed if elapsed else 0:.1f} orders/s"
+        )
+        if latencies:
+            self.stdout.write(
+                "latency ms: "
+                f"mean={statistics.fmean(latencies) * 1000:.2f} "
+                f"p50={_percentile(latencies, 50) * 1000:.2f} "
+                f"p95={_percentile(latencies, 95) * 1000:.2f} "
+                f"p99={_percentile(latencies, 99) * 1000:.2f}"
+            )
+        self.stdout.write(
+            f"retries={stats['retries']} conflicts={stats['conflicts']} "
+            f"failures={stats['failures']} topups={stats['topups']}"
+        )
+
+        if not options["keep"]:
+            user.delete()
+
+        if not consistent:
+            raise CommandError(
+                f"Ledger mismatch: paid={paid} debits={debits} "
+                f"balance={profile.calocoin_balance} expected={expected_balance}"
+            )
+        self.stdout.write(self.style.SUCCESS("Ledger is consistent"))
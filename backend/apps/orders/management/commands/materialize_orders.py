@@ -0,0 +1,41 @@
+"""Build delivery orders from accepted subscription menu plans."""
+from __future__ import annotations
+
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.orders.materializer import DEFAULT_CHUNK_SIZE, MaterializeResult, materialize_subscription_orders
+
+
+class Command(BaseCommand):
+    help = "Materialize orders for active subscriptions whose accepted menu plan is for the given date"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Plan date in YYYY-MM-DD (defaults to tomorrow).")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        plan_date = None
+        if options["date"]:
+            try:
+                plan_date = date.fromisoformat(options["date"])
+            except ValueError as exc:
+                raise CommandError(f"Invalid --date: {exc}") from exc
+
+        started = time.perf_counter()
+
+        def report(done: int, total: int, result: MaterializeResult) -> None:
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{done}/{total} subscriptions, orders={result.orders_created} "
+                f"items={result.items_created} ({done / elapsed if elapsed else 0:.1f}/s)"
+            )
+
+        result = materialize_subscription_orders(
+            plan_date=plan_date,
+            chunk_size=max(1, options["chunk_size"]),
+            progress=report,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Done: {result.as_dict()}"))
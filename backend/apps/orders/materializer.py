@@ -0,0 +1,291 @@
+"""Turn accepted menu plans into delivery orders.
+
+:func:`materialize_plans` is the bulk core: one joined query snapshots every
+meal of the given plans together with its price and nutrients, then orders and
+order items are written with two ``bulk_create`` calls.
+:func:`materialize_subscription_orders` drives it for the nightly run — active
+subscriptions are walked by primary key in chunks, each chunk is claimed with
+``SKIP LOCKED`` and committed on its own, so parallel or restarted runs pick
+up where the previous one stopped.
+
+Subscription plans become paid orders only when the billing payment of the
+period that covers the plan date has succeeded; the rest are left for a later
+run and reported as ``unpaid``.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Set, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.nutrition.models import MenuPlan, PlanMeal
+
+from .models import MealSubscription, Order, OrderItem, PaymentAttempt
+from .slots import release_slots_for_orders
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 200
+NUTRIENT_FIELDS = ("calories", "protein", "fat", "carbs", "fiber", "sodium")
+
+_CENT = Decimal("0.01")
+_MEAL_VALUES = (
+    "id",
+    "plan_id",
+    "qty",
+    "time_hint",
+    "user_note",
+    "item_id",
+    "item__title",
+    "item__price",
+    *(f"item__nutrients__{field}" for field in NUTRIENT_FIELDS),
+)
+
+
+@dataclass
+class MaterializeResult:
+    plans: int = 0
+    orders_created: int = 0
+    items_created: int = 0
+    skipped: int = 0
+    unpaid: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+def _load_meals(plan_ids: Sequence[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """Meals of ``plan_ids`` with item price and nutrients, in a single joined query."""
+    meals: Dict[int, List[Dict[str, Any]]] = {plan_id: [] for plan_id in plan_ids}
+    rows = PlanMeal.objects.filter(plan_id__in=plan_ids).order_by("plan_id", "id").values(*_MEAL_VALUES)
+    for row in rows:
+        meals[row["plan_id"]].append(row)
+    return meals
+
+
+def _build_items(order: Order, meals: List[Dict[str, Any]]) -> tuple[List[OrderItem], Dict[str, float]]:
+    items: List[OrderItem] = []
+    totals = {field: 0.0 for field in NUTRIENT_FIELDS}
+    for meal in meals:
+        quantity = Decimal(str(meal["qty"])).quantize(_CENT, rounding=ROUND_HALF_UP)
+        unit_price = Decimal(meal["item__price"] or 0).quantize(_CENT)
+        nutrients = {field: meal[f"item__nutrients__{field}"] or 0.0 for field in NUTRIENT_FIELDS}
+        for field, value in nutrients.items():
+            totals[field] += value * meal["qty"]
+        items.append(
+            OrderItem(
+                order=order,
+                plan_meal_id=meal["id"],
+                menu_item_id=meal["item_id"],
+                quantity=quantity,
+                unit_price=unit_price,
+                total_price=(unit_price * quantity).quantize(_CENT, rounding=ROUND_HALF_UP),
+                metadata={
+                    "title": meal["item__title"],
+                    "time_hint": meal["time_hint"],
+                    "note": meal["user_note"],
+                    "nutrients": nutrients,
+                },
+            )
+        )
+    return items, {field: round(value, 1) for field, value in totals.items()}
+
+
+def _period_reference(subscription: MealSubscription, day: date) -> str | None:
+    """Reference of the billing order for the current period, if that period covers ``day``."""
+    start, end = subscription.current_period_start, subscription.current_period_end
+    if not start or not end or not start <= day <= end:
+        return None
+    # Совпадает с reference заказа, который создаёт биллинг за период.
+    return f"sub-{subscription.pk}-{start:%Y%m%d}"
+
+
+def _paid_plan_ids(plans: Sequence[MenuPlan], subscriptions: Mapping[int, MealSubscription]) -> Set[int]:
+    """Plans whose subscription period is paid: its billing payment attempt has succeeded."""
+    references = {}
+    for plan in plans:
+        subscription = subscriptions.get(plan.pk)
+        reference = _period_reference(subscription, plan.date) if subscription is not None else None
+        if reference:
+            references[plan.pk] = (subscription.pk, reference)
+    if not references:
+        return set()
+    paid = set(
+        PaymentAttempt.objects.filter(
+            subscription_id__in={subscription_id for subscription_id, _ in references.values()},
+            order__reference__in={reference for _, reference in references.values()},
+            status=PaymentAttempt.Status.SUCCEEDED,
+        ).values_list("subscription_id", "order__reference")
+    )
+    return {plan_id for plan_id, key in references.items() if key in paid}
+
+
+def _materialize(
+        plans: Sequence[MenuPlan],
+        subscriptions: Mapping[int, MealSubscription],
+) -> Tuple[List[Order], List[int]]:
+    plan_ids = [plan.pk for plan in plans]
+    existing = set(
+        Order.objects.filter(menu_plan_id__in=plan_ids)
+        .exclude(status=Order.Status.CANCELLED)
+        .values_list("menu_plan_id", flat=True)
+    )
+    pending = [plan for plan in plans if plan.pk not in existing]
+    if not pending:
+        return [], []
+
+    covered = [plan for plan in pending if plan.pk in subscriptions]
+    paid = _paid_plan_ids(covered, subscriptions)
+    unpaid = [plan.pk for plan in covered if plan.pk not in paid]
+    pending = [plan for plan in pending if plan.pk not in subscriptions or plan.pk in paid]
+    if not pending:
+        return [], unpaid
+
+    standalone = [plan.pk for plan in pending if plan.pk not in subscriptions]
+    profiles = {}
+    if standalone:
+        # Профили одним запросом, а не plan.user.profile на каждый план.
+        profiles = {
+            plan.pk: plan.user.profile
+            for plan in MenuPlan.objects.filter(pk__in=standalone).select_related("user__profile")
+        }
+    meals = _load_meals([plan.pk for plan in pending])
+    now = timezone.now()
+    orders: List[Order] = []
+    items_by_order: List[List[OrderItem]] = []
+    for plan in pending:
+        subscription = subscriptions.get(plan.pk)
+        order = Order(
+            user_id=plan.user_id,
+            title=f"Меню на {plan.date:%d.%m.%Y}",
+            kind=Order.Kind.OTHER,
+            menu_plan=plan,
+            delivery_date=plan.date,
+            currency=Order.Currency.RUB,
+            status=Order.Status.PENDING_PAYMENT,
+        )
+        if subscription is not None:
+            order.kind = Order.Kind.MEAL_SUBSCRIPTION
+            order.profile_id = subscription.profile_id
+            order.subscription = subscription
+            order.status = Order.Status.PAID
+            order.paid_at = now
+            order.city = subscription.city
+            order.delivery_service_id = subscription.plan.delivery_service_id
+            order.delivery_window_id = (
+                subscription.preferred_delivery_window_id or subscription.plan.default_delivery_window_id
+            )
+        else:
+            profile = profiles[plan.pk]
+            order.profile_id = profile.pk
+            order.city = profile.city
+
+        items, nutrients = _build_items(order, meals[plan.pk])
+        order.items_count = len(items)
+        order.total_price = sum((item.total_price for item in items), Decimal("0.00"))
+        order.metadata = {"nutrients": nutrients}
+        orders.append(order)
+        items_by_order.append(items)
+
+    Order.objects.bulk_create(orders)
+    OrderItem.objects.bulk_create([item for items in items_by_order for item in items])
+    # bulk_create не шлёт post_save — сбрасываем кэш слотов сами.
+    release_slots_for_orders(orders)
+    return orders, unpaid
+
+
+def materialize_plans(
+        plans: Sequence[MenuPlan],
+        *,
+        subscriptions: Mapping[int, MealSubscription] | None = None,
+) -> List[Order]:
+    """
+    Create an order with items for every plan that does not have one yet.
+
+    ``subscriptions`` maps plan ids to the subscription that covers them: such
+    orders are paid by the subscription period and get its delivery settings,
+    but only once the period's billing payment has succeeded — until then the
+    plan is skipped. Other plans become orders awaiting payment. Must be
+    called inside ``transaction.atomic``.
+    """
+    orders, unpaid = _materialize(plans, subscriptions or {})
+    if unpaid:
+        logger.warning("Subscription period is not paid, plans skipped: %s", unpaid)
+    return orders
+
+
+def materialize_plan(plan: MenuPlan, *, subscription: MealSubscription | None = None) -> Order | None:
+    """Materialize a single plan; returns ``None`` if it already has an order."""
+    with transaction.atomic():
+        orders = materialize_plans([plan], subscriptions={plan.pk: subscription} if subscription else None)
+    return orders[0] if orders else None
+
+
+def materialize_subscription_orders(
+        *,
+        plan_date: date | None = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        progress: Callable[[int, int, MaterializeResult], None] | None = None,
+) -> MaterializeResult:
+    """
+    Build delivery orders for active subscriptions whose accepted plan is for ``plan_date``.
+
+    ``plan_date`` defaults to tomorrow. ``progress`` is called after every
+    chunk with ``(processed, total, result)``.
+    """
+    plan_date = plan_date or timezone.localdate() + timedelta(days=1)
+    base = MealSubscription.objects.filter(
+        status=MealSubscription.Status.ACTIVE,
+        current_menu_plan__date=plan_date,
+        current_menu_plan__status=MenuPlan.Status.ACCEPTED,
+    )
+    total = base.count()
+    result = MaterializeResult()
+    processed = 0
+    last_id = 0
+    while True:
+        chunk_ids = list(base.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:chunk_size])
+        if not chunk_ids:
+            break
+        last_id = chunk_ids[-1]
+        with transaction.atomic():
+            subscriptions = list(
+                MealSubscription.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(pk__in=chunk_ids)
+                .select_related("plan", "current_menu_plan")
+                .order_by("pk")
+            )
+            by_plan = {subscription.current_menu_plan_id: subscription for subscription in subscriptions}
+            orders, unpaid = _materialize(
+                [subscription.current_menu_plan for subscription in subscriptions],
+                by_plan,
+            )
+        result.plans += len(subscriptions)
+        result.orders_created += len(orders)
+        result.items_created += sum(order.items_count for order in orders)
+        result.unpaid += len(unpaid)
+        result.skipped += len(chunk_ids) - len(orders) - len(unpaid)
+        processed += len(chunk_ids)
+        if progress is not None:
+            progress(processed, total, result)
+
+    if result.unpaid:
+        logger.warning(
+            "%s subscription plans for %s skipped: billing payment has not succeeded", result.unpaid, plan_date
+        )
+    if result.plans:
+        logger.info("Order materialization for %s finished: %s", plan_date, result.as_dict())
+    return result
+
+
+__all__ = [
+    "MaterializeResult",
+    "materialize_plan",
+    "materialize_plans",
+    "materialize_subscription_orders",
+]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0005_order_description_order_kind_and_more"),
+        ("users", "0005_profile_avatar_preferences_profile_wallet_settings"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="wallettransaction",
+            index=models.Index(fields=["profile", "-created_at", "-id"], name="orders_wallet_profile_created"),
+        ),
+        migrations.AddIndex(
+            model_name="wallettransaction",
+            index=models.Index(fields=["profile", "currency", "-created_at", "-id"], name="orders_wallet_profile_cur_crt"),
+        ),
+        migrations.AddIndex(
+            model_name="wallettransaction",
+            index=models.Index(fields=["profile", "reference"], name="orders_wallet_profile_ref"),
+        ),
+    ]
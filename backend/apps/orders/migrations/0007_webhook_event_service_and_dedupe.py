@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0006_wallettransaction_history_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="integrationwebhookevent",
+            name="delivery_service",
+            field=models.ForeignKey(blank=True, help_text="Партнёр, чьей подписью проверено событие", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="webhook_events", to="orders.deliveryservice"),
+        ),
+        migrations.AddConstraint(
+            model_name="integrationwebhookevent",
+            constraint=models.UniqueConstraint(condition=models.Q(models.Q(("external_event_id", ""), _negated=True), ("delivery_service__isnull", False)), fields=("source", "delivery_service", "external_event_id"), name="orders_webhook_partner_event_uniq"),
+        ),
+        migrations.AddConstraint(
+            model_name="integrationwebhookevent",
+            constraint=models.UniqueConstraint(condition=models.Q(models.Q(("external_event_id", ""), _negated=True), ("delivery_service__isnull", True)), fields=("source", "external_event_id"), name="orders_webhook_source_event_uniq"),
+        ),
+    ]
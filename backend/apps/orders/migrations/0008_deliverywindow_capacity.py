@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nutrition", "0003_menuplan_processing_and_meal_note"),
+        ("orders", "0007_webhook_event_service_and_dedupe"),
+        ("users", "0005_profile_avatar_preferences_profile_wallet_settings"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deliverywindow",
+            name="capacity",
+            field=models.PositiveIntegerField(blank=True, help_text="Сколько заказов принимает слот в день; пусто — без ограничений", null=True),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["delivery_window", "delivery_date"], name="orders_order_window_date"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0008_deliverywindow_capacity"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="kind",
+            field=models.CharField(choices=[("pro_subscription", "PRO подписка"), ("meal_subscription", "Подписка на питание"), ("consultation", "Консультация"), ("digital_product", "Цифровой продукт"), ("other", "Другое")], default="pro_subscription", max_length=32),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nutrition", "0003_menuplan_processing_and_meal_note"),
+        ("orders", "0009_order_kind_meal_subscription"),
+        ("users", "0005_profile_avatar_preferences_profile_wallet_settings"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="order",
+            constraint=models.UniqueConstraint(condition=models.Q(("menu_plan__isnull", False), models.Q(("status", "cancelled"), _negated=True)), fields=("menu_plan",), name="orders_order_menu_plan_uniq"),
+        ),
+    ]
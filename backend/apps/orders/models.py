@@ -71,6 +71,11 @@ class DeliveryWindow(models.Model):
         default=120,
         help_text="За сколько минут до начала слота требуется подтверждение",
     )
+    capacity = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Сколько заказов принимает слот в день; пусто — без ограничений",
+    )
 
     class Meta:
         verbose_name = "Окно доставки"
@@ -237,6 +242,7 @@ class Order(models.Model):
 
     class Kind(models.TextChoices):
         PRO_SUBSCRIPTION = "pro_subscription", "PRO подписка"
+        MEAL_SUBSCRIPTION = "meal_subscription", "Подписка на питание"
         CONSULTATION = "consultation", "Консультация"
         DIGITAL_PRODUCT = "digital_product", "Цифровой продукт"
         OTHER = "other", "Другое"
@@ -341,6 +347,15 @@ class Order(models.Model):
         indexes = [
             models.Index(fields=["status", "delivery_date"], name="orders_order_status_date"),
             models.Index(fields=["external_order_id"], name="orders_order_external_idx"),
+            models.Index(fields=["delivery_window", "delivery_date"], name="orders_order_window_date"),
+        ]
+        constraints = [
+            # Один живой заказ на план меню — повторный запуск материализации его не задвоит.
+            models.UniqueConstraint(
+                fields=["menu_plan"],
+                condition=models.Q(menu_plan__isnull=False) & ~models.Q(status="cancelled"),
+                name="orders_order_menu_plan_uniq",
+            ),
         ]
 
     def __str__(self) -> str:  # pragma: no cover
@@ -515,6 +530,16 @@ class WalletTransaction(models.Model):
         unique_together = ("profile", "idempotency_key")
         indexes = [
             models.Index(fields=["currency", "occurred_at"], name="orders_wallet_currency_date"),
+            # Keyset-пагинация истории: WHERE profile = ? ORDER BY created_at DESC, id DESC
+            models.Index(
+                fields=["profile", "-created_at", "-id"],
+                name="orders_wallet_profile_created",
+            ),
+            models.Index(
+                fields=["profile", "currency", "-created_at", "-id"],
+                name="orders_wallet_profile_cur_crt",
+            ),
+            models.Index(fields=["profile", "reference"], name="orders_wallet_profile_ref"),
         ]
 
     def __str__(self) -> str:  # pragma: no cover
@@ -548,6 +573,14 @@ class IntegrationWebhookEvent(models.Model):
         FAILED = "failed", "Ошибка обработки"
 
     source = models.CharField(max_length=16, choices=Source.choices)
+    delivery_service = models.ForeignKey(
+        DeliveryService,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="webhook_events",
+        help_text="Партнёр, чьей подписью проверено событие",
+    )
     external_event_id = models.CharField(max_length=128, blank=True)
     event_type = models.CharField(max_length=64)
     payload = models.JSONField()
@@ -581,6 +614,21 @@ class IntegrationWebhookEvent(models.Model):
             models.Index(fields=["source", "status"], name="orders_webhook_source_status"),
             models.Index(fields=["external_event_id"], name="orders_webhook_external_idx"),
         ]
+        constraints = [
+            # Повторная доставка того же события партнёром отбрасывается на INSERT.
+            # Идентификаторы событий уникальны только в пределах партнёра, поэтому
+            # у доставки ключ включает delivery_service (NULL в уникальном индексе не сравнивается).
+            models.UniqueConstraint(
+                fields=["source", "delivery_service", "external_event_id"],
+                condition=~models.Q(external_event_id="") & models.Q(delivery_service__isnull=False),
+                name="orders_webhook_partner_event_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["source", "external_event_id"],
+                condition=~models.Q(external_event_id="") & models.Q(delivery_service__isnull=True),
+                name="orders_webhook_source_event_uniq",
+            ),
+        ]
 
     def __str__(self) -> str:  # pragma: no cover
         return f"Webhook<{self.source}:{self.event_type}>"
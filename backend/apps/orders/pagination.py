@@ -0,0 +1,116 @@
+"""Keyset pagination helpers for append-only ledgers."""
+
+from __future__ import annotations
+
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, List, Tuple
+
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Курсорная пагинация по паре ``(created_at, id)`` в порядке убывания.
+
+    В отличие от ``CursorPagination`` из DRF курсор хранит обе колонки, поэтому
+    следующая страница выбирается одним условием
+    ``created_at < ts OR (created_at = ts AND id < pk)`` без OFFSET и
+    опирается на составной индекс ``(profile, -created_at, -id)``.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = 50
+    max_page_size = 200
+    invalid_cursor_message = "Некорректный курсор"
+
+    def __init__(self) -> None:
+        self.request = None
+        self.page_size_value = self.page_size
+        self.next_cursor: str | None = None
+
+    # --- cursor encoding -------------------------------------------------
+
+    @staticmethod
+    def encode_cursor(created_at: datetime, pk: int) -> str:
+        raw = f"{created_at.isoformat()}|{pk}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def decode_cursor(self, value: str) -> Tuple[datetime, int]:
+        try:
+            padded = value + "=" * (-len(value) % 4)
+            raw = base64.urlsafe_b64decode(padded.encode()).decode()
+            stamp, pk = raw.rsplit("|", 1)
+            created_at = parse_datetime(stamp)
+            if created_at is None:
+                raise ValueError(stamp)
+            return created_at, int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    # --- BasePagination API ------------------------------------------------
+
+    def get_page_size(self, request) -> int:
+        raw = request.query_params.get(self.page_size_query_param)
+        if raw is None:
+            return self.page_size
+        try:
+            value = int(raw)
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(value, self.max_page_size))
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None) -> List[Any]:
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+
+        rows = list(queryset.order_by("-created_at", "-id")[: self.page_size_value + 1])
+        has_next = len(rows) > self.page_size_value
+        rows = rows[: self.page_size_value]
+        self.next_cursor = (
+            self.encode_cursor(rows[-1].created_at, rows[-1].pk) if has_next and rows else None
+        )
+        return rows
+
+    def get_next_link(self) -> str | None:
+        if self.next_cursor is None or self.request is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "next_cursor": self.next_cursor,
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "next_cursor": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+
+__all__ = ["KeysetCursorPagination"]
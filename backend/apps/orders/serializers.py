@@ -6,11 +6,13 @@ from typing import Any, Dict
 from rest_framework import serializers
 
 from apps.orders.models import Order, WalletTransaction
+from apps.orders.slots import MAX_SLOT_DAYS
 from apps.orders.services import (
     build_wallet_summary,
     create_order,
     normalize_transaction_direction,
     pay_order_from_wallet,
+    pay_orders_from_wallet,
     wallet_topup,
     wallet_withdraw,
 )
@@ -60,6 +62,57 @@ class WalletTransactionSerializer(serializers.ModelSerializer):
         return data
 
 
+class WalletTransactionFilterSerializer(serializers.Serializer):
+    """Validates query parameters of the transaction history and export endpoints."""
+
+    DIRECTION_ALIASES = {
+        "in": (WalletTransaction.Direction.CREDIT, WalletTransaction.Direction.RELEASE),
+        "out": (WalletTransaction.Direction.DEBIT, WalletTransaction.Direction.HOLD),
+    }
+
+    currency = serializers.CharField(required=False)
+    direction = serializers.CharField(required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    reference = serializers.CharField(required=False, allow_blank=False, max_length=64)
+
+    def validate_currency(self, value: str) -> str:
+        normalized = value.upper()
+        valid = {choice for choice, _ in WalletTransaction.Currency.choices}
+        if normalized not in valid:
+            raise serializers.ValidationError("Неизвестная валюта")
+        return normalized
+
+    def validate_direction(self, value: str) -> tuple[str, ...]:
+        normalized = value.lower()
+        if normalized in self.DIRECTION_ALIASES:
+            return self.DIRECTION_ALIASES[normalized]
+        if normalized in WalletTransaction.Direction.values:
+            return (normalized,)
+        raise serializers.ValidationError("Неизвестное направление операции")
+
+    def validate(self, attrs: Dict[str, Any]) -> Dict[str, Any]:
+        after = attrs.get("created_after")
+        before = attrs.get("created_before")
+        if after and before and after >= before:
+            raise serializers.ValidationError({"created_before": "Должно быть позже created_after"})
+        return attrs
+
+    def filter_queryset(self, queryset):
+        data = self.validated_data
+        if "currency" in data:
+            queryset = queryset.filter(currency=data["currency"])
+        if "direction" in data:
+            queryset = queryset.filter(direction__in=data["direction"])
+        if "created_after" in data:
+            queryset = queryset.filter(created_at__gte=data["created_after"])
+        if "created_before" in data:
+            queryset = queryset.filter(created_at__lt=data["created_before"])
+        if "reference" in data:
+            queryset = queryset.filter(reference=data["reference"])
+        return queryset
+
+
 class WalletOperationSerializer(serializers.Serializer):
     currency = serializers.CharField()
     amount = serializers.DecimalField(max_digits=12, decimal_places=2)
@@ -191,6 +244,33 @@ class OrderPaymentSerializer(serializers.Serializer):
         return updated
 
 
+class OrderBatchPaymentSerializer(OrderPaymentSerializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    def save(self, orders) -> list[Order]:
+        try:
+            paid = pay_orders_from_wallet(
+                orders,
+                description=self.validated_data.get("description"),
+                reference=self.validated_data.get("reference"),
+                metadata=self.validated_data.get("metadata"),
+            )
+        except ValueError as exc:
+            raise serializers.ValidationError({"detail": str(exc)}) from exc
+        return [order for order, _ in paid]
+
+
+class DeliverySlotsQuerySerializer(serializers.Serializer):
+    city = serializers.CharField(required=False, allow_blank=False, max_length=120)
+    date = serializers.DateField(required=False)
+    days = serializers.IntegerField(required=False, min_value=1, max_value=MAX_SLOT_DAYS, default=7)
+    include_closed = serializers.BooleanField(required=False, default=False)
+
+
 class WalletSummarySerializer(serializers.Serializer):
     def to_representation(self, instance: Dict[str, Any]) -> Dict[str, Any]:
         return instance
@@ -202,9 +282,12 @@ class WalletSummarySerializer(serializers.Serializer):
 
 __all__ = [
     "WalletTransactionSerializer",
+    "WalletTransactionFilterSerializer",
     "WalletTopUpSerializer",
     "WalletWithdrawSerializer",
     "OrderSerializer",
     "OrderPaymentSerializer",
+    "OrderBatchPaymentSerializer",
+    "DeliverySlotsQuerySerializer",
     "WalletSummarySerializer",
 ]
\ No newline at end of file
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import csv
+import json
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
 
 from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from apps.users.models import Profile
@@ -52,53 +56,120 @@ def _normalize_amount(currency: str, amount: Any) -> Decimal:
     return value.quantize(quant, rounding=ROUND_HALF_UP)
 
 
-def _profile_balance(profile: Profile, currency: str) -> Decimal:
-    if currency == WalletTransaction.Currency.TELEGRAM_STARS:
-        return Decimal(profile.telegram_stars_balance or 0)
-    return Decimal(profile.calocoin_balance or 0)
+_BALANCE_FIELDS: Dict[str, str] = {
+    WalletTransaction.Currency.TELEGRAM_STARS: "telegram_stars_balance",
+    WalletTransaction.Currency.CALOCOIN: "calocoin_balance",
+}
 
+_PAYABLE_ORDER_STATUSES = (
+    Order.Status.DRAFT,
+    Order.Status.PENDING_PAYMENT,
+    Order.Status.PAYMENT_FAILED,
+)
 
-def _set_profile_balance(profile: Profile, currency: str, balance: Decimal) -> None:
-    quant = _quant_for_currency(currency)
-    normalized = balance.quantize(quant, rounding=ROUND_HALF_UP)
-    if currency == WalletTransaction.Currency.TELEGRAM_STARS:
-        profile.telegram_stars_balance = int(normalized)
-        profile.save(update_fields=["telegram_stars_balance", "updated_at"])
-    else:
-        profile.calocoin_balance = normalized
-        profile.save(update_fields=["calocoin_balance", "updated_at"])
 
+class InsufficientFundsError(ValueError):
+    """Raised when the wallet cannot cover a withdrawal."""
 
-def wallet_topup(
+
+class OrderPaymentConflict(ValueError):
+    """Raised when an order changed state while its payment was in flight."""
+
+
+def _balance_field(currency: str) -> str:
+    try:
+        return _BALANCE_FIELDS[currency]
+    except KeyError:
+        raise ValueError("Валюта не поддерживается кошельком") from None
+
+
+def _apply_balance_deltas(
+        profile: Profile,
+        deltas: Dict[str, Decimal],
+) -> Dict[str, Tuple[Decimal, Decimal]]:
+    """
+    Atomically move profile balances by ``deltas`` with a single conditional UPDATE.
+
+    Debits are guarded by ``balance >= amount`` in the WHERE clause instead of a
+    preceding ``SELECT ... FOR UPDATE``, so the only row lock taken is the one the
+    UPDATE itself holds until commit. Returns ``{currency: (before, after)}``.
+    Must be called inside ``transaction.atomic``.
+    """
+    guards: Dict[str, Any] = {}
+    updates: Dict[str, Any] = {"updated_at": timezone.now()}
+    for currency, delta in deltas.items():
+        field = _balance_field(currency)
+        if currency == WalletTransaction.Currency.TELEGRAM_STARS:
+            delta = int(delta)
+        if delta < 0:
+            guards[f"{field}__gte"] = -delta
+        updates[field] = F(field) + delta
+
+    updated = Profile.objects.filter(pk=profile.pk, **guards).update(**updates)
+    if not updated:
+        raise InsufficientFundsError("Недостаточно средств для списания")
+
+    fields = [_balance_field(currency) for currency in deltas]
+    current = Profile.objects.filter(pk=profile.pk).values(*fields).get()
+    balances: Dict[str, Tuple[Decimal, Decimal]] = {}
+    for currency, delta in deltas.items():
+        field = _balance_field(currency)
+        after = Decimal(current[field] or 0)
+        setattr(profile, field, current[field])
+        balances[currency] = (after - delta, after)
+    return balances
+
+
+def _create_wallet_transaction(
         profile: Profile,
         *,
         currency: str,
+        direction: str,
         amount: Any,
-        description: str | None = None,
-        reference: str | None = None,
-        metadata: Dict[str, Any] | None = None,
-        related_order: Order | None = None,
+        description: str,
+        reference: str | None,
+        metadata: Dict[str, Any] | None,
+        related_order: Order | None,
 ) -> WalletTransaction:
     normalized_amount = _normalize_amount(currency, amount)
-    meta = metadata or {}
+    delta = normalized_amount if direction == WalletTransaction.Direction.CREDIT else -normalized_amount
+    quant = _quant_for_currency(currency)
     with transaction.atomic():
-        locked = Profile.objects.select_for_update().get(pk=profile.pk)
-        balance_before = _profile_balance(locked, currency)
-        balance_after = balance_before + normalized_amount
-        _set_profile_balance(locked, currency, balance_after)
-        transaction_record = WalletTransaction.objects.create(
-            profile=locked,
+        balance_before, balance_after = _apply_balance_deltas(profile, {currency: delta})[currency]
+        return WalletTransaction.objects.create(
+            profile=profile,
             currency=currency,
-            direction=WalletTransaction.Direction.CREDIT,
+            direction=direction,
             amount=normalized_amount,
-            balance_before=balance_before.quantize(_quant_for_currency(currency)),
-            balance_after=balance_after.quantize(_quant_for_currency(currency)),
-            description=description or "Пополнение баланса",
+            balance_before=balance_before.quantize(quant),
+            balance_after=balance_after.quantize(quant),
+            description=description,
             reference=reference or "",
-            metadata=meta,
+            metadata=metadata or {},
             related_order=related_order,
         )
-        return transaction_record
+
+
+def wallet_topup(
+        profile: Profile,
+        *,
+        currency: str,
+        amount: Any,
+        description: str | None = None,
+        reference: str | None = None,
+        metadata: Dict[str, Any] | None = None,
+        related_order: Order | None = None,
+) -> WalletTransaction:
+    return _create_wallet_transaction(
+        profile,
+        currency=currency,
+        direction=WalletTransaction.Direction.CREDIT,
+        amount=amount,
+        description=description or "Пополнение баланса",
+        reference=reference,
+        metadata=metadata,
+        related_order=related_order,
+    )
 
 
 def wallet_withdraw(
@@ -111,28 +182,16 @@ def wallet_withdraw(
         metadata: Dict[str, Any] | None = None,
         related_order: Order | None = None,
 ) -> WalletTransaction:
-    normalized_amount = _normalize_amount(currency, amount)
-    meta = metadata or {}
-    with transaction.atomic():
-        locked = Profile.objects.select_for_update().get(pk=profile.pk)
-        balance_before = _profile_balance(locked, currency)
-        if balance_before < normalized_amount:
-            raise ValueError("Недостаточно средств для списания")
-        balance_after = balance_before - normalized_amount
-        _set_profile_balance(locked, currency, balance_after)
-        transaction_record = WalletTransaction.objects.create(
-            profile=locked,
-            currency=currency,
-            direction=WalletTransaction.Direction.DEBIT,
-            amount=normalized_amount,
-            balance_before=balance_before.quantize(_quant_for_currency(currency)),
-            balance_after=balance_after.quantize(_quant_for_currency(currency)),
-            description=description or "Списание средств",
-            reference=reference or "",
-            metadata=meta,
-            related_order=related_order,
-        )
-        return transaction_record
+    return _create_wallet_transaction(
+        profile,
+        currency=currency,
+        direction=WalletTransaction.Direction.DEBIT,
+        amount=amount,
+        description=description or "Списание средств",
+        reference=reference,
+        metadata=metadata,
+        related_order=related_order,
+    )
 
 
 def create_order(
@@ -164,6 +223,112 @@ def create_order(
     return order
 
 
+def pay_orders_from_wallet(
+        orders: Sequence[Order | int],
+        *,
+        description: str | None = None,
+        reference: str | None = None,
+        metadata: Dict[str, Any] | None = None,
+) -> List[Tuple[Order, WalletTransaction]]:
+    """
+    Pay several orders of one profile from the wallet in a single transaction.
+
+    Locks are taken in a fixed order — the profile row (via the conditional
+    balance UPDATE) first, then the order rows (via the conditional status
+    UPDATE) — and never with ``SELECT ... FOR UPDATE``, so concurrent payments
+    and top-ups of the same user cannot deadlock. Each order gets its own debit
+    in the ledger. Already paid orders are returned with their existing
+    transaction; if any order is paid or cancelled concurrently the whole batch
+    is rolled back with :class:`OrderPaymentConflict`.
+    """
+    order_ids = sorted({order if isinstance(order, int) else order.pk for order in orders})
+    if not order_ids:
+        return []
+
+    meta = metadata or {}
+    with transaction.atomic():
+        loaded = list(
+            Order.objects.filter(pk__in=order_ids)
+            .select_related("profile", "payment_transaction")
+            .order_by("pk")
+        )
+        if len(loaded) != len(order_ids):
+            raise ValueError("Заказ не найден")
+        profiles = {order.profile_id for order in loaded}
+        if len(profiles) != 1:
+            raise ValueError("Все заказы должны принадлежать одному профилю")
+        profile = loaded[0].profile
+
+        results: Dict[int, Tuple[Order, WalletTransaction]] = {}
+        to_pay: List[Order] = []
+        for order in loaded:
+            if order.is_paid:
+                results[order.pk] = (order, order.payment_transaction)  # type: ignore[assignment]
+            elif order.status not in _PAYABLE_ORDER_STATUSES:
+                raise OrderPaymentConflict(f"Заказ #{order.pk} нельзя оплатить в статусе {order.status}")
+            else:
+                to_pay.append(order)
+
+        if to_pay:
+            amounts = {order.pk: _normalize_amount(order.currency, order.total_price) for order in to_pay}
+            deltas: Dict[str, Decimal] = {}
+            for order in to_pay:
+                deltas[order.currency] = deltas.get(order.currency, Decimal("0")) - amounts[order.pk]
+
+            balances = _apply_balance_deltas(profile, deltas)
+
+            now = timezone.now()
+            claimed = (
+                Order.objects.filter(
+                    pk__in=[order.pk for order in to_pay],
+                    status__in=_PAYABLE_ORDER_STATUSES,
+                    payment_transaction__isnull=True,
+                )
+                .update(
+                    status=Order.Status.PAID,
+                    paid_at=now,
+                    wallet_currency=Coalesce(F("wallet_currency"), F("currency")),
+                    updated_at=now,
+                )
+            )
+            if claimed != len(to_pay):
+                raise OrderPaymentConflict("Заказ изменился во время оплаты, повторите попытку")
+
+            running = {currency: before for currency, (before, _) in balances.items()}
+            ledger: List[WalletTransaction] = []
+            for order in to_pay:
+                quant = _quant_for_currency(order.currency)
+                before = running[order.currency]
+                after = before - amounts[order.pk]
+                running[order.currency] = after
+                ledger.append(
+                    WalletTransaction(
+                        profile=profile,
+                        currency=order.currency,
+                        direction=WalletTransaction.Direction.DEBIT,
+                        amount=amounts[order.pk],
+                        balance_before=before.quantize(quant),
+                        balance_after=after.quantize(quant),
+                        description=description or f"Оплата заказа #{order.pk}",
+                        reference=reference or order.reference,
+                        metadata={**meta, "order_id": order.pk},
+                        related_order=order,
+                    )
+                )
+            WalletTransaction.objects.bulk_create(ledger)
+
+            for order, tx in zip(to_pay, ledger):
+                order.payment_transaction = tx
+                order.status = Order.Status.PAID
+                order.paid_at = now
+                order.updated_at = now
+                order.wallet_currency = order.wallet_currency or order.currency
+                results[order.pk] = (order, tx)
+            Order.objects.bulk_update(to_pay, ["payment_transaction"])
+
+    return [results[pk] for pk in order_ids]
+
+
 def pay_order_from_wallet(
         order: Order,
         *,
@@ -173,25 +338,20 @@ def pay_order_from_wallet(
 ) -> Tuple[Order, WalletTransaction]:
     if order.is_paid:
         return order, order.payment_transaction  # type: ignore[return-value]
-    meta = metadata or {}
-    with transaction.atomic():
-        locked = Order.objects.select_for_update().get(pk=order.pk)
-        if locked.is_paid:
-            return locked, locked.payment_transaction  # type: ignore[return-value]
-        tx = wallet_withdraw(
-            locked.profile,
-            currency=locked.currency,
-            amount=locked.total_price,
-            description=description or f"Оплата заказа #{locked.pk}",
-            reference=reference or locked.reference,
-            metadata={**meta, "order_id": locked.pk},
+    try:
+        [(paid, tx)] = pay_orders_from_wallet(
+            [order.pk],
+            description=description,
+            reference=reference,
+            metadata=metadata,
         )
-        locked.payment_transaction = tx
-        locked.status = Order.Status.PAID
-        locked.wallet_currency = locked.wallet_currency or locked.currency
-        locked.paid_at = timezone.now()
-        locked.save(update_fields=["payment_transaction", "status", "paid_at", "updated_at"])
-        return locked, tx
+    except OrderPaymentConflict:
+        # Двойное нажатие: параллельный запрос уже оплатил заказ из кошелька — отдаём его списание.
+        current = Order.objects.select_related("payment_transaction").get(pk=order.pk)
+        if current.payment_transaction_id is None:
+            raise
+        return current, current.payment_transaction  # type: ignore[return-value]
+    return paid, tx
 
 
 def _format_decimal(value: Decimal, currency: str) -> float | int:
@@ -364,6 +524,71 @@ def _serialize_transaction(tx: WalletTransaction) -> Dict[str, Any]:
     }
 
 
+WALLET_EXPORT_FIELDS = (
+    "id",
+    "created_at",
+    "currency",
+    "direction",
+    "amount",
+    "balance_before",
+    "balance_after",
+    "description",
+    "reference",
+)
+WALLET_EXPORT_CHUNK_SIZE = 2000
+
+
+class _EchoBuffer:
+    """File-like object for ``csv.writer`` that hands rows back instead of buffering them."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def _iter_export_rows(queryset) -> Iterator[Dict[str, Any]]:
+    rows = queryset.order_by("-created_at", "-id").values_list(
+        "id",
+        "created_at",
+        "currency",
+        "direction",
+        "amount",
+        "balance_before",
+        "balance_after",
+        "description",
+        "reference",
+    )
+    for pk, created_at, currency, direction, amount, before, after, description, reference in rows.iterator(
+        chunk_size=WALLET_EXPORT_CHUNK_SIZE
+    ):
+        yield {
+            "id": pk,
+            "created_at": created_at.isoformat(),
+            "currency": currency.lower(),
+            "direction": normalize_transaction_direction(direction),
+            "amount": _format_decimal(amount, currency),
+            "balance_before": _format_decimal(before, currency),
+            "balance_after": _format_decimal(after, currency),
+            "description": description,
+            "reference": reference or None,
+        }
+
+
+def iter_wallet_transactions_csv(queryset) -> Iterable[str]:
+    """Stream the ledger as CSV, reading the queryset with a server-side cursor."""
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(WALLET_EXPORT_FIELDS)
+    for row in _iter_export_rows(queryset):
+        yield writer.writerow([
+            "" if row[field] is None else row[field] for field in WALLET_EXPORT_FIELDS
+        ])
+
+
+def iter_wallet_transactions_ndjson(queryset) -> Iterable[str]:
+    """Stream the ledger as newline-delimited JSON."""
+    for row in _iter_export_rows(queryset):
+        yield json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
 def _serialize_order(order: Order) -> Dict[str, Any]:
     return {
         "id": order.pk,
@@ -422,8 +647,14 @@ __all__ = [
     "wallet_withdraw",
     "create_order",
     "pay_order_from_wallet",
+    "pay_orders_from_wallet",
+    "InsufficientFundsError",
+    "OrderPaymentConflict",
     "build_wallet_summary",
     "STARS_CONSULTATION_TARGET",
     "CALO_PRO_TARGET",
     "normalize_transaction_direction",
+    "iter_wallet_transactions_csv",
+    "iter_wallet_transactions_ndjson",
+    "WALLET_EXPORT_FIELDS",
 ]
\ No newline at end of file
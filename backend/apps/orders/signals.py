@@ -0,0 +1,54 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import DeliveryService, DeliveryWindow, Order
+from .slots import NON_BOOKING_STATUSES, invalidate_city_slots, invalidate_window_slots
+from .webhooks import invalidate_delivery_webhook_secret
+
+
+@receiver(post_save, sender=DeliveryService)
+@receiver(post_delete, sender=DeliveryService)
+def reset_webhook_secret_cache(sender, instance, **kwargs):
+    invalidate_delivery_webhook_secret(instance.pk)
+
+
+@receiver(post_save, sender=DeliveryService)
+def reset_service_slots_cache(sender, instance, created, **kwargs):
+    if created:
+        return
+    cities = set(instance.delivery_windows.values_list("city", flat=True))
+    for city in cities:
+        invalidate_city_slots(city)
+
+
+@receiver(post_save, sender=DeliveryWindow)
+@receiver(post_delete, sender=DeliveryWindow)
+def reset_window_slots_cache(sender, instance, **kwargs):
+    invalidate_city_slots(instance.city)
+
+
+def _slot_key(order: Order):
+    if not order.delivery_window_id or not order.delivery_date:
+        return None
+    if order.status in NON_BOOKING_STATUSES:
+        return None
+    return order.delivery_window_id, order.delivery_date
+
+
+@receiver(post_init, sender=Order)
+def remember_order_slot(sender, instance, **kwargs):
+    instance._initial_slot = _slot_key(instance)
+
+
+@receiver(post_save, sender=Order)
+def reset_order_slots_cache(sender, instance, created, **kwargs):
+    current = _slot_key(instance)
+    previous = None if created else getattr(instance, "_initial_slot", None)
+    if current != previous:
+        invalidate_window_slots((previous, current))
+    instance._initial_slot = current
+
+
+@receiver(post_delete, sender=Order)
+def release_order_slot(sender, instance, **kwargs):
+    invalidate_window_slots((getattr(instance, "_initial_slot", None),))
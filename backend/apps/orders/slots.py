@@ -0,0 +1,231 @@
+"""Delivery slot availability for checkout and the bot keyboard.
+
+Per (city, date) we cache the static part of the answer — windows, their
+capacity and how many orders are already booked — and derive the time
+dependent part (cutoff, ``is_open``) on every read. Cache entries are dropped
+by signals — once the transaction commits — when an order lands in or leaves
+a window, or when windows change.
+"""
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from datetime import date as dt_date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import DeliveryWindow, Order
+
+SLOT_CACHE_TIMEOUT = 10 * 60
+SLOT_HORIZON_DAYS = 14
+MAX_SLOT_DAYS = 14
+
+# Заказы в этих статусах не занимают место в слоте.
+NON_BOOKING_STATUSES = (Order.Status.CANCELLED, Order.Status.PAYMENT_FAILED)
+
+
+@dataclass(frozen=True)
+class SlotAvailability:
+    window_id: int
+    service_id: int
+    service_name: str
+    date: dt_date
+    start_time: Any
+    end_time: Any
+    capacity: int | None
+    booked: int
+    cutoff_at: datetime
+
+    @property
+    def remaining(self) -> int | None:
+        if self.capacity is None:
+            return None
+        return max(0, self.capacity - self.booked)
+
+    def is_open(self, now: datetime) -> bool:
+        if now >= self.cutoff_at:
+            return False
+        return self.remaining is None or self.remaining > 0
+
+    def as_dict(self, now: datetime) -> Dict[str, Any]:
+        return {
+            "window_id": self.window_id,
+            "service_id": self.service_id,
+            "service": self.service_name,
+            "date": self.date.isoformat(),
+            "start": self.start_time.strftime("%H:%M"),
+            "end": self.end_time.strftime("%H:%M"),
+            "capacity": self.capacity,
+            "booked": self.booked,
+            "remaining": self.remaining,
+            "cutoff_at": self.cutoff_at.isoformat(),
+            "is_open": self.is_open(now),
+        }
+
+
+def normalize_city(city: str) -> str:
+    """City as both the cache key and the windows lookup see it (case is kept, as in the catalog)."""
+    return (city or "").strip()
+
+
+def _cache_key(city: str, day: dt_date) -> str:
+    digest = hashlib.md5(normalize_city(city).encode()).hexdigest()[:16]
+    return f"orders:slots:{digest}:{day.isoformat()}"
+
+
+def invalidate_slots(city: str, days: Iterable[dt_date]) -> None:
+    if not city:
+        return
+    keys = [_cache_key(city, day) for day in days]
+    # Сбрасываем после коммита: иначе параллельный запрос успеет закешировать ещё не изменённые данные.
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_city_slots(city: str, *, start: dt_date | None = None) -> None:
+    """Drop cached availability for the whole booking horizon of a city."""
+    start = start or timezone.localdate()
+    invalidate_slots(city, (start + timedelta(days=offset) for offset in range(SLOT_HORIZON_DAYS)))
+
+
+def invalidate_window_slots(keys: Iterable[Tuple[int, dt_date]]) -> None:
+    """Drop cached availability for ``(window_id, date)`` pairs."""
+    keys = {key for key in keys if key}
+    if not keys:
+        return
+    cities = dict(
+        DeliveryWindow.objects.filter(pk__in={window_id for window_id, _ in keys})
+        .values_list("pk", "city")
+    )
+    for window_id, day in keys:
+        invalidate_slots(cities.get(window_id, ""), [day])
+
+
+def release_slots_for_orders(orders: Iterable[Order]) -> None:
+    """Invalidate availability for orders changed with ``update``/``bulk_update``."""
+    invalidate_window_slots(
+        (order.delivery_window_id, order.delivery_date)
+        for order in orders
+        if order.delivery_window_id and order.delivery_date
+    )
+
+
+def _cutoff_minutes(window: DeliveryWindow) -> int:
+    return max(window.cutoff_lead_time_minutes, window.service.cutoff_lead_time_minutes)
+
+
+def _build_rows(city: str, days: Sequence[dt_date]) -> Dict[dt_date, List[Dict[str, Any]]]:
+    windows = list(
+        DeliveryWindow.objects.filter(city=normalize_city(city), service__is_active=True)
+        .select_related("service")
+        .order_by("start_time", "id")
+    )
+    if not windows:
+        return {day: [] for day in days}
+
+    booked = {
+        (row["delivery_window_id"], row["delivery_date"]): row["booked"]
+        for row in Order.objects.filter(
+            delivery_window__in=[window.pk for window in windows],
+            delivery_date__in=list(days),
+        )
+        .exclude(status__in=NON_BOOKING_STATUSES)
+        .values("delivery_window_id", "delivery_date")
+        .annotate(booked=Count("id"))
+        .order_by()
+    }
+
+    result: Dict[dt_date, List[Dict[str, Any]]] = {}
+    for day in days:
+        result[day] = [
+            {
+                "window_id": window.pk,
+                "service_id": window.service_id,
+                "service_name": window.service.name,
+                "start_time": window.start_time,
+                "end_time": window.end_time,
+                "capacity": window.capacity,
+                "booked": booked.get((window.pk, day), 0),
+                "cutoff_minutes": _cutoff_minutes(window),
+            }
+            for window in windows
+        ]
+    return result
+
+
+def get_slots(city: str, days: Sequence[dt_date]) -> Dict[dt_date, List[SlotAvailability]]:
+    """
+    Return availability for ``days`` in ``city``.
+
+    Cached days cost one ``get_many``; all missing days are computed together
+    with one windows query and one aggregated ``COUNT ... GROUP BY`` over orders.
+    """
+    keys = {_cache_key(city, day): day for day in days}
+    cached = cache.get_many(list(keys))
+    rows_by_day: Dict[dt_date, List[Dict[str, Any]]] = {keys[key]: rows for key, rows in cached.items()}
+
+    missing = [day for day in days if day not in rows_by_day]
+    if missing:
+        fresh = _build_rows(city, missing)
+        cache.set_many({_cache_key(city, day): rows for day, rows in fresh.items()}, SLOT_CACHE_TIMEOUT)
+        rows_by_day.update(fresh)
+
+    tz = timezone.get_current_timezone()
+    result: Dict[dt_date, List[SlotAvailability]] = {}
+    for day in days:
+        slots: List[SlotAvailability] = []
+        for row in rows_by_day.get(day, []):
+            start_at = timezone.make_aware(datetime.combine(day, row["start_time"]), tz)
+            slots.append(
+                SlotAvailability(
+                    window_id=row["window_id"],
+                    service_id=row["service_id"],
+                    service_name=row["service_name"],
+                    date=day,
+                    start_time=row["start_time"],
+                    end_time=row["end_time"],
+                    capacity=row["capacity"],
+                    booked=row["booked"],
+                    cutoff_at=start_at - timedelta(minutes=row["cutoff_minutes"]),
+                )
+            )
+        result[day] = slots
+    return result
+
+
+def available_slots(
+        city: str,
+        *,
+        start: dt_date | None = None,
+        days: int = 7,
+        now: datetime | None = None,
+        include_closed: bool = False,
+) -> List[Dict[str, Any]]:
+    """Open delivery slots for ``days`` consecutive days, grouped by date."""
+    now = now or timezone.now()
+    start = start or timezone.localdate(now)
+    days = max(1, min(int(days), MAX_SLOT_DAYS))
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+
+    payload: List[Dict[str, Any]] = []
+    for day, slots in get_slots(city, dates).items():
+        entries = [slot.as_dict(now) for slot in slots]
+        if not include_closed:
+            entries = [entry for entry in entries if entry["is_open"]]
+        payload.append({"date": day.isoformat(), "slots": entries})
+    return payload
+
+
+__all__ = [
+    "SlotAvailability",
+    "available_slots",
+    "get_slots",
+    "invalidate_slots",
+    "invalidate_city_slots",
+    "invalidate_window_slots",
+    "normalize_city",
+    "release_slots_for_orders",
+]
@@ -0,0 +1,51 @@
+"""Celery tasks for order integrations."""
+from __future__ import annotations
+
+from datetime import date
+from typing import Any
+
+from celery import shared_task
+from django.conf import settings
+
+from apps.orders.billing import drain_billing_queue
+from apps.orders.materializer import materialize_subscription_orders
+from apps.orders.webhooks import drain_webhook_queue
+
+
+@shared_task(name="orders.process_webhook_events")
+def process_webhook_events_task(batch_size: int | None = None, max_batches: int | None = None) -> dict[str, Any]:
+    """Drain received webhook events in ``SKIP LOCKED`` batches.
+
+    Scheduled by Celery beat; several workers may run it concurrently, each one
+    claims a disjoint batch.
+    """
+
+    return drain_webhook_queue(
+        batch_size=batch_size or getattr(settings, "ORDERS_WEBHOOK_BATCH_SIZE", 200),
+        max_batches=max_batches or getattr(settings, "ORDERS_WEBHOOK_MAX_BATCHES", 50),
+    )
+
+
+@shared_task(name="orders.bill_due_subscriptions")
+def bill_due_subscriptions_task(batch_size: int | None = None, max_batches: int | None = None) -> dict[str, Any]:
+    """Bill subscriptions whose ``next_billing_at`` has passed.
+
+    Safe to run on several workers at once: batches are claimed with
+    ``SKIP LOCKED`` and committed atomically.
+    """
+
+    return drain_billing_queue(
+        batch_size=batch_size or getattr(settings, "ORDERS_BILLING_BATCH_SIZE", 100),
+        max_batches=max_batches or getattr(settings, "ORDERS_BILLING_MAX_BATCHES", 50),
+    )
+
+
+@shared_task(name="orders.materialize_subscription_orders")
+def materialize_subscription_orders_task(plan_date: str | None = None, chunk_size: int | None = None) -> dict[str, Any]:
+    """Nightly: turn accepted menu plans of active subscriptions into delivery orders."""
+
+    result = materialize_subscription_orders(
+        plan_date=date.fromisoformat(plan_date) if plan_date else None,
+        chunk_size=chunk_size or getattr(settings, "ORDERS_MATERIALIZE_CHUNK_SIZE", 200),
+    )
+    return result.as_dict()
@@ -0,0 +1,162 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.orders.models import DeliveryService, DeliveryWindow, Order
+from apps.orders.slots import available_slots, get_slots
+
+User = get_user_model()
+
+CITY = "Москва"
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def user() -> User:
+    user = User.objects.create_user(username="+79990004455", password="StrongPass!1")
+    user.profile.city = CITY
+    user.profile.save(update_fields=["city"])
+    return user
+
+
+@pytest.fixture
+def service() -> DeliveryService:
+    return DeliveryService.objects.create(
+        slug="fast", name="Fast", city=CITY, cutoff_lead_time_minutes=60
+    )
+
+
+@pytest.fixture
+def windows(service: DeliveryService) -> list[DeliveryWindow]:
+    return [
+        DeliveryWindow.objects.create(
+            service=service,
+            city=CITY,
+            start_time=time(9),
+            end_time=time(11),
+            capacity=2,
+        ),
+        DeliveryWindow.objects.create(
+            service=service,
+            city=CITY,
+            start_time=time(18),
+            end_time=time(20),
+            cutoff_lead_time_minutes=180,
+        ),
+    ]
+
+
+def _book(user: User, window: DeliveryWindow, day: date) -> Order:
+    return Order.objects.create(
+        user=user,
+        profile=user.profile,
+        delivery_service=window.service,
+        delivery_window=window,
+        delivery_date=day,
+        city=CITY,
+    )
+
+
+def _at(day: date, hour: int, minute: int = 0) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+@pytest.mark.django_db
+def test_full_window_is_closed(user, windows, django_capture_on_commit_callbacks):
+    day = timezone.localdate() + timedelta(days=1)
+    now = _at(day, 6)
+    _book(user, windows[0], day)
+
+    slots = available_slots(CITY, start=day, days=1, now=now)[0]["slots"]
+    assert [slot["window_id"] for slot in slots] == [windows[0].pk, windows[1].pk]
+    assert slots[0]["remaining"] == 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        _book(user, windows[0], day)
+    slots = available_slots(CITY, start=day, days=1, now=now)[0]["slots"]
+    assert [slot["window_id"] for slot in slots] == [windows[1].pk]
+    assert slots[0]["remaining"] is None
+
+
+@pytest.mark.django_db
+def test_cancelled_order_releases_capacity(user, windows, django_capture_on_commit_callbacks):
+    day = timezone.localdate() + timedelta(days=1)
+    orders = [_book(user, windows[0], day) for _ in range(2)]
+    assert get_slots(CITY, [day])[day][0].remaining == 0
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        orders[0].status = Order.Status.CANCELLED
+        orders[0].save()
+        # До коммита кеш не трогаем: параллельный запрос закешировал бы старые данные.
+        assert get_slots(CITY, [day])[day][0].remaining == 0
+    for callback in callbacks:
+        callback()
+    assert get_slots(CITY, [day])[day][0].remaining == 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        orders[1].delete()
+    assert get_slots(CITY, [day])[day][0].remaining == 2
+
+
+@pytest.mark.django_db
+def test_cutoff_uses_strictest_lead_time(windows):
+    day = timezone.localdate() + timedelta(days=1)
+    slots = {slot.window_id: slot for slot in get_slots(CITY, [day])[day]}
+
+    assert slots[windows[0].pk].cutoff_at == _at(day, 9) - timedelta(minutes=120)
+    assert slots[windows[1].pk].cutoff_at == _at(day, 15)
+    assert not slots[windows[1].pk].is_open(_at(day, 15, 30))
+    assert slots[windows[0].pk].is_open(_at(day, 6, 59))
+
+
+@pytest.mark.django_db
+def test_week_of_slots_is_served_from_cache(user, windows, django_capture_on_commit_callbacks):
+    start = timezone.localdate()
+    with CaptureQueriesContext(connection) as ctx:
+        available_slots(CITY, start=start, days=7)
+    assert len(ctx.captured_queries) == 2
+
+    with CaptureQueriesContext(connection) as ctx:
+        week = available_slots(CITY, start=start, days=7)
+    assert len(ctx.captured_queries) == 0
+    assert len(week) == 7
+
+    windows[1].capacity = 5
+    with django_capture_on_commit_callbacks(execute=True):
+        windows[1].save()
+    # Кеш и выборка окон видят город одинаково.
+    day = start + timedelta(days=3)
+    slots = {slot.window_id: slot for slot in get_slots(f" {CITY} ", [day])[day]}
+    assert slots[windows[1].pk].capacity == 5
+
+
+@pytest.mark.django_db
+def test_slots_endpoint_defaults_to_profile_city(user, windows, settings):
+    client = APIClient()
+    client.force_authenticate(user=user)
+    resp = client.get("/api/orders/delivery/slots/", {"days": 3, "include_closed": "true"})
+    assert resp.status_code == 200
+    payload = resp.json()
+    assert payload["city"] == CITY
+    assert len(payload["days"]) == 3
+    assert len(payload["days"][0]["slots"]) == 2
+
+    settings.BOT_INTERNAL_KEY = "bot-key"
+    bot = APIClient()
+    resp = bot.get("/api/orders/delivery/slots/", HTTP_X_BOT_KEY="bot-key")
+    assert resp.status_code == 400
+    resp = bot.get("/api/orders/delivery/slots/", {"city": CITY}, HTTP_X_BOT_KEY="bot-key")
+    assert resp.status_code == 200
+    assert resp.json()["city"] == CITY
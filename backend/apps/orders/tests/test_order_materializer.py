@@ -0,0 +1,184 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+from apps.nutrition.models import MenuPlan, PlanMeal
+from apps.orders.materializer import materialize_plan, materialize_plans, materialize_subscription_orders
+from apps.orders.models import DeliveryService, MealSubscription, Order, PaymentAttempt, SubscriptionPlan
+
+User = get_user_model()
+
+PLAN_DATE = date(2030, 3, 2)
+
+
+@pytest.fixture
+def items() -> list[MenuItem]:
+    restaurant = Restaurant.objects.create(name="Kitchen", city="Москва")
+    return [
+        MenuItem.objects.create(
+            source="restaurant",
+            source_id=restaurant.id,
+            title=title,
+            price=price,
+            nutrients=Nutrients.objects.create(calories=kcal, protein=20, fat=10, carbs=30),
+        )
+        for title, price, kcal in (("Омлет", 250, 400), ("Боул", 420, 650))
+    ]
+
+
+@pytest.fixture
+def sub_plan() -> SubscriptionPlan:
+    service = DeliveryService.objects.create(slug="mat", name="Mat", city="Москва")
+    return SubscriptionPlan.objects.create(
+        slug="mat-week", name="Неделя", city="Москва", delivery_service=service, price_rub=Decimal("5000")
+    )
+
+
+def _accepted_plan(user, items, *, plan_date=PLAN_DATE) -> MenuPlan:
+    plan = MenuPlan.objects.create(
+        user=user,
+        date=plan_date,
+        target_calories=2000,
+        target_protein=120,
+        target_fat=60,
+        target_carbs=200,
+        status=MenuPlan.Status.ACCEPTED,
+    )
+    PlanMeal.objects.bulk_create(
+        [
+            PlanMeal(plan=plan, item=items[0], qty=1, time_hint="breakfast"),
+            PlanMeal(plan=plan, item=items[1], qty=1.5, time_hint="lunch", user_note="без лука"),
+        ]
+    )
+    return plan
+
+
+def _subscription(sub_plan, items, username: str, *, payment=PaymentAttempt.Status.SUCCEEDED, **extra):
+    user = User.objects.create_user(username=username)
+    period_start = PLAN_DATE - timedelta(days=1)
+    subscription = MealSubscription.objects.create(
+        user=user,
+        profile=user.profile,
+        plan=sub_plan,
+        status=extra.pop("status", MealSubscription.Status.ACTIVE),
+        city="Москва",
+        current_menu_plan=_accepted_plan(user, items, **extra),
+        current_period_start=period_start,
+        current_period_end=period_start + timedelta(days=6),
+    )
+    # Заказ и попытка оплаты периода — как их оставляет биллинг.
+    billing_order = Order.objects.create(
+        user=user,
+        profile=user.profile,
+        subscription=subscription,
+        kind=Order.Kind.MEAL_SUBSCRIPTION,
+        status=Order.Status.PAID if payment == PaymentAttempt.Status.SUCCEEDED else Order.Status.PAYMENT_FAILED,
+        total_price=sub_plan.price_rub,
+        reference=f"sub-{subscription.pk}-{period_start:%Y%m%d}",
+    )
+    PaymentAttempt.objects.create(
+        order=billing_order,
+        subscription=subscription,
+        provider=PaymentAttempt.Provider.CALOCOIN,
+        status=payment,
+        amount=sub_plan.price_rub,
+    )
+    return subscription
+
+
+@pytest.mark.django_db
+def test_plan_becomes_order_with_snapshot(items):
+    user = User.objects.create_user(username="+79990006601")
+    user.profile.city = "Казань"
+    user.profile.save(update_fields=["city"])
+    plan = _accepted_plan(user, items)
+
+    order = materialize_plan(plan)
+    assert order.status == Order.Status.PENDING_PAYMENT
+    assert order.kind == Order.Kind.OTHER
+    assert order.city == "Казань"
+    assert order.delivery_date == PLAN_DATE
+    assert order.items_count == 2
+    assert order.total_price == Decimal("880.00")
+    assert order.metadata["nutrients"]["calories"] == pytest.approx(1375.0)
+
+    lines = {line.menu_item_id: line for line in order.items.all()}
+    bowl = lines[items[1].pk]
+    assert (bowl.quantity, bowl.unit_price, bowl.total_price) == (Decimal("1.50"), Decimal("420.00"), Decimal("630.00"))
+    assert bowl.metadata["nutrients"]["calories"] == 650
+    assert bowl.metadata["note"] == "без лука"
+    assert bowl.plan_meal.plan_id == plan.pk
+
+    # Повторный вызов не создаёт второй заказ.
+    assert materialize_plan(plan) is None
+
+
+@pytest.mark.django_db
+def test_nightly_run_is_chunked_and_idempotent(sub_plan, items):
+    subs = [_subscription(sub_plan, items, f"+7999000661{idx}") for idx in range(5)]
+    _subscription(sub_plan, items, "+79990006620", plan_date=PLAN_DATE + timedelta(days=1))
+    _subscription(sub_plan, items, "+79990006621", status=MealSubscription.Status.PAUSED)
+
+    progress = []
+    result = materialize_subscription_orders(
+        plan_date=PLAN_DATE, chunk_size=2, progress=lambda done, total, _: progress.append((done, total))
+    )
+    assert (result.orders_created, result.items_created) == (5, 10)
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+
+    order = Order.objects.get(subscription=subs[0], menu_plan__isnull=False)
+    assert order.status == Order.Status.PAID
+    assert order.kind == Order.Kind.MEAL_SUBSCRIPTION
+    assert order.menu_plan_id == subs[0].current_menu_plan_id
+    assert order.delivery_service_id == sub_plan.delivery_service_id
+
+    again = materialize_subscription_orders(plan_date=PLAN_DATE, chunk_size=2)
+    assert (again.orders_created, again.skipped) == (0, 5)
+    assert Order.objects.filter(menu_plan__isnull=False).count() == 5
+
+
+@pytest.mark.django_db
+def test_query_count_does_not_grow_with_chunk(sub_plan, items):
+    for idx in range(6):
+        _subscription(sub_plan, items, f"+7999000663{idx}")
+    with CaptureQueriesContext(connection) as ctx:
+        materialize_subscription_orders(plan_date=PLAN_DATE, chunk_size=6)
+    # count + ids + claim + existing orders + meals + orders insert + items insert + slot lookup, then the empty probe
+    assert len(ctx.captured_queries) <= 12
+
+
+@pytest.mark.django_db
+def test_standalone_plans_load_profiles_in_one_query(items):
+    def run(count: int, prefix: str) -> int:
+        users = [User.objects.create_user(username=f"{prefix}{idx}") for idx in range(count)]
+        plans = list(MenuPlan.objects.filter(pk__in=[_accepted_plan(user, items).pk for user in users]))
+        with CaptureQueriesContext(connection) as ctx, transaction.atomic():
+            assert len(materialize_plans(plans)) == count
+        return len(ctx.captured_queries)
+
+    assert run(1, "+7999000665") == run(4, "+7999000666")
+
+
+@pytest.mark.django_db
+def test_failed_autopay_is_not_materialized_as_paid(sub_plan, items):
+    paid = _subscription(sub_plan, items, "+79990006640")
+    declined = _subscription(sub_plan, items, "+79990006641", payment=PaymentAttempt.Status.FAILED)
+    pending = _subscription(sub_plan, items, "+79990006642", payment=PaymentAttempt.Status.PENDING)
+
+    result = materialize_subscription_orders(plan_date=PLAN_DATE)
+
+    assert (result.orders_created, result.unpaid, result.skipped) == (1, 2, 0)
+    assert Order.objects.get(menu_plan__isnull=False).subscription_id == paid.pk
+    assert materialize_plan(declined.current_menu_plan, subscription=declined) is None
+
+    # Оплата прошла позже — следующий запуск создаёт заказ.
+    PaymentAttempt.objects.filter(subscription=pending).update(status=PaymentAttempt.Status.SUCCEEDED)
+    again = materialize_subscription_orders(plan_date=PLAN_DATE)
+    assert (again.orders_created, again.unpaid, again.skipped) == (1, 1, 1)
+    order = Order.objects.get(subscription=pending, menu_plan__isnull=False)
+    assert order.status == Order.Status.PAID
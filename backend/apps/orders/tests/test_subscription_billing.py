@@ -0,0 +1,138 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from apps.orders.billing import add_billing_period, bill_due_subscriptions, drain_billing_queue
+from apps.orders.models import (
+    DeliveryService,
+    MealSubscription,
+    Order,
+    PaymentAttempt,
+    SubscriptionPlan,
+    WalletTransaction,
+)
+from apps.orders.services import wallet_topup
+
+User = get_user_model()
+
+
+@pytest.fixture
+def plan() -> SubscriptionPlan:
+    service = DeliveryService.objects.create(slug="bill", name="Bill", city="Москва")
+    return SubscriptionPlan.objects.create(
+        slug="week",
+        name="Неделя",
+        city="Москва",
+        delivery_service=service,
+        price_calocoin=Decimal("50.00"),
+        price_rub=Decimal("4900.00"),
+    )
+
+
+def _subscribe(plan: SubscriptionPlan, username: str, *, due, autopay: bool = True, **extra) -> MealSubscription:
+    user = User.objects.create_user(username=username)
+    extra.setdefault("status", MealSubscription.Status.ACTIVE)
+    return MealSubscription.objects.create(
+        user=user,
+        profile=user.profile,
+        plan=plan,
+        autopay_enabled=autopay,
+        city="Москва",
+        next_billing_at=due,
+        **extra,
+    )
+
+
+@pytest.mark.django_db
+def test_autopay_debits_wallet_and_advances_period(plan):
+    due = timezone.now() - timedelta(hours=1)
+    sub = _subscribe(plan, "+79990005501", due=due, current_period_end=date(2030, 1, 7))
+    wallet_topup(sub.profile, currency="CALO", amount=120)
+
+    result = bill_due_subscriptions()
+    assert result.billed == 1 and result.paid == 1
+
+    sub.refresh_from_db()
+    assert sub.current_period_start == date(2030, 1, 8)
+    assert sub.current_period_end == date(2030, 1, 14)
+    assert sub.next_billing_at == due + timedelta(days=7)
+
+    order = Order.objects.get(subscription=sub)
+    assert order.status == Order.Status.PAID
+    assert order.kind == Order.Kind.MEAL_SUBSCRIPTION
+    assert order.payment_transaction.amount == Decimal("50.00")
+    attempt = PaymentAttempt.objects.get(subscription=sub)
+    assert attempt.status == PaymentAttempt.Status.SUCCEEDED
+    assert attempt.wallet_transaction_id == order.payment_transaction_id
+    sub.profile.refresh_from_db()
+    assert sub.profile.calocoin_balance == Decimal("70.00")
+
+
+@pytest.mark.django_db
+def test_insufficient_funds_and_manual_payment(plan):
+    due = timezone.now() - timedelta(minutes=5)
+    broke = _subscribe(plan, "+79990005502", due=due)
+    manual = _subscribe(plan, "+79990005503", due=due, autopay=False)
+
+    result = bill_due_subscriptions()
+    assert (result.billed, result.payment_failed, result.awaiting_payment) == (2, 1, 1)
+
+    failed = Order.objects.get(subscription=broke)
+    assert failed.status == Order.Status.PAYMENT_FAILED
+    assert PaymentAttempt.objects.get(subscription=broke).failure_code == "insufficient_funds"
+
+    pending = Order.objects.get(subscription=manual)
+    assert pending.status == Order.Status.PENDING_PAYMENT
+    assert pending.currency == Order.Currency.RUB
+    assert PaymentAttempt.objects.get(subscription=manual).provider == PaymentAttempt.Provider.CARD
+    assert not WalletTransaction.objects.filter(direction=WalletTransaction.Direction.DEBIT).exists()
+
+
+@pytest.mark.django_db
+def test_profile_with_several_subscriptions_pays_what_it_can(plan):
+    due = timezone.now() - timedelta(minutes=5)
+    first = _subscribe(plan, "+79990005504", due=due)
+    second = MealSubscription.objects.create(
+        user=first.user,
+        profile=first.profile,
+        plan=plan,
+        status=MealSubscription.Status.ACTIVE,
+        city="Москва",
+        next_billing_at=due,
+    )
+    wallet_topup(first.profile, currency="CALO", amount=60)
+
+    result = bill_due_subscriptions()
+    assert (result.paid, result.payment_failed) == (1, 1)
+    statuses = sorted(Order.objects.filter(subscription__in=[first, second]).values_list("status", flat=True))
+    assert statuses == [Order.Status.PAID, Order.Status.PAYMENT_FAILED]
+    first.profile.refresh_from_db()
+    assert first.profile.calocoin_balance == Decimal("10.00")
+
+
+@pytest.mark.django_db
+def test_drain_bills_each_period_once_and_skips_future(plan):
+    now = timezone.now()
+    behind = _subscribe(plan, "+79990005505", due=now - timedelta(days=15))
+    _subscribe(plan, "+79990005506", due=now + timedelta(days=1))
+    _subscribe(plan, "+79990005507", due=now - timedelta(days=1), status=MealSubscription.Status.PAUSED)
+
+    report = drain_billing_queue(batch_size=1, max_batches=10)
+    # Отстающая на две недели подписка догоняет расписание за три периода.
+    assert report["billed"] == 3
+    assert "billed_per_second" in report
+    assert Order.objects.filter(subscription=behind).count() == 3
+    behind.refresh_from_db()
+    assert behind.next_billing_at > now
+
+    assert drain_billing_queue()["billed"] == 0
+
+
+def test_add_billing_period_clamps_month_end():
+    assert add_billing_period(date(2030, 1, 31), SubscriptionPlan.BillingPeriod.MONTHLY) == date(2030, 2, 28)
+    assert add_billing_period(date(2030, 11, 30), SubscriptionPlan.BillingPeriod.QUARTERLY) == date(2031, 2, 28)
+    stamp = datetime(2030, 1, 1, 9, 0)
+    assert add_billing_period(stamp, SubscriptionPlan.BillingPeriod.WEEKLY) == datetime(2030, 1, 8, 9, 0)
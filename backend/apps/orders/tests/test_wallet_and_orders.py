@@ -4,7 +4,9 @@ import pytest
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 
+from apps.orders import services
 from apps.orders.models import Order, WalletPerk, WalletTarget, WalletTransaction
+from apps.orders.services import OrderPaymentConflict, pay_order_from_wallet, pay_orders_from_wallet, wallet_topup
 
 User = get_user_model()
 
@@ -193,4 +195,109 @@ def test_wallet_summary_creates_profile_if_missing(api_client: APIClient):
 
     payload = resp.json()
     assert "targets" in payload
-    assert payload["targets"]["stars"]["balance"] == 0
\ No newline at end of file
+    assert payload["targets"]["stars"]["balance"] == 0
+
+def _pending_order(user: User, *, currency: str, amount: str) -> Order:
+    return Order.objects.create(
+        user=user,
+        profile=user.profile,
+        title="Заказ",
+        currency=currency,
+        total_price=Decimal(amount),
+        status=Order.Status.PENDING_PAYMENT,
+    )
+
+
+@pytest.mark.django_db
+def test_batch_pay_creates_one_debit_per_order(auth_client: APIClient, user: User):
+    wallet_topup(user.profile, currency="CALO", amount="500")
+    wallet_topup(user.profile, currency="STARS", amount="100")
+    first = _pending_order(user, currency="CALO", amount="120.50")
+    second = _pending_order(user, currency="CALO", amount="79.50")
+    third = _pending_order(user, currency="STARS", amount="60")
+
+    resp = auth_client.post(
+        "/api/orders/wallet/orders/pay/",
+        {"order_ids": [third.id, first.id, second.id]},
+        format="json",
+    )
+
+    assert resp.status_code == 200
+    assert [item["status"] for item in resp.json()] == [Order.Status.PAID] * 3
+    user.profile.refresh_from_db()
+    assert user.profile.calocoin_balance == Decimal("300.00")
+    assert user.profile.telegram_stars_balance == 40
+
+    debits = WalletTransaction.objects.filter(
+        profile=user.profile, direction=WalletTransaction.Direction.DEBIT
+    ).order_by("id")
+    assert [tx.related_order_id for tx in debits] == [first.id, second.id, third.id]
+    assert [tx.balance_after for tx in debits] == [Decimal("379.50"), Decimal("300.00"), Decimal("40.00")]
+    for order in (first, second, third):
+        order.refresh_from_db()
+        assert order.payment_transaction.related_order_id == order.id
+
+
+@pytest.mark.django_db
+def test_batch_pay_is_atomic_when_funds_are_insufficient(auth_client: APIClient, user: User):
+    wallet_topup(user.profile, currency="CALO", amount="100")
+    orders = [_pending_order(user, currency="CALO", amount="60") for _ in range(2)]
+
+    resp = auth_client.post(
+        "/api/orders/wallet/orders/pay/",
+        {"order_ids": [order.id for order in orders]},
+        format="json",
+    )
+
+    assert resp.status_code == 400
+    user.profile.refresh_from_db()
+    assert user.profile.calocoin_balance == Decimal("100.00")
+    assert not Order.objects.filter(status=Order.Status.PAID).exists()
+    assert not WalletTransaction.objects.filter(direction=WalletTransaction.Direction.DEBIT).exists()
+
+
+@pytest.mark.django_db
+def test_batch_pay_is_idempotent_and_scoped_to_owner(auth_client: APIClient, user: User):
+    wallet_topup(user.profile, currency="CALO", amount="100")
+    order = _pending_order(user, currency="CALO", amount="40")
+    paid, tx = pay_orders_from_wallet([order])[0]
+    assert paid.status == Order.Status.PAID
+
+    again = pay_orders_from_wallet([order.id])
+    assert again[0][1].pk == tx.pk
+    user.profile.refresh_from_db()
+    assert user.profile.calocoin_balance == Decimal("60.00")
+
+    stranger = User.objects.create_user(username="stranger", password="StrongPass!1")
+    foreign = _pending_order(stranger, currency="CALO", amount="10")
+    resp = auth_client.post(
+        "/api/orders/wallet/orders/pay/", {"order_ids": [foreign.id]}, format="json"
+    )
+    assert resp.status_code == 404
+
+
+@pytest.mark.django_db
+def test_double_tap_returns_the_winning_payment(user: User, monkeypatch):
+    wallet_topup(user.profile, currency="CALO", amount="100")
+    order = _pending_order(user, currency="CALO", amount="40")
+    cancelled = _pending_order(user, currency="CALO", amount="10")
+    real_pay = services.pay_orders_from_wallet
+
+    def lose_race(orders, **kwargs):
+        # Другой запрос успевает первым; этот проигрывает проверку claim.
+        target = Order.objects.get(pk=orders[0])
+        if target.pk == order.pk:
+            real_pay([target])
+        else:
+            Order.objects.filter(pk=target.pk).update(status=Order.Status.CANCELLED)
+        raise OrderPaymentConflict("Заказ изменился во время оплаты, повторите попытку")
+
+    monkeypatch.setattr(services, "pay_orders_from_wallet", lose_race)
+
+    paid, tx = pay_order_from_wallet(order)
+    assert paid.status == Order.Status.PAID
+    assert tx.related_order_id == order.pk
+    assert WalletTransaction.objects.filter(direction=WalletTransaction.Direction.DEBIT).count() == 1
+
+    with pytest.raises(OrderPaymentConflict):
+        pay_order_from_wallet(cancelled)
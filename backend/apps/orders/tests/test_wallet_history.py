@@ -0,0 +1,120 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.orders.models import WalletTransaction
+from apps.orders.services import wallet_topup, wallet_withdraw
+
+User = get_user_model()
+
+
+@pytest.fixture
+def user() -> User:
+    return User.objects.create_user(
+        username="+79990002233",
+        email="history@example.com",
+        password="StrongPass!1",
+    )
+
+
+@pytest.fixture
+def auth_client(user: User) -> APIClient:
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+@pytest.fixture
+def ledger(user: User) -> list[WalletTransaction]:
+    profile = user.profile
+    records = []
+    for idx in range(5):
+        records.append(
+            wallet_topup(profile, currency="CALO", amount=100 + idx, reference=f"ref-{idx}")
+        )
+    records.append(wallet_topup(profile, currency="STARS", amount=50))
+    records.append(wallet_withdraw(profile, currency="CALO", amount=10, reference="ref-out"))
+    return records
+
+
+@pytest.mark.django_db
+def test_history_is_keyset_paginated(auth_client: APIClient, ledger):
+    seen: list[int] = []
+    url = "/api/orders/wallet/transactions/?limit=3"
+    pages = 0
+    while url:
+        resp = auth_client.get(url)
+        assert resp.status_code == 200
+        payload = resp.json()
+        assert len(payload["results"]) <= 3
+        seen.extend(item["id"] for item in payload["results"])
+        url = payload["next"]
+        pages += 1
+
+    assert pages == 3
+    assert seen == sorted((tx.id for tx in ledger), reverse=True)
+
+
+@pytest.mark.django_db
+def test_history_cursor_handles_identical_timestamps(auth_client: APIClient, ledger):
+    stamp = timezone.now()
+    WalletTransaction.objects.filter(id__in=[tx.id for tx in ledger]).update(created_at=stamp)
+
+    first = auth_client.get("/api/orders/wallet/transactions/?limit=4").json()
+    second = auth_client.get(
+        "/api/orders/wallet/transactions/", {"limit": 4, "cursor": first["next_cursor"]}
+    ).json()
+
+    ids = [item["id"] for item in first["results"] + second["results"]]
+    assert ids == sorted((tx.id for tx in ledger), reverse=True)
+    assert second["next"] is None
+
+
+@pytest.mark.django_db
+def test_history_filters(auth_client: APIClient, ledger):
+    resp = auth_client.get("/api/orders/wallet/transactions/", {"currency": "stars"})
+    assert [item["currency"] for item in resp.json()["results"]] == ["stars"]
+
+    resp = auth_client.get("/api/orders/wallet/transactions/", {"direction": "out"})
+    assert [item["reference"] for item in resp.json()["results"]] == ["ref-out"]
+
+    resp = auth_client.get("/api/orders/wallet/transactions/", {"reference": "ref-2"})
+    results = resp.json()["results"]
+    assert len(results) == 1 and results[0]["amount"] == pytest.approx(102.0)
+
+    old = ledger[0]
+    WalletTransaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+    resp = auth_client.get(
+        "/api/orders/wallet/transactions/",
+        {"created_before": (timezone.now() - timedelta(days=1)).isoformat()},
+    )
+    assert [item["id"] for item in resp.json()["results"]] == [old.id]
+
+
+@pytest.mark.django_db
+def test_history_rejects_invalid_filters(auth_client: APIClient, ledger):
+    assert auth_client.get("/api/orders/wallet/transactions/", {"currency": "usd"}).status_code == 400
+    assert auth_client.get("/api/orders/wallet/transactions/", {"direction": "up"}).status_code == 400
+    assert auth_client.get("/api/orders/wallet/transactions/", {"cursor": "!!!"}).status_code == 404
+
+
+@pytest.mark.django_db
+def test_history_export_streams_csv_and_ndjson(auth_client: APIClient, ledger):
+    resp = auth_client.get("/api/orders/wallet/transactions/export/", {"currency": "calo"})
+    assert resp.status_code == 200
+    assert resp.streaming
+    lines = b"".join(resp.streaming_content).decode().strip().splitlines()
+    assert lines[0].startswith("id,created_at,currency,direction,amount")
+    assert len(lines) == 1 + 6
+
+    resp = auth_client.get("/api/orders/wallet/transactions/export/", {"as": "ndjson"})
+    assert resp["Content-Type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in b"".join(resp.streaming_content).decode().splitlines()]
+    assert [row["id"] for row in rows] == sorted((tx.id for tx in ledger), reverse=True)
+    assert rows[0]["direction"] == "out"
+
+    assert auth_client.get("/api/orders/wallet/transactions/export/", {"as": "xml"}).status_code == 400
@@ -0,0 +1,176 @@
+import json
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from apps.orders.models import DeliveryService, IntegrationWebhookEvent, Order, PaymentAttempt
+from apps.orders.tasks import process_webhook_events_task
+from apps.orders.webhooks import SIGNATURE_HEADER, compute_signature, process_webhook_batch
+
+User = get_user_model()
+
+
+@pytest.fixture
+def service(db) -> DeliveryService:
+    return DeliveryService.objects.create(
+        slug="fastfood", name="Fast Food", city="Москва", webhook_secret="s3cret"
+    )
+
+
+@pytest.fixture
+def order(service: DeliveryService) -> Order:
+    user = User.objects.create_user(username="courier-client", password="StrongPass!1")
+    return Order.objects.create(
+        user=user,
+        profile=user.profile,
+        status=Order.Status.PAID,
+        delivery_service=service,
+        external_order_id="ext-42",
+        total_price=Decimal("100.00"),
+    )
+
+
+def _post(client: APIClient, url: str, payload: dict, secret: str):
+    body = json.dumps(payload).encode()
+    return client.generic(
+        "POST",
+        url,
+        body,
+        content_type="application/json",
+        **{f"HTTP_{SIGNATURE_HEADER.upper().replace('-', '_')}": f"sha256={compute_signature(secret, body)}"},
+    )
+
+
+@pytest.mark.django_db
+def test_delivery_webhook_is_verified_and_deduplicated(service: DeliveryService, order: Order):
+    client = APIClient()
+    url = f"/api/orders/webhooks/delivery/{service.id}/"
+    event = {"event_id": "evt-1", "type": "order.out_for_delivery", "order_id": order.id}
+
+    assert _post(client, url, event, "wrong").status_code == 403
+    assert _post(client, url, event, service.webhook_secret).status_code == 202
+    assert _post(client, url, event, service.webhook_secret).status_code == 202
+
+    stored = IntegrationWebhookEvent.objects.get()
+    assert stored.external_event_id == "evt-1"
+    assert stored.delivery_service_id == service.id
+    assert stored.status == IntegrationWebhookEvent.ProcessingStatus.RECEIVED
+
+    assert _post(client, "/api/orders/webhooks/delivery/999/", event, "s3cret").status_code == 404
+
+
+@pytest.mark.django_db
+def test_same_event_id_from_different_partners_is_kept(service: DeliveryService):
+    other = DeliveryService.objects.create(slug="slowfood", name="Slow Food", city="Москва", webhook_secret="other")
+    client = APIClient()
+    event = {"event_id": "evt-1", "type": "order.preparing", "order_id": 1}
+
+    assert _post(client, f"/api/orders/webhooks/delivery/{service.id}/", event, "s3cret").status_code == 202
+    assert _post(client, f"/api/orders/webhooks/delivery/{other.id}/", event, "other").status_code == 202
+    assert _post(client, f"/api/orders/webhooks/delivery/{other.id}/", event, "other").status_code == 202
+
+    stored = IntegrationWebhookEvent.objects.filter(external_event_id="evt-1")
+    assert sorted(stored.values_list("delivery_service_id", flat=True)) == sorted([service.id, other.id])
+
+
+@pytest.mark.django_db
+def test_processing_applies_delivery_events_in_bulk(service: DeliveryService, order: Order):
+    def store(event_id, event_type, **payload):
+        IntegrationWebhookEvent.objects.create(
+            source=IntegrationWebhookEvent.Source.DELIVERY,
+            delivery_service=service,
+            external_event_id=event_id,
+            event_type=event_type,
+            payload={"type": event_type, **payload},
+        )
+
+    store("e1", "order.preparing", order_id=order.id)
+    store("e2", "order.delivered", external_order_id="ext-42", tracking_url="https://track.example/42")
+    store("e3", "order.confirmed", order_id=order.id)  # запоздавшее событие не откатывает статус
+    store("e4", "order.delivered", order_id=987654)
+    store("e5", "menu.updated")
+
+    summary = process_webhook_events_task(batch_size=2)
+
+    assert summary["claimed"] == 5
+    assert summary["processed"] == 3
+    assert summary["failed"] == 2
+    order.refresh_from_db()
+    assert order.status == Order.Status.DELIVERED
+    assert order.tracking_url == "https://track.example/42"
+    statuses = dict(IntegrationWebhookEvent.objects.values_list("external_event_id", "status"))
+    assert statuses["e3"] == IntegrationWebhookEvent.ProcessingStatus.PROCESSED
+    assert statuses["e4"] == IntegrationWebhookEvent.ProcessingStatus.FAILED
+    assert process_webhook_batch().claimed == 0
+
+
+@pytest.mark.django_db
+def test_payment_webhook_updates_payment_attempt(settings, order: Order):
+    settings.PAYMENT_WEBHOOK_SECRET = "pay-secret"
+    attempt = PaymentAttempt.objects.create(
+        order=order,
+        provider=PaymentAttempt.Provider.CARD,
+        status=PaymentAttempt.Status.PENDING,
+        external_payment_id="pay-1",
+    )
+    client = APIClient()
+    event = {
+        "id": "pevt-1",
+        "type": "payment.failed",
+        "external_payment_id": "pay-1",
+        "failure_code": "card_declined",
+    }
+    assert _post(client, "/api/orders/webhooks/payment/", event, "pay-secret").status_code == 202
+
+    result = process_webhook_batch()
+
+    assert result.payments_updated == 1
+    attempt.refresh_from_db()
+    assert attempt.status == PaymentAttempt.Status.FAILED
+    assert attempt.failure_code == "card_declined"
+    stored = IntegrationWebhookEvent.objects.get()
+    assert stored.related_payment_id == attempt.id
+    assert stored.related_order_id == order.id
+
+
+@pytest.mark.django_db
+def test_payment_events_settle_linked_orders(order: Order):
+    pending = Order.objects.create(
+        user=order.user,
+        profile=order.profile,
+        status=Order.Status.PENDING_PAYMENT,
+        total_price=Decimal("100.00"),
+    )
+    declined = Order.objects.create(
+        user=order.user,
+        profile=order.profile,
+        status=Order.Status.PENDING_PAYMENT,
+        total_price=Decimal("100.00"),
+    )
+    for target, external_id in ((pending, "pay-ok"), (declined, "pay-ko")):
+        PaymentAttempt.objects.create(
+            order=target,
+            provider=PaymentAttempt.Provider.CARD,
+            status=PaymentAttempt.Status.PENDING,
+            external_payment_id=external_id,
+        )
+    events = (("p1", "payment.succeeded", "pay-ok"), ("p2", "payment.failed", "pay-ko"))
+    for event_id, event_type, external_id in events:
+        IntegrationWebhookEvent.objects.create(
+            source=IntegrationWebhookEvent.Source.PAYMENT,
+            external_event_id=event_id,
+            event_type=event_type,
+            payload={"type": event_type, "external_payment_id": external_id},
+        )
+
+    result = process_webhook_batch()
+
+    assert (result.processed, result.orders_updated, result.payments_updated) == (2, 2, 2)
+    pending.refresh_from_db()
+    declined.refresh_from_db()
+    assert pending.status == Order.Status.PAID
+    assert pending.paid_at is not None
+    assert declined.status == Order.Status.PAYMENT_FAILED
+    assert declined.paid_at is None
@@ -1,7 +1,14 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import OrderViewSet, WalletSummaryView, WalletTransactionViewSet
+from .views import (
+    DeliverySlotsView,
+    DeliveryWebhookView,
+    OrderViewSet,
+    PaymentWebhookView,
+    WalletSummaryView,
+    WalletTransactionViewSet,
+)
 
 router = DefaultRouter()
 router.register("wallet/transactions", WalletTransactionViewSet, basename="wallet-transaction")
@@ -9,5 +16,12 @@ router.register("wallet/orders", OrderViewSet, basename="wallet-order")
 
 urlpatterns = [
     path("wallet/summary/", WalletSummaryView.as_view(), name="wallet-summary"),
+    path("delivery/slots/", DeliverySlotsView.as_view(), name="delivery-slots"),
+    path(
+        "webhooks/delivery/<int:service_id>/",
+        DeliveryWebhookView.as_view(),
+        name="webhook-delivery",
+    ),
+    path("webhooks/payment/", PaymentWebhookView.as_view(), name="webhook-payment"),
     path("", include(router.urls)),
 ]
\ No newline at end of file
@@ -1,22 +1,38 @@
 from __future__ import annotations
 
 # Create your views here.
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from apps.orders.models import Order, WalletTransaction
+from apps.orders.models import IntegrationWebhookEvent, Order, WalletTransaction
+from apps.common.permissions import HasBotKey
+from apps.orders.pagination import KeysetCursorPagination
 from apps.users.models import Profile
 from apps.orders.serializers import (
+    DeliverySlotsQuerySerializer,
+    OrderBatchPaymentSerializer,
     OrderPaymentSerializer,
     OrderSerializer,
     WalletSummarySerializer,
     WalletTopUpSerializer,
+    WalletTransactionFilterSerializer,
     WalletTransactionSerializer,
     WalletWithdrawSerializer,
 )
+from apps.orders.slots import available_slots
+from apps.orders.services import iter_wallet_transactions_csv, iter_wallet_transactions_ndjson
+from apps.orders.webhooks import (
+    SIGNATURE_HEADER,
+    WebhookRejected,
+    get_webhook_secret,
+    ingest_webhook,
+)
 
 
 class WalletProfileMixin:
@@ -36,13 +52,21 @@ class WalletProfileMixin:
 class WalletTransactionViewSet(WalletProfileMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = WalletTransactionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetCursorPagination
+
+    # ``format`` занят content negotiation в DRF, поэтому формат выгрузки передаём через ``as``.
+    export_format_param = "as"
+    export_formats = {
+        "csv": ("text/csv; charset=utf-8", iter_wallet_transactions_csv),
+        "ndjson": ("application/x-ndjson; charset=utf-8", iter_wallet_transactions_ndjson),
+    }
 
     def get_queryset(self):
         profile = self.get_profile()
         queryset = WalletTransaction.objects.filter(profile=profile)
-        currency = self.request.query_params.get("currency")
-        if currency in dict(WalletTransaction.Currency.choices):
-            queryset = queryset.filter(currency=currency)
+        filters = WalletTransactionFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        queryset = filters.filter_queryset(queryset)
         return queryset.order_by("-created_at", "-id")
 
     def get_serializer_class(self):
@@ -57,6 +81,20 @@ class WalletTransactionViewSet(WalletProfileMixin, mixins.ListModelMixin, viewse
         context["profile"] = self.get_profile()
         return context
 
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request, *args, **kwargs):
+        export_format = (request.query_params.get(self.export_format_param) or "csv").lower()
+        if export_format not in self.export_formats:
+            return Response(
+                {self.export_format_param: f"Поддерживаются форматы: {', '.join(self.export_formats)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        content_type, stream = self.export_formats[export_format]
+        response = StreamingHttpResponse(stream(self.get_queryset()), content_type=content_type)
+        filename = f"wallet-{timezone.localdate():%Y%m%d}.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
     @action(detail=False, methods=["post"])
     def topup(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -99,6 +137,18 @@ class OrderViewSet(WalletProfileMixin, mixins.ListModelMixin, mixins.RetrieveMod
         output = self.get_serializer(updated)
         return Response(output.data)
 
+    @action(detail=False, methods=["post"], url_path="pay")
+    def pay_batch(self, request, *args, **kwargs):
+        serializer = OrderBatchPaymentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_ids = set(serializer.validated_data["order_ids"])
+        owned = set(self.get_queryset().filter(pk__in=order_ids).values_list("pk", flat=True))
+        if owned != order_ids:
+            raise NotFound("Заказ не найден")
+        updated = serializer.save(sorted(order_ids))
+        output = self.get_serializer(updated, many=True)
+        return Response(output.data)
+
 
 class WalletSummaryView(WalletProfileMixin, APIView):
     permission_classes = [IsAuthenticated]
@@ -111,8 +161,72 @@ class WalletSummaryView(WalletProfileMixin, APIView):
         return Response(serializer.data)
 
 
+class DeliverySlotsView(APIView):
+    """Open delivery slots for the next days; the city defaults to the profile one."""
+
+    permission_classes = [IsAuthenticated | HasBotKey]
+
+    def get(self, request, *args, **kwargs):
+        query = DeliverySlotsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        city = params.get("city")
+        if not city and request.user.is_authenticated:
+            city = Profile.objects.filter(user=request.user).values_list("city", flat=True).first()
+        if not city:
+            return Response({"city": ["Укажите город доставки"]}, status=status.HTTP_400_BAD_REQUEST)
+
+        days = available_slots(
+            city,
+            start=params.get("date"),
+            days=params["days"],
+            include_closed=params["include_closed"],
+        )
+        return Response({"city": city, "days": days})
+
+
+class WebhookIngestView(APIView):
+    """
+    Accepts signed partner webhooks and stores them for asynchronous processing.
+
+    The view only checks the HMAC of the raw body and writes one row; state
+    changes are applied later by the ``orders.process_webhook_events`` task.
+    """
+
+    authentication_classes: list = []
+    permission_classes = [AllowAny]
+    source = IntegrationWebhookEvent.Source.DELIVERY
+
+    def get_secret(self, **kwargs) -> str:
+        return get_webhook_secret(self.source, delivery_service_id=kwargs.get("service_id"))
+
+    def post(self, request, *args, **kwargs):
+        try:
+            ingest_webhook(
+                source=self.source,
+                body=request.body,
+                signature=request.headers.get(SIGNATURE_HEADER),
+                secret=self.get_secret(**kwargs),
+                delivery_service_id=kwargs.get("service_id"),
+            )
+        except WebhookRejected as exc:
+            return Response({"detail": str(exc)}, status=exc.status_code)
+        return Response({"status": "accepted"}, status=status.HTTP_202_ACCEPTED)
+
+
+class DeliveryWebhookView(WebhookIngestView):
+    source = IntegrationWebhookEvent.Source.DELIVERY
+
+
+class PaymentWebhookView(WebhookIngestView):
+    source = IntegrationWebhookEvent.Source.PAYMENT
+
+
 __all__ = [
     "WalletTransactionViewSet",
     "OrderViewSet",
     "WalletSummaryView",
+    "DeliveryWebhookView",
+    "PaymentWebhookView",
 ]
\ No newline at end of file
@@ -0,0 +1,437 @@
+"""Ingestion and batch processing of partner webhooks.
+
+Ingestion is deliberately thin: verify the HMAC signature and store the raw
+event with one ``INSERT ... ON CONFLICT DO NOTHING``. Everything else —
+resolving orders and payments, state transitions, dedupe — happens in
+:func:`process_webhook_batch`, which Celery workers call in a loop. Workers
+claim batches with ``SELECT ... FOR UPDATE SKIP LOCKED`` so any number of them
+can drain the queue in parallel without stepping on each other.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Mapping
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DeliveryService, IntegrationWebhookEvent, Order, PaymentAttempt
+from .slots import NON_BOOKING_STATUSES, release_slots_for_orders
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Webhook-Signature"
+SECRET_CACHE_TIMEOUT = 60
+DEFAULT_BATCH_SIZE = 200
+
+DELIVERY_STATUS_EVENTS: Mapping[str, str] = {
+    "order.confirmed": Order.Status.CONFIRMED,
+    "order.preparing": Order.Status.PREPARING,
+    "order.out_for_delivery": Order.Status.OUT_FOR_DELIVERY,
+    "order.delivered": Order.Status.DELIVERED,
+    "order.cancelled": Order.Status.CANCELLED,
+}
+PAYMENT_STATUS_EVENTS: Mapping[str, str] = {
+    "payment.pending": PaymentAttempt.Status.PENDING,
+    "payment.succeeded": PaymentAttempt.Status.SUCCEEDED,
+    "payment.failed": PaymentAttempt.Status.FAILED,
+    "payment.cancelled": PaymentAttempt.Status.CANCELLED,
+}
+
+# Порядок жизненного цикла доставки: события, пришедшие не по порядку, не откатывают статус назад.
+_DELIVERY_RANK = {
+    Order.Status.PAID: 0,
+    Order.Status.CONFIRMED: 1,
+    Order.Status.PREPARING: 2,
+    Order.Status.OUT_FOR_DELIVERY: 3,
+    Order.Status.DELIVERED: 4,
+}
+_FINAL_ORDER_STATUSES = {Order.Status.DELIVERED, Order.Status.CANCELLED}
+_FINAL_PAYMENT_STATUSES = {
+    PaymentAttempt.Status.SUCCEEDED,
+    PaymentAttempt.Status.FAILED,
+    PaymentAttempt.Status.CANCELLED,
+}
+# Из каких статусов заказа итог платежа переводит его в PAID / PAYMENT_FAILED.
+_PAYABLE_ORDER_STATUSES = {Order.Status.DRAFT, Order.Status.PENDING_PAYMENT, Order.Status.PAYMENT_FAILED}
+_FAILABLE_ORDER_STATUSES = {Order.Status.DRAFT, Order.Status.PENDING_PAYMENT}
+
+
+class WebhookRejected(Exception):
+    """Raised when an incoming webhook cannot be accepted."""
+
+    def __init__(self, message: str, *, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# --- ingestion -------------------------------------------------------------
+
+
+def _secret_cache_key(service_id: int) -> str:
+    return f"orders:webhook-secret:{service_id}"
+
+
+def get_delivery_webhook_secret(service_id: int) -> str:
+    """Return the webhook secret of an active delivery service, cached briefly."""
+
+    def _load() -> str:
+        secret = (
+            DeliveryService.objects.filter(pk=service_id, is_active=True)
+            .values_list("webhook_secret", flat=True)
+            .first()
+        )
+        return secret or ""
+
+    return cache.get_or_set(_secret_cache_key(service_id), _load, SECRET_CACHE_TIMEOUT)
+
+
+def invalidate_delivery_webhook_secret(service_id: int) -> None:
+    cache.delete(_secret_cache_key(service_id))
+
+
+def compute_signature(secret: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret: str, body: bytes, signature: str | None) -> bool:
+    if not secret or not signature:
+        return False
+    provided = signature.strip()
+    if provided.lower().startswith("sha256="):
+        provided = provided[len("sha256="):]
+    return hmac.compare_digest(compute_signature(secret, body), provided.lower())
+
+
+def ingest_webhook(
+        *,
+        source: str,
+        body: bytes,
+        signature: str | None,
+        secret: str,
+        delivery_service_id: int | None = None,
+) -> None:
+    """
+    Verify and persist a raw webhook with a single ``INSERT``.
+
+    Redeliveries of an already stored ``external_event_id`` are dropped by the
+    unique constraint (``ON CONFLICT DO NOTHING``), so partners may retry freely.
+    """
+    if not secret:
+        raise WebhookRejected("webhook is not configured", status_code=404)
+    if not verify_signature(secret, body, signature):
+        raise WebhookRejected("invalid signature", status_code=403)
+    try:
+        payload = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise WebhookRejected("invalid JSON") from None
+    if not isinstance(payload, dict):
+        raise WebhookRejected("payload must be an object")
+
+    event_type = payload.get("type") or payload.get("event_type")
+    if not isinstance(event_type, str) or not event_type:
+        raise WebhookRejected("event type missing")
+    external_id = payload.get("event_id") or payload.get("id") or ""
+
+    IntegrationWebhookEvent.objects.bulk_create(
+        [
+            IntegrationWebhookEvent(
+                source=source,
+                delivery_service_id=delivery_service_id,
+                external_event_id=str(external_id)[:128],
+                event_type=event_type[:64],
+                payload=payload,
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def get_payment_webhook_secret() -> str:
+    return getattr(settings, "PAYMENT_WEBHOOK_SECRET", "") or ""
+
+
+def get_webhook_secret(source: str, *, delivery_service_id: int | None = None) -> str:
+    """Signing secret for ``source``; ``""`` when the endpoint is not configured."""
+    if source == IntegrationWebhookEvent.Source.PAYMENT:
+        return get_payment_webhook_secret()
+    if source == IntegrationWebhookEvent.Source.DELIVERY and delivery_service_id:
+        return get_delivery_webhook_secret(delivery_service_id)
+    return ""
+
+
+# --- processing ------------------------------------------------------------
+
+
+@dataclass
+class BatchResult:
+    claimed: int = 0
+    processed: int = 0
+    failed: int = 0
+    orders_updated: int = 0
+    payments_updated: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+
+def _payload(event: IntegrationWebhookEvent) -> Dict[str, Any]:
+    return event.payload if isinstance(event.payload, dict) else {}
+
+
+def _as_int(value: Any) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _order_transition_allowed(current: str, target: str) -> bool:
+    if current in _FINAL_ORDER_STATUSES:
+        return False
+    if target == Order.Status.CANCELLED:
+        return True
+    if current not in _DELIVERY_RANK:
+        return False
+    return _DELIVERY_RANK[target] > _DELIVERY_RANK[current]
+
+
+def _apply_payment_to_order(order: Order, payment_status: str, now) -> bool:
+    """Move ``order`` to PAID / PAYMENT_FAILED after its payment settles; ``True`` if it changed."""
+    if payment_status == PaymentAttempt.Status.SUCCEEDED and order.status in _PAYABLE_ORDER_STATUSES:
+        order.status = Order.Status.PAID
+        order.paid_at = now
+        return True
+    if payment_status == PaymentAttempt.Status.FAILED and order.status in _FAILABLE_ORDER_STATUSES:
+        order.status = Order.Status.PAYMENT_FAILED
+        return True
+    return False
+
+
+def _load_orders(
+        events: Iterable[IntegrationWebhookEvent],
+        extra_ids: Iterable[int] = (),
+) -> tuple[Dict[int, Order], Dict[str, Order]]:
+    ids: set[int] = set(extra_ids)
+    external_ids: set[str] = set()
+    for event in events:
+        order_id = _as_int(_payload(event).get("order_id"))
+        if order_id:
+            ids.add(order_id)
+        external = _payload(event).get("external_order_id")
+        if external:
+            external_ids.add(str(external))
+    if not ids and not external_ids:
+        return {}, {}
+    query = Order.objects.none()
+    if ids:
+        query = query | Order.objects.filter(pk__in=ids)
+    if external_ids:
+        query = query | Order.objects.filter(external_order_id__in=external_ids)
+    # Блокируем заказы в порядке pk: оплата тоже берёт их после профиля, цикла ожиданий нет.
+    orders = list(query.select_for_update().order_by("pk"))
+    by_id = {order.pk: order for order in orders}
+    by_external = {order.external_order_id: order for order in orders if order.external_order_id}
+    return by_id, by_external
+
+
+def _payments_query(events: Iterable[IntegrationWebhookEvent]):
+    ids: set[int] = set()
+    external_ids: set[str] = set()
+    for event in events:
+        payment_id = _as_int(_payload(event).get("payment_id"))
+        if payment_id:
+            ids.add(payment_id)
+        external = _payload(event).get("external_payment_id")
+        if external:
+            external_ids.add(str(external))
+    if not ids and not external_ids:
+        return None
+    query = PaymentAttempt.objects.none()
+    if ids:
+        query = query | PaymentAttempt.objects.filter(pk__in=ids)
+    if external_ids:
+        query = query | PaymentAttempt.objects.filter(external_payment_id__in=external_ids)
+    return query
+
+
+def _payment_order_ids(events: Iterable[IntegrationWebhookEvent]) -> set[int]:
+    """Orders behind the batch's payments, read without locks so orders can be locked first."""
+    query = _payments_query(events)
+    if query is None:
+        return set()
+    return set(query.values_list("order_id", flat=True))
+
+
+def _load_payments(
+        events: Iterable[IntegrationWebhookEvent],
+) -> tuple[Dict[int, PaymentAttempt], Dict[str, PaymentAttempt]]:
+    query = _payments_query(events)
+    if query is None:
+        return {}, {}
+    payments = list(query.select_for_update().order_by("pk"))
+    by_id = {payment.pk: payment for payment in payments}
+    by_external = {
+        payment.external_payment_id: payment for payment in payments if payment.external_payment_id
+    }
+    return by_id, by_external
+
+
+def _resolve(payload: Mapping[str, Any], key: str, external_key: str, by_id: Mapping, by_external: Mapping):
+    target = by_id.get(_as_int(payload.get(key)))
+    if target is None and payload.get(external_key):
+        target = by_external.get(str(payload[external_key]))
+    return target
+
+
+def process_webhook_batch(*, batch_size: int = DEFAULT_BATCH_SIZE) -> BatchResult:
+    """
+    Claim up to ``batch_size`` received events and apply them in bulk.
+
+    The claim, the state changes of orders/payments and the event status update
+    share one transaction, so a crashed worker simply releases its rows.
+    """
+    result = BatchResult()
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            IntegrationWebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=IntegrationWebhookEvent.ProcessingStatus.RECEIVED)
+            .order_by("id")[:batch_size]
+        )
+        result.claimed = len(events)
+        if not events:
+            return result
+
+        orders_by_id, orders_by_external = _load_orders(events, _payment_order_ids(events))
+        payments_by_id, payments_by_external = _load_payments(events)
+
+        dirty_orders: Dict[int, Order] = {}
+        dirty_payments: Dict[int, PaymentAttempt] = {}
+        # Заказы, которые заняли или освободили место в слоте доставки.
+        slot_changes: Dict[int, Order] = {}
+
+        for event in events:
+            event.processed_at = now
+            event.status = IntegrationWebhookEvent.ProcessingStatus.PROCESSED
+            payload = _payload(event)
+
+            if event.event_type in DELIVERY_STATUS_EVENTS:
+                order = _resolve(payload, "order_id", "external_order_id", orders_by_id, orders_by_external)
+                if order is None or (
+                    event.delivery_service_id and order.delivery_service_id != event.delivery_service_id
+                ):
+                    event.status = IntegrationWebhookEvent.ProcessingStatus.FAILED
+                    event.error_details = "order not found"
+                    result.failed += 1
+                    continue
+                event.related_order = order
+                target = DELIVERY_STATUS_EVENTS[event.event_type]
+                if _order_transition_allowed(order.status, target):
+                    order.status = target
+                    if target == Order.Status.CANCELLED:
+                        slot_changes[order.pk] = order
+                        order.cancelled_at = now
+                        order.cancellation_reason = str(payload.get("reason") or "")[:255]
+                    if payload.get("tracking_url"):
+                        order.tracking_url = str(payload["tracking_url"])[:200]
+                    dirty_orders[order.pk] = order
+                else:
+                    event.error_details = f"ignored transition {order.status} -> {target}"
+            elif event.event_type in PAYMENT_STATUS_EVENTS:
+                payment = _resolve(
+                    payload, "payment_id", "external_payment_id", payments_by_id, payments_by_external
+                )
+                if payment is None:
+                    event.status = IntegrationWebhookEvent.ProcessingStatus.FAILED
+                    event.error_details = "payment not found"
+                    result.failed += 1
+                    continue
+                event.related_payment = payment
+                event.related_order_id = payment.order_id
+                if payment.status in _FINAL_PAYMENT_STATUSES:
+                    event.error_details = f"payment already {payment.status}"
+                else:
+                    payment.status = PAYMENT_STATUS_EVENTS[event.event_type]
+                    payment.processed_at = now
+                    payment.webhook_payload = payload
+                    if payment.status == PaymentAttempt.Status.FAILED:
+                        payment.failure_code = str(payload.get("failure_code") or "")[:64]
+                        payment.failure_reason = str(payload.get("failure_reason") or "")[:255]
+                    dirty_payments[payment.pk] = payment
+                    order = orders_by_id.get(payment.order_id)
+                    if order is not None:
+                        booked_before = order.status not in NON_BOOKING_STATUSES
+                        if _apply_payment_to_order(order, payment.status, now):
+                            dirty_orders[order.pk] = order
+                            if booked_before != (order.status not in NON_BOOKING_STATUSES):
+                                slot_changes[order.pk] = order
+            else:
+                event.status = IntegrationWebhookEvent.ProcessingStatus.FAILED
+                event.error_details = f"unsupported event type {event.event_type}"
+                result.failed += 1
+                continue
+
+            result.processed += 1
+
+        if dirty_orders:
+            for order in dirty_orders.values():
+                order.updated_at = now
+            Order.objects.bulk_update(
+                list(dirty_orders.values()),
+                ["status", "paid_at", "cancelled_at", "cancellation_reason", "tracking_url", "updated_at"],
+            )
+            if slot_changes:
+                # bulk_update не шлёт post_save, поэтому пересчёт слотов запускаем вручную.
+                release_slots_for_orders(slot_changes.values())
+        if dirty_payments:
+            for payment in dirty_payments.values():
+                payment.updated_at = now
+            PaymentAttempt.objects.bulk_update(
+                list(dirty_payments.values()),
+                ["status", "processed_at", "webhook_payload", "failure_code", "failure_reason", "updated_at"],
+            )
+        IntegrationWebhookEvent.objects.bulk_update(
+            events,
+            ["status", "processed_at", "error_details", "related_order", "related_payment"],
+        )
+
+    result.orders_updated = len(dirty_orders)
+    result.payments_updated = len(dirty_payments)
+    return result
+
+
+def drain_webhook_queue(*, batch_size: int = DEFAULT_BATCH_SIZE, max_batches: int = 50) -> Dict[str, int]:
+    """Process batches until the queue is empty or ``max_batches`` is reached."""
+    totals = BatchResult()
+    for _ in range(max(1, max_batches)):
+        batch = process_webhook_batch(batch_size=batch_size)
+        for key, value in batch.as_dict().items():
+            setattr(totals, key, getattr(totals, key) + value)
+        if batch.claimed < batch_size:
+            break
+    if totals.claimed:
+        logger.info("Webhook batch processing finished: %s", totals.as_dict())
+    return totals.as_dict()
+
+
+__all__ = [
+    "SIGNATURE_HEADER",
+    "WebhookRejected",
+    "BatchResult",
+    "compute_signature",
+    "verify_signature",
+    "ingest_webhook",
+    "get_delivery_webhook_secret",
+    "get_payment_webhook_secret",
+    "get_webhook_secret",
+    "invalidate_delivery_webhook_secret",
+    "process_webhook_batch",
+    "drain_webhook_queue",
+]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_profile_avatar_preferences_profile_wallet_settings"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="menu_push_claimed_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="menu_push_enabled",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="menu_push_hour",
+            field=models.PositiveSmallIntegerField(default=8, help_text="Локальный час отправки меню"),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="menu_push_last_date",
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="timezone",
+            field=models.CharField(blank=True, help_text="Часовой пояс IANA, например Europe/Moscow; пусто — TIME_ZONE сервера", max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name="profile",
+            index=models.Index(condition=models.Q(("menu_push_enabled", True), ("telegram_id__isnull", False)), fields=["timezone", "menu_push_hour"], name="users_profile_menu_push_idx"),
+        ),
+    ]
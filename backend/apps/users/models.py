@@ -91,8 +91,29 @@ class Profile(models.Model):
     avatar_preferences = models.JSONField(default=_avatar_preferences_default, blank=True)
     wallet_settings = models.JSONField(default=_wallet_settings_default, blank=True)
 
+    # Утренний пуш меню в Telegram
+    timezone = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text="Часовой пояс IANA, например Europe/Moscow; пусто — TIME_ZONE сервера",
+    )
+    menu_push_enabled = models.BooleanField(default=False)
+    menu_push_hour = models.PositiveSmallIntegerField(default=8, help_text="Локальный час отправки меню")
+    menu_push_last_date = models.DateField(null=True, blank=True, editable=False)
+    # Профиль взят рассылкой в работу; день отмечается только после генерации.
+    menu_push_claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["timezone", "menu_push_hour"],
+                name="users_profile_menu_push_idx",
+                condition=models.Q(menu_push_enabled=True, telegram_id__isnull=False),
+            ),
+        ]
+
     def __str__(self):
         return f"Profile<{self.user_id}>"
@@ -0,0 +1,194 @@
+"""Batched profile upsert for the Telegram bot.
+
+The bot syncs wizard results keyed by ``telegram_id``. A batch costs a fixed
+number of queries regardless of its size: one ``SELECT`` of the current
+values, user rows for first-time Telegram users, and one
+``INSERT ... ON CONFLICT (user_id) DO UPDATE`` per distinct set of changed
+fields (Django emits the same statement on Postgres and SQLite). Only the
+columns whose values actually changed are written, and the result lists
+them per profile so callers can invalidate caches precisely.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Tuple
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Profile
+from .tg_auth import invalidate_telegram_user
+
+User = get_user_model()
+
+SYNC_FIELDS: Tuple[str, ...] = (
+    "city",
+    "sex",
+    "birth_date",
+    "height_cm",
+    "weight_kg",
+    "body_fat_pct",
+    "activity_level",
+    "goal",
+    "allergies",
+    "exclusions",
+    "daily_budget",
+    "timezone",
+    "menu_push_enabled",
+    "menu_push_hour",
+)
+MAX_BATCH_SIZE = 500
+
+
+@dataclass
+class ProfileUpsertResult:
+    telegram_id: int
+    user_id: int | None = None
+    created: bool = False
+    changed: List[str] = field(default_factory=list)
+    errors: Dict[str, List[str]] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "telegram_id": self.telegram_id,
+            "user_id": self.user_id,
+            "created": self.created,
+            "changed": self.changed,
+        }
+        if self.errors:
+            payload["errors"] = self.errors
+        return payload
+
+
+def _clean_values(values: Mapping[str, Any]) -> Tuple[Dict[str, Any], Dict[str, List[str]]]:
+    cleaned: Dict[str, Any] = {}
+    errors: Dict[str, List[str]] = {}
+    for name in SYNC_FIELDS:
+        if name not in values:
+            continue
+        model_field = Profile._meta.get_field(name)
+        value = values[name]
+        if value is None and not model_field.null:
+            value = "" if model_field.empty_strings_allowed and model_field.blank else value
+        try:
+            cleaned[name] = model_field.clean(value, None)
+        except ValidationError as exc:
+            errors[name] = list(exc.messages)
+    if "menu_push_hour" in cleaned and cleaned["menu_push_hour"] > 23:
+        errors["menu_push_hour"] = ["Час должен быть от 0 до 23"]
+    return cleaned, errors
+
+
+def _merge_entries(entries: Iterable[Mapping[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Collapse the batch to one set of values per telegram_id; later entries win."""
+    merged: Dict[int, Dict[str, Any]] = {}
+    for entry in entries:
+        tg_id = int(entry["telegram_id"])
+        values = dict(entry.get("profile") or {})
+        if entry.get("city"):
+            values["city"] = entry["city"]
+        merged.setdefault(tg_id, {}).update(values)
+    return merged
+
+
+def _upsert(merged: Dict[int, Dict[str, Any]]) -> List[ProfileUpsertResult]:
+    results: Dict[int, ProfileUpsertResult] = {}
+    cleaned_by_tg: Dict[int, Dict[str, Any]] = {}
+    for tg_id, values in merged.items():
+        result = results[tg_id] = ProfileUpsertResult(telegram_id=tg_id)
+        cleaned, errors = _clean_values(values)
+        if errors:
+            result.errors = errors
+            continue
+        cleaned_by_tg[tg_id] = cleaned
+
+    current = {
+        row["telegram_id"]: row
+        for row in Profile.objects.filter(telegram_id__in=list(cleaned_by_tg)).values(
+            "telegram_id", "user_id", *SYNC_FIELDS
+        )
+    }
+
+    new_ids = [tg_id for tg_id in cleaned_by_tg if tg_id not in current]
+    if new_ids:
+        usernames = {f"tg_{tg_id}": tg_id for tg_id in new_ids}
+        User.objects.bulk_create(
+            [User(username=username, password="!") for username in usernames],  # пароль непригоден для входа
+            ignore_conflicts=True,
+        )
+        user_ids = dict(User.objects.filter(username__in=list(usernames)).values_list("id", "username"))
+        # У пользователя tg_<id> уже может быть профиль без telegram_id — тогда обновляем его.
+        orphan_profiles = {
+            row["user_id"]: row
+            for row in Profile.objects.filter(user_id__in=list(user_ids)).values(
+                "telegram_id", "user_id", *SYNC_FIELDS
+            )
+        }
+        for user_id, username in user_ids.items():
+            tg_id = usernames[username]
+            row = orphan_profiles.get(user_id)
+            if row is None:
+                results[tg_id].created = True
+                row = {"user_id": user_id}
+            current[tg_id] = row
+
+    now = timezone.now()
+    groups: Dict[FrozenSet[str], List[Profile]] = {}
+    for tg_id, cleaned in cleaned_by_tg.items():
+        row = current[tg_id]
+        result = results[tg_id]
+        result.user_id = row["user_id"]
+        if result.created:
+            changed = sorted(cleaned)
+        else:
+            changed = sorted(name for name, value in cleaned.items() if row.get(name) != value)
+            if row.get("telegram_id") != tg_id:
+                changed.append("telegram_id")
+                invalidate_telegram_user(tg_id)
+        result.changed = changed
+        if not changed and not result.created:
+            continue
+        groups.setdefault(frozenset(changed), []).append(
+            Profile(user_id=row["user_id"], telegram_id=tg_id, updated_at=now, **cleaned)
+        )
+
+    for changed, profiles in groups.items():
+        # Новые строки вставляются целиком, у существующих обновляются только изменённые колонки.
+        Profile.objects.bulk_create(
+            profiles,
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=sorted(changed | {"updated_at"}),
+        )
+    return [results[tg_id] for tg_id in merged]
+
+
+def upsert_telegram_profiles(entries: Iterable[Mapping[str, Any]]) -> List[ProfileUpsertResult]:
+    """
+    Create or update profiles by ``telegram_id``.
+
+    ``entries`` are ``{"telegram_id": ..., "profile": {...}, "city": ...}``
+    dicts; unknown profile keys are ignored and invalid values are reported
+    per profile without failing the rest of the batch. A profile of a
+    first-time Telegram user is created together with its ``tg_<id>`` user.
+    """
+    merged = _merge_entries(entries)
+    if not merged:
+        return []
+    try:
+        with transaction.atomic():
+            return _upsert(merged)
+    except IntegrityError:
+        # Параллельный запрос успел создать тех же пользователей — теперь они существующие.
+        with transaction.atomic():
+            return _upsert(merged)
+
+
+__all__ = [
+    "MAX_BATCH_SIZE",
+    "ProfileUpsertResult",
+    "SYNC_FIELDS",
+    "upsert_telegram_profiles",
+]
@@ -1,4 +1,6 @@
 from typing import Any, Dict
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
@@ -200,6 +202,7 @@ class ProfileSerializer(serializers.ModelSerializer):
             "calocoin_balance", "calocoin_rate_rub",
             "experience_level", "experience_level_display",
             "avatar_preferences", "wallet_settings",
+            "timezone", "menu_push_enabled", "menu_push_hour",
             "sidebar_meta",
             "metrics",
             "created_at", "updated_at",
@@ -211,6 +214,19 @@ class ProfileSerializer(serializers.ModelSerializer):
         if not include_user:
             self.fields.pop("user", None)
 
+    def validate_timezone(self, value):
+        if value:
+            try:
+                ZoneInfo(value)
+            except (ZoneInfoNotFoundError, ValueError):
+                raise serializers.ValidationError("Неизвестный часовой пояс")
+        return value
+
+    def validate_menu_push_hour(self, value):
+        if not 0 <= value <= 23:
+            raise serializers.ValidationError("Час должен быть от 0 до 23")
+        return value
+
     def get_experience_level_display(self, obj):
         return obj.get_experience_level_display()
 
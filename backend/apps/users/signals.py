@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from .models import Profile
+from .tg_auth import invalidate_telegram_user
 
 User = get_user_model()
 
@@ -9,3 +10,29 @@ User = get_user_model()
 def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def forget_inactive_telegram_user(sender, instance, created, **kwargs):
+    if not created and not instance.is_active:
+        for tg_id in Profile.objects.filter(user=instance).values_list("telegram_id", flat=True):
+            invalidate_telegram_user(tg_id)
+
+
+@receiver(post_init, sender=Profile)
+def remember_profile_telegram_id(sender, instance, **kwargs):
+    # Через __dict__: при .only()/.defer() не дёргаем отложенное поле отдельным запросом.
+    instance._initial_telegram_id = instance.__dict__.get("telegram_id")
+
+
+@receiver(post_save, sender=Profile)
+def reset_telegram_user_cache(sender, instance, **kwargs):
+    if getattr(instance, "_initial_telegram_id", None) != instance.telegram_id:
+        invalidate_telegram_user(getattr(instance, "_initial_telegram_id", None))
+        invalidate_telegram_user(instance.telegram_id)
+    instance._initial_telegram_id = instance.__dict__.get("telegram_id")
+
+
+@receiver(post_delete, sender=Profile)
+def drop_telegram_user_cache(sender, instance, **kwargs):
+    invalidate_telegram_user(instance.telegram_id)
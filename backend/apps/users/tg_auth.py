@@ -1,13 +1,21 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import FieldDoesNotExist
 from django.db import transaction
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import RefreshToken
-from .tg_utils import verify_init_data
+from .tg_utils import InitDataError, verify_init_data
 
 from .models import Profile
 User = get_user_model()
@@ -19,6 +27,107 @@ except FieldDoesNotExist:  # pragma: no cover - default local setup
     USER_HAS_TELEGRAM_FIELD = False
 
 
+def bot_tokens() -> Tuple[str, ...]:
+    """Current bot token first, then the previous ones still accepted during rotation."""
+    previous = getattr(settings, "TELEGRAM_BOT_TOKENS_PREVIOUS", ()) or ()
+    return tuple(t for t in (getattr(settings, "TELEGRAM_BOT_TOKEN", ""), *previous) if t)
+
+
+_HASH_RE = re.compile(r"(?:^|&)hash=([0-9a-fA-F]{64})(?:&|$)")
+
+
+class VerifiedInitDataCache:
+    """
+    In-process LRU of successfully verified initData, keyed by its hash.
+
+    The Mini App sends the same initData on every launch until Telegram
+    issues a new one, so repeated exchanges skip parsing and HMAC. An entry
+    lives until ``auth_date + max_age`` and is bound to the raw string and
+    the set of accepted tokens, so rotating a token out drops its entries.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[str, Tuple[str, ...], float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, init_data: str, tokens: Tuple[str, ...], now: float) -> Optional[Dict]:
+        match = _HASH_RE.search(init_data)
+        if not match:
+            return None
+        with self._lock:
+            entry = self._entries.get(match.group(1))
+            if entry is None:
+                return None
+            raw, entry_tokens, expires_at, parsed = entry
+            if raw != init_data or entry_tokens != tokens or expires_at < now:
+                return None
+            self._entries.move_to_end(match.group(1))
+            return parsed
+
+    def put(self, init_data: str, tokens: Tuple[str, ...], parsed: Dict, expires_at: float) -> None:
+        match = _HASH_RE.search(init_data)
+        if not match:
+            return
+        with self._lock:
+            self._entries[match.group(1)] = (init_data, tokens, expires_at, parsed)
+            self._entries.move_to_end(match.group(1))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+verified_init_data = VerifiedInitDataCache()
+
+
+def verify_telegram_init_data(init_data: str, *, now: float | None = None) -> Dict:
+    """Verify Mini App initData against the configured bot tokens, reusing recent results."""
+    now = time.time() if now is None else now
+    tokens = bot_tokens()
+    max_age = int(getattr(settings, "TELEGRAM_INIT_DATA_MAX_AGE", 86400) or 0)
+    if isinstance(init_data, str):
+        cached = verified_init_data.get(init_data, tokens, now)
+        if cached is not None:
+            return cached
+    parsed = verify_init_data(init_data, tokens, max_age=max_age or None, now=now)
+    if max_age:
+        verified_init_data.put(init_data, tokens, parsed, int(parsed.get("auth_date") or 0) + max_age)
+    return parsed
+
+
+def _telegram_user_cache_key(tg_id: int) -> str:
+    return f"users:tg:{tg_id}"
+
+
+def invalidate_telegram_user(tg_id: int | None) -> None:
+    if tg_id:
+        cache.delete(_telegram_user_cache_key(tg_id))
+
+
+def cached_telegram_user_id(tg_id: int) -> Optional[int]:
+    return cache.get(_telegram_user_cache_key(tg_id))
+
+
+def remember_telegram_user(tg_id: int, user_id: int) -> None:
+    cache.set(
+        _telegram_user_cache_key(tg_id),
+        user_id,
+        getattr(settings, "TELEGRAM_USER_CACHE_SECONDS", 3600),
+    )
+
+
+def _tokens_for_user_id(user_id: int) -> RefreshToken:
+    # Токен несёт только id; без проверки отзыва по паролю пользователя можно не загружать.
+    if jwt_settings.CHECK_REVOKE_TOKEN:
+        user = User.objects.get(pk=user_id)
+    else:
+        user = User(pk=user_id)
+    return RefreshToken.for_user(user)
+
+
 def _ensure_profile_telegram_id(user, tg_id: int) -> None:
     profile, _ = Profile.objects.get_or_create(user=user)
     if profile.telegram_id != tg_id:
@@ -63,17 +172,15 @@ def tg_exchange(request):
 
     init_data = request.data.get("init_data")
     try:
-        parsed = verify_init_data(
-            init_data, getattr(settings, "TELEGRAM_BOT_TOKEN", "")
-        )
-    except Exception as e:
+        parsed = verify_telegram_init_data(init_data)
+    except InitDataError as e:
         return Response(
             {"detail": f"invalid initData: {e}"},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
     user_json = parsed.get("user")
-    if not user_json:
+    if not isinstance(user_json, dict):
         return Response(
             {"detail": "user missing in initData"},
             status=status.HTTP_400_BAD_REQUEST,
@@ -86,6 +193,12 @@ def tg_exchange(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
+    # Вернувшийся пользователь: id из кэша, токены без запросов в БД.
+    user_id = cached_telegram_user_id(tg_id)
+    if user_id is not None:
+        refresh = _tokens_for_user_id(user_id)
+        return Response({"access": str(refresh.access_token), "refresh": str(refresh)})
+
     # Найдём/создадим пользователя по telegram_id
     username = f"tg_{tg_id}"
     user, created = _get_user_by_telegram_id(tg_id, username)
@@ -93,6 +206,8 @@ def tg_exchange(request):
         user.first_name = user_json.get("first_name") or ""
         user.last_name = user_json.get("last_name") or ""
         user.save(update_fields=["first_name", "last_name"])
+    if user.is_active:
+        remember_telegram_user(tg_id, user.pk)
 
     refresh = RefreshToken.for_user(user)
     return Response({"access": str(refresh.access_token), "refresh": str(refresh)})
@@ -1,33 +1,74 @@
-import hashlib, hmac, json
+import hashlib
+import hmac
+import json
+import time
+from functools import lru_cache
+from typing import Iterable
 from urllib.parse import parse_qsl
 
-def verify_init_data(init_data: str, bot_token: str) -> dict:
+WEBAPP_KEY = b"WebAppData"
+JSON_FIELDS = ("user", "receiver", "chat")
+
+
+class InitDataError(ValueError):
+    pass
+
+
+@lru_cache(maxsize=16)
+def webapp_secret(bot_token: str) -> bytes:
+    """secret_key = HMAC_SHA256(key="WebAppData", msg=bot_token); считается один раз на токен."""
+    return hmac.new(WEBAPP_KEY, bot_token.encode(), hashlib.sha256).digest()
+
+
+def verify_init_data(
+    init_data: str,
+    bot_token: str | Iterable[str],
+    *,
+    max_age: int | None = None,
+    now: float | None = None,
+) -> dict:
     """
-    Проверка по документации Telegram WebApp:
+    Проверка initData по документации Telegram WebApp:
     - data_check_string = join(sorted("{k}={v}")) без 'hash', через '\n'
-    - secret_key = SHA256(bot_token)
-    - hmac_sha256(data_check_string, secret_key) == provided hash (hex)
+    - secret_key = HMAC_SHA256("WebAppData", bot_token)
+    - hmac_sha256(data_check_string, secret_key) == hash (hex)
+
+    ``bot_token`` может быть списком — при ротации подпись проверяется каждым
+    токеном. ``max_age`` (секунды) — допустимый возраст auth_date.
     """
-    if not init_data or not bot_token:
-        raise ValueError("init_data or token missing")
+    tokens = [bot_token] if isinstance(bot_token, str) else [t for t in bot_token if t]
+    if not init_data or not any(tokens):
+        raise InitDataError("init_data or token missing")
+    if not isinstance(init_data, str):
+        raise InitDataError("init_data must be a string")
 
     params = dict(parse_qsl(init_data, keep_blank_values=True))
     received_hash = params.pop("hash", None)
     if not received_hash:
-        raise ValueError("hash missing")
+        raise InitDataError("hash missing")
+
+    data_check = "\n".join(f"{k}={params[k]}" for k in sorted(params)).encode()
+    if not any(
+        hmac.compare_digest(hmac.new(webapp_secret(token), data_check, hashlib.sha256).hexdigest(), received_hash)
+        for token in tokens
+    ):
+        raise InitDataError("hash mismatch")
 
-    data_check = "\n".join(f"{k}={params[k]}" for k in sorted(params.keys()))
-    secret_key = hashlib.sha256(bot_token.encode()).digest()
-    calc_hash = hmac.new(secret_key, data_check.encode(), hashlib.sha256).hexdigest()
-    if calc_hash != received_hash:
-        raise ValueError("hash mismatch")
+    if max_age:
+        try:
+            auth_date = int(params.get("auth_date") or 0)
+        except ValueError:
+            raise InitDataError("auth_date invalid")
+        if auth_date + max_age < (now if now is not None else time.time()):
+            raise InitDataError("auth_date expired")
 
-    # user/json поля
     parsed = {}
     for k, v in params.items():
-        if k in ("user","receiver","chat"):
-          try: parsed[k] = json.loads(v)
-          except Exception: parsed[k] = v
+        if k in JSON_FIELDS:
+            try:
+                parsed[k] = json.loads(v)
+            except ValueError:
+                parsed[k] = v
         else:
-          parsed[k] = v
+            parsed[k] = v
     return parsed
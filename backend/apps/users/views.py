@@ -7,6 +7,7 @@ from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.contrib.auth import get_user_model
+from apps.common.query_budget import query_budget
 from .models import Profile
 from .serializers import (
     ProfileSerializer,
@@ -41,7 +42,7 @@ class MeViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def _get_or_create_profile(self, user):
-        profile, _ = Profile.objects.get_or_create(user=user)
+        profile, _ = Profile.objects.select_related("user").get_or_create(user=user)
         return profile
 
     def _build_me_payload(self, user, profile):
@@ -53,6 +54,7 @@ class MeViewSet(viewsets.ViewSet):
             "metrics": metrics,
         }
 
+    @query_budget(6)
     def me(self, request):
         profile = self._get_or_create_profile(request.user)
         payload = self._build_me_payload(request.user, profile)
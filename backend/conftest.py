@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _strict_query_budgets(settings):
+    # Превышение бюджета запросов или N+1 в любом тесте — падение, а не строчка в логе.
+    settings.QUERY_BUDGET_STRICT = True
+    settings.QUERY_BUDGET_HEADERS = True
@@ -1,6 +1,8 @@
 from pathlib import Path
 import os
 
+from celery.schedules import crontab
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY", "dev-secret")
@@ -25,6 +27,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "apps.common.query_budget.QueryBudgetMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -106,11 +109,57 @@ CSRF_TRUSTED_ORIGINS = CORS_ALLOWED_ORIGINS
 
 CELERY_BROKER_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+CELERY_BEAT_SCHEDULE = {
+    "orders-process-webhook-events": {
+        "task": "orders.process_webhook_events",
+        "schedule": float(os.getenv("ORDERS_WEBHOOK_POLL_SECONDS", "5")),
+    },
+    "orders-bill-due-subscriptions": {
+        "task": "orders.bill_due_subscriptions",
+        "schedule": float(os.getenv("ORDERS_BILLING_POLL_SECONDS", "60")),
+    },
+    "orders-materialize-subscription-orders": {
+        "task": "orders.materialize_subscription_orders",
+        "schedule": crontab(hour=int(os.getenv("ORDERS_MATERIALIZE_HOUR", "2")), minute=0),
+    },
+    "nutrition-dispatch-menu-push": {
+        "task": "nutrition.dispatch_menu_push",
+        "schedule": float(os.getenv("MENU_PUSH_POLL_SECONDS", "300")),
+    },
+    "nutrition-build-plan-library": {
+        "task": "nutrition.build_plan_library",
+        "schedule": crontab(hour=int(os.getenv("PLAN_LIBRARY_HOUR", "3")), minute=30),
+    },
+}
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+# Провайдеры LLM создаются один раз на процесс (apps/nutrition/llm_provider.py::ProviderRegistry);
+# LLM_PROVIDER_CONFIG_FILE, LLM_PROVIDER_RELOAD_SECONDS и LLM_HTTP_POOL_SIZE читаются оттуда же.
+LLM_PROVIDER_RELOAD_SIGNAL = os.getenv("LLM_PROVIDER_RELOAD_SIGNAL", "")
 BOT_INTERNAL_KEY = os.getenv("BOT_INTERNAL_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+# Старые токены бота, initData с их подписью ещё принимаются (ротация), через запятую
+TELEGRAM_BOT_TOKENS_PREVIOUS = [
+    t.strip() for t in os.getenv("TELEGRAM_BOT_TOKENS_PREVIOUS", "").split(",") if t.strip()
+]
+TELEGRAM_INIT_DATA_MAX_AGE = int(os.getenv("TELEGRAM_INIT_DATA_MAX_AGE", "86400"))
+TELEGRAM_USER_CACHE_SECONDS = int(os.getenv("TELEGRAM_USER_CACHE_SECONDS", "3600"))
+PAYMENT_WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+ORDERS_WEBHOOK_BATCH_SIZE = int(os.getenv("ORDERS_WEBHOOK_BATCH_SIZE", "200"))
+ORDERS_WEBHOOK_MAX_BATCHES = int(os.getenv("ORDERS_WEBHOOK_MAX_BATCHES", "50"))
+ORDERS_BILLING_BATCH_SIZE = int(os.getenv("ORDERS_BILLING_BATCH_SIZE", "100"))
+ORDERS_BILLING_MAX_BATCHES = int(os.getenv("ORDERS_BILLING_MAX_BATCHES", "50"))
+ORDERS_MATERIALIZE_CHUNK_SIZE = int(os.getenv("ORDERS_MATERIALIZE_CHUNK_SIZE", "200"))
+MENU_PUSH_REDIS_URL = os.getenv("MENU_PUSH_REDIS_URL", CELERY_BROKER_URL)
+MENU_PUSH_STREAM = os.getenv("MENU_PUSH_STREAM", "menu:push")
+MENU_PUSH_STREAM_MAXLEN = int(os.getenv("MENU_PUSH_STREAM_MAXLEN", "200000"))
+MENU_PUSH_CHUNK_SIZE = int(os.getenv("MENU_PUSH_CHUNK_SIZE", "100"))
+MENU_PUSH_WINDOW_HOURS = int(os.getenv("MENU_PUSH_WINDOW_HOURS", "3"))
+# Через сколько минут профиль, взятый в рассылку, но не отмеченный (задача упала), берётся снова
+MENU_PUSH_CLAIM_TTL_MINUTES = int(os.getenv("MENU_PUSH_CLAIM_TTL_MINUTES", "30"))
+# Сколько пользователей одного города и с одинаковыми ограничениями собирать в один запрос к LLM (1 — по одному)
+MENU_PUSH_LLM_BATCH_SIZE = int(os.getenv("MENU_PUSH_LLM_BATCH_SIZE", "8"))
 
 # Email settings
 EMAIL_BACKEND = os.getenv(
@@ -119,4 +168,57 @@ EMAIL_BACKEND = os.getenv(
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "no-reply@example.com")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
-CATALOG_MINIMUM_AVAILABLE_ITEMS = int(os.getenv("CATALOG_MINIMUM_AVAILABLE_ITEMS", "120"))
\ No newline at end of file
+CATALOG_MINIMUM_AVAILABLE_ITEMS = int(os.getenv("CATALOG_MINIMUM_AVAILABLE_ITEMS", "120"))
+CATALOG_DELTA_SETTLE_SECONDS = float(os.getenv("CATALOG_DELTA_SETTLE_SECONDS", "2"))
+
+# Счётчик запросов к БД на HTTP-запрос (apps/common/query_budget.py)
+QUERY_BUDGET_HEADERS = os.getenv("QUERY_BUDGET_HEADERS", "1" if DEBUG else "0") == "1"
+QUERY_BUDGET_REPEAT_THRESHOLD = int(os.getenv("QUERY_BUDGET_REPEAT_THRESHOLD", "5"))
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "0") == "1"
+
+# Трассировка планировщика меню (apps/nutrition/tracing.py)
+PLANNER_TRACE_BUFFER = int(os.getenv("PLANNER_TRACE_BUFFER", "500"))
+PLANNER_TRACE_SLOW_MS = float(os.getenv("PLANNER_TRACE_SLOW_MS", "2000"))
+PLANNER_TRACE_FILTER_COUNTS = os.getenv("PLANNER_TRACE_FILTER_COUNTS", "0") == "1"
+
+# Библиотека готовых планов по корзинам профилей (apps/nutrition/plan_library.py)
+PLAN_LIBRARY_ENABLED = os.getenv("PLAN_LIBRARY_ENABLED", "1") == "1"
+PLAN_LIBRARY_CALORIE_STEP = int(os.getenv("PLAN_LIBRARY_CALORIE_STEP", "100"))
+PLAN_LIBRARY_MACRO_STEP = int(os.getenv("PLAN_LIBRARY_MACRO_STEP", "5"))
+PLAN_LIBRARY_SIZE = int(os.getenv("PLAN_LIBRARY_SIZE", "500"))
+PLAN_LIBRARY_MIN_PROFILES = int(os.getenv("PLAN_LIBRARY_MIN_PROFILES", "3"))
+# llm — как живая генерация, greedy — детерминированный решатель без обращений к LLM
+PLAN_LIBRARY_SOLVER = os.getenv("PLAN_LIBRARY_SOLVER", "llm")
+
+# Одна генерация на (пользователь, дата, версия профиля) (apps/nutrition/singleflight.py):
+# local — в пределах процесса, redis — между узлами, off — выключено
+PLAN_SINGLE_FLIGHT = os.getenv("PLAN_SINGLE_FLIGHT", "local")
+PLAN_SINGLE_FLIGHT_REDIS_URL = os.getenv("PLAN_SINGLE_FLIGHT_REDIS_URL", CELERY_BROKER_URL)
+PLAN_SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("PLAN_SINGLE_FLIGHT_WAIT_SECONDS", "60"))
+PLAN_SINGLE_FLIGHT_LOCK_SECONDS = float(os.getenv("PLAN_SINGLE_FLIGHT_LOCK_SECONDS", "120"))
+PLAN_SINGLE_FLIGHT_RESULT_SECONDS = float(os.getenv("PLAN_SINGLE_FLIGHT_RESULT_SECONDS", "10"))
+
+# Допуск вызовов LLM: общий семафор и бюджет токенов в минуту (apps/nutrition/llm_governor.py).
+# local — в пределах процесса, redis — на весь кластер, off — без ограничений
+LLM_GOVERNOR_BACKEND = os.getenv("LLM_GOVERNOR_BACKEND", "local")
+LLM_GOVERNOR_REDIS_URL = os.getenv("LLM_GOVERNOR_REDIS_URL", CELERY_BROKER_URL)
+LLM_GOVERNOR_MAX_CONCURRENCY = int(os.getenv("LLM_GOVERNOR_MAX_CONCURRENCY", "8"))
+LLM_GOVERNOR_TPM = int(os.getenv("LLM_GOVERNOR_TPM", "150000"))
+LLM_GOVERNOR_INTERACTIVE_RESERVE = int(os.getenv("LLM_GOVERNOR_INTERACTIVE_RESERVE", "2"))
+LLM_GOVERNOR_LEASE_SECONDS = float(os.getenv("LLM_GOVERNOR_LEASE_SECONDS", "120"))
+# wait — ждать до дедлайна, queue — ждать в очереди по приоритету, shed — сразу на резервный алгоритм
+LLM_GOVERNOR_MODE = os.getenv("LLM_GOVERNOR_MODE", "queue")
+LLM_GOVERNOR_DEADLINE_SECONDS = float(os.getenv("LLM_GOVERNOR_DEADLINE_SECONDS", "3"))
+LLM_GOVERNOR_BATCH_MODE = os.getenv("LLM_GOVERNOR_BATCH_MODE", "queue")
+LLM_GOVERNOR_BATCH_DEADLINE_SECONDS = float(os.getenv("LLM_GOVERNOR_BATCH_DEADLINE_SECONDS", "300"))
+
+# Деградация планировщика (apps/nutrition/degraded_mode.py): при нарушении SLO по задержке
+# или доле ошибок LLM новые планы строит резервный алгоритм, пока зонд не пройдёт успешно
+PLANNER_DEGRADED_ENABLED = os.getenv("PLANNER_DEGRADED_ENABLED", "1") == "1"
+PLANNER_SLO_WINDOW_SECONDS = float(os.getenv("PLANNER_SLO_WINDOW_SECONDS", "60"))
+PLANNER_SLO_MIN_SAMPLES = int(os.getenv("PLANNER_SLO_MIN_SAMPLES", "10"))
+PLANNER_SLO_LATENCY_MS = float(os.getenv("PLANNER_SLO_LATENCY_MS", "8000"))
+PLANNER_SLO_LATENCY_QUANTILE = float(os.getenv("PLANNER_SLO_LATENCY_QUANTILE", "0.9"))
+PLANNER_SLO_ERROR_RATE = float(os.getenv("PLANNER_SLO_ERROR_RATE", "0.5"))
+PLANNER_DEGRADED_COOLDOWN_SECONDS = float(os.getenv("PLANNER_DEGRADED_COOLDOWN_SECONDS", "120"))
+PLANNER_DEGRADED_PROBE_SECONDS = float(os.getenv("PLANNER_DEGRADED_PROBE_SECONDS", "15"))
@@ -0,0 +1,141 @@
+import logging
+from datetime import date
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+from rest_framework.test import APIClient
+
+from apps.catalog.models import MenuItem, Nutrients, Restaurant
+from apps.common.query_budget import QueryBudgetExceeded, QueryBudgetMiddleware, query_budget, sql_shape
+from apps.nutrition.models import MenuPlan
+
+User = get_user_model()
+
+
+def _run(view, settings, *, strict: bool):
+    settings.QUERY_BUDGET_STRICT = strict
+    request = RequestFactory().get("/probe/")
+    middleware = QueryBudgetMiddleware(lambda req: view(req))
+    middleware.process_view(request, view, (), {})
+    return middleware(request)
+
+
+def _n_plus_one_view(request):
+    for user in User.objects.all():
+        list(MenuPlan.objects.filter(user=user))
+    return HttpResponse("ok")
+
+
+@pytest.fixture
+def menu_items(db):
+    restaurant = Restaurant.objects.create(name="Test", city="City")
+    return [
+        MenuItem.objects.create(
+            source="restaurant",
+            source_id=restaurant.id,
+            title=f"Блюдо {idx}",
+            price=100 + idx,
+            nutrients=Nutrients.objects.create(calories=400 + idx, protein=25, fat=12, carbs=40),
+        )
+        for idx in range(8)
+    ]
+
+
+def test_sql_shape_strips_parameters():
+    assert sql_shape('SELECT * FROM "t" WHERE "id" IN (%s, %s, %s) LIMIT 21') == sql_shape(
+        'SELECT * FROM "t" WHERE "id" IN (%s) LIMIT 5'
+    )
+
+
+@pytest.mark.django_db
+def test_repeated_shapes_are_flagged(settings, caplog):
+    for idx in range(6):
+        User.objects.create_user(username=f"u{idx}", password="StrongPass123")
+
+    with caplog.at_level(logging.WARNING, logger="apps.db"):
+        response = _run(_n_plus_one_view, settings, strict=False)
+
+    assert response["X-DB-Queries"] == "7"
+    assert response["X-DB-Repeated"] == "6"
+    [record] = [r for r in caplog.records if r.name == "apps.db"]
+    assert record.db["queries"] == 7
+    assert list(record.db["repeated"].values()) == [6]
+
+    with pytest.raises(QueryBudgetExceeded, match="repeated SQL shapes"):
+        _run(_n_plus_one_view, settings, strict=True)
+
+
+@pytest.mark.django_db
+def test_declared_budget_is_enforced(settings):
+    @query_budget(2)
+    def view(request):
+        for _ in range(3):
+            User.objects.exists()
+        return HttpResponse("ok")
+
+    response = _run(view, settings, strict=False)
+    assert response["X-DB-Budget"] == "2"
+    assert "X-DB-Repeated" not in response
+
+    with pytest.raises(QueryBudgetExceeded, match="3 queries > budget 2"):
+        _run(view, settings, strict=True)
+
+
+@pytest.mark.django_db
+def test_streamed_queries_are_counted_until_the_last_chunk(settings, caplog):
+    @query_budget(2)
+    def view(request):
+        def body():
+            for _ in range(3):
+                yield str(User.objects.exists())
+        return StreamingHttpResponse(body())
+
+    with caplog.at_level(logging.WARNING, logger="apps.db"):
+        response = _run(view, settings, strict=False)
+        assert not caplog.records
+        b"".join(response.streaming_content)
+
+    assert "X-DB-Queries" not in response
+    [record] = [r for r in caplog.records if r.name == "apps.db"]
+    assert record.db["queries"] == 3
+
+    response = _run(view, settings, strict=True)
+    with pytest.raises(QueryBudgetExceeded, match="3 queries > budget 2"):
+        b"".join(response.streaming_content)
+
+
+@pytest.mark.django_db
+def test_catalog_list_fits_budget(menu_items):
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user(username="reader", password="StrongPass123"))
+
+    response = client.get("/api/catalog/items/")
+
+    assert response.status_code == 200
+    assert len(response.json()) == len(menu_items)
+    assert response["X-DB-Budget"] == "2"
+    assert int(response["X-DB-Queries"]) <= 2
+
+
+@pytest.mark.django_db
+def test_plan_history_query_count_does_not_grow_with_plans(menu_items):
+    user = User.objects.create_user(username="planner", password="StrongPass123")
+    for day in range(1, 8):
+        MenuPlan.create_from_payload(
+            user=user,
+            plan_date=date(2024, 5, day),
+            payload={
+                "targets": {"calories": 2000, "protein_g": 120, "fat_g": 70, "carbs_g": 220},
+                "plan": [{"item_id": item.id, "qty": 1, "title": item.title} for item in menu_items[:3]],
+            },
+        )
+    client = APIClient()
+    client.force_authenticate(user)
+
+    response = client.get("/api/nutrition/plans/")
+
+    assert response.status_code == 200
+    assert len(response.json()) == 7
+    assert int(response["X-DB-Queries"]) <= int(response["X-DB-Budget"])
@@ -1,16 +1,32 @@
 import hashlib
 import hmac
 import json
+import time
 from urllib.parse import urlencode
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.users.tg_auth import verified_init_data
+
+
+@pytest.fixture(autouse=True)
+def _clear_auth_caches():
+    cache.clear()
+    verified_init_data.clear()
+    yield
+    cache.clear()
+    verified_init_data.clear()
 
 
 def build_init_data(bot_token: str, payload: dict) -> str:
     data = payload.copy()
     data_check_string = "\n".join(f"{key}={data[key]}" for key in sorted(data))
-    secret_key = hashlib.sha256(bot_token.encode()).digest()
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
     data["hash"] = hmac.new(
         secret_key, data_check_string.encode(), hashlib.sha256
     ).hexdigest()
@@ -22,7 +38,7 @@ def test_tg_exchange_returns_tokens_and_binds_profile(client, settings):
     settings.TELEGRAM_BOT_TOKEN = "bot-token"
     user_payload = {"id": 12345, "first_name": "Иван", "last_name": "Петров"}
     raw_payload = {
-        "auth_date": "1700000000",
+        "auth_date": str(int(time.time())),
         "query_id": "AAEAAQ",
         "user": json.dumps(user_payload, separators=(",", ":"), ensure_ascii=False),
     }
@@ -53,7 +69,7 @@ def test_tg_exchange_reuses_existing_profile(client, settings):
     profile.save(update_fields=["telegram_id"])
 
     raw_payload = {
-        "auth_date": "1700000000",
+        "auth_date": str(int(time.time())),
         "user": json.dumps({"id": 777, "first_name": "Alex"}),
     }
     init_data = build_init_data(settings.TELEGRAM_BOT_TOKEN, raw_payload)
@@ -68,4 +84,95 @@ def test_tg_exchange_reuses_existing_profile(client, settings):
     existing.refresh_from_db()
     assert existing.profile.telegram_id == 777
     assert User.objects.filter(username="existing").count() == 1
-    assert not User.objects.filter(username="tg_777").exists()
\ No newline at end of file
+    assert not User.objects.filter(username="tg_777").exists()
+
+
+@pytest.mark.django_db
+def test_tg_exchange_rejects_legacy_sha256_secret(client, settings):
+    settings.TELEGRAM_BOT_TOKEN = "bot-token"
+    data = {"auth_date": str(int(time.time())), "user": json.dumps({"id": 1})}
+    check = "\n".join(f"{key}={data[key]}" for key in sorted(data))
+    data["hash"] = hmac.new(hashlib.sha256(b"bot-token").digest(), check.encode(), hashlib.sha256).hexdigest()
+
+    response = client.post("/api/users/auth/tg_exchange/", {"init_data": urlencode(data)})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("init_data", [123, ["a"], {"hash": "x"}])
+def test_tg_exchange_rejects_non_string_init_data(client, settings, init_data):
+    settings.TELEGRAM_BOT_TOKEN = "bot-token"
+
+    response = client.post("/api/users/auth/tg_exchange/", {"init_data": init_data}, content_type="application/json")
+
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_tg_exchange_rejects_stale_auth_date(client, settings):
+    settings.TELEGRAM_BOT_TOKEN = "bot-token"
+    settings.TELEGRAM_INIT_DATA_MAX_AGE = 3600
+    init_data = build_init_data(
+        "bot-token", {"auth_date": str(int(time.time()) - 7200), "user": json.dumps({"id": 5})}
+    )
+
+    response = client.post("/api/users/auth/tg_exchange/", {"init_data": init_data})
+
+    assert response.status_code == 400
+    assert "expired" in response.json()["detail"]
+
+
+@pytest.mark.django_db
+def test_tg_exchange_accepts_previous_token_during_rotation(client, settings):
+    settings.TELEGRAM_BOT_TOKEN = "new-token"
+    settings.TELEGRAM_BOT_TOKENS_PREVIOUS = ["old-token"]
+    init_data = build_init_data(
+        "old-token", {"auth_date": str(int(time.time())), "user": json.dumps({"id": 6})}
+    )
+
+    assert client.post("/api/users/auth/tg_exchange/", {"init_data": init_data}).status_code == 200
+
+    settings.TELEGRAM_BOT_TOKENS_PREVIOUS = []
+    assert client.post("/api/users/auth/tg_exchange/", {"init_data": init_data}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_tg_exchange_returning_user_is_query_free(client, settings):
+    settings.TELEGRAM_BOT_TOKEN = "bot-token"
+    init_data = build_init_data(
+        "bot-token", {"auth_date": str(int(time.time())), "user": json.dumps({"id": 4242})}
+    )
+    first = client.post("/api/users/auth/tg_exchange/", {"init_data": init_data})
+    assert first.status_code == 200
+
+    with CaptureQueriesContext(connection) as queries:
+        second = client.post("/api/users/auth/tg_exchange/", {"init_data": init_data})
+
+    assert second.status_code == 200
+    assert len(queries) == 0
+    user = get_user_model().objects.get(username="tg_4242")
+    assert AccessToken(second.json()["access"])["user_id"] == user.id
+
+
+@pytest.mark.django_db
+def test_tg_exchange_cache_follows_telegram_id_changes(client, settings):
+    settings.TELEGRAM_BOT_TOKEN = "bot-token"
+    init_data = build_init_data(
+        "bot-token", {"auth_date": str(int(time.time())), "user": json.dumps({"id": 9001})}
+    )
+    assert client.post("/api/users/auth/tg_exchange/", {"init_data": init_data}).status_code == 200
+    User = get_user_model()
+    first_user = User.objects.get(username="tg_9001")
+
+    # Telegram-аккаунт перепривязали к другому пользователю.
+    profile = first_user.profile
+    profile.telegram_id = None
+    profile.save(update_fields=["telegram_id"])
+    other = User.objects.create_user(username="other", password="StrongPass!1")
+    other.profile.telegram_id = 9001
+    other.profile.save(update_fields=["telegram_id"])
+
+    response = client.post("/api/users/auth/tg_exchange/", {"init_data": init_data})
+    assert response.status_code == 200
+    assert AccessToken(response.json()["access"])["user_id"] == other.id
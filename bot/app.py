@@ -5,11 +5,18 @@ from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.types import BotCommand
 from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from handlers.menu import router as menu_router
 from handlers.profile_wizard import router as wizard_router
 from services.backend import BackendClient
+from services.catalog import CatalogCache
+from services.menu_push import MenuPushConsumer
+from services.outbox import OutboundQueue
+from middlewares.ordering import OrderedConcurrencyMiddleware, RedisOrderQueue
 from middlewares.store import StoreMiddleware
 
 def _clean_backend_url(raw: str) -> str:
@@ -25,6 +32,100 @@ class Config:
     backend_url = _clean_backend_url(os.getenv("BACKEND_URL") or os.getenv("API_BASE") or "http://backend:8000")
     # По-умолчанию на ваш Vite dev-сервер
     webapp_url = os.getenv("WEBAPP_URL", "http://localhost:5173/")
+    backend_user = os.getenv("BOT_BACKEND_USERNAME")
+    backend_pass = os.getenv("BOT_BACKEND_PASSWORD")
+    backend_max_connections = int(os.getenv("BACKEND_MAX_CONNECTIONS", "50"))
+    catalog_snapshot = os.getenv("CATALOG_SNAPSHOT_PATH", "data/catalog.snapshot")
+    catalog_sync_seconds = float(os.getenv("CATALOG_SYNC_SECONDS", "60"))
+    fallback_products_file = os.getenv("FALLBACK_PRODUCTS_FILE", "data/products.json")
+    # polling | webhook
+    mode = os.getenv("BOT_MODE", "polling").lower()
+    redis_url = os.getenv("REDIS_URL")
+    # Сколько хендлеров выполняется одновременно (апдейты одного юзера всегда по очереди)
+    handler_concurrency = int(os.getenv("BOT_HANDLER_CONCURRENCY", "64"))
+    # С REDIS_URL очередь апдейтов пользователя общая для реплик; аренда записи упавшей реплики
+    ordering_lease_seconds = float(os.getenv("BOT_ORDERING_LEASE_SECONDS", "30"))
+    webhook_base_url = (os.getenv("WEBHOOK_BASE_URL") or "").rstrip("/")
+    webhook_path = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+    webhook_secret = os.getenv("WEBHOOK_SECRET") or None
+    webhook_host = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    webhook_port = int(os.getenv("WEBHOOK_PORT", "8080"))
+    # Лимиты исходящих сообщений (Telegram: ~30/с на бота, ~1/с в один чат)
+    outbox_global_rate = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+    outbox_chat_rate = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+    outbox_chat_burst = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+    # Redis stream, куда бэк складывает утренние меню (MENU_PUSH_STREAM на бэке)
+    menu_push_stream = os.getenv("MENU_PUSH_STREAM", "menu:push")
+    # После стольких неудачных доставок сообщение уходит в <stream>:dead
+    menu_push_max_deliveries = int(os.getenv("MENU_PUSH_MAX_DELIVERIES", "5"))
+
+def build_storage(cfg: Config) -> BaseStorage:
+    """FSM в Redis переживает рестарт и общий для всех реплик; без REDIS_URL — в памяти."""
+    if cfg.redis_url:
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+        return RedisStorage.from_url(cfg.redis_url, key_builder=DefaultKeyBuilder(with_bot_id=True))
+    if cfg.mode == "webhook":
+        logging.warning("REDIS_URL не задан — FSM в памяти, несколько реплик бота будут терять состояние.")
+    return MemoryStorage()
+
+
+def build_outbox(cfg: Config, bot: Bot) -> OutboundQueue:
+    """Все отправки бота идут через очередь с лимитами; хендлеры — в интерактивной полосе."""
+    outbox = OutboundQueue(
+        global_rate=cfg.outbox_global_rate,
+        chat_rate=cfg.outbox_chat_rate,
+        chat_burst=cfg.outbox_chat_burst,
+    )
+    bot.session.middleware(outbox.middleware())
+    return outbox
+
+
+def build_dispatcher(
+    cfg: Config,
+    store: BackendClient,
+    catalog: CatalogCache | None,
+    outbox: OutboundQueue | None = None,
+) -> Dispatcher:
+    dp = Dispatcher(storage=build_storage(cfg))
+    shared = None
+    if cfg.redis_url:
+        shared = RedisOrderQueue.from_url(cfg.redis_url, lease=cfg.ordering_lease_seconds)
+    elif cfg.mode == "webhook":
+        logging.warning("REDIS_URL не задан — порядок апдейтов пользователя держится только внутри одной реплики.")
+    ordering = OrderedConcurrencyMiddleware(cfg.handler_concurrency, shared=shared)
+    dp.update.outer_middleware(ordering)
+    dp.shutdown.register(ordering.close)
+    dp.update.middleware(StoreMiddleware(store, cfg.webapp_url, catalog, outbox))
+    dp.include_router(menu_router)
+    dp.include_router(wizard_router)
+    return dp
+
+
+def build_webhook_app(cfg: Config, dp: Dispatcher, bot: Bot) -> web.Application:
+    app = web.Application()
+    # handle_in_background: отвечаем Telegram сразу, обработка — в задачах под семафором.
+    SimpleRequestHandler(dp, bot, secret_token=cfg.webhook_secret).register(app, path=cfg.webhook_path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(cfg: Config, dp: Dispatcher, bot: Bot) -> None:
+    if not cfg.webhook_base_url:
+        raise RuntimeError("WEBHOOK_BASE_URL is not set")
+
+    async def on_startup(bot: Bot) -> None:
+        await bot.set_webhook(f"{cfg.webhook_base_url}{cfg.webhook_path}", secret_token=cfg.webhook_secret)
+
+    dp.startup.register(on_startup)
+    runner = web.AppRunner(build_webhook_app(cfg, dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, cfg.webhook_host, cfg.webhook_port).start()
+    logging.info("Bot started in WEBHOOK mode on %s:%s%s", cfg.webhook_host, cfg.webhook_port, cfg.webhook_path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 
 async def main() -> None:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s:%(name)s:%(message)s")
@@ -38,21 +139,43 @@ async def main() -> None:
         logging.warning("WEBAPP_URL='%s' не HTTPS — кнопка WebApp будет скрыта, используем обычную ссылку.", cfg.webapp_url)
 
     bot = Bot(cfg.token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
-
-    store = BackendClient(cfg.backend_url, cfg.bot_key)
-    dp.update.middleware(StoreMiddleware(store, cfg.webapp_url))
 
-    dp.include_router(menu_router)
-    dp.include_router(wizard_router)
+    # Один пул соединений к бэку на весь процесс — его получают все хендлеры через middleware.
+    store = BackendClient(
+        cfg.backend_url,
+        cfg.bot_key,
+        username=cfg.backend_user,
+        password=cfg.backend_pass,
+        max_connections=cfg.backend_max_connections,
+    )
+    catalog = CatalogCache(store, cfg.catalog_snapshot, fallback_file=cfg.fallback_products_file)
+    logging.info("Catalog warm start: %s items (version=%r)", catalog.warm_start(), catalog.version)
+    catalog.start(cfg.catalog_sync_seconds)
+    outbox = build_outbox(cfg, bot)
+    outbox.start()
+    dp = build_dispatcher(cfg, store, catalog, outbox)
+    menu_push = None
+    if cfg.redis_url:
+        menu_push = MenuPushConsumer(
+            cfg.redis_url, bot, outbox, stream=cfg.menu_push_stream, max_deliveries=cfg.menu_push_max_deliveries
+        )
+        menu_push.start()
 
     await bot.set_my_commands([BotCommand(command="start", description="Запуск и меню")])
 
-    logging.info("Bot started in POLLING mode")
     try:
-        await dp.start_polling(bot)
+        if cfg.mode == "webhook":
+            await run_webhook(cfg, dp, bot)
+        else:
+            logging.info("Bot started in POLLING mode")
+            await dp.start_polling(bot)
     finally:
+        if menu_push is not None:
+            await menu_push.stop()
+        await outbox.stop()
+        await catalog.stop()
         await store.close()
+        await dp.storage.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
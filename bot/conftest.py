@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Бот запускается из своей папки (``python app.py``) и импортирует services/handlers от неё.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
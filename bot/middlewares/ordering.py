@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject
+
+try:
+    from redis import asyncio as aioredis
+except Exception:
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+# Голова очереди ключа; записи, чья аренда истекла (реплика упала), выкидываются.
+_HEAD_SCRIPT = """
+while true do
+  local head = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+  if not head then return false end
+  if redis.call('EXISTS', ARGV[1] .. head) == 1 then return head end
+  redis.call('ZREM', KEYS[1], head)
+end
+"""
+
+
+class RedisOrderQueue:
+    """
+    Общая для всех реплик очередь апдейтов одного пользователя.
+
+    Апдейт встаёт в sorted set ключа со своим ``update_id`` (Telegram выдаёт
+    их по возрастанию) и ждёт, пока не станет головой: так апдейты одного
+    пользователя обрабатываются по очереди, на какую бы реплику их ни прислал
+    балансировщик. Каждая запись держит аренду с TTL и продлевает её, пока
+    ждёт или работает; если реплика упала, аренда истекает и очередь идёт дальше.
+    """
+
+    def __init__(
+        self,
+        redis: Any,
+        *,
+        prefix: str = "bot:order",
+        lease: float = 30.0,
+        poll: float = 0.02,
+        max_poll: float = 0.2,
+    ):
+        self.redis = redis
+        self.prefix = prefix
+        self.lease_ms = int(lease * 1000)
+        self.poll = poll
+        self.max_poll = max_poll
+        self._head = redis.register_script(_HEAD_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisOrderQueue":
+        if aioredis is None:
+            raise RuntimeError("redis не установлен")
+        return cls(aioredis.from_url(url), **kwargs)
+
+    def _keys(self, key: Hashable) -> tuple[str, str]:
+        # Хэштег держит очередь и аренды ключа в одном слоте Redis Cluster.
+        tag = "{" + ":".join(str(part) for part in key) + "}"
+        return f"{self.prefix}:{tag}", f"{self.prefix}:{tag}:lease:"
+
+    async def _keep_lease(self, queue: str, lease: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            try:
+                await self.redis.set(lease, 1, px=self.lease_ms)
+                await self.redis.pexpire(queue, self.lease_ms * 2)
+            except Exception:
+                log.warning("Не удалось продлить аренду %s", lease, exc_info=True)
+
+    @contextlib.asynccontextmanager
+    async def turn(self, key: Hashable, ticket: int) -> AsyncIterator[None]:
+        queue, lease_prefix = self._keys(key)
+        member = str(ticket)
+        lease = lease_prefix + member
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.set(lease, 1, px=self.lease_ms)
+        pipe.zadd(queue, {member: ticket})
+        pipe.pexpire(queue, self.lease_ms * 2)
+        await pipe.execute()
+        keeper = asyncio.create_task(self._keep_lease(queue, lease))
+        try:
+            delay = self.poll
+            while True:
+                head = await self._head(keys=[queue], args=[lease_prefix])
+                if head is not None and (head.decode() if isinstance(head, bytes) else head) == member:
+                    break
+                await asyncio.sleep(delay)
+                delay = min(self.max_poll, delay * 2)
+            yield
+        finally:
+            keeper.cancel()
+            with contextlib.suppress(Exception):
+                pipe = self.redis.pipeline(transaction=True)
+                pipe.zrem(queue, member)
+                pipe.delete(lease)
+                await pipe.execute()
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class OrderedConcurrencyMiddleware(BaseMiddleware):
+    """
+    Ограничивает параллелизм хендлеров и сохраняет порядок апдейтов одного пользователя.
+
+    Вешается outer-middleware на ``dp.update``. Апдейты разных пользователей идут
+    параллельно (не больше ``limit`` одновременно), апдейты одного — строго по
+    очереди: asyncio.Lock отдаёт замок в порядке ожидания, а задачи на апдейты
+    aiogram создаёт в порядке поступления. Замок берётся до семафора, чтобы
+    очередь одного пользователя не занимала слоты, пока ждёт.
+
+    Замки в памяти держат порядок только внутри процесса. С ``shared``
+    (:class:`RedisOrderQueue`) очередь пользователя общая для всех реплик
+    webhook-режима; семафор по-прежнему ограничивает параллелизм каждой реплики.
+    """
+
+    def __init__(self, limit: int = 64, shared: RedisOrderQueue | None = None):
+        super().__init__()
+        self.limit = limit
+        self.shared = shared
+        self._sem = asyncio.Semaphore(limit)
+        self._locks: Dict[Hashable, list] = {}  # key -> [Lock, число ожидающих]
+
+    @staticmethod
+    def _key(data: Dict[str, Any]) -> Hashable:
+        user = data.get("event_from_user")
+        if user is not None:
+            return "u", user.id
+        chat = data.get("event_chat")
+        if chat is not None:
+            return "c", chat.id
+        return None
+
+    @property
+    def active_keys(self) -> int:
+        return len(self._locks)
+
+    async def close(self) -> None:
+        if self.shared is not None:
+            await self.shared.close()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = self._key(data)
+        if key is None:
+            async with self._sem:
+                return await handler(event, data)
+
+        ticket = getattr(event, "update_id", None)
+        if self.shared is not None and ticket is not None:
+            async with self.shared.turn(key, ticket):
+                async with self._sem:
+                    return await handler(event, data)
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._sem:
+                    return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
@@ -1,13 +1,17 @@
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
 
 class StoreMiddleware(BaseMiddleware):
-    def __init__(self, store, webapp_url: str):
+    def __init__(self, store, webapp_url: str, catalog=None, outbox=None):
         super().__init__()
         self.store = store
         self.webapp_url = webapp_url
+        self.catalog = catalog
+        self.outbox = outbox
 
     async def __call__(self, handler, event, data):
         # кладём зависимости в data — aiogram передаст их по именам параметров хендлеров
         data["store"] = self.store
         data["webapp_url"] = self.webapp_url
+        data["catalog"] = self.catalog
+        data["outbox"] = self.outbox
         return await handler(event, data)
@@ -1,28 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import asdict, is_dataclass
+from typing import Any, List, Optional
+
 import httpx
-from typing import Optional
+
+from .models import MenuItem, MenuPlanPayload, Profile
+
+log = logging.getLogger(__name__)
+
 
 class BackendClient:
-    """Простой async-клиент для нашего Django-бэка с X-Bot-Key."""
-    def __init__(self, base_url: str, bot_key: str, timeout: float = 15.0):
+    """
+    Общий async-клиент бота к Django-бэку.
+
+    Один ``httpx.AsyncClient`` на процесс: пул соединений с keep-alive, так что
+    параллельные апдейты Telegram переиспользуют TCP/TLS-сессии. Бот-эндпоинты
+    авторизуются заголовком X-Bot-Key, остальные — JWT сервисного пользователя,
+    access-токен обновляется через /users/auth/refresh/ при 401.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        bot_key: str,
+        *,
+        username: str | None = None,
+        password: str | None = None,
+        timeout: float = 15.0,
+        max_connections: int = 50,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+    ):
         self.base_url = base_url.rstrip("/")
         self.bot_key = bot_key
+        self.username = username
+        self.password = password
         self._timeout = timeout
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
         self._client: Optional[httpx.AsyncClient] = None
+        self._access: Optional[str] = None
+        self._refresh: Optional[str] = None
+        self._auth_lock = asyncio.Lock()
 
-    async def _cli(self) -> httpx.AsyncClient:
-        if self._client is None:
-            self._client = httpx.AsyncClient(timeout=self._timeout, headers={"X-Bot-Key": self.bot_key})
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self._timeout,
+                limits=self._limits,
+                headers={"X-Bot-Key": self.bot_key},
+            )
         return self._client
 
+    # --- JWT ---------------------------------------------------------------
+
+    async def _login(self) -> None:
+        if not (self.username and self.password):
+            raise RuntimeError("BOT_BACKEND_USERNAME/BOT_BACKEND_PASSWORD не заданы")
+        r = await self.client.post(
+            "/api/users/auth/token/",
+            json={"username": self.username, "password": self.password},
+        )
+        r.raise_for_status()
+        data = r.json()
+        self._access, self._refresh = data["access"], data.get("refresh")
+
+    async def _renew(self, stale: Optional[str]) -> None:
+        # Под замком: из пачки параллельных 401 токен обновляет только первый.
+        async with self._auth_lock:
+            if self._access and self._access != stale:
+                return
+            if self._refresh:
+                r = await self.client.post("/api/users/auth/refresh/", json={"refresh": self._refresh})
+                if r.status_code == 200:
+                    data = r.json()
+                    self._access = data["access"]
+                    self._refresh = data.get("refresh", self._refresh)
+                    return
+                log.info("JWT refresh rejected (%s), logging in again", r.status_code)
+            await self._login()
+
+    async def _request(self, method: str, path: str, *, jwt: bool = False, **kwargs: Any) -> httpx.Response:
+        if not jwt:
+            return await self.client.request(method, path, **kwargs)
+        if self._access is None:
+            await self._renew(None)
+        for attempt in range(2):
+            token = self._access
+            r = await self.client.request(
+                method, path, headers={"Authorization": f"Bearer {token}"}, **kwargs
+            )
+            if r.status_code != 401 or attempt:
+                return r
+            await self._renew(token)
+        return r
+
+    # --- API ---------------------------------------------------------------
+
     async def ping(self) -> bool:
         try:
-            cli = await self._cli()
-            r = await cli.get(f"{self.base_url}/api/nutrition/ping/")
+            r = await self._request("GET", "/api/nutrition/ping/")
             return r.status_code == 200
-        except Exception:
+        except httpx.HTTPError:
             return False
 
+    async def upsert_profile(self, telegram_id: int, profile: Profile | dict, city: str | None = None) -> int:
+        """Создаёт/обновляет профиль пользователя Telegram, возвращает user_id."""
+        body: dict[str, Any] = {
+            "telegram_id": telegram_id,
+            "profile": asdict(profile) if is_dataclass(profile) else dict(profile),
+        }
+        if city:
+            body["city"] = city
+        r = await self._request("POST", "/api/nutrition/bot/upsert_profile/", json=body)
+        r.raise_for_status()
+        return int(r.json()["user_id"])
+
+    async def upsert_profiles(self, entries: List[dict]) -> List[dict]:
+        """
+        Пачка профилей одним запросом: [{"telegram_id", "profile", "city"?}, ...].
+
+        Для каждого возвращает user_id, created, changed (изменившиеся поля) и errors, если есть.
+        """
+        body = [
+            {**entry, "profile": asdict(entry["profile"]) if is_dataclass(entry["profile"]) else entry["profile"]}
+            for entry in entries
+        ]
+        r = await self._request("POST", "/api/nutrition/bot/upsert_profile/", json={"profiles": body})
+        r.raise_for_status()
+        return r.json()["results"]
+
+    async def generate_plan(self, telegram_id: int) -> MenuPlanPayload:
+        """Генерирует и сохраняет меню на сегодня."""
+        r = await self._request("POST", "/api/nutrition/bot/generate/", json={"telegram_id": telegram_id})
+        r.raise_for_status()
+        return r.json()
+
+    async def list_plans(self, telegram_id: int, *, limit: int = 7, date: str | None = None) -> List[MenuPlanPayload]:
+        """Последние планы пользователя, новые первыми."""
+        params: dict[str, Any] = {"telegram_id": telegram_id, "limit": limit}
+        if date:
+            params["date"] = date
+        r = await self._request("GET", "/api/nutrition/bot/plans/", params=params)
+        r.raise_for_status()
+        return r.json()
+
+    async def delivery_slots(self, city: str, days: int = 7) -> list[dict]:
+        """Открытые слоты доставки по дням: [{"date": ..., "slots": [...]}, ...]."""
+        r = await self._request("GET", "/api/orders/delivery/slots/", params={"city": city, "days": days})
+        r.raise_for_status()
+        return r.json().get("days", [])
+
+    async def fetch_catalog_delta(self, since: str = "", *, limit: int = 1000) -> dict:
+        """Изменения каталога после версии ``since`` (пустая — полный снапшот)."""
+        r = await self._request("GET", "/api/catalog/items/delta/", params={"since": since, "limit": limit})
+        r.raise_for_status()
+        return r.json()
+
+    async def fetch_items(self) -> List[MenuItem]:
+        """Каталог блюд (под JWT сервисного пользователя)."""
+        r = await self._request("GET", "/api/catalog/items/", jwt=True)
+        if r.status_code != 200:
+            raise RuntimeError(f"backend catalog/items status={r.status_code}")
+        return [_item_from_json(row) for row in r.json()]
+
     async def close(self):
-        if self._client:
+        if self._client is not None:
             await self._client.aclose()
             self._client = None
+
+
+def _item_from_json(r: dict) -> MenuItem:
+    n = r["nutrients"]
+    return MenuItem(
+        id=r["id"],
+        title=r["title"],
+        price=r.get("price", 0),
+        tags=r.get("tags", []),
+        allergens=r.get("allergens", []),
+        exclusions=r.get("exclusions", []),
+        nutrients={
+            "calories": n["calories"],
+            "protein": n["protein"],
+            "fat": n["fat"],
+            "carbs": n["carbs"],
+            "fiber": n.get("fiber", 0),
+            "sodium": n.get("sodium", 0),
+        },
+    )
+
+
+def load_local_items(path: str) -> List[MenuItem]:
+    """Фоллбек-каталог из JSON-файла рядом с ботом."""
+    p = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", path))
+    with open(p, "r", encoding="utf-8") as f:
+        arr = json.load(f)
+    return [
+        MenuItem(
+            id=int(r.get("id") or r["source_id"]),
+            title=r["title"], price=r.get("price", 0),
+            tags=r.get("tags", []), allergens=r.get("allergens", []), exclusions=r.get("exclusions", []),
+            nutrients=r["nutrients"],
+        )
+        for r in arr
+    ]
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import struct
+import zlib
+from typing import Dict, List, Optional
+
+from .backend import BackendClient, _item_from_json, load_local_items
+from .models import MenuItem
+
+log = logging.getLogger(__name__)
+
+# Снапшот: MAGIC + версия схемы, дальше zlib-сжатое тело:
+#   H len + версия каталога (utf-8), I количество позиций,
+#   на каждую позицию — _ITEM (id, price, 6 нутриентов) и четыре строки с H-длиной:
+#   title, tags, allergens, exclusions (списки склеены через \x1f).
+SNAPSHOT_MAGIC = b"NBCAT"
+SNAPSHOT_SCHEMA = 1
+_ITEM = struct.Struct("<II6f")
+_LEN = struct.Struct("<H")
+_COUNT = struct.Struct("<I")
+_SEP = "\x1f"
+_NUTRIENTS = ("calories", "protein", "fat", "carbs", "fiber", "sodium")
+
+
+def _pack_str(value: str) -> bytes:
+    raw = value.encode("utf-8")[:0xFFFF]
+    return _LEN.pack(len(raw)) + raw
+
+
+def _unpack_str(buf: memoryview, offset: int) -> tuple[str, int]:
+    (size,) = _LEN.unpack_from(buf, offset)
+    offset += _LEN.size
+    return bytes(buf[offset:offset + size]).decode("utf-8"), offset + size
+
+
+def dump_snapshot(version: str, items: List[MenuItem]) -> bytes:
+    parts = [_pack_str(version), _COUNT.pack(len(items))]
+    for it in items:
+        parts.append(_ITEM.pack(it.id, int(it.price or 0), *(float(it.nutrients.get(k, 0) or 0) for k in _NUTRIENTS)))
+        parts.append(_pack_str(it.title))
+        for values in (it.tags, it.allergens, it.exclusions):
+            parts.append(_pack_str(_SEP.join(values)))
+    header = SNAPSHOT_MAGIC + bytes([SNAPSHOT_SCHEMA])
+    return header + zlib.compress(b"".join(parts), 6)
+
+
+def load_snapshot(data: bytes) -> tuple[str, List[MenuItem]]:
+    header = SNAPSHOT_MAGIC + bytes([SNAPSHOT_SCHEMA])
+    if not data.startswith(header):
+        raise ValueError("unknown catalog snapshot format")
+    buf = memoryview(zlib.decompress(data[len(header):]))
+    version, offset = _unpack_str(buf, 0)
+    (count,) = _COUNT.unpack_from(buf, offset)
+    offset += _COUNT.size
+    items: List[MenuItem] = []
+    for _ in range(count):
+        item_id, price, *nutrients = _ITEM.unpack_from(buf, offset)
+        offset += _ITEM.size
+        title, offset = _unpack_str(buf, offset)
+        lists = []
+        for _ in range(3):
+            raw, offset = _unpack_str(buf, offset)
+            lists.append(raw.split(_SEP) if raw else [])
+        items.append(MenuItem(
+            id=item_id, title=title, price=price,
+            tags=lists[0], allergens=lists[1], exclusions=lists[2],
+            nutrients=dict(zip(_NUTRIENTS, nutrients)),
+        ))
+    return version, items
+
+
+class CatalogCache:
+    """
+    Каталог блюд в памяти бота для офлайн-планировщика.
+
+    Старт — из бинарного снапшота на диске (или из JSON-фоллбека), дальше
+    периодически подтягиваем с бэка только изменения после своей версии
+    (/api/catalog/items/delta/) и перезаписываем снапшот, если что-то поменялось.
+    """
+
+    def __init__(self, client: BackendClient, snapshot_path: str, *, fallback_file: str | None = None,
+                 page_size: int = 1000):
+        self.client = client
+        if not os.path.isabs(snapshot_path):
+            snapshot_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", snapshot_path))
+        self.snapshot_path = snapshot_path
+        self.fallback_file = fallback_file
+        self.page_size = page_size
+        self.version = ""
+        self._items: Dict[int, MenuItem] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def items(self) -> List[MenuItem]:
+        return list(self._items.values())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def warm_start(self) -> int:
+        """Поднимает каталог с диска без сети; возвращает число позиций."""
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                self.version, items = load_snapshot(f.read())
+        except FileNotFoundError:
+            items = []
+        except (ValueError, zlib.error, struct.error) as exc:
+            log.warning("Catalog snapshot %s is unreadable: %s", self.snapshot_path, exc)
+            items = []
+        if not items and self.fallback_file:
+            # Версии у фоллбека нет — первая синхронизация заменит его целиком.
+            self.version = ""
+            items = load_local_items(self.fallback_file)
+        self._items = {it.id: it for it in items}
+        return len(self._items)
+
+    def save(self) -> None:
+        tmp = f"{self.snapshot_path}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(dump_snapshot(self.version, self.items()))
+        os.replace(tmp, self.snapshot_path)
+
+    async def sync(self) -> int:
+        """Догоняет бэк по дельтам; возвращает число изменённых позиций."""
+        since, changed = self.version, 0
+        fresh: Dict[int, MenuItem] | None = None
+        while True:
+            page = await self.client.fetch_catalog_delta(since, limit=self.page_size)
+            if page.get("full") and fresh is None:
+                fresh = {}
+            target = fresh if fresh is not None else self._items
+            for row in page["items"]:
+                target[row["id"]] = _item_from_json(row)
+            for item_id in page["removed"]:
+                target.pop(item_id, None)
+            changed += len(page["items"]) + len(page["removed"])
+            since = page["version"]
+            if not page.get("has_more"):
+                break
+        if fresh is not None:
+            self._items = fresh
+        if since != self.version or fresh is not None:
+            self.version = since
+            self.save()
+        return changed
+
+    async def run_periodic(self, interval: float) -> None:
+        while True:
+            try:
+                changed = await self.sync()
+                if changed:
+                    log.info("Catalog synced: %s changes, %s items, version=%s", changed, len(self), self.version)
+            except Exception:  # сеть/бэк недоступны — работаем на том, что есть
+                log.exception("Catalog sync failed")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run_periodic(interval))
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
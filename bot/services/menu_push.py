@@ -0,0 +1,254 @@
+import asyncio
+import html
+import json
+import logging
+import os
+import socket
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from .outbox import OutboundQueue, Priority
+
+try:
+    from redis import asyncio as aioredis
+    from redis.exceptions import RedisError, ResponseError
+except Exception:
+    aioredis = None
+    RedisError = ResponseError = Exception
+
+log = logging.getLogger(__name__)
+
+TIME_HINTS = {
+    "breakfast": "завтрак",
+    "lunch": "обед",
+    "dinner": "ужин",
+    "snack": "перекус",
+}
+
+
+def format_menu_push(message: dict) -> str:
+    """Текст утреннего пуша из сообщения бэка (apps/nutrition/push.py::build_push_message)."""
+    day = message.get("date", "")
+    if len(day) == 10:
+        day = f"{day[8:10]}.{day[5:7]}"
+    lines = [f"🍽 <b>Меню на {day}</b>"]
+    targets = message.get("targets") or {}
+    if targets.get("calories"):
+        lines.append(
+            f"Цель: {targets['calories']} ккал · Б {targets.get('protein_g', 0)}"
+            f" · Ж {targets.get('fat_g', 0)} · У {targets.get('carbs_g', 0)}"
+        )
+    lines.append("")
+    for meal in message.get("plan") or []:
+        qty = meal.get("qty", 1)
+        qty_text = f" ×{qty:g}" if isinstance(qty, (int, float)) and qty != 1 else ""
+        hint = TIME_HINTS.get(meal.get("time_hint") or "")
+        hint_text = f" <i>({hint})</i>" if hint else ""
+        lines.append(f"• {html.escape(meal.get('title') or '—')}{qty_text}{hint_text}")
+    if not message.get("plan"):
+        lines.append("Сегодня подобрать блюда не получилось — загляните в кабинет.")
+    return "\n".join(lines)
+
+
+class MenuPushConsumer:
+    """
+    Читает готовые планы из Redis stream бэка и рассылает их через OutboundQueue.
+
+    Бэк пишет в stream по мере генерации, бот забирает consumer group'ой и
+    сразу отправляет в массовой полосе — генерация и отправка идут
+    параллельно. Сообщение подтверждается (XACK) после отправки или
+    окончательной ошибки Telegram (бот заблокирован и т.п.); неподтверждённые
+    после рестарта дочитываются. Раз в ``reclaim_interval`` секунд XAUTOCLAIM
+    забирает сообщения, которые висят дольше ``claim_idle_ms`` — упавшие
+    отправки этой реплики и брошенные другими. После ``max_deliveries``
+    попыток сообщение уходит в dead-letter stream ``<stream>:dead`` и
+    подтверждается, чтобы не крутиться вечно.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        bot: Bot,
+        outbox: OutboundQueue,
+        *,
+        stream: str = "menu:push",
+        group: str = "bot",
+        consumer: str | None = None,
+        batch_size: int = 200,
+        max_pending: int = 2000,
+        claim_idle_ms: int = 10 * 60 * 1000,
+        reclaim_interval: float = 60.0,
+        max_deliveries: int = 5,
+        dead_stream: str | None = None,
+        dead_maxlen: int = 10_000,
+    ):
+        self.redis_url = redis_url
+        self.bot = bot
+        self.outbox = outbox
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.claim_idle_ms = claim_idle_ms
+        self.reclaim_interval = reclaim_interval
+        self.max_deliveries = max_deliveries
+        self.dead_stream = dead_stream or f"{stream}:dead"
+        self.dead_maxlen = dead_maxlen
+        self._slots = asyncio.Semaphore(max_pending)
+        self._r = None
+        self._task: Optional[asyncio.Task] = None
+        self._sends: set[asyncio.Task] = set()
+        self._inflight: set = set()  # id сообщений, которые сейчас отправляются этой репликой
+        self.stats = {"sent": 0, "dropped": 0, "errors": 0, "dead": 0}
+
+    async def _ensure_group(self) -> None:
+        try:
+            await self._r.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+
+    async def _deliver(self, msg_id, fields) -> None:
+        try:
+            message = json.loads(fields[b"data"])
+            await self.outbox.send_message(
+                int(message["telegram_id"]), format_menu_push(message), bot=self.bot, priority=Priority.BULK,
+            )
+            self.stats["sent"] += 1
+        except (TelegramForbiddenError, TelegramBadRequest, KeyError, ValueError) as exc:
+            # Повторять бессмысленно: пользователь заблокировал бота или сообщение битое.
+            log.info("Menu push %s dropped: %s", msg_id, exc)
+            self.stats["dropped"] += 1
+        except Exception:
+            # Не подтверждаем — сообщение останется в pending и будет дочитано.
+            log.exception("Menu push %s failed", msg_id)
+            self.stats["errors"] += 1
+            return
+        finally:
+            self._slots.release()
+            self._inflight.discard(msg_id)
+        await self._r.xack(self.stream, self.group, msg_id)
+
+    async def _spawn(self, entries) -> None:
+        for msg_id, fields in entries:
+            if msg_id in self._inflight:
+                # Отправка ещё идёт (долго ждёт в очереди OutboundQueue) — второй раз не шлём.
+                continue
+            await self._slots.acquire()
+            self._inflight.add(msg_id)
+            task = asyncio.create_task(self._deliver(msg_id, fields))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _admit(self, entries) -> list:
+        """Повторно доставляемые сообщения: исчерпавшие попытки — в dead-letter, остальные — в отправку."""
+        if not entries:
+            return []
+        pending = await self._r.xpending_range(
+            self.stream, self.group, min=entries[0][0], max=entries[-1][0],
+            count=len(entries), consumername=self.consumer,
+        )
+        deliveries = {row["message_id"]: row["times_delivered"] for row in pending}
+        admitted, dead = [], []
+        for msg_id, fields in entries:
+            if not fields:
+                dead.append((msg_id, {}, deliveries.get(msg_id, 0)))  # запись уже вычищена из stream
+            elif deliveries.get(msg_id, 0) > self.max_deliveries:
+                dead.append((msg_id, fields, deliveries[msg_id]))
+            else:
+                admitted.append((msg_id, fields))
+        if dead:
+            pipe = self._r.pipeline(transaction=False)
+            for msg_id, fields, count in dead:
+                if fields:
+                    pipe.xadd(
+                        self.dead_stream,
+                        {"data": fields.get(b"data", b""), "source_id": msg_id, "deliveries": count},
+                        maxlen=self.dead_maxlen,
+                        approximate=True,
+                    )
+                pipe.xack(self.stream, self.group, msg_id)
+            await pipe.execute()
+            self.stats["dead"] += sum(1 for _, fields, _ in dead if fields)
+            log.warning("Menu push: %s messages moved to %s", len(dead), self.dead_stream)
+        return admitted
+
+    async def _reclaim(self) -> None:
+        """Забрать сообщения, зависшие дольше claim_idle_ms, — свои упавшие и брошенные другими."""
+        start = "0-0"
+        while True:
+            next_start, claimed, *_ = await self._r.xautoclaim(
+                self.stream, self.group, self.consumer, self.claim_idle_ms, start_id=start, count=self.batch_size
+            )
+            await self._spawn(await self._admit(claimed))
+            if next_start in (b"0-0", "0-0"):
+                break
+            start = next_start
+
+    async def _recover(self) -> None:
+        # Свои неподтверждённые (рестарт) и зависшие у других консьюмеров.
+        start = "0"
+        while True:
+            resp = await self._r.xreadgroup(self.group, self.consumer, {self.stream: start}, count=self.batch_size)
+            entries = resp[0][1] if resp else []
+            if not entries:
+                break
+            await self._spawn(await self._admit(entries))
+            start = entries[-1][0]
+        await self._reclaim()
+
+    async def run(self) -> None:
+        if aioredis is None:
+            raise RuntimeError("redis не установлен")
+        self._r = aioredis.from_url(self.redis_url)
+        loop = asyncio.get_running_loop()
+        recovered = False
+        next_reclaim = 0.0
+        while True:
+            try:
+                if not recovered:
+                    # Redis может быть недоступен на старте — повторяем, как и чтение.
+                    await self._ensure_group()
+                    await self._recover()
+                    recovered = True
+                    next_reclaim = loop.time() + self.reclaim_interval
+                elif loop.time() >= next_reclaim:
+                    next_reclaim = loop.time() + self.reclaim_interval
+                    await self._reclaim()
+                resp = await self._r.xreadgroup(
+                    self.group, self.consumer, {self.stream: ">"}, count=self.batch_size, block=5000
+                )
+            except RedisError:
+                log.exception("Menu push stream read failed")
+                await asyncio.sleep(5)
+                continue
+            for _, entries in resp or []:
+                await self._spawn(entries)
+
+    @staticmethod
+    def _report(task: asyncio.Task) -> None:
+        # start() не ждёт задачу — без этого её падение никто бы не увидел.
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Menu push consumer stopped", exc_info=task.exception())
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            self._task.add_done_callback(self._report)
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._sends):
+            task.cancel()
+        if self._r is not None:
+            await self._r.aclose()
+            self._r = None
@@ -30,3 +30,25 @@ class Profile:
     allergies: List[str]
     exclusions: List[str]
     daily_budget: Optional[int]
+
+class PlanMealPayload(TypedDict, total=False):
+    id: int
+    item_id: int
+    title: str
+    qty: float
+    time_hint: str
+    nutrients: dict
+    price: int
+    tags: list[str]
+    user_note: str
+
+class MenuPlanPayload(TypedDict, total=False):
+    id: int
+    plan_id: int
+    date: str
+    created_at: str
+    status: str
+    status_display: str
+    provider: str
+    targets: dict
+    plan: List[PlanMealPayload]
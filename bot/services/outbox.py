@@ -0,0 +1,294 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+
+log = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # ответы на апдейты пользователя
+    BULK = 1         # рассылки, пуши меню, напоминания
+
+
+# Приоритет отправок текущей задачи; хендлеры по умолчанию интерактивные.
+current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "outbox_priority", default=Priority.INTERACTIVE
+)
+
+
+class TokenBucket:
+    """Классический token bucket: ``rate`` токенов в секунду, не больше ``capacity``."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0  # retry_after от Telegram
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже есть)."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+@dataclass(eq=False)
+class _Job:
+    chat_id: int
+    priority: Priority
+    call: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих сообщений бота с лимитами Telegram.
+
+    Два token bucket'а: общий на бота (``global_rate``/с) и на каждый чат
+    (``chat_rate``/с с запасом ``chat_burst``). Интерактивная полоса всегда
+    выбирается раньше массовой, так что ответы пользователям не стоят за
+    рассылкой. Сообщение в чат без токена откладывается, не блокируя другие
+    чаты; порядок сообщений одного чата сохраняется. 429 (retry_after)
+    блокирует чат на указанное время и возвращает сообщение в очередь.
+
+    Хендлеры не знают про очередь: ``middleware()`` ставится на сессию бота и
+    пропускает через очередь все send*/edit*-вызовы с ``chat_id``.
+    """
+
+    def __init__(
+        self,
+        *,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_in_flight: int = 32,
+        max_attempts: int = 5,
+    ):
+        now = time.monotonic()
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        # Без запаса: общий лимит Telegram считает скользящим окном, всплеск в начале секунды даёт 429.
+        self._global = TokenBucket(global_rate, 1.0, now)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._lanes: Dict[Priority, Deque[_Job]] = {p: deque() for p in Priority}
+        # Отложенные: (когда можно, приоритет, seq, job); seq держит порядок внутри чата.
+        self._delayed: List[Tuple[float, int, int, _Job]] = []
+        self._delayed_chats: Dict[int, List[float]] = {}  # chat -> [сколько отложено, до какого времени]
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._tasks: set[asyncio.Task] = set()
+        self._runner: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"sent": 0, "retry_after": 0, "failed": 0, "delayed": 0}
+
+    # --- постановка в очередь ---------------------------------------------
+
+    def submit(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.BULK,
+    ) -> asyncio.Future:
+        """Ставит вызов Bot API в очередь; future завершится его результатом."""
+        job = _Job(chat_id, Priority(priority), call, asyncio.get_running_loop().create_future())
+        if chat_id in self._delayed_chats:
+            # У чата уже есть отложенные сообщения — встаём за ними.
+            self._delay(job, self._delayed_chats[chat_id][1])
+        else:
+            self._lanes[job.priority].append(job)
+        self._wakeup.set()
+        return job.future
+
+    async def send_message(self, chat_id: int, text: str, *, bot: Bot,
+                           priority: Priority = Priority.BULK, **kwargs: Any):
+        """Отправка с явным приоритетом (для рассылок): bot.send_message под нужной полосой."""
+        token = current_priority.set(priority)
+        try:
+            return await bot.send_message(chat_id, text, **kwargs)
+        finally:
+            current_priority.reset(token)
+
+    def middleware(self) -> "OutboxRequestMiddleware":
+        return OutboxRequestMiddleware(self)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values()) + len(self._delayed)
+
+    # --- планировщик -------------------------------------------------------
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _delay(self, job: _Job, ready_at: float) -> None:
+        entry = self._delayed_chats.setdefault(job.chat_id, [0, ready_at])
+        entry[0] += 1
+        entry[1] = ready_at = max(entry[1], ready_at)
+        heapq.heappush(self._delayed, (ready_at, job.priority, next(self._seq), job))
+        self.stats["delayed"] += 1
+
+    def _release_delayed(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, _, job = heapq.heappop(self._delayed)
+            entry = self._delayed_chats[job.chat_id]
+            entry[0] -= 1
+            if not entry[0]:
+                del self._delayed_chats[job.chat_id]
+            self._lanes[job.priority].append(job)
+
+    def _next_job(self, now: float) -> Optional[_Job]:
+        for priority in Priority:
+            lane = self._lanes[priority]
+            while lane:
+                job = lane.popleft()
+                if job.future.done():  # отменили, пока ждал
+                    continue
+                bucket = self._chat_bucket(job.chat_id, now)
+                wait = bucket.delay(now)
+                if job.chat_id in self._delayed_chats or wait > 0:
+                    self._delay(job, now + wait)  # за отложенными своего чата, если они есть
+                    continue
+                return job
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._release_delayed(now)
+            wait = self._global.delay(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            job = self._next_job(now)
+            if job is None:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._global.take(now)
+            self._chat_bucket(job.chat_id, now).take(now)
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._dispatch(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, job: _Job) -> None:
+        job.attempts += 1
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as exc:
+            self.stats["retry_after"] += 1
+            now = time.monotonic()
+            bucket = self._chat_bucket(job.chat_id, now)
+            bucket.blocked_until = max(bucket.blocked_until, now + exc.retry_after)
+            if job.attempts < self.max_attempts:
+                log.info("429 for chat %s, retry in %ss", job.chat_id, exc.retry_after)
+                self._delay(job, bucket.blocked_until)
+                self._wakeup.set()
+            else:
+                self._fail(job, exc)
+        except TelegramNetworkError as exc:
+            if job.attempts < self.max_attempts:
+                self._delay(job, time.monotonic() + min(30.0, 0.5 * 2 ** job.attempts))
+                self._wakeup.set()
+            else:
+                self._fail(job, exc)
+        except Exception as exc:
+            self._fail(job, exc)
+        else:
+            self.stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._in_flight.release()
+
+    def _fail(self, job: _Job, exc: BaseException) -> None:
+        self.stats["failed"] += 1
+        if not job.future.done():
+            job.future.set_exception(exc)
+
+    # --- жизненный цикл ----------------------------------------------------
+
+    def start(self) -> asyncio.Task:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+        return self._runner
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Дожидается отправки очереди (не дольше ``drain_timeout``) и останавливает планировщик."""
+        deadline = time.monotonic() + drain_timeout
+        while (self.pending or self._tasks) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        for lane in self._lanes.values():
+            for job in lane:
+                job.future.cancel()
+            lane.clear()
+        for *_, job in self._delayed:
+            job.future.cancel()
+        self._delayed.clear()
+        self._delayed_chats.clear()
+
+
+class OutboxRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: отправки в чаты идут через OutboundQueue."""
+
+    def __init__(self, queue: OutboundQueue):
+        self.queue = queue
+
+    @staticmethod
+    def _is_outgoing(method: Any) -> bool:
+        name = type(method).__name__
+        return name.startswith(("Send", "Edit", "Copy", "Forward")) and getattr(method, "chat_id", None) is not None
+
+    async def __call__(self, make_request, bot, method):
+        if not self._is_outgoing(method):
+            return await make_request(bot, method)
+        chat_id = method.chat_id
+        if not isinstance(chat_id, int):  # @username каналов — без лимитов по чату
+            return await make_request(bot, method)
+        return await self.queue.submit(chat_id, lambda: make_request(bot, method), current_priority.get())
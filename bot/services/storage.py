@@ -1,5 +1,9 @@
 import json
-from typing import Optional
+import struct
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
 from .models import Profile
 
 try:
@@ -7,25 +11,199 @@ try:
 except Exception:
     aioredis = None
 
+# Профиль в Redis: байт версии схемы, H-маска полей со значением None, дальше _HEAD
+# (рост, вес, бюджет; на месте None — 0), четыре строки с B-длиной: sex, birth_date,
+# activity_level, goal, и два списка allergies, exclusions: H-число элементов,
+# каждый — строка с B-длиной. Строки длиннее 255 байт обрезаются по границе символа.
+# Значения старого формата (JSON) читаются как раньше и переписываются при следующем set.
+PROFILE_SCHEMA = 1
+_HEAD = struct.Struct("<Hfi")
+_MASK = struct.Struct("<H")
+_SHORT = struct.Struct("<B")
+_LONG = struct.Struct("<H")
+# Порядок битов маски None.
+_FIELDS = (
+    "height_cm", "weight_kg", "daily_budget", "sex", "birth_date",
+    "activity_level", "goal", "allergies", "exclusions",
+)
+
+# Сколько команд отправлять одним пайплайном / MGET.
+BATCH_SIZE = 500
+
+
+def _pack_str(value: str | None, length: struct.Struct = _SHORT) -> bytes:
+    raw = (value or "").encode("utf-8")
+    limit = (1 << (8 * length.size)) - 1
+    if len(raw) > limit:
+        # Не разрезаем многобайтный символ пополам.
+        raw = raw[:limit].decode("utf-8", "ignore").encode("utf-8")
+    return length.pack(len(raw)) + raw
+
+
+def _unpack_str(buf: bytes, offset: int, length: struct.Struct = _SHORT) -> Tuple[str, int]:
+    (size,) = length.unpack_from(buf, offset)
+    offset += length.size
+    return buf[offset:offset + size].decode("utf-8"), offset + size
+
+
+def _pack_list(values: List[str] | None) -> bytes:
+    values = values or []
+    return _LONG.pack(len(values)) + b"".join(_pack_str(value) for value in values)
+
+
+def _unpack_list(buf: bytes, offset: int) -> Tuple[List[str], int]:
+    (count,) = _LONG.unpack_from(buf, offset)
+    offset += _LONG.size
+    values = []
+    for _ in range(count):
+        value, offset = _unpack_str(buf, offset)
+        values.append(value)
+    return values, offset
+
+
+def dump_profile(p: Profile) -> bytes:
+    mask = sum(1 << bit for bit, name in enumerate(_FIELDS) if getattr(p, name) is None)
+    return b"".join((
+        bytes([PROFILE_SCHEMA]),
+        _MASK.pack(mask),
+        _HEAD.pack(int(p.height_cm or 0), float(p.weight_kg or 0), int(p.daily_budget or 0)),
+        _pack_str(p.sex),
+        _pack_str(p.birth_date),
+        _pack_str(p.activity_level),
+        _pack_str(p.goal),
+        _pack_list(p.allergies),
+        _pack_list(p.exclusions),
+    ))
+
+
+def load_profile(data: bytes | str) -> Profile:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data[:1] == b"{":
+        return Profile(**json.loads(data))
+    if data[0] != PROFILE_SCHEMA:
+        raise ValueError(f"unknown profile schema {data[0]}")
+    (mask,) = _MASK.unpack_from(data, 1)
+    height, weight, budget = _HEAD.unpack_from(data, 1 + _MASK.size)
+    offset = 1 + _MASK.size + _HEAD.size
+    values = {"height_cm": height, "weight_kg": round(weight, 2), "daily_budget": budget}
+    for name in ("sex", "birth_date", "activity_level", "goal"):
+        values[name], offset = _unpack_str(data, offset)
+    for name in ("allergies", "exclusions"):
+        values[name], offset = _unpack_list(data, offset)
+    for bit, name in enumerate(_FIELDS):
+        if mask & (1 << bit):
+            values[name] = None
+    return Profile(**values)
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 class Storage:
-    def __init__(self, dsn: str | None = None):
+    """
+    Профили пользователей бота: Redis, если задан DSN, иначе память процесса.
+
+    Батчевые ``get_many``/``set_many`` ходят в Redis одним MGET / пайплайном
+    на ``BATCH_SIZE`` ключей, так что рассылка по тысячам профилей — это
+    несколько round-trip'ов, а не тысячи. ``ttl`` (секунды) — срок жизни
+    записи, None — бессрочно. В памяти — LRU не больше ``memory_limit`` профилей.
+    """
+
+    def __init__(self, dsn: str | None = None, *, ttl: int | None = None, memory_limit: int = 10_000):
         self.dsn = dsn
-        self._mem: dict[int, Profile] = {}
+        self.ttl = ttl
+        self.memory_limit = memory_limit
+        self._mem: OrderedDict[int, Tuple[float | None, Profile]] = OrderedDict()
         self._r = None
 
     async def connect(self):
         if self.dsn and aioredis:
-            self._r = aioredis.from_url(self.dsn, encoding="utf-8", decode_responses=True)
+            self._r = aioredis.from_url(self.dsn)
         return self
 
+    async def close(self):
+        if self._r is not None:
+            await self._r.aclose()
+            self._r = None
+
+    @staticmethod
+    def _key(tg_id: int) -> str:
+        return f"profile:{tg_id}"
+
+    # --- память ------------------------------------------------------------
+
+    def _mem_get(self, tg_id: int, now: float) -> Optional[Profile]:
+        entry = self._mem.get(tg_id)
+        if entry is None:
+            return None
+        expires_at, profile = entry
+        if expires_at is not None and expires_at <= now:
+            del self._mem[tg_id]
+            return None
+        self._mem.move_to_end(tg_id)
+        return profile
+
+    def _mem_set(self, tg_id: int, p: Profile, ttl: int | None, now: float) -> None:
+        self._mem[tg_id] = (now + ttl if ttl else None, p)
+        self._mem.move_to_end(tg_id)
+        while len(self._mem) > self.memory_limit:
+            self._mem.popitem(last=False)
+
+    # --- API ---------------------------------------------------------------
+
     async def get_profile(self, tg_id: int) -> Optional[Profile]:
         if self._r:
-            s = await self._r.get(f"profile:{tg_id}")
-            return Profile(**json.loads(s)) if s else None
-        return self._mem.get(tg_id)
+            s = await self._r.get(self._key(tg_id))
+            return load_profile(s) if s else None
+        return self._mem_get(tg_id, time.monotonic())
 
-    async def set_profile(self, tg_id: int, p: Profile):
+    async def set_profile(self, tg_id: int, p: Profile, *, ttl: int | None = None):
+        ttl = ttl if ttl is not None else self.ttl
         if self._r:
-            await self._r.set(f"profile:{tg_id}", json.dumps(p.__dict__, ensure_ascii=False))
+            await self._r.set(self._key(tg_id), dump_profile(p), ex=ttl or None)
         else:
-            self._mem[tg_id] = p
+            self._mem_set(tg_id, p, ttl, time.monotonic())
+
+    async def get_many(self, tg_ids: Iterable[int]) -> Dict[int, Profile]:
+        """Профили по списку id; отсутствующих в ответе нет."""
+        ids = list(dict.fromkeys(tg_ids))
+        found: Dict[int, Profile] = {}
+        if self._r:
+            for chunk in _chunks(ids, BATCH_SIZE):
+                values = await self._r.mget([self._key(tg_id) for tg_id in chunk])
+                for tg_id, value in zip(chunk, values):
+                    if value:
+                        found[tg_id] = load_profile(value)
+            return found
+        now = time.monotonic()
+        for tg_id in ids:
+            profile = self._mem_get(tg_id, now)
+            if profile is not None:
+                found[tg_id] = profile
+        return found
+
+    async def set_many(self, profiles: Mapping[int, Profile], *, ttl: int | None = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        if self._r:
+            items = list(profiles.items())
+            for chunk in _chunks(items, BATCH_SIZE):
+                pipe = self._r.pipeline(transaction=False)
+                for tg_id, p in chunk:
+                    pipe.set(self._key(tg_id), dump_profile(p), ex=ttl or None)
+                await pipe.execute()
+            return
+        now = time.monotonic()
+        for tg_id, p in profiles.items():
+            self._mem_set(tg_id, p, ttl, now)
+
+    async def delete_many(self, tg_ids: Iterable[int]) -> None:
+        ids = list(tg_ids)
+        if self._r:
+            for chunk in _chunks(ids, BATCH_SIZE):
+                await self._r.delete(*(self._key(tg_id) for tg_id in chunk))
+            return
+        for tg_id in ids:
+            self._mem.pop(tg_id, None)
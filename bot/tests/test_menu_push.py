@@ -0,0 +1,53 @@
+import asyncio
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from services import menu_push
+from services.menu_push import MenuPushConsumer
+
+_sleep = asyncio.sleep
+
+
+class FlakyRedis:
+    """Отказывает на первом обращении, дальше — пустой stream."""
+
+    def __init__(self):
+        self.failures = 1
+        self.reads = 0
+
+    async def xgroup_create(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise RedisConnectionError("redis is starting")
+
+    async def xreadgroup(self, *args, **kwargs):
+        self.reads += 1
+        await _sleep(0)  # настоящий XREADGROUP блокируется
+        return []
+
+    async def xautoclaim(self, *args, **kwargs):
+        return "0-0", [], []
+
+
+def test_startup_redis_error_is_retried(monkeypatch):
+    redis = FlakyRedis()
+    monkeypatch.setattr(menu_push.aioredis, "from_url", lambda url: redis)
+
+    async def no_wait(delay):
+        await _sleep(0)
+
+    monkeypatch.setattr(menu_push.asyncio, "sleep", no_wait)
+
+    async def scenario():
+        consumer = MenuPushConsumer("redis://test", bot=None, outbox=None)
+        task = consumer.start()
+        for _ in range(50):
+            await _sleep(0)
+            if redis.reads > 2:
+                break
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert redis.failures == 0
+    assert redis.reads > 2
@@ -0,0 +1,56 @@
+import pytest
+
+from services.models import Profile
+from services.storage import dump_profile, load_profile
+
+
+def _profile(**overrides) -> Profile:
+    values = {
+        "sex": "f",
+        "birth_date": "1990-05-01",
+        "height_cm": 170,
+        "weight_kg": 61.5,
+        "activity_level": "moderate",
+        "goal": "maintain",
+        "allergies": ["орехи", "молоко"],
+        "exclusions": ["свинина"],
+        "daily_budget": 1500,
+    }
+    values.update(overrides)
+    return Profile(**values)
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {},
+        {"height_cm": None, "weight_kg": None, "daily_budget": None, "birth_date": None},
+        {"height_cm": 0, "weight_kg": 0.0, "daily_budget": 0},
+        {"sex": None, "activity_level": None, "goal": None},
+        {"sex": "", "activity_level": "", "goal": ""},
+        {"allergies": [""], "exclusions": ["", "рыба"]},
+        {"allergies": [], "exclusions": None},
+    ],
+)
+def test_profile_round_trip(overrides):
+    profile = _profile(**overrides)
+    assert load_profile(dump_profile(profile)) == profile
+
+
+def test_long_values_are_cut_on_a_character_boundary():
+    profile = _profile(goal="ж" * 200, allergies=["я" * 200])
+
+    restored = load_profile(dump_profile(profile))
+
+    assert restored.goal == "ж" * 127
+    assert restored.allergies == ["я" * 127]
+
+
+def test_legacy_json_is_still_readable():
+    profile = _profile()
+    legacy = (
+        '{"sex": "f", "birth_date": "1990-05-01", "height_cm": 170, "weight_kg": 61.5,'
+        ' "activity_level": "moderate", "goal": "maintain", "allergies": ["орехи", "молоко"],'
+        ' "exclusions": ["свинина"], "daily_budget": 1500}'
+    )
+    assert load_profile(legacy) == profile
@@ -0,0 +1,179 @@
+"""
+Бенчмарк очереди исходящих сообщений против локальной заглушки Bot API.
+
+Заглушка сама следит за лимитами как Telegram: больше ``--api-global-rate``
+сообщений в секунду на бота или ``--api-chat-rate`` в один чат — отвечает
+429 с retry_after. Бот шлёт массовую рассылку (``--chats`` × ``--per-chat``),
+а посреди неё — интерактивные ответы; печатаются пропускная способность,
+число 429 и задержка доставки по полосам.
+
+    python tools/bench_outbox.py --chats 300 --per-chat 2 --interactive 30
+    python tools/bench_outbox.py --no-queue      # те же отправки напрямую, для сравнения
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from services.outbox import OutboundQueue, Priority  # noqa: E402
+
+TOKEN = "42:OUTBOXBENCH"
+
+
+class RateLimitedBotAPI:
+    """Заглушка Bot API со скользящим окном в 1 с на бота и на чат."""
+
+    def __init__(self, global_rate: int, chat_rate: int, latency: float):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.latency = latency
+        self._global: Deque[float] = deque()
+        self._chats: Dict[int, Deque[float]] = defaultdict(deque)
+        self.accepted = 0
+        self.rejected = 0
+        self._message_id = 0
+
+    @staticmethod
+    def _over(window: Deque[float], limit: int, now: float) -> bool:
+        while window and window[0] <= now - 1.0:
+            window.popleft()
+        return len(window) >= limit
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        chat_id = int(data.get("chat_id") or 0)
+        now = time.monotonic()
+        chat = self._chats[chat_id]
+        if self._over(self._global, self.global_rate, now) or self._over(chat, self.chat_rate, now):
+            self.rejected += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            })
+        self._global.append(now)
+        chat.append(now)
+        self.accepted += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self._message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+        }})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+def _pct(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(args) -> int:
+    api = RateLimitedBotAPI(args.api_global_rate, args.api_chat_rate, args.api_latency_ms / 1000)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.api_port}"))
+    bot = Bot(TOKEN, session=session)
+    outbox = None
+    if not args.no_queue:
+        outbox = OutboundQueue(
+            global_rate=args.global_rate, chat_rate=args.chat_rate, chat_burst=args.chat_burst,
+        )
+        bot.session.middleware(outbox.middleware())
+        outbox.start()
+
+    latencies: Dict[str, List[float]] = {"bulk": [], "interactive": []}
+    failures = 0
+
+    async def send(chat_id: int, lane: str) -> None:
+        nonlocal failures
+        started = time.perf_counter()
+        priority = Priority.INTERACTIVE if lane == "interactive" else Priority.BULK
+        try:
+            if outbox is not None:
+                await outbox.send_message(chat_id, f"{lane} {chat_id}", bot=bot, priority=priority)
+            else:
+                await bot.send_message(chat_id, f"{lane} {chat_id}")
+        except TelegramRetryAfter:
+            failures += 1
+            return
+        latencies[lane].append(time.perf_counter() - started)
+
+    async def interactive_trickle() -> None:
+        # Интерактивные ответы приходят, когда рассылка уже забила очередь.
+        await asyncio.sleep(args.interactive_delay)
+        for n in range(args.interactive):
+            asyncio.create_task(send(10_000_000 + n, "interactive"))
+            await asyncio.sleep(args.interactive_gap_ms / 1000)
+
+    tasks = [
+        asyncio.create_task(send(chat_id, "bulk"))
+        for _ in range(args.per_chat)
+        for chat_id in range(1, args.chats + 1)
+    ]
+    started = time.perf_counter()
+    trickle = asyncio.create_task(interactive_trickle())
+    await asyncio.gather(*tasks, trickle)
+    while sum(len(v) for v in latencies.values()) + failures < len(tasks) + args.interactive:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    if outbox is not None:
+        await outbox.stop()
+    await bot.session.close()
+    await runner.cleanup()
+
+    delivered = len(latencies["bulk"]) + len(latencies["interactive"])
+    print(f"mode={'direct' if args.no_queue else 'outbox'} messages={len(tasks) + args.interactive} "
+          f"api_limits={args.api_global_rate}/s global, {args.api_chat_rate}/s per chat")
+    print(f"delivered={delivered} failed={failures} elapsed={elapsed:.2f}s "
+          f"throughput={delivered / elapsed:.1f} msg/s api_429={api.rejected}")
+    for lane, values in latencies.items():
+        print(f"{lane:>11} latency ms: p50={_pct(values, 50) * 1000:.0f} "
+              f"p95={_pct(values, 95) * 1000:.0f} max={_pct(values, 100) * 1000:.0f}")
+    if outbox is not None:
+        print(f"outbox stats: {outbox.stats}")
+    return 0 if not failures else 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--per-chat", type=int, default=2)
+    parser.add_argument("--interactive", type=int, default=30)
+    parser.add_argument("--interactive-delay", type=float, default=1.0, help="Когда начинать интерактив, с")
+    parser.add_argument("--interactive-gap-ms", type=float, default=100.0)
+    parser.add_argument("--global-rate", type=float, default=28.0, help="OUTBOX_GLOBAL_RATE")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="OUTBOX_CHAT_RATE")
+    parser.add_argument("--chat-burst", type=float, default=1.0, help="OUTBOX_CHAT_BURST")
+    parser.add_argument("--api-global-rate", type=int, default=30)
+    parser.add_argument("--api-chat-rate", type=int, default=1)
+    parser.add_argument("--api-latency-ms", type=float, default=30.0)
+    parser.add_argument("--api-port", type=int, default=18082)
+    parser.add_argument("--no-queue", action="store_true", help="Слать напрямую, без очереди")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Нагрузочный прогон webhook-режима бота без Telegram.
+
+Поднимает локальную заглушку Bot API, webhook-приложение бота с теми же
+middleware и роутерами, что и в проде, и проигрывает апдейты (записанные —
+из JSON Lines файла, или синтетические). Апдейты одного пользователя шлются
+последовательно, как это делает Telegram, разные пользователи — параллельно.
+
+В конце печатает пропускную способность, задержку обработки, пик
+параллельных хендлеров и проверяет, что апдейты каждого пользователя
+обработаны строго по порядку и не пересекались.
+
+    python tools/loadtest_webhook.py --users 200 --per-user 10 --api-latency-ms 20
+    python tools/loadtest_webhook.py --updates recorded.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiohttp import ClientSession, TCPConnector, web  # noqa: E402
+
+from app import Config, build_dispatcher, build_webhook_app  # noqa: E402
+from services.backend import BackendClient  # noqa: E402
+
+TOKEN = "42:LOADTEST"
+SECRET = "loadtest-secret"
+
+
+class StubBotAPI:
+    """Минимальная заглушка api.telegram.org: отвечает ok на любой метод."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._message_id = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = await request.post()
+        if method.lower() in ("sendmessage", "editmessagetext"):
+            self._message_id += 1
+            chat_id = int(data.get("chat_id") or 0)
+            result: Any = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+class Probe:
+    """Inner-middleware: фиксирует порядок и параллельность обработки."""
+
+    def __init__(self):
+        self.sent_at: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.order: Dict[int, List[int]] = defaultdict(list)
+        self.in_flight: Dict[int, int] = defaultdict(int)
+        self.overlaps = 0
+        self.active = 0
+        self.peak = 0
+        self.done = 0
+        self.finished = asyncio.Event()
+        self.expected = 0
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        uid = user.id if user else 0
+        self.order[uid].append(event.update_id)
+        self.in_flight[uid] += 1
+        if self.in_flight[uid] > 1:
+            self.overlaps += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            self.in_flight[uid] -= 1
+            self.latencies.append(time.perf_counter() - self.sent_at.get(event.update_id, time.perf_counter()))
+            self.done += 1
+            if self.done >= self.expected:
+                self.finished.set()
+
+
+def synthetic_updates(users: int, per_user: int) -> List[dict]:
+    updates = []
+    update_id = 1
+    for n in range(per_user):
+        for uid in range(1, users + 1):
+            text = "/start" if n % 2 == 0 else str(1000 + n)
+            user = {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+            updates.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": uid, "type": "private"},
+                    "from": user,
+                    "text": text,
+                },
+            })
+            update_id += 1
+    return updates
+
+
+def _user_of(update: dict) -> int:
+    for key in ("message", "edited_message", "callback_query"):
+        if key in update:
+            return update[key]["from"]["id"]
+    return 0
+
+
+def _pct(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(args) -> int:
+    if args.updates:
+        with open(args.updates, encoding="utf-8") as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = synthetic_updates(args.users, args.per_user)
+
+    stub = StubBotAPI(args.api_latency_ms / 1000)
+    stub_runner = web.AppRunner(stub.app())
+    await stub_runner.setup()
+    await web.TCPSite(stub_runner, "127.0.0.1", args.api_port).start()
+
+    cfg = Config()
+    cfg.token = TOKEN
+    cfg.mode = "webhook"
+    cfg.redis_url = args.redis_url
+    cfg.handler_concurrency = args.concurrency
+    cfg.webhook_secret = SECRET
+    cfg.webhook_path = "/tg/webhook"
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.api_port}"))
+    bot = Bot(TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    store = BackendClient("http://127.0.0.1:9", cfg.bot_key)
+    dp = build_dispatcher(cfg, store, None)
+    probe = Probe()
+    probe.expected = len(updates)
+    dp.update.middleware(probe)
+
+    bot_runner = web.AppRunner(build_webhook_app(cfg, dp, bot))
+    await bot_runner.setup()
+    await web.TCPSite(bot_runner, "127.0.0.1", args.webhook_port).start()
+
+    by_user: Dict[int, List[dict]] = defaultdict(list)
+    for update in updates:
+        by_user[_user_of(update)].append(update)
+
+    url = f"http://127.0.0.1:{args.webhook_port}{cfg.webhook_path}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    post_latencies: List[float] = []
+    gate = asyncio.Semaphore(args.connections)
+
+    async def replay_user(http: ClientSession, user_updates: List[dict]) -> None:
+        async with gate:
+            for update in user_updates:
+                probe.sent_at[update["update_id"]] = started = time.perf_counter()
+                async with http.post(url, json=update, headers=headers) as resp:
+                    resp.raise_for_status()
+                post_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=args.connections)) as http:
+        await asyncio.gather(*(replay_user(http, items) for items in by_user.values()))
+    try:
+        await asyncio.wait_for(probe.finished.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        print(f"timeout: processed {probe.done}/{len(updates)}")
+    elapsed = time.perf_counter() - started
+
+    await bot_runner.cleanup()
+    await stub_runner.cleanup()
+    await store.close()
+
+    out_of_order = sum(1 for ids in probe.order.values() if ids != sorted(ids))
+    print(f"updates={len(updates)} users={len(by_user)} handler_concurrency={args.concurrency} "
+          f"api_latency={args.api_latency_ms}ms storage={'redis' if args.redis_url else 'memory'}")
+    print(f"processed={probe.done} elapsed={elapsed:.3f}s throughput={probe.done / elapsed:.1f} updates/s")
+    print("processing latency ms: "
+          f"p50={_pct(probe.latencies, 50) * 1000:.1f} p95={_pct(probe.latencies, 95) * 1000:.1f} "
+          f"p99={_pct(probe.latencies, 99) * 1000:.1f}; "
+          f"webhook ack p50={statistics.median(post_latencies) * 1000 if post_latencies else 0:.1f}")
+    print(f"peak_parallel_handlers={probe.peak} bot_api_calls={sum(stub.calls.values())} {dict(stub.calls)}")
+    print(f"per_user_order_violations={out_of_order} per_user_overlaps={probe.overlaps}")
+    return 0 if probe.done == len(updates) and not out_of_order and not probe.overlaps else 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", help="JSON Lines с записанными апдейтами Telegram")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--per-user", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=64, help="BOT_HANDLER_CONCURRENCY")
+    parser.add_argument("--connections", type=int, default=50, help="Параллельных webhook-соединений")
+    parser.add_argument("--api-latency-ms", type=float, default=20.0, help="Задержка ответа заглушки Bot API")
+    parser.add_argument("--redis-url", default=None, help="Прогнать с RedisStorage вместо памяти")
+    parser.add_argument("--api-port", type=int, default=18081)
+    parser.add_argument("--webhook-port", type=int, default=18080)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import api from './client'
 import type {
   WalletSummary,
   WalletTransactionRecord,
+  WalletTransactionPage,
   WalletOrderRecord,
   WalletOperationPayload,
 } from '../types'
@@ -11,7 +12,17 @@ export async function fetchWalletSummary(): Promise<WalletSummary> {
   return resp.data
 }
 
-export async function listWalletTransactions(params?: { currency?: 'stars' | 'calo' }): Promise<WalletTransactionRecord[]> {
+export interface WalletTransactionQuery {
+  currency?: 'stars' | 'calo'
+  direction?: 'in' | 'out'
+  created_after?: string
+  created_before?: string
+  reference?: string
+  limit?: number
+  cursor?: string
+}
+
+export async function fetchWalletTransactionsPage(params?: WalletTransactionQuery): Promise<WalletTransactionPage> {
   const resp = await api.get('/orders/wallet/transactions/', { params })
   return resp.data
 }
@@ -53,4 +64,11 @@ export async function payOrder(
 ): Promise<WalletOrderRecord> {
   const resp = await api.post(`/orders/wallet/orders/${orderId}/pay/`, payload ?? {})
   return resp.data
-}
\ No newline at end of file
+}
+export async function payOrders(
+  orderIds: number[],
+  payload?: { description?: string; reference?: string; metadata?: Record<string, unknown> }
+): Promise<WalletOrderRecord[]> {
+  const resp = await api.post('/orders/wallet/orders/pay/', { ...(payload ?? {}), order_ids: orderIds })
+  return resp.data
+}
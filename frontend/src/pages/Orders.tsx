@@ -1,7 +1,7 @@
 import React, { useCallback, useEffect, useState } from 'react'
 import {
   fetchWalletSummary,
-  listWalletTransactions,
+  fetchWalletTransactionsPage,
   walletTopUp,
   walletWithdraw,
   listOrders,
@@ -34,6 +34,8 @@ const currencyLabels: Record<WalletCurrency, string> = {
   calo: 'CaloCoin',
 }
 
+const TRANSACTIONS_PAGE_SIZE = 8
+
 const numberFormatter = new Intl.NumberFormat('ru-RU', {
   maximumFractionDigits: 2,
 })
@@ -41,6 +43,8 @@ const numberFormatter = new Intl.NumberFormat('ru-RU', {
 export default function Orders(): JSX.Element {
   const [summary, setSummary] = useState<WalletSummary | null>(null)
   const [transactions, setTransactions] = useState<WalletTransactionRecord[]>([])
+  const [transactionsCursor, setTransactionsCursor] = useState<string | null>(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [orders, setOrders] = useState<WalletOrderRecord[]>([])
   const [loading, setLoading] = useState(true)
   const [submitting, setSubmitting] = useState(false)
@@ -60,13 +64,14 @@ export default function Orders(): JSX.Element {
     setLoading(true)
     setError(null)
     try {
-      const [summaryData, txData, ordersData] = await Promise.all([
+      const [summaryData, txPage, ordersData] = await Promise.all([
         fetchWalletSummary(),
-        listWalletTransactions(),
+        fetchWalletTransactionsPage({ limit: TRANSACTIONS_PAGE_SIZE }),
         listOrders(),
       ])
       setSummary(summaryData)
-      setTransactions(txData)
+      setTransactions(txPage.results)
+      setTransactionsCursor(txPage.next_cursor)
       setOrders(ordersData)
     } catch (err) {
       console.error('Не удалось загрузить данные монетизации', err)
@@ -173,6 +178,21 @@ export default function Orders(): JSX.Element {
     }
   }
 
+  const handleLoadMoreTransactions = async () => {
+    if (!transactionsCursor) return
+    setLoadingMore(true)
+    try {
+      const page = await fetchWalletTransactionsPage({ limit: TRANSACTIONS_PAGE_SIZE, cursor: transactionsCursor })
+      setTransactions(prev => [...prev, ...page.results])
+      setTransactionsCursor(page.next_cursor)
+    } catch (err) {
+      console.error('Не удалось загрузить историю транзакций', err)
+      setError('Не удалось загрузить историю транзакций. Попробуйте ещё раз.')
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const handlePayOrder = async (orderId: number) => {
     setSubmitting(true)
     setError(null)
@@ -189,8 +209,6 @@ export default function Orders(): JSX.Element {
     }
   }
 
-  const recentTransactions = transactions.slice(0, 8)
-
   return (
     <div className="orders-page">
       <div className="card orders-summary">
@@ -380,11 +398,11 @@ export default function Orders(): JSX.Element {
 
         <section className="card orders-history">
           <h2>История транзакций</h2>
-          {recentTransactions.length === 0 ? (
+          {transactions.length === 0 ? (
             <p className="orders-empty">Пока нет операций по кошельку.</p>
           ) : (
             <ul className="orders-transaction-list">
-              {recentTransactions.map(tx => {
+              {transactions.map(tx => {
                 const created = new Date(tx.created_at)
                 const dateDisplay = Number.isNaN(created.getTime()) ? '' : created.toLocaleString('ru-RU')
                 const amountDisplay = `${tx.direction === 'in' ? '+' : '−'} ${numberFormatter.format(Math.abs(tx.amount))} ${currencyLabels[tx.currency]}`
@@ -400,6 +418,16 @@ export default function Orders(): JSX.Element {
               })}
             </ul>
           )}
+          {transactionsCursor && (
+            <button
+              type="button"
+              className="orders-button orders-button--ghost"
+              onClick={handleLoadMoreTransactions}
+              disabled={loadingMore}
+            >
+              {loadingMore ? 'Загружаем...' : 'Показать ещё'}
+            </button>
+          )}
 
           <h2>Заказы</h2>
           {orders.length === 0 ? (
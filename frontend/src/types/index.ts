@@ -92,6 +92,12 @@ export interface WalletTransactionRecord {
   created_at: string
 }
 
+export interface WalletTransactionPage {
+  next: string | null
+  next_cursor: string | null
+  results: WalletTransactionRecord[]
+}
+
 export interface WalletOrderRecord {
   id: number
   title: string